@@ -0,0 +1,334 @@
+#! /usr/bin/env python
+
+import os
+import json
+import shutil
+import logging
+
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+
+logger = logging.getLogger(__name__)
+
+
+class ArtifactStore(object):
+    """
+    Content addressed store, on the local filesystem, of step output
+    directories that can be shared across pipeline runs. Entries are keyed
+    on the step key computed by :py:class:`~cellmaps_pipeline.stepcache.StepCache`
+    so an entry is only reused when the inputs and parameters of the step
+    are unchanged.
+
+    Files are hard linked into and out of the store when possible so reusing
+    an entry takes no additional disk space. When the total size of the
+    store exceeds **max_size** the least recently used entries are evicted.
+
+    Layout of store:
+
+    .. code-block::
+
+        <store_dir>/
+            <key>/
+                manifest.json
+                last_used
+                data/
+                    <files of step output directory>
+    """
+
+    HARDLINK_MODE = 'hardlink'
+    """
+    Hard link files, falling back to copying if hard
+    links are not possible, such as across filesystems
+    """
+
+    SYMLINK_MODE = 'symlink'
+    """
+    Symbolic link files. Output directories break if
+    the entry is later evicted from the store
+    """
+
+    COPY_MODE = 'copy'
+    """
+    Copy files
+    """
+
+    LINK_MODES = [HARDLINK_MODE, SYMLINK_MODE, COPY_MODE]
+
+    MANIFEST_FILE = 'manifest.json'
+
+    LAST_USED_FILE = 'last_used'
+
+    DATA_DIR = 'data'
+
+    TMP_PREFIX = '.tmp_'
+
+    def __init__(self, store_dir=None, max_size=None,
+                 link_mode=HARDLINK_MODE):
+        """
+        Constructor
+
+        :param store_dir: Directory holding the store, created if it does not exist
+        :type store_dir: str
+        :param max_size: Maximum size of store in bytes. If ``None`` no
+                         entries are ever evicted
+        :type max_size: int
+        :param link_mode: How files are placed into output directories, one of
+                          :py:const:`LINK_MODES`
+        :type link_mode: str
+        :raises CellmapsPipelineError: If **store_dir** is ``None`` or **link_mode**
+                                       is invalid
+        """
+        if store_dir is None:
+            raise CellmapsPipelineError('store_dir is None')
+        if link_mode not in ArtifactStore.LINK_MODES:
+            raise CellmapsPipelineError('Invalid link mode: ' + str(link_mode))
+        self._store_dir = os.path.abspath(store_dir)
+        self._max_size = max_size
+        self._link_mode = link_mode
+
+    def get_entry_dir(self, key):
+        """
+        Gets directory of entry in store
+
+        :param key: Key of entry
+        :type key: str
+        :return: path to entry directory
+        :rtype: str
+        """
+        return os.path.join(self._store_dir, key)
+
+    def has_entry(self, key):
+        """
+        Checks if store has a complete entry for **key**
+
+        :param key: Key of entry
+        :type key: str
+        :return: ``True`` if entry exists
+        :rtype: bool
+        """
+        return os.path.isfile(os.path.join(self.get_entry_dir(key),
+                                           ArtifactStore.MANIFEST_FILE))
+
+    def _touch(self, entry_dir):
+        """
+        Updates the last used time of entry, which is the
+        modification time of an empty marker file so the size
+        of the entry does not change
+
+        :param entry_dir: Directory of entry
+        :type entry_dir: str
+        """
+        last_used_file = os.path.join(entry_dir, ArtifactStore.LAST_USED_FILE)
+        with open(last_used_file, 'a'):
+            pass
+        os.utime(last_used_file, None)
+
+    def _get_last_used(self, entry_dir):
+        """
+        Gets last used time of entry
+
+        :param entry_dir: Directory of entry
+        :type entry_dir: str
+        :return: time in seconds since epoch or ``0`` if unknown
+        :rtype: float
+        """
+        try:
+            return os.path.getmtime(os.path.join(entry_dir, ArtifactStore.LAST_USED_FILE))
+        except OSError:
+            return 0
+
+    def get_data_dir(self, key):
+        """
+        Gets directory holding the files of entry with **key**, so they
+        can be read in place, and updates the last used time of the entry
+
+        :param key: Key of entry
+        :type key: str
+        :return: path to data directory of entry or ``None`` if
+                 store does not have entry
+        :rtype: str
+        """
+        if not self.has_entry(key):
+            return None
+        entry_dir = self.get_entry_dir(key)
+        self._touch(entry_dir)
+        return os.path.join(entry_dir, ArtifactStore.DATA_DIR)
+
+    def _place_file(self, src, dest, link_mode):
+        """
+        Places file **src** at **dest** using **link_mode**
+
+        :param src: Source file
+        :type src: str
+        :param dest: Destination path
+        :type dest: str
+        :param link_mode: One of :py:const:`LINK_MODES`
+        :type link_mode: str
+        """
+        if link_mode == ArtifactStore.HARDLINK_MODE:
+            try:
+                os.link(src, dest)
+                return
+            except OSError as e:
+                logger.debug('Unable to hard link ' + src + ', copying instead: ' + str(e))
+        elif link_mode == ArtifactStore.SYMLINK_MODE:
+            os.symlink(src, dest)
+            return
+        shutil.copy2(src, dest)
+
+    def _place_tree(self, src_dir, dest_dir, link_mode):
+        """
+        Recreates directory tree of **src_dir** under **dest_dir** placing
+        each file via :py:meth:`_place_file`
+
+        :param src_dir: Source directory
+        :type src_dir: str
+        :param dest_dir: Destination directory, created if needed
+        :type dest_dir: str
+        :param link_mode: One of :py:const:`LINK_MODES`
+        :type link_mode: str
+        """
+        for dirpath, dirnames, filenames in os.walk(src_dir):
+            dest_path = os.path.join(dest_dir, os.path.relpath(dirpath, src_dir))
+            os.makedirs(dest_path, mode=0o755, exist_ok=True)
+            for filename in filenames:
+                self._place_file(os.path.join(dirpath, filename),
+                                 os.path.join(dest_path, filename),
+                                 link_mode)
+
+    def fetch(self, key, dest_dir):
+        """
+        Places the files of entry with **key** into **dest_dir**
+
+        :param key: Key of entry
+        :type key: str
+        :param dest_dir: Output directory of step, must not exist
+        :type dest_dir: str
+        :return: manifest of step stored with entry or ``None`` if
+                 store does not have entry or it could not be placed
+        :rtype: dict
+        """
+        if not self.has_entry(key):
+            return None
+        entry_dir = self.get_entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, ArtifactStore.MANIFEST_FILE), 'r') as f:
+                manifest = json.load(f)
+            self._place_tree(os.path.join(entry_dir, ArtifactStore.DATA_DIR),
+                             dest_dir, self._link_mode)
+            self._touch(entry_dir)
+        except (OSError, ValueError) as e:
+            logger.warning('Unable to use entry ' + key + ' from artifact store: ' + str(e))
+            if os.path.isdir(dest_dir):
+                shutil.rmtree(dest_dir)
+            return None
+        logger.info('Reused ' + dest_dir + ' from artifact store entry ' + key)
+        return manifest
+
+    def put(self, key, src_dir, manifest=None):
+        """
+        Adds files under **src_dir** to the store as entry **key**, always
+        hard linking or copying, and then evicts least recently used entries
+        if the store exceeds its maximum size. If the entry already exists
+        only its last used time is updated
+
+        :param key: Key of entry
+        :type key: str
+        :param src_dir: Output directory of step
+        :type src_dir: str
+        :param manifest: Manifest of step to store with entry
+        :type manifest: dict
+        :return: ``True`` if entry is in store
+        :rtype: bool
+        """
+        entry_dir = self.get_entry_dir(key)
+        if self.has_entry(key):
+            self._touch(entry_dir)
+            return True
+        os.makedirs(self._store_dir, mode=0o755, exist_ok=True)
+        tmp_dir = os.path.join(self._store_dir, ArtifactStore.TMP_PREFIX +
+                               key + '_' + str(os.getpid()))
+        try:
+            link_mode = ArtifactStore.HARDLINK_MODE
+            if self._link_mode == ArtifactStore.COPY_MODE:
+                link_mode = ArtifactStore.COPY_MODE
+            self._place_tree(src_dir, os.path.join(tmp_dir, ArtifactStore.DATA_DIR),
+                             link_mode)
+            with open(os.path.join(tmp_dir, ArtifactStore.MANIFEST_FILE), 'w') as f:
+                json.dump(manifest if manifest is not None else {}, f, indent=2, default=str)
+            self._touch(tmp_dir)
+            os.rename(tmp_dir, entry_dir)
+        except OSError as e:
+            logger.warning('Unable to add ' + src_dir + ' to artifact store: ' + str(e))
+            if os.path.isdir(tmp_dir):
+                shutil.rmtree(tmp_dir)
+            return self.has_entry(key)
+        self.evict()
+        return self.has_entry(key)
+
+    @staticmethod
+    def _get_dir_size(directory):
+        """
+        Gets total size in bytes of files under **directory**
+
+        :param directory: Directory to examine
+        :type directory: str
+        :return: size in bytes
+        :rtype: int
+        """
+        total = 0
+        for dirpath, dirnames, filenames in os.walk(directory):
+            for filename in filenames:
+                full_path = os.path.join(dirpath, filename)
+                if not os.path.islink(full_path):
+                    total += os.path.getsize(full_path)
+        return total
+
+    def get_entries(self):
+        """
+        Gets complete entries in store along with their size
+        and last used time, least recently used first
+
+        :return: list of tuples (key, size in bytes, last used time)
+        :rtype: list
+        """
+        if not os.path.isdir(self._store_dir):
+            return []
+        entries = []
+        for key in os.listdir(self._store_dir):
+            if key.startswith(ArtifactStore.TMP_PREFIX) or not self.has_entry(key):
+                continue
+            entry_dir = self.get_entry_dir(key)
+            entries.append((key, ArtifactStore._get_dir_size(entry_dir),
+                            self._get_last_used(entry_dir)))
+        entries.sort(key=lambda x: x[2])
+        return entries
+
+    def evict(self):
+        """
+        Removes least recently used entries until the size
+        of the store is at or below **max_size**
+
+        :return: keys of evicted entries
+        :rtype: list
+        """
+        if self._max_size is None:
+            return []
+        entries = self.get_entries()
+        total = sum([entry[1] for entry in entries])
+        evicted = []
+        for key, size, last_used in entries:
+            if total <= self._max_size:
+                break
+            logger.info('Evicting entry ' + key + ' from artifact store')
+            # rename first so a concurrent fetch never sees a partial entry
+            tmp_dir = os.path.join(self._store_dir, ArtifactStore.TMP_PREFIX +
+                                   key + '_evict_' + str(os.getpid()))
+            try:
+                os.rename(self.get_entry_dir(key), tmp_dir)
+            except OSError as e:
+                logger.debug('Unable to evict ' + key + ': ' + str(e))
+                continue
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            total -= size
+            evicted.append(key)
+        return evicted
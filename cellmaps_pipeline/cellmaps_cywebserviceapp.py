@@ -1,9 +1,9 @@
 #! /usr/bin/env python
 
 import argparse
-import json
+import itertools
 import os.path
-import math
+import shutil
 import sys
 import tempfile
 
@@ -21,12 +21,48 @@ from cellmaps_utils import logutils
 from cellmaps_utils import constants
 from cellmaps_utils import music_utils
 
-from ndex2.cx2 import CX2Network, RawCX2NetworkFactory, CX2NetworkPandasDataFrameFactory
+from ndex2 import constants as ndex2constants
+from ndex2.cx2 import RawCX2NetworkFactory
 
 import cellmaps_pipeline
+from cellmaps_pipeline import topk
+from cellmaps_pipeline import similarity
+from cellmaps_pipeline import cx2builder
+from cellmaps_pipeline import jsonstream
+from cellmaps_pipeline import embeddingio
+from cellmaps_pipeline.parallelhidef import ParallelHiDeFRunner
+from cellmaps_pipeline.hcx import CX2HCXFromCDAPSCXHierarchy
+from cellmaps_pipeline.jsonlinesserver import JSONLinesServer
+from cellmaps_pipeline.resultcache import ResultCache
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
 
 logger = logging.getLogger(__name__)
 
+SCRATCH_SIZE_FACTOR = 4
+"""
+Space community detection needs in scratch directory as a multiple
+of the size of the edgelist files, leaving room for HiDeF output
+"""
+
+RESULT_CACHE_INPUT_FILES = {'networkfromembedding': ['embedding'],
+                            'communitydetection': ['input'],
+                            'createhcx': ['input', 'parent_network']}
+"""
+Modes whose results can be cached, mapped to the arguments holding
+paths to input files. Contents, not paths, of these files are part
+of the key of a cached result
+"""
+
+RESULT_CACHE_IGNORED_ARGS = ['input', 'embedding', 'parent_network',
+                             'max_concurrent_requests',
+                             'tempdir', 'scratch_dir', 'scratch_max_size',
+                             'result_cache', 'result_cache_max_size',
+                             'logconf', 'verbose', 'program', 'version']
+"""
+Arguments left out of the key of a cached result since they
+do not change the result
+"""
+
 
 def _parse_arguments(desc, args):
     """
@@ -42,24 +78,60 @@ def _parse_arguments(desc, args):
     parser = argparse.ArgumentParser(description=desc,
                                      formatter_class=constants.ArgParseFormatter)
     # TODO: what input supposed to be
-    parser.add_argument('input', help='Input data')
+    parser.add_argument('input', nargs='?', help='Input data. Not used by --mode server')
     parser.add_argument('--mode', required=True,
                         choices=['networkfromembedding',
                                  'communitydetection',
-                                 'createhcx'],
-                        help='Action to perform')
+                                 'createhcx',
+                                 'server'],
+                        help='Action to perform. server reads requests, one JSON object '
+                             'per line, from standard in, each holding the command line '
+                             'arguments of one action under "args" and an optional "id". '
+                             'A response holding "id", "status" and "result" or '
+                             '"error" is written, as one line of JSON, to standard out '
+                             'for each request')
     parser.add_argument('--embedding',
-                        help='Sets the embedding file to load. Used by --mode networkfromebedding')
+                        help='Sets the embedding file to load. Used by --mode networkfromebedding. '
+                             'Tab delimited with genes as first column unless it ends with '
+                             '.npy, in which case genes are read from a file with .npy '
+                             'replaced by ' + embeddingio.GENES_SUFFIX + ', or with .parquet, '
+                             'which requires pyarrow. Binary embeddings are memory mapped')
+    parser.add_argument('--embedding_dtype', choices=sorted(embeddingio.DTYPES.keys()),
+                        help='Type embedding values are loaded as. float32 halves memory '
+                             'and speeds up similarity computation at the cost of '
+                             'precision. If unset, text embeddings are loaded as float64 '
+                             'and binary embeddings as stored')
     parser.add_argument('--similarity',
-                        choices=['euclidean', 'cosine', 'manhatten',
+                        choices=['euclidean', 'cosine', 'manhattan',
                                  'canberra', 'pearson', 'spearman', 'kendall'], default='cosine',
                         help='Sets type of similarity algorithm to use during embedding'
                              'conversion')
-    parser.add_argument('--embedding_cutoff', default=0.1, type=float,
+    parser.add_argument('--embedding_cutoff', default=[0.1], nargs='+', type=float,
                         help='Cutoff for keeping embedding edges, 0.0 means keep all edges,'
-                             '0.1 means keep top 10 percent')
+                             '0.1 means keep top 10 percent. If multiple cutoffs are set, '
+                             'a network is created for each cutoff from a single '
+                             'similarity computation')
+    parser.add_argument('--knn', type=int,
+                        help='If set, --mode networkfromembedding connects each gene to '
+                             'its K most similar genes, found by an exact search a tile '
+                             'of rows at a time, instead of keeping the top '
+                             '--embedding_cutoff fraction of all pairs')
+    parser.add_argument('--blocked_similarity', action='store_true',
+                        help='If set, --mode networkfromembedding computes similarity '
+                             'a tile of rows at a time keeping only the top edges so the '
+                             'full similarity matrix is never held in memory, except for '
+                             'kendall which computes the full matrix in one pass. Supported '
+                             'for --similarity ' +
+                             ', '.join(sorted(similarity.BLOCKED_SIMILARITIES.keys())))
+    parser.add_argument('--block_rows', type=int,
+                        help='Number of rows per tile when --blocked_similarity is set. '
+                             'If unset, this is picked so each tile has about ' +
+                             str(topk.BLOCK_ELEMENTS) + ' values')
     parser.add_argument('--interactome_uuid',
                         help='UUID of input NDEx network hierarchy')
+    parser.add_argument('--parent_network',
+                        help='Path to parent network, or interactome, in CX2 format of '
+                             'hierarchy set as input. Used by --mode createhcx')
     parser.add_argument('--ppi_cutoffs', nargs='+', type=float,
                         default=CosineSimilarityPPIGenerator.PPI_CUTOFFS,
                         help='Cutoffs used to generate PPI input networks. For example, '
@@ -81,8 +153,40 @@ def _parse_arguments(desc, args):
                              'parent-child pair')
     parser.add_argument('--min_system_size', default=HiDeFHierarchyRefiner.MIN_SYSTEM_SIZE, type=float,
                         help='Minimum number of proteins each system must have to be kept')
+    parser.add_argument('--workers', default=1, type=int,
+                        help='If greater than 1, --mode communitydetection runs HiDeF '
+                             'separately on the network of each PPI cutoff, this many '
+                             'at a time, and merges the resulting clusters instead of '
+                             'running HiDeF once with the networks of all cutoffs as '
+                             'layers of a multiplex network')
+    parser.add_argument('--max_concurrent_requests', default=1, type=int,
+                        help='Maximum number of requests --mode server runs at a time')
+    parser.add_argument('--no_pretty', action='store_true',
+                        help='If set, result is written to standard out as compact '
+                             'JSON with no indentation or whitespace')
     parser.add_argument('--tempdir', default='/tmp',
-                        help='Directory needed to hold files temporarily for processing')
+                        help='Directory needed to hold files temporarily for processing. '
+                             'Files are removed once processing is done')
+    parser.add_argument('--scratch_dir',
+                        help='Directory on an in memory filesystem, such as /dev/shm, '
+                             'used instead of --tempdir by --mode communitydetection to '
+                             'hold edgelists and HiDeF output if they fit within '
+                             '--scratch_max_size and the free space of the filesystem')
+    parser.add_argument('--scratch_max_size', type=float,
+                        help='Maximum size in gigabytes of files --mode communitydetection '
+                             'may write to --scratch_dir. If unset, only free space '
+                             'of --scratch_dir is considered')
+    parser.add_argument('--result_cache',
+                        help='Directory where results of --mode ' +
+                             ', '.join(sorted(RESULT_CACHE_INPUT_FILES.keys())) +
+                             ' are cached, keyed on the contents of input files and '
+                             'the other arguments, so repeated requests return '
+                             'immediately. Used by requests to --mode server that do '
+                             'not set their own')
+    parser.add_argument('--result_cache_max_size', type=float,
+                        help='Maximum size in gigabytes of --result_cache. Least recently '
+                             'used results are removed once exceeded. If unset, '
+                             'results are never removed')
     parser.add_argument('--logconf', default=None,
                         help='Path to python logging configuration file in '
                              'this format: https://docs.python.org/3/library/'
@@ -116,57 +220,280 @@ def _get_sim_mat_from_similarity(df=None, algorithm='cosine'):
     alorithm_lower = algorithm.lower()
     if alorithm_lower == 'cosine':
         return music_utils.cosine_similarity_scaled(df)
-    elif alorithm_lower == 'manhattan':
-        return music_utils.manhattan_similarity(df)
+    elif alorithm_lower in ('manhattan', 'canberra', 'kendall', 'spearman'):
+        # blocked kernels avoid music_utils comparing each pair in python
+        sim = similarity.get_blocked_similarity(df, alorithm_lower)
+        return pd.DataFrame(similarity.get_similarity_matrix(sim),
+                            index=df.index.values, columns=df.index.values)
     elif alorithm_lower == 'pearson':
         return music_utils.pearson_scaled(df)
-    elif alorithm_lower == 'kendall':
-        return music_utils.kendall_scaled(df)
     elif alorithm_lower == 'euclidean':
         return music_utils.euclidean_similarity(df)
-    elif alorithm_lower == 'canberra':
-        return music_utils.canberra_similarity(df)
-    elif alorithm_lower == 'spearman':
-        return music_utils.spearman_scaled(df)
 
     raise Exception('Invalid similarity: ' + str(algorithm))
 
 
 def network_from_embedding_mode(embedding=None, algorithm='cosine',
-                                cutoff=0.1):
-    df = pd.read_table(embedding, sep='\t', index_col=0)
-
-    sim_mat = _get_sim_mat_from_similarity(df=df,
-                                           algorithm=algorithm)
-
-    keep = np.triu(np.ones(sim_mat.shape)).astype(bool)
-    sim_mat = sim_mat.where(keep)
-
-    pairs = sim_mat.stack().reset_index().rename(columns={'level_0': constants.PPI_EDGELIST_GENEA_COL,
-                                                          'level_1': constants.PPI_EDGELIST_GENEB_COL,
-                                                          0: constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL})
-
-    pairs = pairs[pairs[constants.PPI_EDGELIST_GENEA_COL] != pairs[constants.PPI_EDGELIST_GENEB_COL]]
-    edgelist = pairs.sort_values(constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL, ascending=False)
-
-    edgelist_cutoff = edgelist.iloc[0:math.ceil(cutoff * len(edgelist))]
+                                cutoff=0.1, blocked=False, block_rows=None,
+                                lazy=False, dtype=None, knn=None):
+    """
+    Creates a network from the top **cutoff** fraction of gene pairs in
+    **embedding** ranked by **algorithm** similarity. Pairs are selected
+    directly from the upper triangle of the similarity matrix via
+    :py:func:`~cellmaps_pipeline.topk.get_top_edges_by_cutoff` so only the kept
+    edges are ever materialized.
+
+    If **blocked** is ``True`` the similarity matrix itself is never built,
+    instead it is computed a tile of rows at a time via
+    :py:func:`~cellmaps_pipeline.similarity.get_top_edges_blocked_by_cutoff`
+
+    If **cutoff** is a list, a network is created for each cutoff, in
+    the same order, from one similarity computation and ranking, and
+    the cutoff is appended to the name of each network
+
+    If **knn** is set, **cutoff** and **blocked** are ignored and a single
+    network connecting each gene to its **knn** most similar genes is
+    created via :py:func:`~cellmaps_pipeline.similarity.get_knn_edges_blocked`.
+    Similarity is computed a tile of rows at a time if **algorithm** is in
+    :py:const:`~cellmaps_pipeline.similarity.BLOCKED_SIMILARITIES`,
+    otherwise the full similarity matrix is computed first
+
+    :param embedding: Path to embedding file in a format supported by
+                      :py:func:`~cellmaps_pipeline.embeddingio.read_embedding`
+    :type embedding: str
+    :param algorithm: Similarity algorithm
+    :type algorithm: str
+    :param cutoff: Fraction of edges to keep, ``0.1`` means top ten percent,
+                   or list of such fractions
+    :type cutoff: float or list
+    :param blocked: If ``True`` compute similarity in tiles of rows
+    :type blocked: bool
+    :param block_rows: Number of rows per tile when **blocked** is ``True``.
+                       If ``None`` a size is picked automatically
+    :type block_rows: int
+    :param lazy: If ``True`` the node and edge aspects of the network are
+                 generators meant to be written once via
+                 :py:func:`~cellmaps_pipeline.jsonstream.write_json`
+    :type lazy: bool
+    :param dtype: Type embedding values are loaded as, see
+                  :py:func:`~cellmaps_pipeline.embeddingio.read_embedding`
+    :type dtype: str
+    :param knn: Number of most similar genes to connect each gene to
+    :type knn: int
+    :raises CellmapsPipelineError: If **blocked** is ``True`` and **algorithm**
+                                   does not support it
+    :return: network in CX2 format for each cutoff
+    :rtype: list
+    """
+    cutoffs = cutoff if isinstance(cutoff, (list, tuple)) else [cutoff]
+    df = embeddingio.read_embedding(embedding, dtype=dtype)
+
+    if knn is not None:
+        return [_get_knn_network(df, embedding, algorithm, knn,
+                                 block_rows=block_rows, lazy=lazy)]
+
+    if blocked is True:
+        genes = df.index.values
+        edges_by_cutoff = similarity.get_top_edges_blocked_by_cutoff(similarity.get_blocked_similarity(df, algorithm),
+                                                                     cutoffs, block_rows=block_rows)
+    else:
+        sim_mat = _get_sim_mat_from_similarity(df=df,
+                                               algorithm=algorithm)
+        genes = sim_mat.index.values
+        sim_values = sim_mat.to_numpy()
+        if not np.issubdtype(sim_values.dtype, np.floating):
+            sim_values = sim_values.astype(float)
+        edges_by_cutoff = topk.get_top_edges_by_cutoff(sim_values, cutoffs)
+
+    networks = []
+    for cur_cutoff, (rows, cols, weights) in zip(cutoffs, edges_by_cutoff):
+        name = f'Network from {os.path.basename(embedding)}'
+        if len(cutoffs) > 1:
+            name += f' top {cur_cutoff:.0%}'
+        networks.append(cx2builder.get_cx2_from_edgelist(rows, cols, weights, node_names=genes,
+                                                         network_attributes={
+                                                             'name': name,
+                                                             'description': f'Created using {algorithm} similarity '
+                                                                            f'with top {cur_cutoff:.0%} edges'},
+                                                         lazy=lazy))
+    return networks
+
+
+def _get_knn_network(df, embedding, algorithm, knn, block_rows=None, lazy=False):
+    """
+    Creates network connecting each gene in **df** to its **knn**
+    most similar genes. See :py:func:`network_from_embedding_mode`
+
+    :param df: Embedding with genes as index
+    :type df: :py:class:`pandas.DataFrame`
+    :param embedding: Path to embedding file, used to name the network
+    :type embedding: str
+    :param algorithm: Similarity algorithm
+    :type algorithm: str
+    :param knn: Number of most similar genes to connect each gene to
+    :type knn: int
+    :param block_rows: Number of rows per tile
+    :type block_rows: int
+    :param lazy: If ``True`` the node and edge aspects of the network are generators
+    :type lazy: bool
+    :raises CellmapsPipelineError: If **knn** is less than ``1``
+    :return: network in CX2 format
+    :rtype: list
+    """
+    if knn < 1:
+        raise CellmapsPipelineError('knn must be at least 1: ' + str(knn))
+    if algorithm is not None and algorithm.lower() in similarity.BLOCKED_SIMILARITIES:
+        sim = similarity.get_blocked_similarity(df, algorithm)
+        genes = df.index.values
+    else:
+        sim_mat = _get_sim_mat_from_similarity(df=df, algorithm=algorithm)
+        sim = similarity.PrecomputedBlockedSimilarity(sim_mat)
+        genes = sim_mat.index.values
+    rows, cols, weights = similarity.get_knn_edges_blocked(sim, knn, block_rows=block_rows)
+    return cx2builder.get_cx2_from_edgelist(rows, cols, weights, node_names=genes,
+                                            network_attributes={
+                                                'name': f'Network from {os.path.basename(embedding)}',
+                                                'description': f'Created using {algorithm} similarity '
+                                                               f'with {knn} nearest neighbors of each gene'},
+                                            lazy=lazy)
+
+
+def _get_edge_arrays(cx2network):
+    """
+    Gets source and target node id and weight of every edge in
+    **cx2network**. Weight is the first edge attribute, in order of
+    appearance, named ``weight`` ignoring case. Edges without
+    it have a weight of ``NaN``
+
+    :param cx2network: Network
+    :type cx2network: :py:class:`~ndex2.cx2.CX2Network`
+    :return: (source ids, target ids, weights or ``None`` if no edge
+             has a weight attribute) as :py:class:`numpy.ndarray`
+    :rtype: tuple
+    """
+    edges = cx2network.get_edges()
+    sources = np.fromiter((edge[ndex2constants.EDGE_SOURCE] for edge in edges.values()),
+                          dtype=np.int64, count=len(edges))
+    targets = np.fromiter((edge[ndex2constants.EDGE_TARGET] for edge in edges.values()),
+                          dtype=np.int64, count=len(edges))
+    weight_attr = None
+    for edge in edges.values():
+        weight_attr = next((key for key in edge.get(ndex2constants.ASPECT_VALUES, {})
+                            if key.lower() == 'weight'), None)
+        if weight_attr is not None:
+            break
+    if weight_attr is None:
+        return sources, targets, None
+
+    def _get_weight(edge):
+        weight = edge.get(ndex2constants.ASPECT_VALUES, {}).get(weight_attr)
+        return np.nan if weight is None else weight
+
+    weights = np.fromiter((_get_weight(edge) for edge in edges.values()),
+                          dtype=float, count=len(edges))
+    return sources, targets, weights
+
+
+def _write_cutoff_edgelists(sources, targets, weights, ppi_cutoffs, outdir):
+    """
+    Writes a tab delimited edgelist file, named
+    ``ppi_<cutoff>.id.edgelist.tsv``, into **outdir** for each of
+    **ppi_cutoffs** holding the top **cutoff** fraction, plus one, of
+    edges by descending weight, or in original order if **weights** is
+    ``None``. Edges are ordered once, via
+    :py:func:`~cellmaps_pipeline.topk.get_descending_order` for as many
+    edges as the largest cutoff needs, since the edges of each cutoff
+    are a prefix of that order
+
+    :param sources: Source node id of each edge
+    :type sources: :py:class:`numpy.ndarray`
+    :param targets: Target node id of each edge
+    :type targets: :py:class:`numpy.ndarray`
+    :param weights: Weight of each edge or ``None``
+    :type weights: :py:class:`numpy.ndarray`
+    :param ppi_cutoffs: Fractions of edges to write to each file
+    :type ppi_cutoffs: list
+    :param outdir: Directory to write files to
+    :type outdir: str
+    :return: paths to edgelist files in same order as **ppi_cutoffs**
+    :rtype: list
+    """
+    num_edges = len(sources)
+    num_top = {cutoff: min(num_edges, int(num_edges * cutoff) + 1)
+               for cutoff in ppi_cutoffs}
+    max_top = max(num_top.values(), default=0)
+    if weights is None:
+        order = np.arange(max_top)
+    else:
+        order = topk.get_descending_order(weights, k=max_top)
+    lines = [str(source) + '\t' + str(target) + '\n'
+             for source, target in zip(sources[order].tolist(),
+                                       targets[order].tolist())]
+    edgelist_files = []
+    for cutoff in ppi_cutoffs:
+        path = os.path.join(outdir, f'ppi_{cutoff}.id.edgelist.tsv')
+        with open(path, 'w') as f:
+            f.writelines(itertools.islice(lines, num_top[cutoff]))
+        edgelist_files.append(path)
+    return edgelist_files
 
-    new_net = CX2Network()
-    new_net.add_network_attribute('name', f'Network from {os.path.basename(embedding)}')
-    new_net.add_network_attribute('description', f'Created using {algorithm} similarity with top {cutoff:.0%} edges')
 
-    node_to_id = {}
-    for node in pd.unique(edgelist_cutoff[[constants.PPI_EDGELIST_GENEA_COL,
-                                           constants.PPI_EDGELIST_GENEB_COL]].values.ravel()):
-        node_to_id[node] = new_net.add_node(attributes={'name': node})
+def _get_edgelists_size(sources, targets, ppi_cutoffs):
+    """
+    Gets upper bound on bytes of edgelist files written by
+    :py:func:`_write_cutoff_edgelists`
+
+    :param sources: Source node id of each edge
+    :type sources: :py:class:`numpy.ndarray`
+    :param targets: Target node id of each edge
+    :type targets: :py:class:`numpy.ndarray`
+    :param ppi_cutoffs: Fractions of edges written to each file
+    :type ppi_cutoffs: list
+    :return: bytes
+    :rtype: int
+    """
+    num_edges = len(sources)
+    if num_edges == 0:
+        return 0
+    line_size = 2 * len(str(max(int(sources.max()), int(targets.max())))) + 2
+    return line_size * sum(min(num_edges, int(num_edges * cutoff) + 1)
+                           for cutoff in ppi_cutoffs)
 
-    for _, row in edgelist_cutoff.iterrows():
-        src = node_to_id[row[constants.PPI_EDGELIST_GENEA_COL]]
-        tgt = node_to_id[row[constants.PPI_EDGELIST_GENEB_COL]]
-        weight = row[constants.WEIGHTED_PPI_EDGELIST_WEIGHT_COL]
-        new_net.add_edge(source=src, target=tgt, attributes={'weight': weight})
 
-    return [new_net.to_cx2()]
+def _get_tempdir(tempdir=None, scratch_dir=None, scratch_max_size=None,
+                 required_size=0):
+    """
+    Gets directory under which to create temporary directory. This is
+    **scratch_dir** if it is a directory and **required_size** is no more
+    than **scratch_max_size**, if set, nor the free space of its filesystem.
+    Otherwise **tempdir** is returned
+
+    :param tempdir: Default directory
+    :type tempdir: str
+    :param scratch_dir: Preferred directory, such as ``/dev/shm``
+    :type scratch_dir: str
+    :param scratch_max_size: Maximum bytes to write to **scratch_dir**
+    :type scratch_max_size: int
+    :param required_size: Estimated bytes that will be written
+    :type required_size: int
+    :return: directory
+    :rtype: str
+    """
+    if scratch_dir is None:
+        return tempdir
+    if not os.path.isdir(scratch_dir):
+        logger.warning('Scratch directory ' + str(scratch_dir) +
+                       ' is not a directory, using ' + str(tempdir))
+        return tempdir
+    if scratch_max_size is not None and required_size > scratch_max_size:
+        logger.info('Estimated size ' + str(required_size) + ' exceeds maximum of ' +
+                    str(scratch_max_size) + ' for scratch directory, using ' + str(tempdir))
+        return tempdir
+    if required_size > shutil.disk_usage(scratch_dir).free:
+        logger.info('Estimated size ' + str(required_size) + ' exceeds free space of ' +
+                    str(scratch_dir) + ', using ' + str(tempdir))
+        return tempdir
+    return scratch_dir
 
 
 def community_detection_mode(interactome, ndex_uuid, ppi_cutoffs=CosineSimilarityPPIGenerator.PPI_CUTOFFS,
@@ -175,56 +502,311 @@ def community_detection_mode(interactome, ndex_uuid, ppi_cutoffs=CosineSimilarit
                              containment_threshold=HiDeFHierarchyRefiner.CONTAINMENT_THRESHOLD,
                              jaccard_threshold=HiDeFHierarchyRefiner.JACCARD_THRESHOLD,
                              min_system_size=HiDeFHierarchyRefiner.MIN_SYSTEM_SIZE,
-                             min_diff=HiDeFHierarchyRefiner.MIN_DIFF):
-
-    tmpdir = tempfile.mkdtemp(prefix='cdetect_')
+                             min_diff=HiDeFHierarchyRefiner.MIN_DIFF,
+                             workers=1, tempdir=None, scratch_dir=None,
+                             scratch_max_size=None):
+    """
+    Runs HiDeF community detection on networks made of the top
+    **ppi_cutoffs** fractions of edges in **interactome** and refines
+    the resulting hierarchy.
+
+    If **workers** is greater than ``1``, and there is more than one
+    cutoff, HiDeF is run separately on the network of each cutoff,
+    **workers** at a time, via
+    :py:class:`~cellmaps_pipeline.parallelhidef.ParallelHiDeFRunner` and
+    the clusters are merged before refinement. Otherwise a single HiDeF
+    run is given the networks of all cutoffs as a multiplex network.
+
+    Edgelists and HiDeF output are written to a temporary directory,
+    created under **scratch_dir** if chosen by :py:func:`_get_tempdir`
+    otherwise under **tempdir**, that is removed when this function
+    returns or raises an exception
+
+    :param interactome: Path to CX2 network
+    :type interactome: str
+    :param ndex_uuid: UUID of **interactome** on NDEx
+    :type ndex_uuid: str
+    :param ppi_cutoffs: Fractions of edges, by descending weight, used
+                        to create each network given to HiDeF
+    :type ppi_cutoffs: list
+    :param algorithm: HiDeF clustering algorithm
+    :type algorithm: str
+    :param maxres: HiDeF max resolution parameter
+    :type maxres: float
+    :param k: HiDeF stability parameter
+    :type k: int
+    :param containment_threshold: Containment index threshold for pruning hierarchy
+    :type containment_threshold: float
+    :param jaccard_threshold: Jaccard index threshold for merging similar clusters
+    :type jaccard_threshold: float
+    :param min_system_size: Minimum number of proteins each system must have
+    :type min_system_size: int
+    :param min_diff: Minimum difference in number of proteins for every parent-child pair
+    :type min_diff: int
+    :param workers: Number of HiDeF runs at a time
+    :type workers: int
+    :param tempdir: Directory under which temporary directory is created,
+                    if ``None`` the default of :py:mod:`tempfile` is used
+    :type tempdir: str
+    :param scratch_dir: Directory, ideally on an in memory filesystem,
+                        used instead of **tempdir** if files fit
+    :type scratch_dir: str
+    :param scratch_max_size: Maximum bytes to write to **scratch_dir**
+    :type scratch_max_size: int
+    :return: hierarchy in CX2 format as only element of list
+    :rtype: list
+    """
 
     factory = RawCX2NetworkFactory()
     parent_cx2 = factory.get_cx2network(interactome)
 
-    pandas_cx2_factory = CX2NetworkPandasDataFrameFactory()
-    df = pandas_cx2_factory.get_dataframe(parent_cx2)
-    weight_col = next((col for col in df.columns if col.lower() == 'weight'), None)
-    if weight_col:
-        df = df.sort_values(weight_col, ascending=False)
-    edgelist_files = []
-    for cutoff in ppi_cutoffs:
-        top_df = df.iloc[:int(len(df) * cutoff)+1]
-        path = os.path.join(tmpdir, f'ppi_{cutoff}.id.edgelist.tsv')
-        top_df[['source_id', 'target_id']].to_csv(path, sep='\t', index=False, header=False)
-        edgelist_files.append(path)
+    sources, targets, weights = _get_edge_arrays(parent_cx2)
+    tempdir = _get_tempdir(tempdir=tempdir, scratch_dir=scratch_dir,
+                           scratch_max_size=scratch_max_size,
+                           required_size=SCRATCH_SIZE_FACTOR *
+                           _get_edgelists_size(sources, targets, ppi_cutoffs))
 
-    outputprefix = os.path.join(tmpdir, CDAPSHiDeFHierarchyGenerator.HIDEF_OUT_PREFIX)
-    hier_generator = CDAPSHiDeFHierarchyGenerator()
+    # removed upon success and failure
+    with tempfile.TemporaryDirectory(prefix='cdetect_', dir=tempdir) as tmpdir:
+        edgelist_files = _write_cutoff_edgelists(sources, targets, weights,
+                                                 ppi_cutoffs, tmpdir)
 
-    try:   
-        hier_generator._run_hidef(edgelist_files, outputprefix, algorithm, maxres, k)
-    except Exception as e:
-        print('HiDeF failed: ' + str(e))
-        raise
+        outputprefix = os.path.join(tmpdir, CDAPSHiDeFHierarchyGenerator.HIDEF_OUT_PREFIX)
+        hier_generator = CDAPSHiDeFHierarchyGenerator()
 
-    refiner = HiDeFHierarchyRefiner(ci_thre=containment_threshold,
-                                    ji_thre=jaccard_threshold,
-                                    min_term_size=min_system_size,
-                                    min_diff=min_diff)
+        try:
+            if workers > 1 and len(edgelist_files) > 1:
+                ParallelHiDeFRunner(workers=workers,
+                                    hier_generator=hier_generator).run(edgelist_files, outputprefix,
+                                                                       algorithm, maxres, k)
+            else:
+                hier_generator._run_hidef(edgelist_files, outputprefix, algorithm, maxres, k)
+        except Exception as e:
+            print('HiDeF failed: ' + str(e))
+            raise
 
-    try:
-        refiner.refine_hierarchy(outprefix=outputprefix)
-    except Exception as e:
-        print('Hierarchy refinement failed: ' + str(e))
-        raise
+        refiner = HiDeFHierarchyRefiner(ci_thre=containment_threshold,
+                                        ji_thre=jaccard_threshold,
+                                        min_term_size=min_system_size,
+                                        min_diff=min_diff)
+
+        try:
+            refiner.refine_hierarchy(outprefix=outputprefix)
+        except Exception as e:
+            print('Hierarchy refinement failed: ' + str(e))
+            raise
 
-    cdaps_out_file = os.path.join(tmpdir,
-                                  CDAPSHiDeFHierarchyGenerator.CDAPS_JSON_FILE)
+        cdaps_out_file = os.path.join(tmpdir,
+                                      CDAPSHiDeFHierarchyGenerator.CDAPS_JSON_FILE)
 
-    hier_generator = CDAPSHiDeFHierarchyGenerator()
-    with open(cdaps_out_file, 'w') as out_stream:
-        hier_generator.convert_hidef_output_to_cdaps(out_stream, tmpdir)
+        hier_generator = CDAPSHiDeFHierarchyGenerator()
+        with open(cdaps_out_file, 'w') as out_stream:
+            hier_generator.convert_hidef_output_to_cdaps(out_stream, tmpdir)
 
-    cd = cdapsutil.CommunityDetection(runner=cdapsutil.ExternalResultsRunner())
-    hierarchy = cd.run_community_detection(parent_cx2, algorithm=cdaps_out_file, uuid=ndex_uuid)
+        cd = cdapsutil.CommunityDetection(runner=cdapsutil.ExternalResultsRunner())
+        hierarchy = cd.run_community_detection(parent_cx2, algorithm=cdaps_out_file, uuid=ndex_uuid)
 
-    return [hierarchy.to_cx2()]
+        return [hierarchy.to_cx2()]
+
+
+def create_hcx_mode(hierarchy, parent_network, interactome_uuid=None):
+    """
+    Converts CDAPS **hierarchy** into HCX format via
+    :py:class:`~cellmaps_pipeline.hcx.CX2HCXFromCDAPSCXHierarchy`.
+    The interactome is referenced in the result by **interactome_uuid**
+    if set otherwise by the name of **parent_network**
+
+    :param hierarchy: Path to CDAPS hierarchy in CX2 format
+    :type hierarchy: str
+    :param parent_network: Path to parent network, or interactome,
+                           of **hierarchy** in CX2 format
+    :type parent_network: str
+    :param interactome_uuid: UUID of **parent_network** on NDEx
+    :type interactome_uuid: str
+    :raises CellmapsPipelineError: If **hierarchy** or **parent_network** is ``None``
+    :return: hierarchy in HCX format as only element of list
+    :rtype: list
+    """
+    if hierarchy is None:
+        raise CellmapsPipelineError('hierarchy is None')
+    if parent_network is None:
+        raise CellmapsPipelineError('parent network is None')
+
+    factory = RawCX2NetworkFactory()
+    hierarchy_cx2 = factory.get_cx2network(hierarchy)
+    parent_cx2 = factory.get_cx2network(parent_network)
+    interactome_name = parent_cx2.get_name()
+    if interactome_name is None:
+        interactome_name = os.path.basename(parent_network)
+
+    converter = CX2HCXFromCDAPSCXHierarchy()
+    hierarchy_cx2, _ = converter.get_converted_hierarchy(hierarchy=hierarchy_cx2,
+                                                         parent_network=parent_cx2,
+                                                         interactome_name=interactome_name,
+                                                         interactome_uuid=interactome_uuid)
+    return [hierarchy_cx2.to_cx2()]
+
+
+def _run_mode(theargs):
+    """
+    Runs action set by ``mode`` in **theargs**
+
+    :param theargs: Parsed command line arguments
+    :type theargs: :py:class:`argparse.Namespace`
+    :return: result in Cytoscape Web Service App format, which may contain
+             generators that can only be written once via
+             :py:func:`~cellmaps_pipeline.jsonstream.write_json`
+    :rtype: list
+    """
+    result = {}
+    if theargs.mode == 'networkfromembedding':
+        result = [{'action': 'addNetworks',
+                   'data': network_from_embedding_mode(embedding=theargs.embedding,
+                                                       algorithm=theargs.similarity,
+                                                       cutoff=theargs.embedding_cutoff,
+                                                       blocked=theargs.blocked_similarity,
+                                                       block_rows=theargs.block_rows,
+                                                       lazy=True,
+                                                       dtype=theargs.embedding_dtype,
+                                                       knn=theargs.knn)}]
+    if theargs.mode == 'communitydetection':
+        scratch_max_size = None
+        if theargs.scratch_max_size is not None:
+            scratch_max_size = int(theargs.scratch_max_size * 1024 ** 3)
+        result = [{'action': 'addNetworks',
+                   'data': community_detection_mode(interactome=theargs.input,
+                                                    ndex_uuid=theargs.interactome_uuid,
+                                                    ppi_cutoffs=theargs.ppi_cutoffs,
+                                                    algorithm=theargs.hidef_algorithm,
+                                                    maxres=theargs.maxres,
+                                                    k=theargs.k,
+                                                    containment_threshold=theargs.containment_threshold,
+                                                    jaccard_threshold=theargs.jaccard_threshold,
+                                                    min_system_size=theargs.min_system_size,
+                                                    min_diff=theargs.min_diff,
+                                                    workers=theargs.workers,
+                                                    tempdir=theargs.tempdir,
+                                                    scratch_dir=theargs.scratch_dir,
+                                                    scratch_max_size=scratch_max_size)}]
+    if theargs.mode == 'createhcx':
+        result = [{'action': 'addNetworks',
+                   'data': create_hcx_mode(hierarchy=theargs.input,
+                                           parent_network=theargs.parent_network,
+                                           interactome_uuid=theargs.interactome_uuid)}]
+    return result
+
+
+def _use_result_cache(theargs):
+    """
+    Checks if result of **theargs** should be cached
+
+    :param theargs: Parsed command line arguments
+    :type theargs: :py:class:`argparse.Namespace`
+    :return: ``True`` if ``result_cache`` is set and ``mode`` is in
+             :py:const:`RESULT_CACHE_INPUT_FILES`
+    :rtype: bool
+    """
+    return theargs.result_cache is not None and theargs.mode in RESULT_CACHE_INPUT_FILES
+
+
+def _open_cached_result(theargs):
+    """
+    Opens result of **theargs** from
+    :py:class:`~cellmaps_pipeline.resultcache.ResultCache` in
+    directory set by ``result_cache``, first running action set by
+    ``mode``, via :py:func:`_run_mode`, and adding its result to the
+    cache if not already cached
+
+    :param theargs: Parsed command line arguments
+    :type theargs: :py:class:`argparse.Namespace`
+    :return: text file holding result as JSON, compact if
+             ``no_pretty`` is set otherwise pretty printed
+    """
+    max_size = None
+    if theargs.result_cache_max_size is not None:
+        max_size = int(theargs.result_cache_max_size * 1024 ** 3)
+    cache = ResultCache(cache_dir=theargs.result_cache, max_size=max_size)
+
+    parameters = {name: value for name, value in vars(theargs).items()
+                  if name not in RESULT_CACHE_IGNORED_ARGS}
+    input_files = {name: getattr(theargs, name)
+                   for name in RESULT_CACHE_INPUT_FILES[theargs.mode]}
+    if input_files.get('embedding') is not None:
+        # binary embeddings keep their genes in a separate file
+        for index, path in enumerate(embeddingio.get_embedding_files(input_files['embedding'])[1:]):
+            input_files['embedding_' + str(index + 1)] = path
+    key = cache.get_key(theargs.mode, parameters=parameters, input_files=input_files)
+    result_file = cache.open_result(key)
+    if result_file is None:
+        result_file = cache.put(key, _run_mode(theargs),
+                                indent=None if theargs.no_pretty else 2)
+    return result_file
+
+
+def _write_result(theargs, out):
+    """
+    Writes result of **theargs** as JSON to **out**, copying it from
+    the result cache if :py:func:`_use_result_cache` is ``True``
+
+    :param theargs: Parsed command line arguments
+    :type theargs: :py:class:`argparse.Namespace`
+    :param out: Text stream to write to
+    """
+    if not _use_result_cache(theargs):
+        jsonstream.write_json(_run_mode(theargs), out,
+                              indent=None if theargs.no_pretty else 2)
+        return
+    with _open_cached_result(theargs) as result_file:
+        shutil.copyfileobj(result_file, out)
+
+
+def _serve(theargs, desc, in_stream=None, out_stream=None):
+    """
+    Serves requests, each holding the command line arguments of one
+    invocation of this tool, read from **in_stream** via
+    :py:class:`~cellmaps_pipeline.jsonlinesserver.JSONLinesServer` until
+    **in_stream** ends. While serving, :py:data:`sys.stdout` is redirected
+    to :py:data:`sys.stderr` so output printed by requests does not
+    corrupt responses written to **out_stream**
+
+    :param theargs: Parsed command line arguments of server
+    :type theargs: :py:class:`argparse.Namespace`
+    :param desc: description passed to :py:func:`_parse_arguments`
+    :type desc: str
+    :param in_stream: Text stream to read requests from, if ``None``
+                      :py:data:`sys.stdin` is used
+    :param out_stream: Text stream to write responses to, if ``None``
+                       :py:data:`sys.stdout` is used
+    :return: 0
+    :rtype: int
+    """
+    def handler(request_args):
+        request_theargs = _parse_arguments(desc, request_args)
+        if request_theargs.mode == 'server':
+            raise CellmapsPipelineError('--mode server cannot be requested from server')
+        if request_theargs.result_cache is None:
+            request_theargs.result_cache = theargs.result_cache
+            request_theargs.result_cache_max_size = theargs.result_cache_max_size
+        if _use_result_cache(request_theargs):
+            # responses are compact so cached text can be used as is
+            request_theargs.no_pretty = True
+            with _open_cached_result(request_theargs) as result_file:
+                return jsonstream.RawJSON(result_file.read())
+        return _run_mode(request_theargs)
+
+    if in_stream is None:
+        in_stream = sys.stdin
+    if out_stream is None:
+        out_stream = sys.stdout
+    orig_stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        server = JSONLinesServer(handler, max_concurrent=theargs.max_concurrent_requests)
+        num_requests = server.serve(in_stream, out_stream)
+        logger.info('Served ' + str(num_requests) + ' requests')
+    finally:
+        sys.stdout = orig_stdout
+    return 0
 
 
 def main(args):
@@ -233,7 +815,11 @@ def main(args):
     The Cell Maps Pipeline cywebserviceapp provides a wrapper to support invocation
     of tools as Cytoscape Web Service Apps
 
-    The result of this invocation is written to standard out
+    The result of this invocation is written to standard out as it
+    is serialized via :py:func:`~cellmaps_pipeline.jsonstream.write_json`,
+    or from the result cache if ``--result_cache`` is set.
+    With ``--mode server`` requests are instead served, via :py:func:`_serve`,
+    until standard in is closed
 
     :param args: arguments passed to command line usually :py:func:`sys.argv[1:]`
     :type args: list
@@ -254,7 +840,6 @@ For more information visit https://cellmaps-pipeline.readthedocs.io
     theargs = _parse_arguments(desc, args[1:])
     theargs.program = args[0]
     theargs.version = cellmaps_pipeline.__version__
-    result = {}
     try:
 
         logutils.setup_cmd_logging(theargs)
@@ -265,25 +850,10 @@ For more information visit https://cellmaps-pipeline.readthedocs.io
             logging.getLogger(logname).setLevel(logging.CRITICAL)
         logging.getLogger().setLevel(logging.CRITICAL)
 
-        if theargs.mode == 'networkfromembedding':
-            result = [{'action': 'addNetworks',
-                       'data': network_from_embedding_mode(embedding=theargs.embedding,
-                                                           algorithm=theargs.similarity,
-                                                           cutoff=theargs.embedding_cutoff,
-                                                           )}]
-        if theargs.mode == 'communitydetection':
-            result = [{'action': 'addNetworks',
-                       'data': community_detection_mode(interactome=theargs.input,
-                                                        ndex_uuid=theargs.interactome_uuid,
-                                                        ppi_cutoffs=theargs.ppi_cutoffs,
-                                                        algorithm=theargs.hidef_algorithm,
-                                                        maxres=theargs.maxres,
-                                                        k=theargs.k,
-                                                        containment_threshold=theargs.containment_threshold,
-                                                        jaccard_threshold=theargs.jaccard_threshold,
-                                                        min_system_size=theargs.min_system_size,
-                                                        min_diff=theargs.min_diff)}]
-        json.dump(result, sys.stdout, indent=2)
+        if theargs.mode == 'server':
+            return _serve(theargs, desc)
+
+        _write_result(theargs, sys.stdout)
     except Exception as e:
         logger.exception('Caught exception: ' + str(e))
         return 2
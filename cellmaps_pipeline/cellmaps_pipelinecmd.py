@@ -17,6 +17,9 @@ from cellmaps_pipeline.runner import ProgrammaticPipelineRunner
 from cellmaps_pipeline.runner import SLURMPipelineRunner
 import cellmaps_pipeline
 from cellmaps_pipeline.runner import CellmapsPipeline
+from cellmaps_pipeline.artifactstore import ArtifactStore
+from cellmaps_pipeline.slurmresources import SLURMResourceProfiles
+from cellmaps_pipeline.localslurm import LocalSLURMExecutor
 
 logger = logging.getLogger(__name__)
 
@@ -44,6 +47,88 @@ def _parse_arguments(desc, args):
                              'be created in <outdir> along with other slurm scripts. '
                              'To run the pipeline directly invoke ./slurm_cellmaps_job.sh '
                              'on a SLURM submit node')
+    parser.add_argument('--slurm_resources',
+                        help='Path to JSON file of CPUs, memory, time and partition '
+                             'requested by the SLURM job of each step, in format: '
+                             '{"default": {"cpus_per_task": 2, "mem": "8G", '
+                             '"time": "1:00:00"}, "image_embedding": '
+                             '{"cpus_per_task": 16, "mem": "64G", "partition": "cpu"}} '
+                             'Valid steps are default, ' +
+                             ', '.join(SLURMResourceProfiles.STEPS) + ' where '
+                             'image_embedding and coembedding apply to every fold '
+                             'and can be set for a single fold by appending _fold#. '
+                             'Resources not set fall back to the default step and then '
+                             'to ' + str(SLURMResourceProfiles.DEFAULT_RESOURCES[
+                                 SLURMResourceProfiles.CPUS_PER_TASK]) + ' CPUs, ' +
+                             SLURMResourceProfiles.DEFAULT_RESOURCES[SLURMResourceProfiles.MEM] +
+                             ' memory and ' +
+                             SLURMResourceProfiles.DEFAULT_RESOURCES[SLURMResourceProfiles.TIME] +
+                             ' time. Only used if --slurm is set')
+    parser.add_argument('--slurm_resource', nargs='+',
+                        help='Overrides resources in --slurm_resources, each in format '
+                             '<step>.<resource>=<value> where resource is one of ' +
+                             ', '.join(SLURMResourceProfiles.RESOURCES) + ', for example: '
+                             'image_embedding.cpus_per_task=16 default.mem=8G. '
+                             'Only used if --slurm is set')
+    parser.add_argument('--slurm_image_shards', type=int,
+                        help='If set, image download and image embedding of each '
+                             'fold are split into at most this many shards submitted '
+                             'as a SLURM job array, followed by a job merging the shards '
+                             'into the usual 1.image_download and 2.image_embedding_fold# '
+                             'directories. Samples of an antibody are kept in the same '
+                             'image download shard. Image download is not sharded if '
+                             '--cm4ai_image is set. Only used if --slurm is set')
+    parser.add_argument('--slurm_local', action='store_true',
+                        help='If set along with --slurm, the generated SLURM jobs are '
+                             'run on this machine, instead of being submitted to a '
+                             'cluster, honoring their dependencies and CPU and memory '
+                             'requests. Timings of each job are written to '
+                             'local_slurm_report.json in <outdir>')
+    parser.add_argument('--slurm_local_cpus', type=int,
+                        help='Number of CPUs jobs run via --slurm_local may request '
+                             'in total. If unset, number of CPUs on this machine')
+    parser.add_argument('--slurm_local_mem',
+                        help='Memory jobs run via --slurm_local may request in total, '
+                             'such as 16G. If unset, memory is not limited')
+    parser.add_argument('--workers', default=1, type=int,
+                        help='Maximum number of pipeline steps to run concurrently. '
+                             'Values greater than 1 run independent steps, such as '
+                             'PPI embedding and image download, at the same time '
+                             'in separate processes. Ignored if --slurm is set')
+    parser.add_argument('--fold_workers', default=1, type=int,
+                        help='When --workers is 1, maximum number of folds whose '
+                             'image embedding and co-embedding steps are run '
+                             'concurrently in separate processes. Ignored if '
+                             '--slurm is set')
+    parser.add_argument('--threads_per_worker', type=int,
+                        help='Maximum number of threads each worker process started '
+                             'via --workers or --fold_workers may use for BLAS and '
+                             'torch. Set this to avoid oversubscribing cores when '
+                             'running several workers. Ignored if --slurm is set')
+    parser.add_argument('--step_cache', action='store_true',
+                        help='If set, a manifest with a hash of the inputs and '
+                             'parameters of each step is written to '
+                             '<outdir>/step_manifests when the step completes. '
+                             'On reruns a step is skipped only if its manifest '
+                             'matches, otherwise its output directory is removed '
+                             'and the step is rerun. If unset, a step is skipped '
+                             'if its output directory exists. Ignored if --slurm is set')
+    parser.add_argument('--artifact_store',
+                        help='Path to directory holding outputs of image download, '
+                             'image embedding, PPI embedding and co-embedding steps '
+                             'shared across runs. Outputs of a step are hard linked '
+                             'from this store, instead of being recomputed, if the '
+                             'inputs and parameters of the step are unchanged. '
+                             'Setting this implies --step_cache. Ignored if --slurm is set')
+    parser.add_argument('--artifact_store_max_size', type=float,
+                        help='Maximum size in gigabytes of --artifact_store. Once '
+                             'exceeded, least recently used entries are removed. '
+                             'If unset, entries are never removed')
+    parser.add_argument('--artifact_store_link_mode', default=ArtifactStore.HARDLINK_MODE,
+                        choices=ArtifactStore.LINK_MODES,
+                        help='How files are placed from --artifact_store into <outdir>. '
+                             'hardlink falls back to copying if <outdir> is on '
+                             'another filesystem')
     parser.add_argument('--samples',
                         help='CSV file with list of IF images to download '
                              'in format of filename,if_plate_id,position,'
@@ -262,6 +347,15 @@ Additional optional fields for registering datasets include
                                             f'File under path {theargs.cm4ai_apms} does not exist.')
 
         if theargs.slurm is True:
+            if theargs.slurm_resources is not None:
+                resource_profiles = SLURMResourceProfiles.from_file(theargs.slurm_resources)
+            else:
+                resource_profiles = SLURMResourceProfiles()
+            resource_profiles.apply_overrides(theargs.slurm_resource)
+            local_executor = None
+            if theargs.slurm_local is True:
+                local_executor = LocalSLURMExecutor(max_cpus=theargs.slurm_local_cpus,
+                                                    max_mem=theargs.slurm_local_mem)
             runner = SLURMPipelineRunner(outdir=theargs.outdir,
                                          cm4ai_image=theargs.cm4ai_image,
                                          cm4ai_apms=theargs.cm4ai_apms,
@@ -275,8 +369,19 @@ Additional optional fields for registering datasets include
                                          fake=theargs.fake,
                                          provenance=theargs.provenance,
                                          fold=theargs.fold,
-                                         input_data_dict=theargs.__dict__)
+                                         input_data_dict=theargs.__dict__,
+                                         resource_profiles=resource_profiles,
+                                         image_shards=theargs.slurm_image_shards,
+                                         local_executor=local_executor)
         else:
+            artifact_store = None
+            if theargs.artifact_store is not None:
+                max_size = None
+                if theargs.artifact_store_max_size is not None:
+                    max_size = int(theargs.artifact_store_max_size * 1024 ** 3)
+                artifact_store = ArtifactStore(store_dir=theargs.artifact_store,
+                                               max_size=max_size,
+                                               link_mode=theargs.artifact_store_link_mode)
             runner = ProgrammaticPipelineRunner(outdir=theargs.outdir,
                                                 cm4ai_image=theargs.cm4ai_image,
                                                 cm4ai_apms=theargs.cm4ai_apms,
@@ -290,7 +395,12 @@ Additional optional fields for registering datasets include
                                                 fake=theargs.fake,
                                                 provenance=json_prov,
                                                 fold=theargs.fold,
-                                                input_data_dict=theargs.__dict__)
+                                                input_data_dict=theargs.__dict__,
+                                                max_workers=theargs.workers,
+                                                fold_workers=theargs.fold_workers,
+                                                threads_per_worker=theargs.threads_per_worker,
+                                                use_step_cache=theargs.step_cache,
+                                                artifact_store=artifact_store)
 
         return CellmapsPipeline(outdir=theargs.outdir,
                                 runner=runner,
@@ -0,0 +1,182 @@
+#! /usr/bin/env python
+
+import argparse
+import sys
+import logging
+import logging.config
+import json
+
+from cellmaps_utils import logutils
+from cellmaps_utils import constants
+
+import cellmaps_pipeline
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+from cellmaps_pipeline import sharding
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EMBEDDING_INPUT_MODE = 'imageembeddinginput'
+
+MERGE_IMAGE_DOWNLOAD_MODE = 'mergeimagedownload'
+
+MERGE_IMAGE_EMBEDDING_MODE = 'mergeimageembedding'
+
+MODES = [IMAGE_EMBEDDING_INPUT_MODE, MERGE_IMAGE_DOWNLOAD_MODE,
+         MERGE_IMAGE_EMBEDDING_MODE]
+
+
+def _parse_arguments(desc, args):
+    """
+    Parses command line arguments
+
+    :param desc: description to display on command line
+    :type desc: str
+    :param args: command line arguments usually :py:func:`sys.argv[1:]`
+    :type args: list
+    :return: arguments parsed by :py:mod:`argparse`
+    :rtype: :py:class:`argparse.Namespace`
+    """
+    parser = argparse.ArgumentParser(description=desc,
+                                     formatter_class=constants.ArgParseFormatter)
+    parser.add_argument('mode', choices=MODES,
+                        help='Task to run, see description above')
+    parser.add_argument('outdir',
+                        help='Input directory of shard to create for ' +
+                             IMAGE_EMBEDDING_INPUT_MODE + ' otherwise merged '
+                             'output directory to create')
+    parser.add_argument('--image_dir',
+                        help='Image download directory. Required for ' +
+                             IMAGE_EMBEDDING_INPUT_MODE + ' and ' +
+                             MERGE_IMAGE_EMBEDDING_MODE)
+    parser.add_argument('--fold', default=1, type=int,
+                        help='Fold of image gene node attributes file')
+    parser.add_argument('--shard', type=int,
+                        help='Shard number, starting at 1, for ' + IMAGE_EMBEDDING_INPUT_MODE)
+    parser.add_argument('--num_shards', type=int,
+                        help='Number of shards for ' + IMAGE_EMBEDDING_INPUT_MODE)
+    parser.add_argument('--shard_dirs', nargs='+',
+                        help='Output directories of shards to merge')
+    parser.add_argument('--samples',
+                        help='CSV file with list of IF images, all shards '
+                             'combined, for ' + MERGE_IMAGE_DOWNLOAD_MODE)
+    parser.add_argument('--unique',
+                        help='CSV file of unique samples, all shards '
+                             'combined, for ' + MERGE_IMAGE_DOWNLOAD_MODE)
+    parser.add_argument('--provenance',
+                        help='Path to file containing provenance information '
+                             'about input files in JSON format, for ' +
+                             MERGE_IMAGE_DOWNLOAD_MODE)
+    parser.add_argument('--proteinatlasxml',
+                        help='URL or path to proteinatlas.xml or proteinatlas.xml.gz '
+                             'file used to look up image URLs for ' +
+                             MERGE_IMAGE_DOWNLOAD_MODE + '. If unset, the file '
+                             'downloaded by the first shard is used')
+    parser.add_argument('--skip_logging', action='store_true',
+                        help='If set, output.log, error.log '
+                             'files will not be created')
+    parser.add_argument('--logconf', default=None,
+                        help='Path to python logging configuration file in '
+                             'this format: https://docs.python.org/3/library/'
+                             'logging.config.html#logging-config-fileformat '
+                             'Setting this overrides -v parameter which uses '
+                             ' default logger. (default None)')
+    parser.add_argument('--verbose', '-v', action='count', default=1,
+                        help='Increases verbosity of logger to standard '
+                             'error for log messages in this module. Messages are '
+                             'output at these python logging levels '
+                             '-v = WARNING, -vv = INFO, '
+                             '-vvv = DEBUG, -vvvv = NOTSET (default ERROR '
+                             'logging)')
+    parser.add_argument('--version', action='version',
+                        version=('%(prog)s ' +
+                                 cellmaps_pipeline.__version__))
+
+    return parser.parse_args(args)
+
+
+def _check_required(theargs, names):
+    """
+    Checks arguments **names** of **theargs** are set
+
+    :param theargs: Parsed arguments
+    :type theargs: :py:class:`argparse.Namespace`
+    :param names: Names of required arguments
+    :type names: list
+    :raises CellmapsPipelineError: If any argument is not set
+    """
+    for name in names:
+        if getattr(theargs, name) is None:
+            raise CellmapsPipelineError('--' + name + ' is required for mode ' + theargs.mode)
+
+
+def main(args):
+    """
+    Main entry point for program
+
+    :param args: arguments passed to command line usually :py:func:`sys.argv[1:]`
+    :type args: list
+
+    :return: return value of task run or ``2`` if an exception is raised
+    :rtype: int
+    """
+    desc = """
+Version {version}
+
+Runs the tasks of the SLURM jobs that shard image download and image
+embedding, which are generated when cellmaps_pipelinecmd.py is run with
+--slurm and --slurm_image_shards. Modes:
+
+  {embedinput} -- Creates <outdir> as input directory of image embedding
+                         shard --shard of --num_shards, holding links to
+                         its share of images in --image_dir
+
+  {mergedownload} -- Creates image download directory <outdir> from
+                        image download shards in --shard_dirs by rerunning
+                        image download on full --samples and --unique lists
+                        with images linked from the shards
+
+  {mergeembed} -- Creates image embedding directory <outdir> from image
+                         embedding shards in --shard_dirs
+    """.format(version=cellmaps_pipeline.__version__,
+               embedinput=IMAGE_EMBEDDING_INPUT_MODE,
+               mergedownload=MERGE_IMAGE_DOWNLOAD_MODE,
+               mergeembed=MERGE_IMAGE_EMBEDDING_MODE)
+    theargs = _parse_arguments(desc, args[1:])
+    theargs.program = args[0]
+    theargs.version = cellmaps_pipeline.__version__
+
+    try:
+        logutils.setup_cmd_logging(theargs)
+        if theargs.mode == IMAGE_EMBEDDING_INPUT_MODE:
+            _check_required(theargs, ['image_dir', 'shard', 'num_shards'])
+            sharding.create_image_embedding_shard_input(theargs.image_dir, theargs.outdir,
+                                                        fold=theargs.fold,
+                                                        shard=theargs.shard,
+                                                        num_shards=theargs.num_shards)
+            return 0
+
+        if theargs.mode == MERGE_IMAGE_DOWNLOAD_MODE:
+            _check_required(theargs, ['shard_dirs', 'samples', 'provenance'])
+            with open(theargs.provenance, 'r') as f:
+                json_prov = json.load(f)
+            return sharding.merge_image_download_shards(theargs.outdir, theargs.shard_dirs,
+                                                        theargs.samples, unique=theargs.unique,
+                                                        provenance=json_prov,
+                                                        proteinatlasxml=theargs.proteinatlasxml,
+                                                        skip_logging=theargs.skip_logging,
+                                                        input_data_dict=theargs.__dict__)
+
+        _check_required(theargs, ['image_dir', 'shard_dirs'])
+        return sharding.merge_image_embedding_shards(theargs.outdir, theargs.image_dir,
+                                                     theargs.shard_dirs, fold=theargs.fold,
+                                                     skip_logging=theargs.skip_logging,
+                                                     input_data_dict=theargs.__dict__)
+    except Exception as e:
+        logger.exception('Caught exception: ' + str(e))
+        return 2
+    finally:
+        logging.shutdown()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main(sys.argv))
@@ -0,0 +1,158 @@
+#! /usr/bin/env python
+
+import logging
+
+import numpy as np
+import pandas as pd
+from ndex2 import constants as ndex2constants
+from ndex2.cx2 import CX2Network
+from ndex2.cx2 import convert_value
+
+logger = logging.getLogger(__name__)
+
+NAME_ATTR = 'name'
+
+WEIGHT_ATTR = 'weight'
+
+CHUNK_SIZE = 65536
+"""
+Number of edges converted to python objects at a time when
+aspects are generated lazily
+"""
+
+
+def _iter_nodes(names, name_attr, name_type):
+    """
+    Generates CX2 node elements
+
+    :param names: Name of each node, position is node id
+    :type names: list
+    :param name_attr: Name of node attribute holding node name
+    :type name_attr: str
+    :param name_type: Declared CX2 type of **name_attr**
+    :type name_type: str
+    :return: node elements
+    :rtype: generator
+    """
+    for node_id, name in enumerate(names):
+        yield {ndex2constants.ASPECT_ID: node_id,
+               ndex2constants.ASPECT_VALUES: {name_attr: convert_value(name_type, name)}}
+
+
+def _iter_edges(codes, weights, weight_attr, weight_type,
+                chunk_size=CHUNK_SIZE):
+    """
+    Generates CX2 edge elements converting **codes** and **weights**
+    to python objects **chunk_size** edges at a time
+
+    :param codes: Source and target node id of each edge
+    :type codes: :py:class:`numpy.ndarray` of shape (number of edges, 2)
+    :param weights: Weight of each edge
+    :type weights: :py:class:`numpy.ndarray`
+    :param weight_attr: Name of edge attribute holding weight
+    :type weight_attr: str
+    :param weight_type: Declared CX2 type of **weight_attr**
+    :type weight_type: str
+    :param chunk_size: Number of edges converted at a time
+    :type chunk_size: int
+    :return: edge elements
+    :rtype: generator
+    """
+    for start in range(0, len(weights), chunk_size):
+        chunk_codes = codes[start:start + chunk_size].tolist()
+        chunk_weights = weights[start:start + chunk_size].tolist()
+        for offset, (edge_codes, weight) in enumerate(zip(chunk_codes, chunk_weights)):
+            yield {ndex2constants.ASPECT_ID: start + offset,
+                   ndex2constants.EDGE_SOURCE: edge_codes[0],
+                   ndex2constants.EDGE_TARGET: edge_codes[1],
+                   ndex2constants.ASPECT_VALUES: {weight_attr: convert_value(weight_type, weight)}}
+
+
+def get_cx2_from_edgelist(sources, targets, weights, node_names=None,
+                          network_attributes=None,
+                          name_attr=NAME_ATTR,
+                          weight_attr=WEIGHT_ATTR,
+                          lazy=False):
+    """
+    Builds a network in `CX2 <https://cytoscape.org/cx/cx2/specification/cytoscape-exchange-format-specification-(version-2)>`__
+    format from an edge list in bulk. The node and edge aspects are built
+    directly from the columns, with node ids assigned via :py:func:`pandas.factorize`,
+    instead of calling :py:meth:`~ndex2.cx2.CX2Network.add_node` and
+    :py:meth:`~ndex2.cx2.CX2Network.add_edge` for every entry.
+
+    The result is the same as adding, to a :py:class:`~ndex2.cx2.CX2Network`,
+    the **network_attributes** in order, then a node for each unique
+    source or target, in order of first appearance across the edges, and
+    then each edge with its weight and calling :py:meth:`~ndex2.cx2.CX2Network.to_cx2`
+
+    :param sources: Source node of each edge, an index into **node_names**
+                    if set, otherwise the name of the node
+    :type sources: :py:class:`numpy.ndarray` or list
+    :param targets: Target node of each edge, same form as **sources**
+    :type targets: :py:class:`numpy.ndarray` or list
+    :param weights: Weight of each edge
+    :type weights: :py:class:`numpy.ndarray` or list
+    :param node_names: Names of nodes
+    :type node_names: :py:class:`numpy.ndarray` or list
+    :param network_attributes: Network attributes, name => value, such as ``name`` and ``description``
+    :type network_attributes: dict
+    :param name_attr: Name of node attribute holding node name
+    :type name_attr: str
+    :param weight_attr: Name of edge attribute holding weight
+    :type weight_attr: str
+    :param lazy: If ``True`` the node and edge aspects are generators that
+                 create each element as it is consumed, for writing via
+                 :py:class:`~cellmaps_pipeline.jsonstream.StreamingJSONWriter`.
+                 These can only be consumed once
+    :type lazy: bool
+    :return: network in CX2 format
+    :rtype: list
+    """
+    sources = np.asarray(sources)
+    targets = np.asarray(targets)
+    weights = np.asarray(weights)
+
+    # template network holding the network attributes and, if there are
+    # edges, the first node and edge so attribute declarations and metadata
+    # are generated exactly as CX2Network would
+    template = CX2Network()
+    if network_attributes is not None:
+        for key, value in network_attributes.items():
+            template.add_network_attribute(key, value)
+
+    if len(weights) == 0:
+        return template.to_cx2()
+
+    codes, node_keys = pd.factorize(np.column_stack((sources, targets)).ravel())
+    if node_names is not None:
+        names = np.asarray(node_names)[node_keys].tolist()
+    else:
+        names = node_keys.tolist() if hasattr(node_keys, 'tolist') else list(node_keys)
+    first_node = template.add_node(attributes={name_attr: names[0]})
+    template.add_edge(source=first_node, target=first_node,
+                      attributes={weight_attr: weights[0].item()})
+    cx2 = template.to_cx2()
+
+    name_type = template.get_declared_type(ndex2constants.NODES_ASPECT, name_attr)
+    weight_type = template.get_declared_type(ndex2constants.EDGES_ASPECT, weight_attr)
+
+    num_nodes = len(names)
+    num_edges = len(weights)
+    nodes = _iter_nodes(names, name_attr, name_type)
+    edges = _iter_edges(codes.reshape(-1, 2), weights, weight_attr, weight_type)
+    if lazy is not True:
+        nodes = list(nodes)
+        edges = list(edges)
+
+    for aspect in cx2:
+        if 'metaData' in aspect:
+            for entry in aspect['metaData']:
+                if entry['name'] == ndex2constants.NODES_ASPECT:
+                    entry['elementCount'] = num_nodes
+                elif entry['name'] == ndex2constants.EDGES_ASPECT:
+                    entry['elementCount'] = num_edges
+        elif ndex2constants.NODES_ASPECT in aspect:
+            aspect[ndex2constants.NODES_ASPECT] = nodes
+        elif ndex2constants.EDGES_ASPECT in aspect:
+            aspect[ndex2constants.EDGES_ASPECT] = edges
+    return cx2
@@ -0,0 +1,220 @@
+#! /usr/bin/env python
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+
+logger = logging.getLogger(__name__)
+
+NPY_SUFFIX = '.npy'
+"""
+Suffix of embedding files in :py:mod:`numpy` ``.npy`` format
+"""
+
+PARQUET_SUFFIXES = ['.parquet', '.pq']
+"""
+Suffixes of embedding files in Parquet format
+"""
+
+GENES_SUFFIX = '.genes.txt'
+"""
+Suffix of file, next to a ``.npy`` embedding, holding the
+gene of each row of the embedding, one per line
+"""
+
+DTYPES = {'float64': np.float64,
+          'float32': np.float32}
+"""
+Names of supported embedding value types => :py:mod:`numpy` type
+"""
+
+
+def _has_suffix(embedding, suffixes):
+    """
+    Checks if path **embedding** ends with one of **suffixes**, ignoring case
+
+    :param embedding: Path to embedding
+    :type embedding: str
+    :param suffixes: Suffixes to check
+    :type suffixes: list
+    :return: ``True`` if it does
+    :rtype: bool
+    """
+    lower_embedding = embedding.lower()
+    return any(lower_embedding.endswith(suffix) for suffix in suffixes)
+
+
+def get_genes_file(embedding):
+    """
+    Gets path to file holding genes of ``.npy`` **embedding**, which
+    is **embedding** with ``.npy`` replaced by :py:const:`GENES_SUFFIX`
+
+    :param embedding: Path to ``.npy`` embedding
+    :type embedding: str
+    :return: path to genes file
+    :rtype: str
+    """
+    return embedding[:-len(NPY_SUFFIX)] + GENES_SUFFIX
+
+
+def get_embedding_files(embedding):
+    """
+    Gets the files that make up **embedding**, which for ``.npy``
+    embeddings includes the genes file from :py:func:`get_genes_file`
+
+    :param embedding: Path to embedding
+    :type embedding: str
+    :return: paths to files
+    :rtype: list
+    """
+    if _has_suffix(embedding, [NPY_SUFFIX]):
+        return [embedding, get_genes_file(embedding)]
+    return [embedding]
+
+
+def _get_dtype(dtype):
+    """
+    Gets :py:mod:`numpy` type for **dtype**
+
+    :param dtype: Name of type in :py:const:`DTYPES`, or ``None``
+    :type dtype: str
+    :raises CellmapsPipelineError: If **dtype** is not supported
+    :return: type or ``None`` if **dtype** is ``None``
+    """
+    if dtype is None:
+        return None
+    if dtype not in DTYPES:
+        raise CellmapsPipelineError('Unsupported embedding dtype: ' + str(dtype) +
+                                    ' supported: ' + str(sorted(DTYPES.keys())))
+    return DTYPES[dtype]
+
+
+def _read_npy_embedding(embedding, mmap=True):
+    """
+    Reads ``.npy`` **embedding** along with its genes file
+
+    :param embedding: Path to ``.npy`` embedding
+    :type embedding: str
+    :param mmap: If ``True`` the values are memory mapped instead of read
+    :type mmap: bool
+    :raises CellmapsPipelineError: If values are not two dimensional or
+                                   number of genes does not match number of rows
+    :return: embedding with genes as index
+    :rtype: :py:class:`pandas.DataFrame`
+    """
+    values = np.load(embedding, mmap_mode='r' if mmap else None)
+    if values.ndim != 2:
+        raise CellmapsPipelineError('Expected 2 dimensional array in ' + embedding +
+                                    ' but found ' + str(values.ndim) + ' dimensions')
+    with open(get_genes_file(embedding), 'r') as f:
+        genes = [line.rstrip('\n') for line in f]
+    if len(genes) != values.shape[0]:
+        raise CellmapsPipelineError('Number of genes in ' + get_genes_file(embedding) +
+                                    ' (' + str(len(genes)) + ') does not match number of '
+                                    'rows in ' + embedding + ' (' + str(values.shape[0]) + ')')
+    return pd.DataFrame(values, index=genes, copy=False)
+
+
+def _read_parquet_embedding(embedding, mmap=True):
+    """
+    Reads Parquet **embedding**. Genes are taken from the index stored
+    in the file or, if there is none, from the first column
+
+    :param embedding: Path to Parquet embedding
+    :type embedding: str
+    :param mmap: If ``True`` the file is memory mapped while being read
+    :type mmap: bool
+    :raises CellmapsPipelineError: If no Parquet engine is installed
+    :return: embedding with genes as index
+    :rtype: :py:class:`pandas.DataFrame`
+    """
+    try:
+        df = pd.read_parquet(embedding, memory_map=mmap)
+    except ImportError as e:
+        raise CellmapsPipelineError('Reading Parquet embeddings requires '
+                                    'pyarrow to be installed: ' + str(e))
+    if isinstance(df.index, pd.RangeIndex):
+        df = df.set_index(df.columns[0])
+    return df
+
+
+def _read_text_embedding(embedding, dtype=None):
+    """
+    Reads tab delimited **embedding** with genes as first column.
+    If **dtype** is set, values are parsed directly into that type
+
+    :param embedding: Path to tab delimited embedding
+    :type embedding: str
+    :param dtype: :py:mod:`numpy` type of values
+    :return: embedding with genes as index
+    :rtype: :py:class:`pandas.DataFrame`
+    """
+    if dtype is None:
+        return pd.read_table(embedding, sep='\t', index_col=0)
+    columns = pd.read_table(embedding, sep='\t', index_col=0, nrows=0).columns
+    return pd.read_table(embedding, sep='\t', index_col=0,
+                         dtype={column: dtype for column in columns})
+
+
+def read_embedding(embedding, dtype=None, mmap=True):
+    """
+    Reads **embedding** with a row per gene. Format is set by suffix:
+
+    * ``.npy`` - :py:mod:`numpy` array, with genes, one per line, in file
+      from :py:func:`get_genes_file`. Memory mapped if **mmap** is ``True``
+      so no time is spent parsing
+
+    * ``.parquet`` or ``.pq`` - Parquet, requires pyarrow
+
+    * anything else - tab delimited text with genes as first column
+
+    :param embedding: Path to embedding
+    :type embedding: str
+    :param dtype: Type of values, one of :py:const:`DTYPES`. ``float32``
+                  halves the memory of values. If ``None``, values are
+                  ``float64`` for text embeddings and as stored otherwise
+    :type dtype: str
+    :param mmap: If ``True`` binary embeddings are memory mapped. Values
+                 are still copied if **dtype** differs from stored type
+    :type mmap: bool
+    :raises CellmapsPipelineError: If **dtype** is not supported or embedding
+                                   can not be read
+    :return: embedding with genes as index
+    :rtype: :py:class:`pandas.DataFrame`
+    """
+    np_dtype = _get_dtype(dtype)
+    if _has_suffix(embedding, [NPY_SUFFIX]):
+        df = _read_npy_embedding(embedding, mmap=mmap)
+    elif _has_suffix(embedding, PARQUET_SUFFIXES):
+        df = _read_parquet_embedding(embedding, mmap=mmap)
+    else:
+        return _read_text_embedding(embedding, dtype=np_dtype)
+
+    if np_dtype is not None:
+        df = df.astype(np_dtype, copy=False)
+    return df
+
+
+def write_npy_embedding(df, embedding):
+    """
+    Writes **df** as ``.npy`` **embedding** along with its genes file, so it can
+    be read, and memory mapped, via :py:func:`read_embedding`
+
+    :param df: Embedding with genes as index
+    :type df: :py:class:`pandas.DataFrame`
+    :param embedding: Path to ``.npy`` file to write
+    :type embedding: str
+    :raises CellmapsPipelineError: If **embedding** does not end with ``.npy``
+    """
+    if not _has_suffix(embedding, [NPY_SUFFIX]):
+        raise CellmapsPipelineError('Embedding path must end with ' + NPY_SUFFIX +
+                                    ': ' + str(embedding))
+    # file object used so np.save does not append .npy to upper case suffixes
+    with open(embedding, 'wb') as f:
+        np.save(f, df.to_numpy())
+    with open(get_genes_file(embedding), 'w') as f:
+        for gene in df.index.values:
+            f.write(str(gene) + '\n')
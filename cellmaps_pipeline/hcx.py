@@ -0,0 +1,182 @@
+#! /usr/bin/env python
+
+import logging
+
+from cellmaps_generate_hierarchy.hcx import HCXFromCDAPSCXHierarchy
+from ndex2 import constants as ndex2constants
+
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+
+logger = logging.getLogger(__name__)
+
+
+class CX2HCXFromCDAPSCXHierarchy(HCXFromCDAPSCXHierarchy):
+    """
+    Converts CDAPS hierarchy, and its parent network or interactome, in
+    `CX2 <https://cytoscape.org/cx/cx2/specification/cytoscape-exchange-format-specification-(version-2)>`__
+    format into `HCX <https://cytoscape.org/cx/cx2/hcx-specification/>`__
+    adding the same annotations as
+    :py:class:`~cellmaps_generate_hierarchy.hcx.HCXFromCDAPSCXHierarchy`
+    does for CX networks.
+
+    The :py:class:`~ndex2.cx2.CX2Network` objects are updated directly
+    and members of each system are resolved via an index, built once,
+    of interactome node name to node id, so conversion takes time
+    proportional to the number of nodes, edges and members instead of
+    looking up each member by scanning the interactome nodes
+    """
+
+    ISROOT_ATTR = 'HCX::isRoot'
+
+    MEMBERS_ATTR = 'HCX::members'
+
+    MEMBERS_DATATYPE = 'list_of_long'
+
+    MEMBERLIST_ATTR = 'CD_MemberList'
+
+    INTERACTION_NETWORK_NAME_ATTR = 'HCX::interactionNetworkName'
+
+    INTERACTION_NETWORK_UUID_ATTR = 'HCX::interactionNetworkUUID'
+
+    def _get_root_nodes(self, hierarchy):
+        """
+        Gets nodes of **hierarchy** that are not the target of any edge
+
+        :param hierarchy: Hierarchy
+        :type hierarchy: :py:class:`~ndex2.cx2.CX2Network`
+        :return: root node ids
+        :rtype: set
+        """
+        nodes_with_targets = set(edge[ndex2constants.EDGE_TARGET]
+                                 for edge in hierarchy.get_edges().values())
+        return set(hierarchy.get_nodes().keys()).difference(nodes_with_targets)
+
+    def _add_isroot_node_attribute(self, hierarchy, root_nodes=None):
+        """
+        Sets ``HCX::isRoot`` node attribute to ``True`` if node
+        id is in **root_nodes** otherwise ``False``
+
+        :param hierarchy: Hierarchy
+        :type hierarchy: :py:class:`~ndex2.cx2.CX2Network`
+        :param root_nodes: Ids of root nodes
+        :type root_nodes: set
+        """
+        for node_id in hierarchy.get_nodes().keys():
+            hierarchy.add_node_attribute(node_id, CX2HCXFromCDAPSCXHierarchy.ISROOT_ATTR,
+                                         node_id in root_nodes,
+                                         datatype=ndex2constants.BOOLEAN_DATATYPE)
+
+    def _add_hierarchy_network_attributes(self, hierarchy, interactome_name=None,
+                                          interactome_uuid=None):
+        """
+        Adds HCX network attributes to **hierarchy**. The interactome is
+        referenced by **interactome_uuid** if set otherwise by **interactome_name**
+
+        :param hierarchy: Hierarchy
+        :type hierarchy: :py:class:`~ndex2.cx2.CX2Network`
+        :param interactome_name: Name of interactome
+        :type interactome_name: str
+        :param interactome_uuid: NDEx UUID of interactome
+        :type interactome_uuid: str
+        """
+        hierarchy.add_network_attribute('ndexSchema', 'hierarchy_v0.1',
+                                        datatype=ndex2constants.STRING_DATATYPE)
+        hierarchy.add_network_attribute('HCX::modelFileCount', 2,
+                                        datatype=ndex2constants.INTEGER_DATATYPE)
+        if interactome_uuid is not None:
+            hierarchy.add_network_attribute(CX2HCXFromCDAPSCXHierarchy.INTERACTION_NETWORK_UUID_ATTR,
+                                            interactome_uuid,
+                                            datatype=ndex2constants.STRING_DATATYPE)
+        else:
+            hierarchy.add_network_attribute(CX2HCXFromCDAPSCXHierarchy.INTERACTION_NETWORK_NAME_ATTR,
+                                            interactome_name,
+                                            datatype=ndex2constants.STRING_DATATYPE)
+
+    def _get_mapping_of_node_names_to_ids(self, network):
+        """
+        Gets index of node name to node id. If names repeat,
+        the last node with the name is used
+
+        :param network: Network
+        :type network: :py:class:`~ndex2.cx2.CX2Network`
+        :return: node name => node id
+        :rtype: dict
+        """
+        return {node.get(ndex2constants.ASPECT_VALUES, {}).get(ndex2constants.NODE_NAME_EXPANDED): node_id
+                for node_id, node in network.get_nodes().items()}
+
+    def _add_members_node_attribute(self, hierarchy,
+                                    interactome_name_map=None,
+                                    memberlist_attr_name=MEMBERLIST_ATTR):
+        """
+        Sets ``HCX::members`` node attribute to the sorted ids, in the
+        interactome, of the space delimited member names in
+        **memberlist_attr_name**. Names not in **interactome_name_map** are
+        skipped and nodes without **memberlist_attr_name** are left as is
+
+        :param hierarchy: Hierarchy
+        :type hierarchy: :py:class:`~ndex2.cx2.CX2Network`
+        :param interactome_name_map: node name => node id of interactome
+        :type interactome_name_map: dict
+        :param memberlist_attr_name: Node attribute holding member names
+        :type memberlist_attr_name: str
+        :raises CellmapsPipelineError: If **interactome_name_map** is ``None``
+        """
+        if interactome_name_map is None:
+            raise CellmapsPipelineError('interactome name map is None')
+
+        hierarchy.get_attribute_declarations().setdefault(ndex2constants.NODES_ASPECT, {})[
+            CX2HCXFromCDAPSCXHierarchy.MEMBERS_ATTR] = {
+            ndex2constants.ATTR_DATATYPE: CX2HCXFromCDAPSCXHierarchy.MEMBERS_DATATYPE}
+
+        num_missing = 0
+        for node_id, node in hierarchy.get_nodes().items():
+            memberlist = node.get(ndex2constants.ASPECT_VALUES, {}).get(memberlist_attr_name)
+            if memberlist is None:
+                logger.warning('no memberlist for node ' + str(node_id))
+                continue
+            member_ids = set()
+            for member in memberlist.split():
+                member_id = interactome_name_map.get(member)
+                if member_id is None:
+                    num_missing += 1
+                    continue
+                member_ids.add(member_id)
+            node[ndex2constants.ASPECT_VALUES][CX2HCXFromCDAPSCXHierarchy.MEMBERS_ATTR] = sorted(member_ids)
+        if num_missing > 0:
+            logger.warning(str(num_missing) + ' members not in interactome. Skipped')
+
+    def get_converted_hierarchy(self, hierarchy=None, parent_network=None,
+                                interactome_name=None, interactome_uuid=None):
+        """
+        Annotates **hierarchy** with HCX attributes and applies the
+        hierarchy and interactome styles of ``cellmaps_generate_hierarchy``
+        to **hierarchy** and **parent_network** respectively. Both are
+        updated in place
+
+        :param hierarchy: CDAPS hierarchy
+        :type hierarchy: :py:class:`~ndex2.cx2.CX2Network`
+        :param parent_network: Parent network, or interactome, of **hierarchy**
+        :type parent_network: :py:class:`~ndex2.cx2.CX2Network`
+        :param interactome_name: Name of interactome, if ``None``, name of
+                                 **parent_network** is used
+        :type interactome_name: str
+        :param interactome_uuid: NDEx UUID of interactome, if set this is
+                                 used to reference the interactome instead
+                                 of its name
+        :type interactome_uuid: str
+        :return: (hierarchy as :py:class:`~ndex2.cx2.CX2Network`,
+                  parent ppi as :py:class:`~ndex2.cx2.CX2Network`)
+        :rtype: tuple
+        """
+        if interactome_name is None:
+            interactome_name = parent_network.get_name()
+        self._add_hierarchy_network_attributes(hierarchy, interactome_name=interactome_name,
+                                               interactome_uuid=interactome_uuid)
+        self._add_isroot_node_attribute(hierarchy, root_nodes=self._get_root_nodes(hierarchy))
+        self._add_members_node_attribute(hierarchy,
+                                         interactome_name_map=self._get_mapping_of_node_names_to_ids(parent_network))
+
+        parent_network = self.apply_style_to_network(parent_network, 'interactome_style.cx2')
+        hierarchy = self.apply_style_to_network(hierarchy, 'hierarchy_style.cx2')
+        return hierarchy, parent_network
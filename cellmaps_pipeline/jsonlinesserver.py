@@ -0,0 +1,178 @@
+#! /usr/bin/env python
+
+import io
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cellmaps_pipeline import jsonstream
+
+logger = logging.getLogger(__name__)
+
+ID_KEY = 'id'
+"""
+Key in request and response holding id, set by caller, of the request
+"""
+
+ARGS_KEY = 'args'
+"""
+Key in request holding list of command line arguments
+"""
+
+STATUS_KEY = 'status'
+"""
+Key in response holding ``0`` upon success otherwise failure
+"""
+
+RESULT_KEY = 'result'
+"""
+Key in response holding result upon success
+"""
+
+ERROR_KEY = 'error'
+"""
+Key in response holding error message upon failure
+"""
+
+ERROR_STATUS = 2
+
+
+class JSONLinesServer(object):
+    """
+    Serves requests read, one JSON object per line, from a text stream
+    and writes a response, as one line of compact JSON, for each request
+    to another text stream. This lets a long running process handle many
+    requests without paying the cost of starting python and importing
+    modules for each one.
+
+    Each request is an object with the command line arguments to run
+    under :py:const:`ARGS_KEY` and an optional caller chosen id, under
+    :py:const:`ID_KEY`, that is copied to the response:
+
+    .. code-block::
+
+        {"id": 1, "args": ["input", "--mode", "networkfromembedding", "--embedding", "e.tsv"]}
+
+    Responses are written as requests complete, which may not be
+    the order they were read, and look like:
+
+    .. code-block::
+
+        {"id": 1, "status": 0, "result": [...]}
+        {"id": 2, "status": 2, "error": "..."}
+
+    Up to **max_concurrent** requests run at a time in a pool of threads.
+    Reading of requests pauses while that many are running. The server
+    stops once the input stream ends and every request has completed
+    """
+
+    def __init__(self, handler, max_concurrent=1):
+        """
+        Constructor
+
+        :param handler: Called with the list of command line arguments of a
+                        request, returns result, which may contain generators
+                        as supported by :py:func:`~cellmaps_pipeline.jsonstream.write_json`,
+                        or raises an exception upon failure
+        :type handler: callable
+        :param max_concurrent: Maximum number of requests to run at a time
+        :type max_concurrent: int
+        """
+        self._handler = handler
+        self._max_concurrent = max(1, int(max_concurrent))
+        self._slots = threading.BoundedSemaphore(self._max_concurrent)
+        self._write_lock = threading.Lock()
+
+    def serve(self, in_stream, out_stream):
+        """
+        Serves requests from **in_stream** until it ends
+
+        :param in_stream: Text stream to read requests from, such as :py:data:`sys.stdin`
+        :param out_stream: Text stream to write responses to, such as :py:data:`sys.stdout`
+        :return: number of requests served
+        :rtype: int
+        """
+        num_requests = 0
+        with ThreadPoolExecutor(max_workers=self._max_concurrent) as executor:
+            for line in in_stream:
+                if len(line.strip()) == 0:
+                    continue
+                num_requests += 1
+                self._slots.acquire()
+                try:
+                    executor.submit(self._serve_request, line, out_stream)
+                except BaseException:
+                    self._slots.release()
+                    raise
+        return num_requests
+
+    def _serve_request(self, line, out_stream):
+        """
+        Runs request in **line** and writes response
+
+        :param line: JSON encoded request
+        :type line: str
+        :param out_stream: Text stream to write response to
+        """
+        try:
+            self._write_response(self._get_response(line), out_stream)
+        except Exception as e:
+            logger.exception('Unable to write response: ' + str(e))
+        finally:
+            self._slots.release()
+
+    def _get_response(self, line):
+        """
+        Runs request in **line**
+
+        :param line: JSON encoded request
+        :type line: str
+        :return: response
+        :rtype: dict
+        """
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('Request must be a JSON object')
+            request_id = request.get(ID_KEY)
+            args = request.get(ARGS_KEY)
+            if not isinstance(args, list):
+                raise ValueError('Request must have a list of arguments under: ' + ARGS_KEY)
+            return {ID_KEY: request_id, STATUS_KEY: 0,
+                    RESULT_KEY: self._handler([str(arg) for arg in args])}
+        except SystemExit as se:
+            # argparse exits upon invalid arguments
+            return {ID_KEY: request_id, STATUS_KEY: ERROR_STATUS,
+                    ERROR_KEY: 'Invalid arguments, exit code: ' + str(se.code)}
+        except Exception as e:
+            logger.exception('Request failed: ' + str(e))
+            return {ID_KEY: request_id, STATUS_KEY: ERROR_STATUS,
+                    ERROR_KEY: str(e)}
+
+    def _write_response(self, response, out_stream):
+        """
+        Writes **response** as a single line of JSON to **out_stream**.
+        The response is serialized before taking the lock on
+        **out_stream** so lines of concurrent responses never interleave
+        and a failure while serializing writes an error response instead
+
+        :param response: response to write
+        :type response: dict
+        :param out_stream: Text stream to write response to
+        """
+        buffer = io.StringIO()
+        try:
+            jsonstream.write_json(response, buffer, indent=None)
+        except Exception as e:
+            logger.exception('Unable to serialize result: ' + str(e))
+            buffer = io.StringIO()
+            jsonstream.write_json({ID_KEY: response.get(ID_KEY),
+                                   STATUS_KEY: ERROR_STATUS,
+                                   ERROR_KEY: 'Unable to serialize result: ' + str(e)},
+                                  buffer, indent=None)
+        buffer.write('\n')
+        with self._write_lock:
+            out_stream.write(buffer.getvalue())
+            out_stream.flush()
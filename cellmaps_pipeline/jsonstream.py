@@ -0,0 +1,283 @@
+#! /usr/bin/env python
+
+import json
+import types
+import logging
+
+logger = logging.getLogger(__name__)
+
+COMPACT_SEPARATORS = (',', ':')
+"""
+Separators used when JSON is not pretty printed
+"""
+
+BATCH_SIZE = 1024
+"""
+Number of consecutive array elements, that do not need to be
+written piece by piece, converted with a single :py:func:`json.dumps` call
+"""
+
+_SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
+class RawJSON(object):
+    """
+    Holds text that is already JSON, such as a result read from a
+    cache, so it is written as is instead of being parsed and
+    serialized again. The text is not reindented so output only
+    matches :py:func:`json.dump` when writing compact JSON
+    """
+
+    def __init__(self, text):
+        """
+        Constructor
+
+        :param text: JSON
+        :type text: str
+        """
+        self.text = text
+
+
+def _is_lazy(value):
+    """
+    Checks if **value** is a generator or iterator that should be
+    written element by element as a JSON array
+
+    :param value: value to check
+    :return: ``True`` if **value** is a generator or iterator
+    :rtype: bool
+    """
+    return isinstance(value, types.GeneratorType) or \
+        (hasattr(value, '__next__') and hasattr(value, '__iter__'))
+
+
+def _get_key(key):
+    """
+    Gets **key** of a dict as the string :py:mod:`json` would use
+
+    :param key: key of dict
+    :return: key as string
+    :rtype: str
+    """
+    if isinstance(key, str):
+        return key
+    return json.dumps(key)
+
+
+def _is_container(value):
+    """
+    Checks if **value** holds other containers, or generators, and
+    so should be written piece by piece instead of with a single
+    :py:func:`json.dumps` call. Dicts holding only scalars and such
+    dicts, such as a CX2 node or edge, are written in one call
+
+    :param value: value to check
+    :return: ``True`` if **value** should be written piece by piece
+    :rtype: bool
+    """
+    if isinstance(value, RawJSON):
+        return True
+    if isinstance(value, dict):
+        for entry in value.values():
+            if isinstance(entry, _SCALAR_TYPES):
+                continue
+            if isinstance(entry, dict):
+                if _is_container(entry):
+                    return True
+                continue
+            if isinstance(entry, (list, tuple, RawJSON)) or _is_lazy(entry):
+                return True
+        return False
+    return isinstance(value, (list, tuple)) or _is_lazy(value)
+
+
+class StreamingJSONWriter(object):
+    """
+    Writes JSON to a text stream incrementally. Lists, tuples, dicts and
+    generators holding other containers are written one element at a
+    time, so generators, such as the node and edge aspects returned by
+    :py:func:`~cellmaps_pipeline.cx2builder.get_cx2_from_edgelist` with
+    ``lazy=True``, are never materialized. The output is identical to
+    :py:func:`json.dump` with the same **indent**, or with
+    :py:const:`COMPACT_SEPARATORS` if **indent** is ``None``.
+    :py:class:`RawJSON` values are written as is
+    """
+
+    def __init__(self, out, indent=2):
+        """
+        Constructor
+
+        :param out: Text stream to write to, such as :py:data:`sys.stdout`
+        :param indent: Number of spaces to indent by. If ``None`` output
+                       is compact with no whitespace
+        :type indent: int
+        """
+        self._out = out
+        self._indent = indent
+        if indent is None:
+            self._item_separator, self._key_separator = COMPACT_SEPARATORS
+        else:
+            self._item_separator, self._key_separator = ',', ': '
+
+    def write(self, value):
+        """
+        Writes **value** as JSON
+
+        :param value: value to write
+        """
+        self._write_value(value, 0)
+
+    def _get_newline(self, level):
+        """
+        Gets the string to write before an element at **level**
+
+        :param level: nesting level
+        :type level: int
+        :return: newline followed by indentation or empty string if not indenting
+        :rtype: str
+        """
+        if self._indent is None:
+            return ''
+        return '\n' + ' ' * (self._indent * level)
+
+    def _dumps(self, value, level):
+        """
+        Gets JSON of **value** indented for **level**
+
+        :param value: value to convert
+        :param level: nesting level
+        :type level: int
+        :return: JSON
+        :rtype: str
+        """
+        if self._indent is None:
+            return json.dumps(value, separators=COMPACT_SEPARATORS)
+        res = json.dumps(value, indent=self._indent)
+        if level > 0 and '\n' in res:
+            res = res.replace('\n', self._get_newline(level))
+        return res
+
+    def _dumps_batch(self, batch, level):
+        """
+        Gets JSON of the elements in **batch**, separated as they would be
+        in a JSON array at **level**, without the enclosing brackets
+
+        :param batch: elements of array
+        :type batch: list
+        :param level: nesting level of array
+        :type level: int
+        :return: JSON
+        :rtype: str
+        """
+        if self._indent is None:
+            return json.dumps(batch, separators=COMPACT_SEPARATORS)[1:-1]
+        res = json.dumps(batch, indent=self._indent)[len(self._get_newline(1)) + 1:-2]
+        if level > 0:
+            res = res.replace('\n', self._get_newline(level))
+        return res
+
+    def _write_batch(self, batch, level, is_empty):
+        """
+        Writes elements in **batch** of a JSON array at **level**
+
+        :param batch: elements to write
+        :type batch: list
+        :param level: nesting level of array
+        :type level: int
+        :param is_empty: ``True`` if no elements of array have been written yet
+        :type is_empty: bool
+        :return: ``True`` if no elements of array have been written yet
+        :rtype: bool
+        """
+        if len(batch) == 0:
+            return is_empty
+        if not is_empty:
+            self._out.write(self._item_separator)
+        self._out.write(self._get_newline(level + 1) + self._dumps_batch(batch, level))
+        return False
+
+    def _write_array(self, value, level):
+        """
+        Writes iterable **value** as a JSON array at **level**. Consecutive
+        elements that are not containers are converted in batches of
+        :py:const:`BATCH_SIZE` to cut the overhead of :py:func:`json.dumps`
+
+        :param value: list, tuple or generator to write
+        :param level: nesting level
+        :type level: int
+        """
+        self._out.write('[')
+        is_empty = True
+        batch = []
+        for entry in value:
+            if not _is_container(entry):
+                batch.append(entry)
+                if len(batch) == BATCH_SIZE:
+                    is_empty = self._write_batch(batch, level, is_empty)
+                    batch = []
+                continue
+            is_empty = self._write_batch(batch, level, is_empty)
+            batch = []
+            if not is_empty:
+                self._out.write(self._item_separator)
+            is_empty = False
+            self._out.write(self._get_newline(level + 1))
+            self._write_value(entry, level + 1)
+        is_empty = self._write_batch(batch, level, is_empty)
+        if not is_empty:
+            self._out.write(self._get_newline(level))
+        self._out.write(']')
+
+    def _write_value(self, value, level):
+        """
+        Writes **value** at **level**
+
+        :param value: value to write
+        :param level: nesting level
+        :type level: int
+        """
+        if isinstance(value, RawJSON):
+            self._out.write(value.text)
+            return
+        if not _is_container(value):
+            self._out.write(self._dumps(value, level))
+            return
+        if isinstance(value, dict):
+            self._write_object(value, level)
+            return
+        self._write_array(value, level)
+
+    def _write_object(self, value, level):
+        """
+        Writes dict **value** as a JSON object at **level**
+
+        :param value: dict to write
+        :type value: dict
+        :param level: nesting level
+        :type level: int
+        """
+        self._out.write('{')
+        is_empty = True
+        for key, entry in value.items():
+            if not is_empty:
+                self._out.write(self._item_separator)
+            is_empty = False
+            self._out.write(self._get_newline(level + 1) + json.dumps(_get_key(key)) +
+                            self._key_separator)
+            self._write_value(entry, level + 1)
+        if not is_empty:
+            self._out.write(self._get_newline(level))
+        self._out.write('}')
+
+
+def write_json(value, out, indent=2):
+    """
+    Writes **value** as JSON to **out** via :py:class:`StreamingJSONWriter`
+
+    :param value: value to write, may contain generators which
+                  are written as JSON arrays
+    :param out: Text stream to write to
+    :param indent: Number of spaces to indent by. If ``None`` output is compact
+    :type indent: int
+    """
+    StreamingJSONWriter(out, indent=indent).write(value)
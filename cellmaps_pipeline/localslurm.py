@@ -0,0 +1,676 @@
+#! /usr/bin/env python
+
+import os
+import re
+import json
+import time
+import sys
+import shlex
+import shutil
+import signal
+import logging
+import tempfile
+import subprocess
+
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+
+logger = logging.getLogger(__name__)
+
+DIRECTIVE_PREFIX = '#SBATCH'
+
+SBATCH_STUB = """#!{python}
+import os
+import sys
+import json
+
+with open({jobs_file!r}, 'a+') as f:
+    f.seek(0)
+    submit_id = len(f.readlines()) + 1
+    f.write(json.dumps({{'submit_id': submit_id, 'cwd': os.getcwd(),
+                        'args': sys.argv[1:]}}) + '\\n')
+print('Submitted batch job ' + str(submit_id))
+"""
+"""
+``sbatch`` put on ``PATH`` of submit script by :py:func:`get_submitted_jobs`,
+which records each submission, one JSON object per line, to ``jobs_file``
+and prints the job id as ``sbatch`` does
+"""
+
+MEM_PATTERN = re.compile(r'^(\d+)([KMGT]?)$', re.IGNORECASE)
+
+MEM_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+"""
+Bytes per unit of SLURM memory values, which are in megabytes if no unit is given
+"""
+
+PENDING = 'PENDING'
+
+RUNNING = 'RUNNING'
+
+COMPLETED = 'COMPLETED'
+
+FAILED = 'FAILED'
+
+TIMEOUT = 'TIMEOUT'
+
+CANCELLED = 'CANCELLED'
+"""
+State of jobs never run since a job they depend on did not complete
+"""
+
+
+def get_mem_bytes(mem):
+    """
+    Converts SLURM memory value **mem**, such as ``32G``, to bytes
+
+    :param mem: Memory in SLURM format, megabytes if there is no unit
+    :type mem: str
+    :raises CellmapsPipelineError: If **mem** is not valid
+    :return: bytes
+    :rtype: int
+    """
+    match = MEM_PATTERN.match(str(mem).strip())
+    if match is None:
+        raise CellmapsPipelineError('Invalid memory value: ' + str(mem))
+    unit = match.group(2).upper() if match.group(2) else 'M'
+    return int(match.group(1)) * MEM_UNITS[unit]
+
+
+def get_time_seconds(slurm_time):
+    """
+    Converts SLURM time limit **slurm_time**, in format ``minutes``,
+    ``minutes:seconds``, ``hours:minutes:seconds``, ``days-hours``,
+    ``days-hours:minutes`` or ``days-hours:minutes:seconds``, to seconds
+
+    :param slurm_time: Time limit
+    :type slurm_time: str
+    :raises CellmapsPipelineError: If **slurm_time** is not valid
+    :return: seconds
+    :rtype: int
+    """
+    try:
+        days = 0
+        value = str(slurm_time).strip()
+        if '-' in value:
+            day_str, value = value.split('-', 1)
+            days = int(day_str)
+            parts = [int(x) for x in value.split(':')]
+            # with days, values are hours[:minutes[:seconds]]
+            parts = parts + [0] * (3 - len(parts))
+        else:
+            parts = [int(x) for x in value.split(':')]
+            if len(parts) == 1:
+                parts = [0, parts[0], 0]
+            elif len(parts) == 2:
+                parts = [0] + parts
+        if len(parts) != 3:
+            raise ValueError('too many fields')
+        return ((days * 24 + parts[0]) * 60 + parts[1]) * 60 + parts[2]
+    except ValueError as e:
+        raise CellmapsPipelineError('Invalid time value: ' + str(slurm_time) + ': ' + str(e))
+
+
+def _get_option(options, arg):
+    """
+    Adds ``sbatch`` option **arg**, in format ``--name=value``
+    or ``-x value`` already joined, to **options**
+
+    :param options: option name, without leading ``-``, => value
+    :type options: dict
+    :param arg: option
+    :type arg: str
+    """
+    name, sep, value = arg.lstrip('-').partition('=')
+    options[name] = value if sep == '=' else None
+
+
+def parse_sbatch_directives(script):
+    """
+    Parses ``#SBATCH`` directives at top of **script**. As with ``sbatch``,
+    directives after the first command are ignored
+
+    :param script: Path to job script
+    :type script: str
+    :return: option name, such as ``cpus-per-task``, => value
+    :rtype: dict
+    """
+    options = {}
+    with open(script, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith(DIRECTIVE_PREFIX):
+                for arg in shlex.split(line[len(DIRECTIVE_PREFIX):]):
+                    _get_option(options, arg)
+                continue
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            break
+    return options
+
+
+def get_submitted_jobs(submit_script, env=None):
+    """
+    Runs **submit_script**, as written by
+    :py:meth:`~cellmaps_pipeline.runner.SLURMPipelineRunner.run`, in
+    its directory with ``sbatch`` replaced by :py:const:`SBATCH_STUB`,
+    which records the jobs submitted without running them. Each job is
+    a dict with:
+
+    * ``submit_id`` - id printed by ``sbatch``, starting at ``1``
+    * ``script`` - absolute path to job script, relative paths are
+      relative to directory ``sbatch`` was called from
+    * ``dependencies`` - ids of jobs this job depends on via ``afterok``
+    * ``options`` - options passed to ``sbatch`` on command line
+
+    :param submit_script: Path to submit script
+    :type submit_script: str
+    :param env: Environment variables to set, in addition to those of
+                this process, for **submit_script**
+    :type env: dict
+    :raises CellmapsPipelineError: If **submit_script** fails, a job has
+                                   no script or a dependency type other
+                                   than ``afterok`` is used or refers to
+                                   a job not submitted before
+    :return: jobs in order of submission
+    :rtype: list
+    """
+    stub_dir = tempfile.mkdtemp(prefix='localslurm')
+    try:
+        jobs_file = os.path.join(stub_dir, 'jobs.jsonl')
+        sbatch = os.path.join(stub_dir, 'sbatch')
+        with open(sbatch, 'w') as f:
+            f.write(SBATCH_STUB.format(python=sys.executable, jobs_file=jobs_file))
+        os.chmod(sbatch, 0o755)
+        submit_env = dict(os.environ)
+        if env is not None:
+            submit_env.update(env)
+        submit_env['PATH'] = stub_dir + os.pathsep + submit_env.get('PATH', '')
+        result = subprocess.run(['bash', os.path.abspath(submit_script)],
+                                cwd=os.path.dirname(os.path.abspath(submit_script)),
+                                env=submit_env, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, universal_newlines=True)
+        logger.debug('Output of ' + submit_script + ': ' + result.stdout)
+        if result.returncode != 0:
+            raise CellmapsPipelineError('Submit script ' + submit_script + ' exited with ' +
+                                        str(result.returncode) + ': ' + result.stdout)
+        submissions = []
+        if os.path.isfile(jobs_file):
+            with open(jobs_file, 'r') as f:
+                submissions = [json.loads(line) for line in f if len(line.strip()) > 0]
+    finally:
+        shutil.rmtree(stub_dir, ignore_errors=True)
+
+    jobs = []
+    submit_ids = set()
+    for submission in submissions:
+        job = {'submit_id': submission['submit_id'],
+               'script': None,
+               'dependencies': [],
+               'options': {}}
+        for arg in submission['args']:
+            if not arg.startswith('-'):
+                job['script'] = arg if os.path.isabs(arg) else os.path.join(submission['cwd'], arg)
+                # remaining arguments are passed to job script
+                break
+            _get_option(job['options'], arg)
+        if job['script'] is None:
+            raise CellmapsPipelineError('No job script for job ' + str(job['submit_id']))
+        dependency = job['options'].pop('dependency', None)
+        if dependency is not None:
+            dep_type, _, dep_ids = dependency.partition(':')
+            if dep_type != 'afterok':
+                raise CellmapsPipelineError('Only afterok dependencies are supported: ' +
+                                            dependency)
+            for dep_id in dep_ids.split(':'):
+                if not dep_id.isdigit() or int(dep_id) not in submit_ids:
+                    raise CellmapsPipelineError('Job ' + str(job['submit_id']) + ' depends on '
+                                                'unknown job ' + repr(dep_id))
+                job['dependencies'].append(int(dep_id))
+        submit_ids.add(job['submit_id'])
+        jobs.append(job)
+    return jobs
+
+
+class LocalSLURMExecutor(object):
+    """
+    Runs the jobs submitted by a SLURM submit script, as written by
+    :py:meth:`~cellmaps_pipeline.runner.SLURMPipelineRunner.run`, on
+    this machine instead of a cluster, so job graphs can be validated and
+    timed before using cluster allocation. The submit script itself is
+    run, via :py:func:`get_submitted_jobs`, to find out which jobs it
+    submits.
+
+    ``sbatch`` is emulated as follows:
+
+    * A job starts once every job it depends on via ``afterok`` has
+      completed. If any of those fail, the job is :py:const:`CANCELLED`
+      rather than run
+    * A job starts only if the CPUs and memory it requests, via
+      ``--cpus-per-task`` and ``--mem``, fit in what remains of the CPU
+      and memory budget. Jobs are considered in order of submission, but
+      a later job that fits may start ahead of an earlier one that does
+      not. Jobs requesting more than the whole budget are given the whole
+      budget
+    * Each task of a ``--array`` job is run as its own job with
+      ``SLURM_ARRAY_TASK_ID`` set
+    * Job script runs in ``--chdir`` with output written to ``--output``
+      and ``SLURM_JOB_ID``, ``SLURM_JOB_NAME`` and ``SLURM_CPUS_PER_TASK``
+      set. Jobs exceeding ``--time`` are killed if **enforce_time_limit**
+      is ``True``
+
+    Timings and resource usage of each job are written to
+    :py:const:`REPORT_FILE`, next to the submit script, and are
+    available via :py:meth:`get_job_metrics`
+    """
+
+    REPORT_FILE = 'local_slurm_report.json'
+
+    DEFAULT_CPUS_PER_TASK = 1
+
+    DEFAULT_MEM = '1G'
+    """
+    Memory of jobs without ``--mem``. SLURM clusters set their own default
+    """
+
+    def __init__(self, max_cpus=None, max_mem=None,
+                 enforce_time_limit=True, poll_interval=0.1,
+                 env=None):
+        """
+        Constructor
+
+        :param max_cpus: CPUs all running jobs may request in total. If
+                         ``None`` number of CPUs on this machine is used
+        :type max_cpus: int
+        :param max_mem: Memory all running jobs may request in total, in
+                        SLURM format such as ``16G``. If ``None`` memory
+                        is not limited
+        :type max_mem: str
+        :param enforce_time_limit: If ``True`` jobs running longer than
+                                   their ``--time`` are killed
+        :type enforce_time_limit: bool
+        :param poll_interval: Seconds between checks of running jobs
+        :type poll_interval: float
+        :param env: Environment variables to set, in addition to those of
+                    this process, for the submit script and every job
+        :type env: dict
+        :raises CellmapsPipelineError: If **max_cpus** is less than ``1``
+                                       or **max_mem** is not valid
+        """
+        if max_cpus is None:
+            max_cpus = os.cpu_count() or 1
+        if max_cpus < 1:
+            raise CellmapsPipelineError('max_cpus must be at least 1: ' + str(max_cpus))
+        self._max_cpus = max_cpus
+        self._max_mem = get_mem_bytes(max_mem) if max_mem is not None else None
+        self._enforce_time_limit = enforce_time_limit
+        self._poll_interval = poll_interval
+        self._env = env
+        self._job_metrics = []
+
+    def _get_tasks(self, jobs):
+        """
+        Creates a task, holding the state of a run, for each job in
+        **jobs** and for each array task of array jobs, assigning
+        job ids in order of submission starting at ``1``
+
+        :param jobs: Jobs from :py:func:`get_submitted_jobs`
+        :type jobs: list
+        :return: (list of job dicts with tasks added, list of all tasks)
+        :rtype: tuple
+        """
+        all_tasks = []
+        job_ids = {}
+        next_job_id = 1
+        for job in jobs:
+            options = parse_sbatch_directives(job['script'])
+            options.update(job['options'])
+            job['job_name'] = options.get('job-name') or os.path.basename(job['script'])
+            job['cpus_per_task'] = int(options.get('cpus-per-task') or
+                                       LocalSLURMExecutor.DEFAULT_CPUS_PER_TASK)
+            job['mem'] = options.get('mem') or LocalSLURMExecutor.DEFAULT_MEM
+            job['time'] = options.get('time')
+            job['chdir'] = options.get('chdir') or os.path.dirname(job['script'])
+            job['output'] = options.get('output') or 'slurm-%j.out'
+            job['job_id'] = next_job_id
+            job['dependency_job_ids'] = [job_ids[dep] for dep in job['dependencies']]
+            job_ids[job['submit_id']] = job['job_id']
+            next_job_id += 1
+            job['tasks'] = []
+            if options.get('array') is None:
+                task_ids = [(job['job_id'], None)]
+            else:
+                task_ids = []
+                for array_id in self._get_array_ids(options['array']):
+                    task_ids.append((next_job_id, array_id))
+                    next_job_id += 1
+            for task_id, array_id in task_ids:
+                task = {'job': job,
+                        'job_id': task_id,
+                        'array_task_id': array_id,
+                        'state': PENDING,
+                        'exit_code': None,
+                        'start_time': None,
+                        'end_time': None,
+                        'process': None,
+                        'rusage': None}
+                job['tasks'].append(task)
+                all_tasks.append(task)
+        return jobs, all_tasks
+
+    @staticmethod
+    def _get_array_ids(array):
+        """
+        Gets array task ids from value of ``--array``, such as ``1-4`` or ``1,3,5-7``.
+        Step and concurrency limit suffixes are not supported
+
+        :param array: value of ``--array``
+        :type array: str
+        :raises CellmapsPipelineError: If **array** is not valid
+        :return: array task ids
+        :rtype: list
+        """
+        ids = []
+        try:
+            for part in array.split(','):
+                start, _, end = part.partition('-')
+                ids.extend(range(int(start), int(end if end else start) + 1))
+        except ValueError:
+            raise CellmapsPipelineError('Unsupported --array value: ' + str(array))
+        return ids
+
+    @staticmethod
+    def _get_output_path(task):
+        """
+        Gets path to output file of **task**, replacing ``%x``, ``%j``,
+        ``%A`` and ``%a`` in ``--output`` as ``sbatch`` does
+
+        :param task: Task
+        :type task: dict
+        :return: path to output file
+        :rtype: str
+        """
+        job = task['job']
+        array_job_id = job['job_id'] if task['array_task_id'] is not None else task['job_id']
+        output = job['output'].replace('%x', str(job['job_name']))
+        output = output.replace('%j', str(task['job_id']))
+        output = output.replace('%A', str(array_job_id))
+        output = output.replace('%a', str(task['array_task_id']))
+        return os.path.join(job['chdir'], output)
+
+    def _get_request(self, job):
+        """
+        Gets CPUs and bytes of memory **job** requests, capped at the budget
+
+        :param job: Job
+        :type job: dict
+        :return: (cpus, bytes of memory)
+        :rtype: tuple
+        """
+        cpus = min(job['cpus_per_task'], self._max_cpus)
+        mem = get_mem_bytes(job['mem'])
+        if self._max_mem is not None:
+            mem = min(mem, self._max_mem)
+        return cpus, mem
+
+    def _start_task(self, task):
+        """
+        Starts job script of **task** in its own process group
+
+        :param task: Task
+        :type task: dict
+        """
+        job = task['job']
+        env = dict(os.environ)
+        if self._env is not None:
+            env.update(self._env)
+        env['SLURM_JOB_ID'] = str(task['job_id'])
+        env['SLURM_JOB_NAME'] = str(job['job_name'])
+        env['SLURM_CPUS_PER_TASK'] = str(job['cpus_per_task'])
+        if task['array_task_id'] is not None:
+            env['SLURM_ARRAY_JOB_ID'] = str(job['job_id'])
+            env['SLURM_ARRAY_TASK_ID'] = str(task['array_task_id'])
+        output_path = LocalSLURMExecutor._get_output_path(task)
+        logger.info('Starting job ' + str(task['job_id']) + ' (' + job['job_name'] + ')')
+        with open(output_path, 'w') as out:
+            task['process'] = subprocess.Popen(['bash', job['script']], cwd=job['chdir'],
+                                               env=env, stdout=out, stderr=subprocess.STDOUT,
+                                               start_new_session=True)
+        task['state'] = RUNNING
+        task['start_time'] = time.time()
+
+    def _check_task(self, task):
+        """
+        Checks if process of running **task** has exited, updating its
+        state, or has run past its time limit, in which case it is killed
+
+        :param task: Task
+        :type task: dict
+        :return: ``True`` if task is no longer running
+        :rtype: bool
+        """
+        process = task['process']
+        pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+        if pid == 0:
+            time_limit = task['job']['time']
+            if (self._enforce_time_limit and time_limit is not None and
+                    time.time() - task['start_time'] > get_time_seconds(time_limit)):
+                logger.warning('Job ' + str(task['job_id']) + ' exceeded time limit ' +
+                               str(time_limit) + ', killing it')
+                task['state'] = TIMEOUT
+                os.killpg(process.pid, signal.SIGKILL)
+            return False
+        # mark process as reaped so subprocess does not wait on it, negative
+        # signal number if killed as with subprocess, os.waitstatus_to_exitcode
+        # is not used since it requires python 3.9
+        process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+        task['end_time'] = time.time()
+        task['exit_code'] = process.returncode
+        task['rusage'] = rusage
+        if task['state'] != TIMEOUT:
+            task['state'] = COMPLETED if process.returncode == 0 else FAILED
+        task['process'] = None
+        logger.info('Job ' + str(task['job_id']) + ' (' + task['job']['job_name'] +
+                    ') ' + task['state'])
+        return True
+
+    @staticmethod
+    def _get_job_state(job):
+        """
+        Gets state of **job** from the states of its tasks. An array job
+        is :py:const:`COMPLETED` only once all its tasks have completed
+
+        :param job: Job
+        :type job: dict
+        :return: state
+        :rtype: str
+        """
+        states = [task['state'] for task in job['tasks']]
+        for state in [RUNNING, PENDING, TIMEOUT, FAILED, CANCELLED]:
+            if state in states:
+                if state == PENDING and COMPLETED in states:
+                    return RUNNING
+                return state
+        return COMPLETED
+
+    def run(self, submit_script):
+        """
+        Runs jobs submitted by **submit_script** as described in
+        :py:class:`LocalSLURMExecutor`, returning once every job has
+        finished or been cancelled
+
+        :param submit_script: Path to submit script
+        :type submit_script: str
+        :return: ``0`` if every job completed, otherwise ``1``
+        :rtype: int
+        """
+        jobs, tasks = self._get_tasks(get_submitted_jobs(submit_script, env=self._env))
+        jobs_by_submit_id = {job['submit_id']: job for job in jobs}
+        logger.info('Running ' + str(len(jobs)) + ' jobs (' + str(len(tasks)) +
+                    ' tasks) locally with ' + str(self._max_cpus) + ' CPUs')
+        start_time = time.time()
+        free_cpus = self._max_cpus
+        free_mem = self._max_mem
+        running = []
+        try:
+            while True:
+                for task in list(running):
+                    if self._check_task(task):
+                        running.remove(task)
+                        cpus, mem = self._get_request(task['job'])
+                        free_cpus += cpus
+                        if free_mem is not None:
+                            free_mem += mem
+
+                for task in tasks:
+                    if task['state'] != PENDING:
+                        continue
+                    dep_states = [LocalSLURMExecutor._get_job_state(jobs_by_submit_id[dep])
+                                  for dep in task['job']['dependencies']]
+                    if any(state in [FAILED, TIMEOUT, CANCELLED] for state in dep_states):
+                        logger.warning('Cancelling job ' + str(task['job_id']) + ' (' +
+                                       task['job']['job_name'] + ') since a dependency failed')
+                        task['state'] = CANCELLED
+                        continue
+                    if any(state != COMPLETED for state in dep_states):
+                        continue
+                    cpus, mem = self._get_request(task['job'])
+                    if cpus > free_cpus or (free_mem is not None and mem > free_mem):
+                        continue
+                    self._start_task(task)
+                    running.append(task)
+                    free_cpus -= cpus
+                    if free_mem is not None:
+                        free_mem -= mem
+
+                if len(running) == 0:
+                    break
+                time.sleep(self._poll_interval)
+        finally:
+            for task in running:
+                if task['process'] is not None:
+                    os.killpg(task['process'].pid, signal.SIGKILL)
+                    task['process'].wait()
+                    task['state'] = CANCELLED
+                    task['end_time'] = time.time()
+        end_time = time.time()
+
+        self._job_metrics = [self._get_job_metrics(job, start_time) for job in jobs]
+        self._write_report(submit_script, start_time, end_time)
+        if all(metrics['state'] == COMPLETED for metrics in self._job_metrics):
+            return 0
+        return 1
+
+    @staticmethod
+    def _get_task_metrics(task, submit_time):
+        """
+        Gets timings and resource usage of **task**
+
+        :param task: Task
+        :type task: dict
+        :param submit_time: Time all jobs were submitted, in seconds since epoch
+        :type submit_time: float
+        :return: metrics
+        :rtype: dict
+        """
+        metrics = {'job_id': task['job_id'],
+                   'array_task_id': task['array_task_id'],
+                   'state': task['state'],
+                   'exit_code': task['exit_code'],
+                   'start_time': task['start_time'],
+                   'end_time': task['end_time'],
+                   'wait_time': None,
+                   'wall_time': None,
+                   'cpu_time': None,
+                   'peak_rss': None}
+        if task['start_time'] is not None:
+            metrics['wait_time'] = task['start_time'] - submit_time
+        if task['start_time'] is not None and task['end_time'] is not None:
+            metrics['wall_time'] = task['end_time'] - task['start_time']
+        if task['rusage'] is not None:
+            metrics['cpu_time'] = task['rusage'].ru_utime + task['rusage'].ru_stime
+            # ru_maxrss is in kilobytes on Linux and bytes on macOS
+            maxrss = task['rusage'].ru_maxrss
+            metrics['peak_rss'] = maxrss if os.uname().sysname == 'Darwin' else maxrss * 1024
+        return metrics
+
+    def _get_job_metrics(self, job, submit_time):
+        """
+        Gets timings and resource usage of **job**, summed
+        over its tasks, along with metrics of each task
+
+        :param job: Job
+        :type job: dict
+        :param submit_time: Time all jobs were submitted, in seconds since epoch
+        :type submit_time: float
+        :return: metrics
+        :rtype: dict
+        """
+        task_metrics = [LocalSLURMExecutor._get_task_metrics(task, submit_time)
+                        for task in job['tasks']]
+        starts = [x['start_time'] for x in task_metrics if x['start_time'] is not None]
+        ends = [x['end_time'] for x in task_metrics if x['end_time'] is not None]
+        cpu_times = [x['cpu_time'] for x in task_metrics if x['cpu_time'] is not None]
+        peak_rss = [x['peak_rss'] for x in task_metrics if x['peak_rss'] is not None]
+        exit_codes = [x['exit_code'] for x in task_metrics if x['exit_code'] is not None]
+        metrics = {'step': job['job_name'],
+                   'job_id': job['job_id'],
+                   'script': job['script'],
+                   'dependencies': job['dependency_job_ids'],
+                   'cpus_per_task': job['cpus_per_task'],
+                   'mem': job['mem'],
+                   'time': job['time'],
+                   'state': LocalSLURMExecutor._get_job_state(job),
+                   'exit_code': max(exit_codes, key=abs) if len(exit_codes) > 0 else None,
+                   'start_time': min(starts) if len(starts) > 0 else None,
+                   'end_time': max(ends) if len(ends) > 0 else None,
+                   'wait_time': min(starts) - submit_time if len(starts) > 0 else None,
+                   'wall_time': None,
+                   'cpu_time': sum(cpu_times) if len(cpu_times) > 0 else None,
+                   'peak_rss': max(peak_rss) if len(peak_rss) > 0 else None}
+        if len(starts) > 0 and len(ends) > 0:
+            metrics['wall_time'] = max(ends) - min(starts)
+        if job['tasks'][0]['array_task_id'] is not None:
+            metrics['tasks'] = task_metrics
+        return metrics
+
+    def _write_report(self, submit_script, start_time, end_time):
+        """
+        Writes :py:const:`REPORT_FILE` next to **submit_script** and logs
+        wall time of each job
+
+        :param submit_script: Path to submit script
+        :type submit_script: str
+        :param start_time: Time jobs were submitted, in seconds since epoch
+        :type start_time: float
+        :param end_time: Time last job finished, in seconds since epoch
+        :type end_time: float
+        """
+        for metrics in self._job_metrics:
+            logger.info('{:<20} {:<10} wait {:>8} wall {:>8}'.format(
+                metrics['step'], metrics['state'],
+                '-' if metrics['wait_time'] is None else '{:.1f}s'.format(metrics['wait_time']),
+                '-' if metrics['wall_time'] is None else '{:.1f}s'.format(metrics['wall_time'])))
+        report = os.path.join(os.path.dirname(os.path.abspath(submit_script)),
+                              LocalSLURMExecutor.REPORT_FILE)
+        try:
+            with open(report, 'w') as f:
+                json.dump({'submit_script': os.path.abspath(submit_script),
+                           'max_cpus': self._max_cpus,
+                           'max_mem': self._max_mem,
+                           'start_time': start_time,
+                           'end_time': end_time,
+                           'elapsed_time': end_time - start_time,
+                           'jobs': self._job_metrics}, f, indent=2, default=str)
+        except OSError as e:
+            logger.warning('Unable to write ' + report + ': ' + str(e))
+
+    def get_job_metrics(self):
+        """
+        Gets timings and resource usage of each job from last call to
+        :py:meth:`run`, in order of submission. Array jobs include
+        metrics of each of their tasks under ``tasks``
+
+        :return: list of dict of metrics for each job
+        :rtype: list
+        """
+        return self._job_metrics
@@ -0,0 +1,295 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import logging
+import resource
+
+logger = logging.getLogger(__name__)
+
+PROC_SELF_IO = '/proc/self/io'
+
+PROC_SELF_STATUS = '/proc/self/status'
+
+PROC_SELF_CLEAR_REFS = '/proc/self/clear_refs'
+
+
+def _read_proc_io():
+    """
+    Gets bytes read and written by this process from :py:const:`PROC_SELF_IO`.
+    ``rchar`` and ``wchar`` are used, rather than ``read_bytes`` and
+    ``write_bytes``, so reads served from the page cache are counted too
+
+    :return: (bytes read, bytes written) or (``None``, ``None``) if unavailable
+    :rtype: tuple
+    """
+    try:
+        values = {}
+        with open(PROC_SELF_IO, 'r') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                values[name.strip()] = int(value)
+        return values.get('rchar'), values.get('wchar')
+    except (OSError, ValueError):
+        return None, None
+
+
+def _reset_peak_rss():
+    """
+    Resets the peak resident set size of this process, reported
+    as ``VmHWM`` in :py:const:`PROC_SELF_STATUS`, so the peak of a
+    step is not masked by an earlier step. Only works on Linux
+
+    :return: ``True`` if peak was reset
+    :rtype: bool
+    """
+    try:
+        with open(PROC_SELF_CLEAR_REFS, 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _get_peak_rss():
+    """
+    Gets peak resident set size in bytes of this process. ``VmHWM``
+    from :py:const:`PROC_SELF_STATUS` is used if available otherwise
+    ``ru_maxrss`` which is the peak over the lifetime of the process
+
+    :return: peak resident set size in bytes
+    :rtype: int
+    """
+    try:
+        with open(PROC_SELF_STATUS, 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return _maxrss_to_bytes(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def _maxrss_to_bytes(maxrss):
+    """
+    Converts ``ru_maxrss`` to bytes. Value is in bytes on
+    macOS and kilobytes everywhere else
+
+    :param maxrss: value of ``ru_maxrss``
+    :type maxrss: int
+    :return: bytes
+    :rtype: int
+    """
+    if sys.platform == 'darwin':
+        return int(maxrss)
+    return int(maxrss) * 1024
+
+
+def count_file_rows(path, header=True):
+    """
+    Counts rows in text file such as a TSV file
+
+    :param path: Path to file
+    :type path: str
+    :param header: If ``True`` first line is a header and is not counted
+    :type header: bool
+    :return: number of rows or ``None`` if **path** is not a file
+    :rtype: int
+    """
+    if not os.path.isfile(path):
+        return None
+    num_lines = 0
+    last_chunk = b''
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1048576), b''):
+            num_lines += chunk.count(b'\n')
+            last_chunk = chunk
+    if len(last_chunk) > 0 and not last_chunk.endswith(b'\n'):
+        num_lines += 1
+    if header is True and num_lines > 0:
+        num_lines -= 1
+    return num_lines
+
+
+def count_files(directory, suffixes=None):
+    """
+    Counts files under **directory**
+
+    :param directory: Directory to examine
+    :type directory: str
+    :param suffixes: If set, only files ending with one of these
+                     suffixes, compared case insensitively, are counted
+    :type suffixes: tuple
+    :return: number of files or ``None`` if **directory** does not exist
+    :rtype: int
+    """
+    if not os.path.isdir(directory):
+        return None
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(directory):
+        if suffixes is None:
+            total += len(filenames)
+            continue
+        total += len([f for f in filenames if f.lower().endswith(suffixes)])
+    return total
+
+
+class StepMetricsRecorder(object):
+    """
+    Measures wall time, CPU time, peak resident memory and bytes read and
+    written by pipeline steps. Metrics of each step are written to their
+    own JSON file in **metrics_dir** so steps run in separate worker
+    processes can be gathered by the parent process via
+    :py:meth:`get_step_metrics`
+
+    CPU time includes child processes that have been waited on. Peak
+    resident memory is the larger of this process, reset at the start of
+    the step where supported, and the largest child process. Bytes read
+    and written only cover this process.
+    """
+
+    METRICS_DIR = 'step_metrics'
+    """
+    Default name of directory, under the pipeline output
+    directory, where metrics of each step are written
+    """
+
+    PIPELINE_METRICS_FILE = 'pipeline_metrics.json'
+    """
+    Name of file, in pipeline output directory, holding
+    metrics of the whole pipeline run
+    """
+
+    METRICS_SUFFIX = '.json'
+
+    def __init__(self, metrics_dir=None):
+        """
+        Constructor
+
+        :param metrics_dir: Directory where metrics of each step are written
+        :type metrics_dir: str
+        """
+        self._metrics_dir = metrics_dir
+
+    def get_metrics_path(self, step_name):
+        """
+        Gets path to metrics file for step
+
+        :param step_name: Name of step
+        :type step_name: str
+        :return: path to metrics file
+        :rtype: str
+        """
+        return os.path.join(self._metrics_dir,
+                            str(step_name) + StepMetricsRecorder.METRICS_SUFFIX)
+
+    def clear(self):
+        """
+        Removes metrics of all steps, such as those left by a prior run
+        """
+        if not os.path.isdir(self._metrics_dir):
+            return
+        for entry in os.listdir(self._metrics_dir):
+            if entry.endswith(StepMetricsRecorder.METRICS_SUFFIX):
+                os.unlink(os.path.join(self._metrics_dir, entry))
+
+    def measure(self, step_name, step_func, item_counter=None):
+        """
+        Runs **step_func** and writes its metrics to the file given by
+        :py:meth:`get_metrics_path`. Metrics are written even if
+        **step_func** raises an exception
+
+        :param step_name: Name of step, passed as the only argument
+                          to **step_func** and **item_counter**
+        :type step_name: str
+        :param step_func: Runs the step, should return ``0`` upon success
+        :type step_func: callable
+        :param item_counter: If set, invoked after the step finishes and
+                             should return a dict of item name => count
+                             such as number of genes or edges
+        :type item_counter: callable
+        :return: value returned by **step_func**
+        """
+        _reset_peak_rss()
+        start_time = time.time()
+        start_self = resource.getrusage(resource.RUSAGE_SELF)
+        start_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start_read, start_written = _read_proc_io()
+        exit_code = None
+        try:
+            exit_code = step_func(step_name)
+            return exit_code
+        finally:
+            end_time = time.time()
+            end_self = resource.getrusage(resource.RUSAGE_SELF)
+            end_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            end_read, end_written = _read_proc_io()
+            metrics = {'step': step_name,
+                       'pid': os.getpid(),
+                       'start_time': start_time,
+                       'end_time': end_time,
+                       'wall_time': end_time - start_time,
+                       'cpu_user_time': ((end_self.ru_utime - start_self.ru_utime) +
+                                         (end_children.ru_utime - start_children.ru_utime)),
+                       'cpu_system_time': ((end_self.ru_stime - start_self.ru_stime) +
+                                           (end_children.ru_stime - start_children.ru_stime)),
+                       'peak_rss': max(_get_peak_rss(),
+                                       _maxrss_to_bytes(end_children.ru_maxrss)),
+                       'bytes_read': None,
+                       'bytes_written': None,
+                       'exit_code': exit_code,
+                       'items': {}}
+            metrics['cpu_time'] = metrics['cpu_user_time'] + metrics['cpu_system_time']
+            if start_read is not None and end_read is not None:
+                metrics['bytes_read'] = end_read - start_read
+                metrics['bytes_written'] = end_written - start_written
+            if item_counter is not None and exit_code == 0:
+                try:
+                    metrics['items'] = item_counter(step_name)
+                except Exception as e:
+                    logger.warning('Unable to count items of step ' +
+                                   str(step_name) + ': ' + str(e))
+            self._write_metrics(step_name, metrics)
+
+    def _write_metrics(self, step_name, metrics):
+        """
+        Writes **metrics** of step to file
+
+        :param step_name: Name of step
+        :type step_name: str
+        :param metrics: Metrics of step
+        :type metrics: dict
+        """
+        try:
+            os.makedirs(self._metrics_dir, mode=0o755, exist_ok=True)
+            metrics_path = self.get_metrics_path(step_name)
+            tmp_path = metrics_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(metrics, f, indent=2, default=str)
+            os.replace(tmp_path, metrics_path)
+        except OSError as e:
+            logger.warning('Unable to write metrics of step ' +
+                           str(step_name) + ': ' + str(e))
+
+    def get_step_metrics(self):
+        """
+        Gets metrics of every step measured, ordered by start time
+
+        :return: list of dict of metrics for each step
+        :rtype: list
+        """
+        if self._metrics_dir is None or not os.path.isdir(self._metrics_dir):
+            return []
+        step_metrics = []
+        for entry in os.listdir(self._metrics_dir):
+            if not entry.endswith(StepMetricsRecorder.METRICS_SUFFIX):
+                continue
+            try:
+                with open(os.path.join(self._metrics_dir, entry), 'r') as f:
+                    step_metrics.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.warning('Unable to read metrics file ' + entry + ': ' + str(e))
+        step_metrics.sort(key=lambda x: x.get('start_time', 0))
+        return step_metrics
@@ -0,0 +1,259 @@
+#! /usr/bin/env python
+
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_EXCEPTION
+from concurrent.futures import wait
+
+import numpy as np
+from cellmaps_generate_hierarchy.hierarchy import CDAPSHiDeFHierarchyGenerator
+from hidef import weaver
+
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+
+logger = logging.getLogger(__name__)
+
+ROOT_CLUSTER = 'Cluster0-0'
+"""
+Name HiDeF gives the cluster holding every node of the network
+"""
+
+CONTAINMENT_CUTOFF = 0.75
+"""
+Containment index cutoff used when weaving clusters into a
+hierarchy, same as default of HiDeF ``--t`` flag
+"""
+
+NODES_SUFFIX = '.nodes'
+
+EDGES_SUFFIX = '.edges'
+
+NO_CLUSTERS_ERROR = 'cluG_collapsed[0]'
+"""
+Code in traceback HiDeF writes to standard error when it exits with
+an ``IndexError`` because it found no clusters
+"""
+
+
+def get_hidef_numthreads(workers, cpu_count=None):
+    """
+    Gets number of threads each HiDeF run should use so **workers**
+    concurrent runs do not use more than **cpu_count** CPUs in total
+
+    :param workers: Number of HiDeF runs done at the same time
+    :type workers: int
+    :param cpu_count: Number of CPUs, if ``None``
+                      :py:func:`multiprocessing.cpu_count` is used
+    :type cpu_count: int
+    :return: number of threads, at least ``1``
+    :rtype: int
+    """
+    if cpu_count is None:
+        cpu_count = multiprocessing.cpu_count()
+    return max(1, int(cpu_count) // max(1, int(workers)))
+
+
+def read_hidef_clusters(nodes_file):
+    """
+    Reads clusters from HiDeF **nodes_file**
+
+    :param nodes_file: Path to HiDeF .nodes file
+    :type nodes_file: str
+    :return: list of (cluster name, list of member names, persistence)
+             for each cluster or empty list if **nodes_file** does not exist
+    :rtype: list
+    """
+    clusters = []
+    if not os.path.isfile(nodes_file):
+        return clusters
+    with open(nodes_file, 'r') as f:
+        for line in f:
+            row = line.rstrip('\n').split('\t')
+            if len(row) < 4:
+                continue
+            clusters.append((row[0], row[2].split(), int(float(row[3]))))
+    return clusters
+
+
+def merge_hidef_outputs(outputprefixes, outputprefix, cutoff=CONTAINMENT_CUTOFF):
+    """
+    Merges the clusters found by separate HiDeF runs into one
+    hierarchy written as HiDeF formatted .nodes and .edges files
+    with **outputprefix** as prefix.
+
+    Clusters of every run are woven together with
+    :py:class:`hidef.weaver.Weaver`, merging clusters that contain
+    each other by at least **cutoff**, the same way HiDeF weaves
+    clusters of different resolutions. Persistence of merged
+    clusters is summed
+
+    :param outputprefixes: Output prefixes of HiDeF runs to merge
+    :type outputprefixes: list
+    :param outputprefix: Prefix of merged .nodes and .edges files
+    :type outputprefix: str
+    :param cutoff: Containment index cutoff for claiming parenthood
+    :type cutoff: float
+    :raises CellmapsPipelineError: If .nodes file of any of **outputprefixes**
+                                   does not exist
+    :return: number of clusters, excluding root, read from all runs
+    :rtype: int
+    """
+    for prefix in outputprefixes:
+        if not os.path.isfile(prefix + NODES_SUFFIX):
+            raise CellmapsPipelineError('HiDeF output ' + prefix + NODES_SUFFIX +
+                                        ' not found')
+    names = set()
+    clusters = []
+    for prefix in outputprefixes:
+        for cluster_name, members, persistence in read_hidef_clusters(prefix + NODES_SUFFIX):
+            names.update(members)
+            # root of each run is replaced by a root holding every name
+            if cluster_name != ROOT_CLUSTER:
+                clusters.append((members, persistence))
+
+    names = sorted(names)
+    if len(clusters) == 0:
+        logger.warning('No clusters found by any HiDeF run')
+        with open(outputprefix + NODES_SUFFIX, 'w') as f:
+            f.write(ROOT_CLUSTER + '\t0\t\t0\n')
+        open(outputprefix + EDGES_SUFFIX, 'w').close()
+        return 0
+
+    name_index = {name: i for i, name in enumerate(names)}
+    # largest first as HiDeF does before weaving, ties keep run order
+    clusters.sort(key=lambda x: len(x[0]), reverse=True)
+    membership = [np.ones(len(names))]
+    persistence = [0]
+    for members, cluster_persistence in clusters:
+        row = np.zeros(len(names))
+        row[[name_index[name] for name in members]] = 1
+        membership.append(row)
+        persistence.append(cluster_persistence)
+
+    # imported here since it pulls in igraph, louvain and leidenalg
+    # which slow start up of the cytoscape web service app
+    from hidef import hidef_finder
+
+    wv = weaver.Weaver()
+    wv.weave(membership, boolean=True, levels=False, merge=True, cutoff=cutoff)
+    hidef_finder.output_nodes(wv, names, outputprefix, extra_data=persistence)
+    hidef_finder.output_edges(wv, names, outputprefix)
+    return len(clusters)
+
+
+class ParallelHiDeFRunner(object):
+    """
+    Runs HiDeF separately on each edgelist, with up to **workers**
+    runs at a time, and merges the resulting clusters via
+    :py:func:`merge_hidef_outputs`. This is an alternative to a single
+    HiDeF run given every edgelist, which treats the edgelists as
+    layers of one multiplex network and clusters them together.
+
+    Each HiDeF run is its own process so a pool of threads is used
+    to launch and wait on them.
+
+    If any run fails, runs not yet started are cancelled, those already
+    running are waited on and :py:class:`~cellmaps_pipeline.exceptions.CellmapsPipelineError`
+    is raised, so no partial merge is written. The exception is a run where
+    HiDeF exits with an ``IndexError`` because it found no clusters, which
+    is common for sparse networks of the smallest cutoffs. An empty .nodes
+    file is written for such a run so it adds no clusters to the merge
+    """
+
+    def __init__(self, workers=2, hier_generator=None,
+                 cutoff=CONTAINMENT_CUTOFF):
+        """
+        Constructor
+
+        :param workers: Maximum number of HiDeF runs at a time
+        :type workers: int
+        :param hier_generator: Used to locate and invoke HiDeF,
+                               if ``None`` a default one is created
+        :type hier_generator: :py:class:`~cellmaps_generate_hierarchy.hierarchy.CDAPSHiDeFHierarchyGenerator`
+        :param cutoff: Containment index cutoff used when merging
+        :type cutoff: float
+        """
+        self._workers = max(1, int(workers))
+        if hier_generator is None:
+            hier_generator = CDAPSHiDeFHierarchyGenerator()
+        self._hier_generator = hier_generator
+        self._cutoff = cutoff
+
+    def _get_cmd(self, edgelist_file, outputprefix, algorithm, maxres, k,
+                 numthreads):
+        """
+        Gets command to run HiDeF on one edgelist, same as
+        :py:meth:`~cellmaps_generate_hierarchy.hierarchy.CDAPSHiDeFHierarchyGenerator._run_hidef`
+        with the addition of ``--numthreads``
+
+        :return: command
+        :rtype: list
+        """
+        return [self._hier_generator._python, self._hier_generator._hidef_cmd,
+                '--g', edgelist_file, '--o', outputprefix,
+                '--alg', algorithm, '--maxres', str(maxres), '--k', str(k),
+                '--numthreads', str(numthreads), '--skipgml']
+
+    def _run_hidef(self, cmd):
+        """
+        Runs HiDeF **cmd**. If HiDeF fails because it found no
+        clusters, an empty .nodes file is written instead
+
+        :param cmd: command from :py:meth:`_get_cmd`
+        :type cmd: list
+        :raises CellmapsPipelineError: If HiDeF fails for any other reason
+        """
+        exit_code, out, err = self._hier_generator._run_cmd(cmd)
+        if exit_code != 0 and NO_CLUSTERS_ERROR in str(err):
+            outputprefix = cmd[cmd.index('--o') + 1]
+            logger.info('HiDeF found no clusters, writing empty ' +
+                        outputprefix + NODES_SUFFIX)
+            open(outputprefix + NODES_SUFFIX, 'w').close()
+            return
+        if exit_code != 0:
+            raise CellmapsPipelineError('HiDeF failed with exit code: ' +
+                                        str(exit_code) + ' : ' + str(out) +
+                                        ' : ' + str(err))
+
+    def run(self, edgelist_files, outputprefix, algorithm, maxres, k):
+        """
+        Runs HiDeF on each of **edgelist_files** and writes merged
+        hierarchy as HiDeF formatted .nodes and .edges files with
+        **outputprefix** as prefix. Output of the run on the
+        Nth edgelist has ``<outputprefix>.<N>`` as prefix
+
+        :param edgelist_files: Paths to tab delimited edgelist files
+        :type edgelist_files: list
+        :param outputprefix: Prefix of merged output files
+        :type outputprefix: str
+        :param algorithm: HiDeF clustering algorithm
+        :type algorithm: str
+        :param maxres: HiDeF max resolution parameter
+        :type maxres: float
+        :param k: HiDeF stability parameter
+        :type k: int
+        :raises CellmapsPipelineError: If any HiDeF run fails, other than
+                                       by finding no clusters, in which case
+                                       runs not yet started are skipped
+        :return: number of clusters, excluding root, found by all runs
+        :rtype: int
+        """
+        numthreads = get_hidef_numthreads(min(self._workers, len(edgelist_files)))
+        prefixes = [outputprefix + '.' + str(i) for i in range(len(edgelist_files))]
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            futures = [executor.submit(self._run_hidef,
+                                       self._get_cmd(edgelist_file, prefix,
+                                                     algorithm, maxres, k,
+                                                     numthreads))
+                       for edgelist_file, prefix in zip(edgelist_files, prefixes)]
+            done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+            # runs not yet started are skipped, running ones are waited on
+            for future in not_done:
+                future.cancel()
+            for edgelist_file, future in zip(edgelist_files, futures):
+                if future in done and future.exception() is not None:
+                    raise CellmapsPipelineError('HiDeF failed on ' + str(edgelist_file) +
+                                                ': ' + str(future.exception()))
+        return merge_hidef_outputs(prefixes, outputprefix, cutoff=self._cutoff)
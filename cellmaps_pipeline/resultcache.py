@@ -0,0 +1,126 @@
+#! /usr/bin/env python
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+
+import cellmaps_pipeline
+from cellmaps_pipeline import jsonstream
+from cellmaps_pipeline.artifactstore import ArtifactStore
+from cellmaps_pipeline.stepcache import StepCache
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache(object):
+    """
+    On disk cache of results of Cytoscape Web Service App requests,
+    stored as the JSON text written for the request, so a request
+    repeated with the same input files and parameters returns
+    immediately by copying the text.
+
+    Results are keyed on a sha256 hex digest of the mode, parameters,
+    contents of input files and version of this package. Entries are held
+    in an :py:class:`~cellmaps_pipeline.artifactstore.ArtifactStore` so
+    they are added atomically and the least recently used entries are
+    evicted once the cache exceeds **max_size**
+    """
+
+    RESULT_FILE = 'result.json'
+
+    def __init__(self, cache_dir=None, max_size=None):
+        """
+        Constructor
+
+        :param cache_dir: Directory holding the cache, created if it does not exist
+        :type cache_dir: str
+        :param max_size: Maximum size of cache in bytes. If ``None`` no
+                         entries are ever evicted
+        :type max_size: int
+        :raises CellmapsPipelineError: If **cache_dir** is ``None``
+        """
+        if cache_dir is None:
+            raise CellmapsPipelineError('cache_dir is None')
+        self._cache_dir = os.path.abspath(cache_dir)
+        self._store = ArtifactStore(store_dir=self._cache_dir, max_size=max_size,
+                                    link_mode=ArtifactStore.HARDLINK_MODE)
+
+    @staticmethod
+    def get_key(mode, parameters=None, input_files=None):
+        """
+        Computes key of a request
+
+        :param mode: Mode of request
+        :type mode: str
+        :param parameters: JSON serializable parameters of request
+        :type parameters: dict
+        :param input_files: name => path to input file
+        :type input_files: dict
+        :return: key
+        :rtype: str
+        """
+        key_data = {'mode': mode,
+                    'version': cellmaps_pipeline.__version__,
+                    'parameters': parameters if parameters is not None else {},
+                    'input_files': {}}
+        if input_files is not None:
+            for name, path in input_files.items():
+                key_data['input_files'][name] = StepCache.get_file_or_value_digest(path)
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True,
+                                         default=str).encode('utf-8')).hexdigest()
+
+    def open_result(self, key):
+        """
+        Opens cached result with **key** for reading. The file is opened
+        right away so the result stays readable even if the entry is
+        evicted while being read
+
+        :param key: Key of result
+        :type key: str
+        :return: text file holding result as JSON or ``None`` if not cached
+        """
+        data_dir = self._store.get_data_dir(key)
+        if data_dir is None:
+            return None
+        try:
+            result_file = open(os.path.join(data_dir, ResultCache.RESULT_FILE), 'r')
+        except OSError as e:
+            logger.warning('Unable to open cached result ' + key + ': ' + str(e))
+            return None
+        logger.info('Using cached result ' + key)
+        return result_file
+
+    def put(self, key, result, indent=None):
+        """
+        Writes **result** as JSON, consuming any generators it
+        holds, and adds it to the cache as **key**. The result is written
+        to a temporary directory within the cache directory, so it can be
+        hard linked into the cache, and is opened for reading before that
+        directory is removed. This way the result can be read even if it
+        is too large to be kept in the cache
+
+        :param key: Key of result
+        :type key: str
+        :param result: Result, which may contain generators as supported by
+                       :py:func:`~cellmaps_pipeline.jsonstream.write_json`
+        :param indent: Number of spaces to indent by. If ``None`` result
+                       is written as compact JSON. Since this changes the
+                       text stored, it should be part of the parameters
+                       given to :py:meth:`get_key`
+        :type indent: int
+        :return: text file holding result as JSON
+        """
+        os.makedirs(self._cache_dir, mode=0o755, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=ArtifactStore.TMP_PREFIX, dir=self._cache_dir)
+        try:
+            result_path = os.path.join(tmp_dir, ResultCache.RESULT_FILE)
+            with open(result_path, 'w') as f:
+                jsonstream.write_json(result, f, indent=indent)
+            self._store.put(key, tmp_dir)
+            return open(result_path, 'r')
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
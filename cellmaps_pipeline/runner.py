@@ -1,6 +1,8 @@
 #! /usr/bin/env python
 
 import os
+import json
+import shutil
 import warnings
 import logging
 import time
@@ -38,6 +40,14 @@ from cellmaps_hierarchyeval.runner import CellmapshierarchyevalRunner
 
 import cellmaps_pipeline
 from cellmaps_pipeline.exceptions import CellmapsPipelineError
+from cellmaps_pipeline.scheduler import StepScheduler
+from cellmaps_pipeline.stepcache import StepCache
+from cellmaps_pipeline.slurmresources import SLURMResourceProfiles
+from cellmaps_pipeline import sharding
+from cellmaps_pipeline import cellmaps_shardcmd
+from cellmaps_pipeline.metrics import StepMetricsRecorder
+from cellmaps_pipeline.metrics import count_file_rows
+from cellmaps_pipeline.metrics import count_files
 
 logger = logging.getLogger(__name__)
 
@@ -49,6 +59,20 @@ class PipelineRunner(object):
     execution environments such as local or SLURM-based clusters.
     """
 
+    IMAGE_DOWNLOAD_STEP = 'image_download'
+
+    PPI_DOWNLOAD_STEP = 'ppi_download'
+
+    PPI_EMBEDDING_STEP = 'ppi_embedding'
+
+    IMAGE_EMBEDDING_STEP_PREFIX = 'image_embedding_fold'
+
+    COEMBEDDING_STEP_PREFIX = 'coembedding_fold'
+
+    HIERARCHY_STEP = 'hierarchy'
+
+    HIERARCHYEVAL_STEP = 'hierarchyeval'
+
     def __init__(self, outdir):
         """
         Constructor
@@ -84,6 +108,105 @@ class PipelineRunner(object):
                      str(image_coembed_tuples))
         return image_coembed_tuples
 
+    def _get_step_dependencies(self):
+        """
+        Gets the steps of the pipeline along with the steps each one
+        depends on, which are the steps whose output directories it
+        reads. This is the step graph both :py:class:`ProgrammaticPipelineRunner`
+        and :py:class:`SLURMPipelineRunner` run. The steps are listed in
+        the order they are run serially
+
+        :return: list of tuples of (step name, list of step names it depends on)
+        :rtype: list
+        """
+        steps = [(PipelineRunner.IMAGE_DOWNLOAD_STEP, []),
+                 (PipelineRunner.PPI_DOWNLOAD_STEP, []),
+                 (PipelineRunner.PPI_EMBEDDING_STEP,
+                  [PipelineRunner.PPI_DOWNLOAD_STEP])]
+        coembed_steps = []
+        for image_coembed_tuple in self._image_coembed_tuples:
+            steps.append((PipelineRunner.IMAGE_EMBEDDING_STEP_PREFIX +
+                          str(image_coembed_tuple[0]),
+                          [PipelineRunner.IMAGE_DOWNLOAD_STEP]))
+        for image_coembed_tuple in self._image_coembed_tuples:
+            coembed_step = PipelineRunner.COEMBEDDING_STEP_PREFIX + str(image_coembed_tuple[0])
+            steps.append((coembed_step,
+                          [PipelineRunner.IMAGE_EMBEDDING_STEP_PREFIX +
+                           str(image_coembed_tuple[0]),
+                           PipelineRunner.PPI_EMBEDDING_STEP]))
+            coembed_steps.append(coembed_step)
+        steps.append((PipelineRunner.HIERARCHY_STEP,
+                      [PipelineRunner.IMAGE_DOWNLOAD_STEP,
+                       PipelineRunner.PPI_DOWNLOAD_STEP] + coembed_steps))
+        steps.append((PipelineRunner.HIERARCHYEVAL_STEP,
+                      [PipelineRunner.HIERARCHY_STEP]))
+        return steps
+
+    def _get_downstream_steps(self, step_name):
+        """
+        Gets the steps that depend, directly or through other
+        steps, on **step_name** in :py:meth:`_get_step_dependencies`
+
+        :param step_name: Name of step
+        :type step_name: str
+        :return: names of downstream steps in the order they are run serially
+        :rtype: list
+        """
+        downstream = set([step_name])
+        downstream_steps = []
+        for name, deps in self._get_step_dependencies():
+            if any(dep in downstream for dep in deps):
+                downstream.add(name)
+                downstream_steps.append(name)
+        return downstream_steps
+
+    def _get_image_coembed_tuple_for_step(self, step_name, prefix):
+        """
+        Gets the entry from **self._image_coembed_tuples** whose fold
+        matches the fold at the end of **step_name**
+
+        :param step_name: Name of step, ie image_embedding_fold1
+        :type step_name: str
+        :param prefix: Prefix of **step_name** before the fold value
+        :type prefix: str
+        :raises CellmapsPipelineError: If no fold matches
+        :return: (fold, image embedding dir, coembedding dir)
+        :rtype: tuple
+        """
+        fold = step_name[len(prefix):]
+        for image_coembed_tuple in self._image_coembed_tuples:
+            if str(image_coembed_tuple[0]) == fold:
+                return image_coembed_tuple
+        raise CellmapsPipelineError('No fold found for step: ' + str(step_name))
+
+    def _get_step_dir(self, step_name):
+        """
+        Gets output directory of step
+
+        :param step_name: Name of step
+        :type step_name: str
+        :raises CellmapsPipelineError: If **step_name** is not a known step
+        :return: path to output directory
+        :rtype: str
+        """
+        if step_name == PipelineRunner.IMAGE_DOWNLOAD_STEP:
+            return self._image_dir
+        if step_name == PipelineRunner.PPI_DOWNLOAD_STEP:
+            return self._ppi_dir
+        if step_name == PipelineRunner.PPI_EMBEDDING_STEP:
+            return self._ppi_embed_dir
+        if step_name.startswith(PipelineRunner.IMAGE_EMBEDDING_STEP_PREFIX):
+            return self._get_image_coembed_tuple_for_step(step_name,
+                                                          PipelineRunner.IMAGE_EMBEDDING_STEP_PREFIX)[1]
+        if step_name.startswith(PipelineRunner.COEMBEDDING_STEP_PREFIX):
+            return self._get_image_coembed_tuple_for_step(step_name,
+                                                          PipelineRunner.COEMBEDDING_STEP_PREFIX)[2]
+        if step_name == PipelineRunner.HIERARCHY_STEP:
+            return self._hierarchy_dir
+        if step_name == PipelineRunner.HIERARCHYEVAL_STEP:
+            return self._hierarchy_eval_dir
+        raise CellmapsPipelineError('Unknown step: ' + str(step_name))
+
     def run(self):
         """
         Abstract method to run the pipeline. This method should be implemented by subclasses.
@@ -92,6 +215,18 @@ class PipelineRunner(object):
         """
         raise NotImplementedError('subclasses need to implement')
 
+    def get_step_metrics(self):
+        """
+        Gets metrics, such as wall time, CPU time and peak memory, of each
+        step run by the last call to :py:meth:`run`. This implementation
+        returns an empty list and should be overridden by subclasses that
+        measure their steps.
+
+        :return: list of dict of metrics for each step
+        :rtype: list
+        """
+        return []
+
 
 class SLURMPipelineRunner(PipelineRunner):
     """
@@ -99,6 +234,25 @@ class SLURMPipelineRunner(PipelineRunner):
     run various steps in a SLURM environment
     """
 
+    IMAGE_DOWNLOAD_SHARDS_DIR = 'image_download_shards'
+    """
+    Directory, under output directory, holding image download shards
+    """
+
+    IMAGE_EMBEDDING_SHARDS_SUFFIX = '_shards'
+    """
+    Suffix appended to image embedding directory of a fold to get
+    the directory holding its shards
+    """
+
+    ARRAY_TASK_ID = '${SLURM_ARRAY_TASK_ID}'
+
+    COMPLETION_MARKER = 'slurm_step_complete'
+    """
+    File created in output directory of a step once its job succeeds.
+    Steps without it are resubmitted by ``slurm_cellmaps_job.sh``
+    """
+
     def __init__(self, outdir=None,
                  cm4ai_apms=None,
                  cm4ai_image=None,
@@ -114,7 +268,10 @@ class SLURMPipelineRunner(PipelineRunner):
                  fold=[1],
                  input_data_dict=None,
                  slurm_partition=None,
-                 slurm_account=None):
+                 slurm_account=None,
+                 resource_profiles=None,
+                 image_shards=None,
+                 local_executor=None):
         """
         :param outdir: Path to the output directory.
         :param cm4ai_apms: Path to the CM4AI APMS data file.
@@ -132,8 +289,25 @@ class SLURMPipelineRunner(PipelineRunner):
         :param input_data_dict: Dictionary of input data configurations.
         :param slurm_partition: Name of the SLURM partition to submit jobs to.
         :param slurm_account: SLURM account name for job submission.
+        :param resource_profiles: CPUs, memory, time and partition requested by
+                                  the job of each step. If ``None``, every job
+                                  requests :py:const:`~cellmaps_pipeline.slurmresources.SLURMResourceProfiles.DEFAULT_RESOURCES`
+        :type resource_profiles: :py:class:`~cellmaps_pipeline.slurmresources.SLURMResourceProfiles`
+        :param image_shards: If set, image download, when **samples** is set, and image
+                             embedding of each fold are split into at most this many
+                             shards run as a SLURM job array, followed by a job merging
+                             the shards into the usual output directory
+        :type image_shards: int
+        :param local_executor: If set, jobs are run on this machine by this
+                               executor, instead of being left for submission to
+                               SLURM, once the scripts are generated
+        :type local_executor: :py:class:`~cellmaps_pipeline.localslurm.LocalSLURMExecutor`
+        :raises CellmapsPipelineError: If **image_shards** is less than ``1``
         """
         super().__init__(outdir=outdir)
+        if image_shards is not None and image_shards < 1:
+            raise CellmapsPipelineError('Number of image shards must be at least 1: ' +
+                                        str(image_shards))
         self._cm4ai_apms = cm4ai_apms if cm4ai_apms is None or os.path.isabs(cm4ai_apms) else os.path.join(os.getcwd(),
                                                                                                            cm4ai_apms)
         self._cm4ai_image = cm4ai_image if cm4ai_image is None or os.path.isabs(cm4ai_image) else os.path.join(
@@ -153,8 +327,15 @@ class SLURMPipelineRunner(PipelineRunner):
         self._input_data_dict = input_data_dict
         self._slurm_partition = slurm_partition
         self._slurm_account = slurm_account
+        if resource_profiles is None:
+            resource_profiles = SLURMResourceProfiles()
+        self._resource_profiles = resource_profiles
+        self._image_shards = image_shards
+        self._local_executor = local_executor
         self._image_dir = os.path.join(self._outdir,
                                        constants.IMAGE_DOWNLOAD_STEP_DIR)
+        self._image_download_shards_dir = os.path.join(self._outdir,
+                                                       SLURMPipelineRunner.IMAGE_DOWNLOAD_SHARDS_DIR)
         self._ppi_dir = os.path.join(self._outdir,
                                      constants.PPI_DOWNLOAD_STEP_DIR)
         self._ppi_embed_dir = os.path.join(self._outdir,
@@ -169,25 +350,47 @@ class SLURMPipelineRunner(PipelineRunner):
                                                 constants.HIERARCHYEVAL_STEP_DIR)
 
     def _write_slurm_directives(self, out=None,
-                                allocated_time='4:00:00',
-                                mem='32G', cpus_per_task='4',
-                                job_name='cellmaps_pipeline'):
+                                allocated_time=None,
+                                mem=None, cpus_per_task=None,
+                                job_name='cellmaps_pipeline',
+                                step_name=None, array_size=None):
         """
-        Writes SLURM job directives to a bash script file.
+        Writes SLURM job directives to a bash script file. Resources not
+        passed in are taken from the resource profile of **step_name**
 
         :param out: File handle to write the SLURM directives.
         :param allocated_time: String specifying the maximum time allowed for the job.
         :param mem: String specifying the memory allocated for the job.
         :param cpus_per_task: String specifying the number of CPUs per task.
         :param job_name: String specifying the name of the SLURM job.
+        :param step_name: Name of step whose resource profile is used, as
+                          in :py:meth:`~cellmaps_pipeline.slurmresources.SLURMResourceProfiles.get_resources`
+        :param array_size: If set, job is a job array of tasks ``1`` to **array_size**,
+                           each requesting the resources above
+        :type array_size: int
         """
+        resources = self._resource_profiles.get_resources(step_name)
+        if allocated_time is None:
+            allocated_time = resources[SLURMResourceProfiles.TIME]
+        if mem is None:
+            mem = resources[SLURMResourceProfiles.MEM]
+        if cpus_per_task is None:
+            cpus_per_task = resources[SLURMResourceProfiles.CPUS_PER_TASK]
+        partition = resources[SLURMResourceProfiles.PARTITION]
+        if partition is None:
+            partition = self._slurm_partition
+
         out.write('#!/bin/bash\n\n')
         out.write('#SBATCH --job-name=' + str(job_name) + '\n')
         out.write('#SBATCH --chdir=' + self._outdir + '\n')
 
-        out.write('#SBATCH --output=%x.%j.out\n')
-        if self._slurm_partition is not None:
-            out.write('#SBATCH --partition=' + self._slurm_partition + '\n')
+        if array_size is not None:
+            out.write('#SBATCH --array=1-' + str(array_size) + '\n')
+            out.write('#SBATCH --output=%x.%A_%a.out\n')
+        else:
+            out.write('#SBATCH --output=%x.%j.out\n')
+        if partition is not None:
+            out.write('#SBATCH --partition=' + partition + '\n')
         if self._slurm_account is not None:
             out.write('#SBATCH --account=' + self._slurm_account + '\n')
         out.write('#SBATCH --ntasks=1\n')
@@ -198,17 +401,51 @@ class SLURMPipelineRunner(PipelineRunner):
         out.write('echo $SLURM_JOB_ID\n')
         out.write('echo $HOSTNAME\n')
 
-    def _write_directory_check(self, out, directory):
+    def _get_completion_marker(self, directory):
         """
-        Writes a directory check script to the provided file handle, which exits the job if the directory exists.
+        Gets path to completion marker of step writing to **directory**
 
-        :param out: File handle to write the directory check script.
-        :param directory: The directory to check for existence.
+        :param directory: Output directory of step
+        :type directory: str
+        :return: path
+        :rtype: str
         """
-        out.write(f"if [ -d \"{directory}\" ]; then\n")
-        out.write(f"    echo \"Directory {directory} exists. Skipping job.\"\n")
+        return os.path.join(directory, SLURMPipelineRunner.COMPLETION_MARKER)
+
+    def _write_completion_check(self, out, directory):
+        """
+        Writes a check to the provided file handle, which exits the job if the
+        completion marker of **directory** exists and otherwise removes any
+        partial output left by an earlier, failed or cancelled, run of the job.
+
+        :param out: File handle to write the check.
+        :param directory: Output directory of step, or of shard of step,
+                          written by the job.
+        """
+        marker = self._get_completion_marker(directory)
+        out.write(f"if [ -f \"{marker}\" ]; then\n")
+        out.write(f"    echo \"Found {marker}. Skipping job.\"\n")
         out.write("    exit 0\n")
         out.write("fi\n\n")
+        out.write(f"if [ -d \"{directory}\" ]; then\n")
+        out.write(f"    echo \"Removing incomplete {directory}\"\n")
+        out.write(f"    rm -rf \"{directory}\"\n")
+        out.write("fi\n\n")
+
+    def _write_completion_marker(self, out, directory):
+        """
+        Writes commands to the provided file handle that, if the preceding
+        command succeeded, create the completion marker of **directory**
+        and exit with the status of the preceding command.
+
+        :param out: File handle to write the commands.
+        :param directory: Output directory of step, or of shard of step.
+        """
+        out.write('exit_code=$?\n')
+        out.write('if [ $exit_code -eq 0 ]; then\n')
+        out.write('    touch "' + self._get_completion_marker(directory) + '" || exit $?\n')
+        out.write('fi\n')
+        out.write('exit $exit_code\n')
 
     def _generate_download_images_command(self):
         """
@@ -217,8 +454,9 @@ class SLURMPipelineRunner(PipelineRunner):
         :return: The filename of the bash script generated for downloading images.
         """
         with open(os.path.join(self._outdir, 'imagedownloadjob.sh'), 'w') as f:
-            self._write_slurm_directives(out=f, job_name='imagedownload')
-            self._write_directory_check(f, self._image_dir)
+            self._write_slurm_directives(out=f, job_name='imagedownload',
+                                         step_name=PipelineRunner.IMAGE_DOWNLOAD_STEP)
+            self._write_completion_check(f, self._image_dir)
             if self._cm4ai_image != None:
                 input_arg = '--cm4ai_table ' + self._cm4ai_image
             elif self._samples != None:
@@ -233,10 +471,93 @@ class SLURMPipelineRunner(PipelineRunner):
                     'You must provide provenance parameter')
             f.write('cellmaps_imagedownloadercmd.py ' + self._image_dir +
                     ' --provenance ' + self._provenance + ' ' + input_arg + '\n')
-            f.write('exit $?\n')
+            self._write_completion_marker(f, self._image_dir)
         os.chmod(os.path.join(self._outdir, 'imagedownloadjob.sh'), 0o755)
         return 'imagedownloadjob.sh'
 
+    def _is_image_download_sharded(self):
+        """
+        Image download is sharded if number of image shards is set and
+        images are listed in samples, not a CM4AI table
+
+        :return: ``True`` if image download is sharded
+        :rtype: bool
+        """
+        return self._image_shards is not None and self._cm4ai_image is None and self._samples is not None
+
+    def _get_image_embedding_shards_dir(self, fold=1):
+        """
+        Gets directory holding image embedding shards of **fold**
+
+        :param fold: The data fold
+        :type fold: int
+        :return: path
+        :rtype: str
+        """
+        return self._image_coembed_tuples[fold - 1][1] + SLURMPipelineRunner.IMAGE_EMBEDDING_SHARDS_SUFFIX
+
+    def _generate_download_images_array_command(self):
+        """
+        Splits samples, and unique if set, into shards, via
+        :py:func:`~cellmaps_pipeline.sharding.split_samples_by_antibody`, and
+        generates a bash script for a job array downloading the images of
+        each shard into its own directory under ``image_download_shards``
+
+        :return: (filename of bash script, number of shards)
+        :rtype: tuple
+        """
+        if self._provenance is None:
+            raise CellmapsPipelineError(
+                'You must provide provenance parameter')
+        num_shards = sharding.split_samples_by_antibody(self._samples,
+                                                        self._image_download_shards_dir,
+                                                        self._image_shards,
+                                                        unique=self._unique)
+        shard_dir = sharding.get_shard_dir(self._image_download_shards_dir,
+                                           SLURMPipelineRunner.ARRAY_TASK_ID)
+        filename = 'imagedownloadarrayjob.sh'
+        with open(os.path.join(self._outdir, filename), 'w') as f:
+            self._write_slurm_directives(out=f, job_name='imagedownloadshard',
+                                         step_name=PipelineRunner.IMAGE_DOWNLOAD_STEP,
+                                         array_size=num_shards)
+            self._write_completion_check(f, shard_dir)
+            input_arg = '--samples ' + sharding.get_samples_file(self._image_download_shards_dir,
+                                                                 SLURMPipelineRunner.ARRAY_TASK_ID)
+            if self._unique is not None:
+                input_arg += ' --unique ' + sharding.get_unique_file(self._image_download_shards_dir,
+                                                                     SLURMPipelineRunner.ARRAY_TASK_ID)
+            f.write('cellmaps_imagedownloadercmd.py ' + shard_dir +
+                    ' --provenance ' + self._provenance + ' ' + input_arg + '\n')
+            self._write_completion_marker(f, shard_dir)
+        os.chmod(os.path.join(self._outdir, filename), 0o755)
+        return filename, num_shards
+
+    def _generate_download_images_merge_command(self, num_shards):
+        """
+        Generates a bash script merging the **num_shards** image download
+        shards into the image download directory
+
+        :param num_shards: Number of image download shards
+        :type num_shards: int
+        :return: imagedownloadmergejob.sh
+        """
+        filename = 'imagedownloadmergejob.sh'
+        with open(os.path.join(self._outdir, filename), 'w') as f:
+            self._write_slurm_directives(out=f, job_name='imagedownloadmerge',
+                                         step_name=SLURMResourceProfiles.IMAGE_DOWNLOAD_MERGE_STEP)
+            self._write_completion_check(f, self._image_dir)
+            input_arg = '--samples ' + self._samples
+            if self._unique is not None:
+                input_arg += ' --unique ' + self._unique
+            f.write('cellmaps_shardcmd.py ' + cellmaps_shardcmd.MERGE_IMAGE_DOWNLOAD_MODE + ' ' +
+                    self._image_dir + ' --provenance ' + self._provenance + ' ' + input_arg +
+                    ' --shard_dirs ' +
+                    ' '.join([sharding.get_shard_dir(self._image_download_shards_dir, shard)
+                              for shard in range(1, num_shards + 1)]) + ' -vvvv\n')
+            self._write_completion_marker(f, self._image_dir)
+        os.chmod(os.path.join(self._outdir, filename), 0o755)
+        return filename
+
     def _generate_download_ppi_command(self):
         """
         Generates a bash script for downloading protein-protein interactions (PPI) data and writes it to a file in the output directory.
@@ -244,8 +565,9 @@ class SLURMPipelineRunner(PipelineRunner):
         :return: ppidownloadjob.sh
         """
         with open(os.path.join(self._outdir, 'ppidownloadjob.sh'), 'w') as f:
-            self._write_slurm_directives(out=f, job_name='ppidownload')
-            self._write_directory_check(f, self._ppi_dir)
+            self._write_slurm_directives(out=f, job_name='ppidownload',
+                                         step_name=PipelineRunner.PPI_DOWNLOAD_STEP)
+            self._write_completion_check(f, self._ppi_dir)
             if self._cm4ai_apms != None:
                 input_arg = '--cm4ai_table ' + self._cm4ai_apms
             elif self._edgelist != None and self._baitlist != None:
@@ -258,7 +580,7 @@ class SLURMPipelineRunner(PipelineRunner):
                     'You must provide provenance parameter')
             f.write('cellmaps_ppidownloadercmd.py ' + self._ppi_dir +
                     ' --provenance ' + self._provenance + ' ' + input_arg + '\n')
-            f.write('exit $?\n')
+            self._write_completion_marker(f, self._ppi_dir)
         os.chmod(os.path.join(self._outdir, 'ppidownloadjob.sh'), 0o755)
         return 'ppidownloadjob.sh'
 
@@ -271,12 +593,69 @@ class SLURMPipelineRunner(PipelineRunner):
         """
         filename = 'imageembedjob' + str(fold) + '.sh'
         with open(os.path.join(self._outdir, filename), 'w') as f:
-            self._write_slurm_directives(out=f, job_name='imageembed' + str(fold))
-            self._write_directory_check(f, self._image_coembed_tuples[fold - 1][1])
+            self._write_slurm_directives(out=f, job_name='imageembed' + str(fold),
+                                         step_name=PipelineRunner.IMAGE_EMBEDDING_STEP_PREFIX +
+                                         str(fold))
+            self._write_completion_check(f, self._image_coembed_tuples[fold - 1][1])
             fake = '--fake_embedder' if self._fake is True else ""
             f.write('cellmaps_image_embeddingcmd.py ' + self._image_coembed_tuples[fold - 1][1] +
                     ' --fold ' + str(fold) + ' --inputdir ' + self._image_dir + ' ' + fake + ' -vvvv\n')
-            f.write('exit $?\n')
+            self._write_completion_marker(f, self._image_coembed_tuples[fold - 1][1])
+        os.chmod(os.path.join(self._outdir, filename), 0o755)
+        return filename
+
+    def _generate_embed_image_array_command(self, fold=1):
+        """
+        Generates a bash script for a job array where each task links its
+        share of the images of **fold**, via
+        :py:func:`~cellmaps_pipeline.sharding.create_image_embedding_shard_input`,
+        into its own input directory and embeds them
+
+        :param fold: The data fold to process for image embedding.
+        :return: The filename of the bash script generated
+        """
+        shards_dir = self._get_image_embedding_shards_dir(fold)
+        input_dir = sharding.get_shard_input_dir(shards_dir, SLURMPipelineRunner.ARRAY_TASK_ID)
+        shard_dir = sharding.get_shard_dir(shards_dir, SLURMPipelineRunner.ARRAY_TASK_ID)
+        filename = 'imageembedarrayjob' + str(fold) + '.sh'
+        with open(os.path.join(self._outdir, filename), 'w') as f:
+            self._write_slurm_directives(out=f, job_name='imageembedshard' + str(fold),
+                                         step_name=PipelineRunner.IMAGE_EMBEDDING_STEP_PREFIX +
+                                         str(fold),
+                                         array_size=self._image_shards)
+            self._write_completion_check(f, shard_dir)
+            f.write('cellmaps_shardcmd.py ' + cellmaps_shardcmd.IMAGE_EMBEDDING_INPUT_MODE + ' ' +
+                    input_dir + ' --image_dir ' + self._image_dir + ' --fold ' + str(fold) +
+                    ' --shard ' + SLURMPipelineRunner.ARRAY_TASK_ID +
+                    ' --num_shards ' + str(self._image_shards) + ' -vvvv || exit $?\n')
+            fake = '--fake_embedder' if self._fake is True else ""
+            f.write('cellmaps_image_embeddingcmd.py ' + shard_dir +
+                    ' --fold ' + str(fold) + ' --inputdir ' + input_dir + ' ' + fake + ' -vvvv\n')
+            self._write_completion_marker(f, shard_dir)
+        os.chmod(os.path.join(self._outdir, filename), 0o755)
+        return filename
+
+    def _generate_embed_image_merge_command(self, fold=1):
+        """
+        Generates a bash script merging the image embedding shards
+        of **fold** into the image embedding directory of **fold**
+
+        :param fold: The data fold to process for image embedding.
+        :return: The filename of the bash script generated
+        """
+        shards_dir = self._get_image_embedding_shards_dir(fold)
+        filename = 'imageembedmergejob' + str(fold) + '.sh'
+        with open(os.path.join(self._outdir, filename), 'w') as f:
+            self._write_slurm_directives(out=f, job_name='imageembedmerge' + str(fold),
+                                         step_name=SLURMResourceProfiles.IMAGE_EMBEDDING_MERGE_STEP +
+                                         '_fold' + str(fold))
+            self._write_completion_check(f, self._image_coembed_tuples[fold - 1][1])
+            f.write('cellmaps_shardcmd.py ' + cellmaps_shardcmd.MERGE_IMAGE_EMBEDDING_MODE + ' ' +
+                    self._image_coembed_tuples[fold - 1][1] + ' --image_dir ' + self._image_dir +
+                    ' --fold ' + str(fold) + ' --shard_dirs ' +
+                    ' '.join([sharding.get_shard_dir(shards_dir, shard)
+                              for shard in range(1, self._image_shards + 1)]) + ' -vvvv\n')
+            self._write_completion_marker(f, self._image_coembed_tuples[fold - 1][1])
         os.chmod(os.path.join(self._outdir, filename), 0o755)
         return filename
 
@@ -287,12 +666,13 @@ class SLURMPipelineRunner(PipelineRunner):
         :return: ppiembedjob.sh
         """
         with open(os.path.join(self._outdir, 'ppiembedjob.sh'), 'w') as f:
-            self._write_slurm_directives(out=f, job_name='ppiembed')
-            self._write_directory_check(f, self._ppi_embed_dir)
+            self._write_slurm_directives(out=f, job_name='ppiembed',
+                                         step_name=PipelineRunner.PPI_EMBEDDING_STEP)
+            self._write_completion_check(f, self._ppi_embed_dir)
             fake = "--fake_embedder" if self._fake is True else ""
             f.write('cellmaps_ppi_embeddingcmd.py ' + self._ppi_embed_dir +
                     ' --inputdir ' + self._ppi_dir + ' ' + fake + ' -vvvv\n')
-            f.write('exit $?\n')
+            self._write_completion_marker(f, self._ppi_embed_dir)
         os.chmod(os.path.join(self._outdir, 'ppiembedjob.sh'), 0o755)
         return 'ppiembedjob.sh'
 
@@ -305,13 +685,15 @@ class SLURMPipelineRunner(PipelineRunner):
         """
         filename = 'coembeddingjob' + str(fold) + '.sh'
         with open(os.path.join(self._outdir, filename), 'w') as f:
-            self._write_slurm_directives(out=f, job_name='coembedding' + str(fold))
-            self._write_directory_check(f, self._image_coembed_tuples[fold - 1][2])
+            self._write_slurm_directives(out=f, job_name='coembedding' + str(fold),
+                                         step_name=PipelineRunner.COEMBEDDING_STEP_PREFIX +
+                                         str(fold))
+            self._write_completion_check(f, self._image_coembed_tuples[fold - 1][2])
             fake = '--fake_embedding' if self._fake is True else ""
             f.write('cellmaps_coembeddingcmd.py ' + self._image_coembed_tuples[fold - 1][
                 2] + ' --ppi_embeddingdir ' + self._ppi_embed_dir +
                     ' --image_embeddingdir ' + self._image_coembed_tuples[fold - 1][1] + ' ' + fake + ' -vvvv\n')
-            f.write('exit $?\n')
+            self._write_completion_marker(f, self._image_coembed_tuples[fold - 1][2])
         os.chmod(os.path.join(self._outdir, filename), 0o755)
         return filename
 
@@ -321,14 +703,15 @@ class SLURMPipelineRunner(PipelineRunner):
         :return: hierarchyjob.sh
         """
         with open(os.path.join(self._outdir, 'hierarchyjob.sh'), 'w') as f:
-            self._write_slurm_directives(out=f, job_name='hierarchy')
-            self._write_directory_check(f, self._hierarchy_dir)
+            self._write_slurm_directives(out=f, job_name='hierarchy',
+                                         step_name=PipelineRunner.HIERARCHY_STEP)
+            self._write_completion_check(f, self._hierarchy_dir)
             f.write('cellmaps_generate_hierarchycmd.py ' + self._hierarchy_dir + ' --coembedding_dirs ')
             for image_coembed_tuple in self._image_coembed_tuples:
                 f.write(image_coembed_tuple[2] + ' ')
             f.write('--gene_node_attributes ' + self._ppi_dir + ' ' + self._image_dir + ' ')
             f.write('-vvvv\n')
-            f.write('exit $?\n')
+            self._write_completion_marker(f, self._hierarchy_dir)
         os.chmod(os.path.join(self._outdir, 'hierarchyjob.sh'), 0o755)
         return 'hierarchyjob.sh'
 
@@ -338,69 +721,212 @@ class SLURMPipelineRunner(PipelineRunner):
         :return: hierarchyevaljob.sh
         """
         with open(os.path.join(self._outdir, 'hierarchyevaljob.sh'), 'w') as f:
-            self._write_slurm_directives(out=f, job_name='hierarchyeval')
-            self._write_directory_check(f, self._hierarchy_eval_dir)
+            self._write_slurm_directives(out=f, job_name='hierarchyeval',
+                                         step_name=PipelineRunner.HIERARCHYEVAL_STEP)
+            self._write_completion_check(f, self._hierarchy_eval_dir)
             f.write('cellmaps_hierarchyevalcmd.py ' + self._hierarchy_eval_dir + ' --hierarchy_dir ' +
                     self._hierarchy_dir)
             f.write(' -vvvv\n')
-            f.write('exit $?\n')
+            self._write_completion_marker(f, self._hierarchy_eval_dir)
         os.chmod(os.path.join(self._outdir, 'hierarchyevaljob.sh'), 0o755)
         return 'hierarchyevaljob.sh'
 
+    def _write_submit(self, out, comment, directory, jobs, dependencies=None,
+                      shards_dir=None):
+        """
+        Writes commands to submit **jobs** of a step, via ``sbatch``, to
+        the provided file handle. The jobs are only submitted if the
+        completion marker of **directory** is missing or any job in
+        **dependencies** was submitted, in which case the marker, along
+        with those of the shards under **shards_dir**, is removed so the
+        step is rerun on the output of those jobs.
+
+        :param out: File handle to write the commands.
+        :param comment: Comment written above the commands.
+        :param directory: Output directory of step.
+        :param jobs: (job variable, job script, job variables it depends on
+                     in addition to **dependencies**) tuples for jobs of step,
+                     in order of submission. Each job variable is set to the id
+                     of the job if submitted, otherwise left empty.
+        :type jobs: list
+        :param dependencies: Variables of jobs of other steps this step depends on.
+        :type dependencies: list
+        :param shards_dir: Directory holding shards of step, if step is sharded
+        :type shards_dir: str
+        """
+        if dependencies is None:
+            dependencies = []
+        marker = self._get_completion_marker(directory)
+        out.write('# ' + comment + '\n')
+        for job_var, _, _ in jobs:
+            out.write(job_var + '=""\n')
+        condition = '[ ! -f "' + marker + '" ]'
+        if len(dependencies) > 0:
+            condition += ' || [ -n "' + ''.join(['$' + x for x in dependencies]) + '" ]'
+        out.write('if ' + condition + '; then\n')
+        out.write('    rm -f "' + marker + '"\n')
+        if shards_dir is not None and len(dependencies) > 0:
+            # finished shards are kept when resuming, unless computed from stale input
+            out.write('    if [ -n "' + ''.join(['$' + x for x in dependencies]) + '" ]; then\n')
+            out.write('        rm -f "' + shards_dir + '"/' + sharding.SHARD_PREFIX + '*/' +
+                      SLURMPipelineRunner.COMPLETION_MARKER + '\n')
+            out.write('    fi\n')
+        for job_var, script, job_dependencies in jobs:
+            job_dependencies = dependencies + job_dependencies
+            dependency_arg = ''
+            if len(job_dependencies) > 0:
+                dependency_arg = '$(get_dependency ' + ' '.join(['$' + x for x in job_dependencies]) + ') '
+            out.write('    ' + job_var + '=$(sbatch ' + dependency_arg + script +
+                      ' | awk \'{print $4}\')\n')
+        out.write('fi\n\n')
+
+    def _get_step_shards_dir(self, step_name):
+        """
+        Gets directory holding shards of step **step_name**
+
+        :param step_name: Name of step as returned by
+                          :py:meth:`~PipelineRunner._get_step_dependencies`
+        :type step_name: str
+        :return: path or ``None`` if step is not run as a job array
+        :rtype: str
+        """
+        if step_name == PipelineRunner.IMAGE_DOWNLOAD_STEP:
+            if self._is_image_download_sharded():
+                return self._image_download_shards_dir
+            return None
+        if step_name.startswith(PipelineRunner.IMAGE_EMBEDDING_STEP_PREFIX) and \
+                self._image_shards is not None:
+            fold = self._get_image_coembed_tuple_for_step(step_name,
+                                                          PipelineRunner.IMAGE_EMBEDDING_STEP_PREFIX)[0]
+            return self._get_image_embedding_shards_dir(fold)
+        return None
+
+    def _get_step_jobs(self, step_name):
+        """
+        Generates the job scripts of step **step_name**
+
+        :param step_name: Name of step as returned by
+                          :py:meth:`~PipelineRunner._get_step_dependencies`
+        :type step_name: str
+        :raises CellmapsPipelineError: If **step_name** is not a known step
+        :return: (comment, list of (job variable, job script, job variables it
+                 depends on within step) tuples as taken by :py:meth:`_write_submit`).
+                 Last job is the one other steps depend on
+        :rtype: tuple
+        """
+        if step_name == PipelineRunner.IMAGE_DOWNLOAD_STEP:
+            if self._is_image_download_sharded():
+                array_script, num_shards = self._generate_download_images_array_command()
+                return ('image download shards, then merge of shards',
+                        [('image_download_array_job', array_script, []),
+                         ('image_download_job', self._generate_download_images_merge_command(num_shards),
+                          ['image_download_array_job'])])
+            return 'image download', [('image_download_job', self._generate_download_images_command(), [])]
+        if step_name == PipelineRunner.PPI_DOWNLOAD_STEP:
+            return 'ppi download', [('ppi_download_job', self._generate_download_ppi_command(), [])]
+        if step_name == PipelineRunner.PPI_EMBEDDING_STEP:
+            return 'ppi embed', [('ppi_embed_job', self._generate_embed_ppi_command(), [])]
+        if step_name.startswith(PipelineRunner.IMAGE_EMBEDDING_STEP_PREFIX):
+            fold = self._get_image_coembed_tuple_for_step(step_name,
+                                                          PipelineRunner.IMAGE_EMBEDDING_STEP_PREFIX)[0]
+            if self._image_shards is not None:
+                return ('fold' + str(fold) + ' image embed shards, then merge of shards',
+                        [('image_embed_array_job' + str(fold),
+                          self._generate_embed_image_array_command(fold=fold), []),
+                         ('image_embed_job' + str(fold),
+                          self._generate_embed_image_merge_command(fold=fold),
+                          ['image_embed_array_job' + str(fold)])])
+            return ('fold' + str(fold) + ' image embed',
+                    [('image_embed_job' + str(fold), self._generate_embed_image_command(fold=fold), [])])
+        if step_name.startswith(PipelineRunner.COEMBEDDING_STEP_PREFIX):
+            fold = self._get_image_coembed_tuple_for_step(step_name,
+                                                          PipelineRunner.COEMBEDDING_STEP_PREFIX)[0]
+            return ('fold' + str(fold) + ' co-embedding',
+                    [('f' + str(fold) + '_coembed_job', self._generate_coembed_command(fold=fold), [])])
+        if step_name == PipelineRunner.HIERARCHY_STEP:
+            return 'hierarchy', [('hierarchy_job', self._generate_hierarchy_command(), [])]
+        if step_name == PipelineRunner.HIERARCHYEVAL_STEP:
+            return 'hierarchyeval', [('hierarchyeval_job', self._generate_hierarchyeval_command(), [])]
+        raise CellmapsPipelineError('Unknown step: ' + str(step_name))
+
     def run(self):
         """
-        Runs pipelines
+        Generates SLURM job scripts along with ``slurm_cellmaps_job.sh``,
+        which submits them, and, if a local executor was passed to the
+        constructor, runs the jobs with it.
+
+        Jobs are submitted for each step of
+        :py:meth:`~PipelineRunner._get_step_dependencies`, depending on the
+        jobs of the steps whose output they read.
+
+        Each job creates :py:const:`COMPLETION_MARKER` in its output directory
+        once it succeeds. ``slurm_cellmaps_job.sh`` only submits steps lacking
+        that marker, along with every step downstream of them, with dependencies
+        on the jobs actually submitted, so rerunning it after a failure resumes
+        the pipeline from the failed steps. Each task of a job array likewise
+        creates the marker in its shard directory, so shards that finished are
+        not rerun if the step is resumed
+
+        :return: ``None`` or, if jobs are run by local executor, value
+                 returned by :py:meth:`~cellmaps_pipeline.localslurm.LocalSLURMExecutor.run`
         """
         slurmjobfile = os.path.join(self._outdir, 'slurm_cellmaps_job.sh')
         with open(slurmjobfile, 'w') as f:
             f.write('#! /bin/bash\n\n')
-            f.write('# image download no dependencies\n')
-            f.write('image_download_job=$(sbatch ' +
-                    self._generate_download_images_command() + ' | awk \'{print $4}\')\n\n')
-
-            f.write('# ppi download no dependencies\n')
-            f.write('ppi_download_job=$(sbatch ' +
-                    self._generate_download_ppi_command() + ' | awk \'{print $4}\')\n\n')
+            f.write('set -e -o pipefail\n\n')
+            f.write('# prints --dependency option for ids of jobs passed in, if any\n')
+            f.write('get_dependency() {\n')
+            f.write('    if [ $# -gt 0 ]; then\n')
+            f.write('        local IFS=:\n')
+            f.write('        echo "--dependency=afterok:$*"\n')
+            f.write('    fi\n')
+            f.write('}\n\n')
+            step_job_vars = {}
+            for step_name, dependencies in self._get_step_dependencies():
+                comment, jobs = self._get_step_jobs(step_name)
+                self._write_submit(f, comment, self._get_step_dir(step_name), jobs,
+                                   dependencies=[step_job_vars[x] for x in dependencies],
+                                   shards_dir=self._get_step_shards_dir(step_name))
+                step_job_vars[step_name] = jobs[-1][0]
+            # every step is upstream of the last, so it is submitted if any step is
+            final_job_var = jobs[-1][0]
+            f.write('if [ -z "$' + final_job_var + '" ]; then\n')
+            f.write('    echo "All steps already completed, no jobs submitted"\n')
+            f.write('else\n')
+            f.write('    echo "job submitted; here is ID of final ' + comment + ' job: $' + final_job_var + '"\n')
+            f.write('fi\n')
+        os.chmod(slurmjobfile, 0o755)
+        if self._local_executor is not None:
+            return self._local_executor.run(slurmjobfile)
+        return None
 
-            f.write('# ppi embed\n')
-            f.write('ppi_embed_job=$(sbatch --dependency=afterok:$ppi_download_job ' +
-                    self._generate_embed_ppi_command() + ' | awk \'{print $4}\')\n\n')
+    def get_step_metrics(self):
+        """
+        Gets timings and resource usage of each job if jobs were run by
+        a local executor, otherwise an empty list
 
-            embed_job_names = ['$ppi_embed_job']
-            for image_coembed_tuple in self._image_coembed_tuples:
-                # [0] = fold value
-                # [1] = image embedding dir
-                # [2] = outdir
-                f.write('# image embed\n')
-                f.write('image_embed_job' + str(
-                    image_coembed_tuple[0]) + '=$(sbatch --dependency=afterok:$image_download_job ' +
-                        self._generate_embed_image_command(fold=image_coembed_tuple[0]) + ' | awk \'{print $4}\')\n\n')
-                f.write(
-                    '# fold' + str(image_coembed_tuple[0]) + ' co-embedding\n')
-                embed_job_name = 'f' + str(image_coembed_tuple[0]) + '_coembed_job'
-                f.write(embed_job_name + '=$(sbatch --dependency=afterok:$image_embed_job' + str(
-                    image_coembed_tuple[0]) + ' ' +
-                        self._generate_coembed_command(fold=image_coembed_tuple[0]) + ' | awk \'{print $4}\')\n\n')
-                embed_job_names.append('$' + embed_job_name)
-            dependency_str = ':'.join(embed_job_names)
-            f.write('# hierarchy\n')
-            f.write(
-                'hierarchy_job=$(sbatch --dependency=afterok:' + dependency_str + ' ' + self._generate_hierarchy_command() + ' | awk \'{print $4}\')\n\n')
-            f.write('echo "job submitted; here is ID of final hierarchy job: $hierarchy_job"\n')
-            f.write('# hierarchyeval\n')
-            f.write(
-                'hierarchyeval_job=$(sbatch --dependency=afterok:$hierarchy_job ' +
-                self._generate_hierarchyeval_command() + ' | awk \'{print $4}\')\n\n')
-            f.write('echo "job submitted; here is ID of final hierarchyeval job: $hierarchyeval_job"\n')
-        os.chmod(slurmjobfile, 0o755)
+        :return: list of dict of metrics for each job
+        :rtype: list
+        """
+        if self._local_executor is None:
+            return []
+        return self._local_executor.get_job_metrics()
 
 
 class ProgrammaticPipelineRunner(PipelineRunner):
     """
-    Runs pipeline programmatically in a serial fashion
+    Runs pipeline programmatically in a serial fashion or,
+    if **max_workers** is greater than ``1``, by running
+    independent steps concurrently in a pool of worker
+    processes
 
     """
 
+    IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.tif', '.tiff')
+    """
+    Suffixes of files counted as images in the metrics of image download
+    """
+
     def __init__(self, outdir=None,
                  cm4ai_apms=None,
                  cm4ai_image=None,
@@ -416,7 +942,12 @@ class ProgrammaticPipelineRunner(PipelineRunner):
                  skip_logging=False,
                  provenance_utils=ProvenanceUtil(),
                  fold=[1],
-                 input_data_dict=None):
+                 input_data_dict=None,
+                 max_workers=1,
+                 fold_workers=1,
+                 threads_per_worker=None,
+                 use_step_cache=False,
+                 artifact_store=None):
         """
         Constructor
 
@@ -436,6 +967,26 @@ class ProgrammaticPipelineRunner(PipelineRunner):
         :param provenance_utils: Utility for handling provenance data.
         :param fold: List of fold of image data.
         :param input_data_dict: Dictionary containing input data configurations.
+        :param max_workers: Maximum number of steps to run concurrently. If ``None``
+                            or ``1`` steps are run serially in this process.
+        :param fold_workers: When steps are run serially, maximum number of
+                             image embedding and co-embedding fold steps to run
+                             concurrently. If ``None`` or ``1`` folds are run
+                             one after another.
+        :param threads_per_worker: Maximum number of threads each worker process
+                                   may use for numerical libraries such as BLAS
+                                   and torch. If ``None`` no limit is applied.
+        :param use_step_cache: If ``True``, a step is skipped only if its
+                               :py:class:`~cellmaps_pipeline.stepcache.StepCache`
+                               manifest matches the current inputs and parameters,
+                               otherwise any existing output directory of the step
+                               is removed and the step is rerun. If ``False``, a
+                               step is skipped if its output directory exists.
+        :param artifact_store: If set, outputs of image download, image embedding,
+                               PPI embedding and co-embedding steps are reused from,
+                               and added to, this store. Setting this enables the
+                               step cache since entries are keyed on step keys.
+        :type artifact_store: :py:class:`~cellmaps_pipeline.artifactstore.ArtifactStore`
         """
         super().__init__(outdir=outdir)
         self._cm4ai_amps = cm4ai_apms
@@ -452,6 +1003,16 @@ class ProgrammaticPipelineRunner(PipelineRunner):
         self._ppi_cutoffs = ppi_cutoffs
         self._input_data_dict = input_data_dict
         self._skip_logging = skip_logging
+        self._max_workers = max_workers
+        self._fold_workers = fold_workers
+        self._threads_per_worker = threads_per_worker
+        self._step_cache = None
+        self._artifact_store = artifact_store
+        if use_step_cache is True or artifact_store is not None:
+            self._step_cache = StepCache(manifest_dir=os.path.join(self._outdir,
+                                                                   StepCache.MANIFEST_DIR))
+        self._metrics_recorder = StepMetricsRecorder(metrics_dir=os.path.join(self._outdir,
+                                                                              StepMetricsRecorder.METRICS_DIR))
         self._image_dir = os.path.join(self._outdir,
                                        constants.IMAGE_DOWNLOAD_STEP_DIR)
         self._ppi_dir = os.path.join(self._outdir,
@@ -472,32 +1033,309 @@ class ProgrammaticPipelineRunner(PipelineRunner):
         Runs pipeline programmatically in serial steps. This would
         be the same as running the steps in a notebook.
 
+        If **max_workers** passed into the constructor is greater than ``1``
+        the steps are instead run via :py:meth:`_run_steps_concurrently`
+
         :raises CellmapsPipelineError: If any step in the pipeline fails, indicating the step and reason.
         :return: Exit code 0 if successful, other values indicate failure.
         """
-        if self._download_images() != 0:
-            raise CellmapsPipelineError('Image download failed')
+        self._metrics_recorder.clear()
+        if self._max_workers is not None and self._max_workers > 1:
+            return self._run_steps_concurrently()
+
+        fold_steps_done = False
+        for step_name, deps in self._get_step_dependencies():
+            if self._fold_workers is not None and self._fold_workers > 1 and self._is_fold_step(step_name):
+                if fold_steps_done is False:
+                    self._run_fold_steps_concurrently()
+                    fold_steps_done = True
+                continue
+            if self._run_step(step_name) != 0:
+                raise CellmapsPipelineError(self._get_step_error_message(step_name))
+
+        return 0
+
+    @staticmethod
+    def _is_fold_step(step_name):
+        """
+        Checks if step is an image embedding or co-embedding step of a fold
+
+        :param step_name: Name of step
+        :type step_name: str
+        :return: ``True`` if step is run per fold
+        :rtype: bool
+        """
+        return step_name.startswith((ProgrammaticPipelineRunner.IMAGE_EMBEDDING_STEP_PREFIX,
+                                     ProgrammaticPipelineRunner.COEMBEDDING_STEP_PREFIX))
+
+    def _get_step_parameters(self, step_name):
+        """
+        Gets the parameters and input files that affect the output of
+        step. Output directory paths are deliberately left out so the
+        values are the same across runs.
+
+        :param step_name: Name of step
+        :type step_name: str
+        :return: (parameters as dict, input files as dict of name => path or URL)
+        :rtype: tuple
+        """
+        if step_name == ProgrammaticPipelineRunner.IMAGE_DOWNLOAD_STEP:
+            return ({'fake': self._fake,
+                     'provenance': self._provenance},
+                    {'cm4ai_image': self._cm4ai_image,
+                     'samples': self._samples,
+                     'unique': self._unique,
+                     'proteinatlasxml': self._proteinatlasxml})
+        if step_name == ProgrammaticPipelineRunner.PPI_DOWNLOAD_STEP:
+            return ({'provenance': self._provenance},
+                    {'cm4ai_apms': self._cm4ai_amps,
+                     'edgelist': self._edgelist,
+                     'baitlist': self._baitlist})
+        if step_name.startswith(ProgrammaticPipelineRunner.IMAGE_EMBEDDING_STEP_PREFIX):
+            fold = self._get_image_coembed_tuple_for_step(step_name,
+                                                          ProgrammaticPipelineRunner.IMAGE_EMBEDDING_STEP_PREFIX)[0]
+            return {'fake': self._fake, 'fold': fold}, {'model_path': self._model_path}
+        if step_name == ProgrammaticPipelineRunner.HIERARCHY_STEP:
+            return {'ppi_cutoffs': self._ppi_cutoffs}, {}
+        if step_name == ProgrammaticPipelineRunner.HIERARCHYEVAL_STEP:
+            return {}, {}
+        return {'fake': self._fake}, {}
+
+    def get_step_metrics(self):
+        """
+        Gets metrics of each step run by the last call to :py:meth:`run`
+        as measured by :py:class:`~cellmaps_pipeline.metrics.StepMetricsRecorder`
 
-        if self._download_ppi() != 0:
-            raise CellmapsPipelineError('PPI download failed')
+        :return: list of dict of metrics for each step, ordered by start time
+        :rtype: list
+        """
+        return self._metrics_recorder.get_step_metrics()
 
-        if self._embed_ppi() != 0:
-            raise CellmapsPipelineError('PPI embed failed')
+    def _run_step(self, step_name):
+        """
+        Runs the step with name **step_name** via :py:meth:`_run_cached_step`
+        recording its metrics. This is invoked in the worker processes when
+        steps are run concurrently.
+
+        :param step_name: Name of step as returned by :py:meth:`_get_step_dependencies`
+        :type step_name: str
+        :raises CellmapsPipelineError: If **step_name** is not a known step
+        :return: Exit code of step, 0 means success
+        :rtype: int
+        """
+        return self._metrics_recorder.measure(step_name, self._run_cached_step,
+                                              item_counter=self._get_step_item_counts)
 
-        if self._embed_image() != 0:
-            raise CellmapsPipelineError('Image embed failed')
+    def _get_step_item_counts(self, step_name):
+        """
+        Counts items, such as images, genes and edges, in the
+        output directory of step
 
-        if self._coembed() != 0:
-            raise CellmapsPipelineError('Coembed failed')
+        :param step_name: Name of step
+        :type step_name: str
+        :return: item name => count, counts are ``None`` if the file counted is missing
+        :rtype: dict
+        """
+        step_dir = self._get_step_dir(step_name)
+        if step_name == ProgrammaticPipelineRunner.IMAGE_DOWNLOAD_STEP:
+            return {'images': count_files(step_dir,
+                                          suffixes=ProgrammaticPipelineRunner.IMAGE_SUFFIXES),
+                    'genes': count_file_rows(os.path.join(step_dir,
+                                                          constants.IMAGE_GENE_NODE_ATTR_FILE))}
+        if step_name == ProgrammaticPipelineRunner.PPI_DOWNLOAD_STEP:
+            return {'genes': count_file_rows(os.path.join(step_dir,
+                                                          constants.PPI_GENE_NODE_ATTR_FILE)),
+                    'edges': count_file_rows(os.path.join(step_dir,
+                                                          constants.PPI_EDGELIST_FILE))}
+        if step_name == ProgrammaticPipelineRunner.PPI_EMBEDDING_STEP:
+            return {'genes': count_file_rows(os.path.join(step_dir,
+                                                          constants.PPI_EMBEDDING_FILE))}
+        if step_name.startswith(ProgrammaticPipelineRunner.IMAGE_EMBEDDING_STEP_PREFIX):
+            return {'genes': count_file_rows(os.path.join(step_dir,
+                                                          constants.IMAGE_EMBEDDING_FILE))}
+        if step_name.startswith(ProgrammaticPipelineRunner.COEMBEDDING_STEP_PREFIX):
+            return {'genes': count_file_rows(os.path.join(step_dir,
+                                                          constants.CO_EMBEDDING_FILE))}
+        if step_name == ProgrammaticPipelineRunner.HIERARCHY_STEP:
+            return {'systems': count_file_rows(os.path.join(step_dir,
+                                                            constants.HIERARCHY_NODES_FILE))}
+        return {}
+
+    def _run_cached_step(self, step_name):
+        """
+        Runs the step with name **step_name**.
+
+        If the step cache is enabled, the step is skipped if its manifest
+        matches, otherwise any existing output directory is removed before
+        the step is run and a new manifest is written upon success. When the
+        step is run, rather than fetched from the artifact store, manifests
+        of the steps downstream of it are removed so they are rerun too.
+
+        :param step_name: Name of step as returned by :py:meth:`_get_step_dependencies`
+        :type step_name: str
+        :raises CellmapsPipelineError: If **step_name** is not a known step
+        :return: Exit code of step, 0 means success
+        :rtype: int
+        """
+        if self._step_cache is None:
+            return self._invoke_step(step_name)
+
+        step_dir = self._get_step_dir(step_name)
+        parameters, input_files = self._get_step_parameters(step_name)
+        key = self._step_cache.get_step_key(step_name, parameters=parameters,
+                                            input_files=input_files,
+                                            upstream_steps=dict(self._get_step_dependencies())[step_name])
+        if self._step_cache.is_step_complete(step_name, key, step_dir):
+            logger.info('Step ' + step_name + ' is complete and its inputs '
+                        'are unchanged. Skipping')
+            return 0
+
+        self._step_cache.remove_manifest(step_name)
+        if os.path.isdir(step_dir):
+            warnings.warn('Removing ' + step_dir + ' since it is incomplete or '
+                          'its inputs have changed')
+            shutil.rmtree(step_dir)
+
+        use_store = self._artifact_store is not None and self._is_storable_step(step_name)
+        if use_store and self._artifact_store.fetch(key, step_dir) is not None:
+            self._step_cache.write_manifest(step_name, key, step_dir,
+                                            parameters=parameters)
+            return 0
+
+        # keys of downstream steps only depend on the key of this step, which
+        # is unchanged, so their manifests are removed to make them rerun on
+        # the new output of this step
+        for downstream_step in self._get_downstream_steps(step_name):
+            self._step_cache.remove_manifest(downstream_step)
+
+        retval = self._invoke_step(step_name)
+        if retval == 0:
+            manifest = self._step_cache.write_manifest(step_name, key, step_dir,
+                                                       parameters=parameters)
+            if use_store:
+                self._artifact_store.put(key, step_dir, manifest=manifest)
+        return retval
+
+    @staticmethod
+    def _is_storable_step(step_name):
+        """
+        Checks if outputs of step are worth keeping in the artifact store.
+        These are the steps that are expensive to rerun and whose outputs
+        are reused when only downstream parameters change
+
+        :param step_name: Name of step
+        :type step_name: str
+        :return: ``True`` if step outputs should be stored
+        :rtype: bool
+        """
+        return (step_name in [ProgrammaticPipelineRunner.IMAGE_DOWNLOAD_STEP,
+                              ProgrammaticPipelineRunner.PPI_EMBEDDING_STEP] or
+                ProgrammaticPipelineRunner._is_fold_step(step_name))
+
+    def _invoke_step(self, step_name):
+        """
+        Invokes the method that performs the step with name **step_name**
 
-        if self._hierarchy() != 0:
-            raise CellmapsPipelineError('Hierarchy failed')
+        :param step_name: Name of step as returned by :py:meth:`_get_step_dependencies`
+        :type step_name: str
+        :raises CellmapsPipelineError: If **step_name** is not a known step
+        :return: Exit code of step, 0 means success
+        :rtype: int
+        """
+        if step_name == ProgrammaticPipelineRunner.IMAGE_DOWNLOAD_STEP:
+            return self._download_images()
+        if step_name == ProgrammaticPipelineRunner.PPI_DOWNLOAD_STEP:
+            return self._download_ppi()
+        if step_name == ProgrammaticPipelineRunner.PPI_EMBEDDING_STEP:
+            return self._embed_ppi()
+        if step_name.startswith(ProgrammaticPipelineRunner.IMAGE_EMBEDDING_STEP_PREFIX):
+            return self._embed_image_fold(
+                self._get_image_coembed_tuple_for_step(step_name,
+                                                       ProgrammaticPipelineRunner.IMAGE_EMBEDDING_STEP_PREFIX))
+        if step_name.startswith(ProgrammaticPipelineRunner.COEMBEDDING_STEP_PREFIX):
+            return self._coembed_fold(
+                self._get_image_coembed_tuple_for_step(step_name,
+                                                       ProgrammaticPipelineRunner.COEMBEDDING_STEP_PREFIX))
+        if step_name == ProgrammaticPipelineRunner.HIERARCHY_STEP:
+            return self._hierarchy()
+        if step_name == ProgrammaticPipelineRunner.HIERARCHYEVAL_STEP:
+            return self._hierarchy_eval()
+        raise CellmapsPipelineError('Unknown step: ' + str(step_name))
+
+    @staticmethod
+    def _get_step_error_message(step_name):
+        """
+        Gets error message to raise when step with **step_name** fails
 
-        if self._hierarchy_eval() != 0:
-            raise CellmapsPipelineError('Hierarchy eval failed')
+        :param step_name: Name of step
+        :type step_name: str
+        :return: error message
+        :rtype: str
+        """
+        if step_name == ProgrammaticPipelineRunner.IMAGE_DOWNLOAD_STEP:
+            return 'Image download failed'
+        if step_name == ProgrammaticPipelineRunner.PPI_DOWNLOAD_STEP:
+            return 'PPI download failed'
+        if step_name == ProgrammaticPipelineRunner.PPI_EMBEDDING_STEP:
+            return 'PPI embed failed'
+        if step_name.startswith(ProgrammaticPipelineRunner.IMAGE_EMBEDDING_STEP_PREFIX):
+            return 'Image embed failed'
+        if step_name.startswith(ProgrammaticPipelineRunner.COEMBEDDING_STEP_PREFIX):
+            return 'Coembed failed'
+        if step_name == ProgrammaticPipelineRunner.HIERARCHY_STEP:
+            return 'Hierarchy failed'
+        return 'Hierarchy eval failed'
+
+    def _run_steps(self, steps, max_workers):
+        """
+        Runs **steps** via :py:class:`~cellmaps_pipeline.scheduler.StepScheduler`
+        so steps whose dependencies are satisfied run at the same time in
+        separate processes
+
+        :param steps: list of tuples of (step name, list of step names it depends on)
+        :type steps: list
+        :param max_workers: Maximum number of steps to run concurrently
+        :type max_workers: int
+        :raises CellmapsPipelineError: If any step fails
+        """
+        logger.info('Running ' + str(len(steps)) + ' pipeline steps with up to ' +
+                    str(max_workers) + ' concurrent workers')
+        results = StepScheduler(max_workers=max_workers,
+                                threads_per_worker=self._threads_per_worker).run(steps, self._run_step)
+        for step_name, deps in steps:
+            if results.get(step_name, 0) != 0:
+                raise CellmapsPipelineError(self._get_step_error_message(step_name))
+
+    def _run_steps_concurrently(self):
+        """
+        Runs all the steps returned by :py:meth:`_get_step_dependencies`
+        concurrently, such as the PPI and image branches, using
+        up to **max_workers** processes
 
+        :raises CellmapsPipelineError: If any step in the pipeline fails
+        :return: 0 upon success
+        :rtype: int
+        """
+        self._run_steps(self._get_step_dependencies(), self._max_workers)
         return 0
 
+    def _run_fold_steps_concurrently(self):
+        """
+        Runs the image embedding and co-embedding steps of every fold
+        using up to **fold_workers** processes. Each fold's co-embedding
+        starts as soon as the image embedding of that fold finishes.
+        PPI embedding must already be complete.
+
+        :raises CellmapsPipelineError: If any step fails
+        """
+        fold_steps = []
+        for step_name, deps in self._get_step_dependencies():
+            if not self._is_fold_step(step_name):
+                continue
+            fold_steps.append((step_name, [dep for dep in deps
+                                           if self._is_fold_step(dep)]))
+        self._run_steps(fold_steps, self._fold_workers)
+
     def _hierarchy_eval(self):
         """
         Evaluates the hierarchy.
@@ -561,32 +1399,46 @@ class ProgrammaticPipelineRunner(PipelineRunner):
         :rtype: int
         """
         for image_coembed_tuple in self._image_coembed_tuples:
-            if os.path.isdir(image_coembed_tuple[2]):
-                warnings.warn('Found coembedding dir' +
-                              str(image_coembed_tuple[2]) +
-                              ', assuming we are good. skipping')
-                continue
-            if self._fake:
-                gen = FakeCoEmbeddingGenerator(ppi_embeddingdir=self._ppi_embed_dir,
-                                               image_embeddingdir=image_coembed_tuple[1])
-            else:
-                gen = MuseCoEmbeddingGenerator(outdir=image_coembed_tuple[2],
-                                               ppi_embeddingdir=self._ppi_embed_dir,
-                                               image_embeddingdir=image_coembed_tuple[1])
-            retval = CellmapsCoEmbedder(outdir=image_coembed_tuple[2],
-                                        inputdirs=[image_coembed_tuple[1],
-                                                   self._ppi_embed_dir],
-                                        embedding_generator=gen,
-                                        skip_logging=self._skip_logging,
-                                        input_data_dict=self._input_data_dict).run()
+            retval = self._coembed_fold(image_coembed_tuple)
             if retval != 0:
-                logger.error('Coembedding ' + image_coembed_tuple[2] +
-                             'using ' + image_coembed_tuple[1] +
-                             ' had non zero exit code of: ' +
-                             str(retval))
                 return retval
         return 0
 
+    def _coembed_fold(self, image_coembed_tuple):
+        """
+        Performs co-embedding of image and PPI data for a single fold
+
+        :param image_coembed_tuple: (fold, image embedding dir, coembedding dir)
+        :type image_coembed_tuple: tuple
+        :return: Exit code 0 if co-embedding is successful or previously completed,
+                 otherwise logs an error and returns non-zero.
+        :rtype: int
+        """
+        if os.path.isdir(image_coembed_tuple[2]):
+            warnings.warn('Found coembedding dir' +
+                          str(image_coembed_tuple[2]) +
+                          ', assuming we are good. skipping')
+            return 0
+        if self._fake:
+            gen = FakeCoEmbeddingGenerator(ppi_embeddingdir=self._ppi_embed_dir,
+                                           image_embeddingdir=image_coembed_tuple[1])
+        else:
+            gen = MuseCoEmbeddingGenerator(outdir=image_coembed_tuple[2],
+                                           ppi_embeddingdir=self._ppi_embed_dir,
+                                           image_embeddingdir=image_coembed_tuple[1])
+        retval = CellmapsCoEmbedder(outdir=image_coembed_tuple[2],
+                                    inputdirs=[image_coembed_tuple[1],
+                                               self._ppi_embed_dir],
+                                    embedding_generator=gen,
+                                    skip_logging=self._skip_logging,
+                                    input_data_dict=self._input_data_dict).run()
+        if retval != 0:
+            logger.error('Coembedding ' + image_coembed_tuple[2] +
+                         'using ' + image_coembed_tuple[1] +
+                         ' had non zero exit code of: ' +
+                         str(retval))
+        return retval
+
     def _embed_image(self):
         """
         Embeds image data using a specified model, typically a Densenet model.
@@ -596,31 +1448,45 @@ class ProgrammaticPipelineRunner(PipelineRunner):
         :rtype: int
         """
         for image_coembed_tuple in self._image_coembed_tuples:
-            if os.path.isdir(image_coembed_tuple[1]):
-                warnings.warn('Found image_embedding dir' +
-                              str(image_coembed_tuple[1]) +
-                              ', assuming we are good. skipping')
-                continue
-            if self._fake is True:
-                gen = FakeEmbeddingGenerator(self._image_dir)
-            else:
-                gen = DensenetEmbeddingGenerator(self._image_dir,
-                                                 outdir=image_coembed_tuple[1],
-                                                 model_path=self._model_path,
-                                                 fold=int(image_coembed_tuple[0]))
-            retval = CellmapsImageEmbedder(outdir=image_coembed_tuple[1],
-                                           inputdir=self._image_dir,
-                                           embedding_generator=gen,
-                                           skip_logging=self._skip_logging,
-                                           input_data_dict=self._input_data_dict).run()
+            retval = self._embed_image_fold(image_coembed_tuple)
             if retval != 0:
-                logger.error('image embedding ' + image_coembed_tuple[1] +
-                             'using fold' + str(image_coembed_tuple[0] +
-                                                ' had non zero exit code of: ' +
-                                                str(retval)))
                 return retval
         return 0
 
+    def _embed_image_fold(self, image_coembed_tuple):
+        """
+        Embeds image data for a single fold
+
+        :param image_coembed_tuple: (fold, image embedding dir, coembedding dir)
+        :type image_coembed_tuple: tuple
+        :return: Exit code 0 if the embedding is successful or already completed,
+                 otherwise it logs an error and returns non-zero.
+        :rtype: int
+        """
+        if os.path.isdir(image_coembed_tuple[1]):
+            warnings.warn('Found image_embedding dir' +
+                          str(image_coembed_tuple[1]) +
+                          ', assuming we are good. skipping')
+            return 0
+        if self._fake is True:
+            gen = FakeEmbeddingGenerator(self._image_dir)
+        else:
+            gen = DensenetEmbeddingGenerator(self._image_dir,
+                                             outdir=image_coembed_tuple[1],
+                                             model_path=self._model_path,
+                                             fold=int(image_coembed_tuple[0]))
+        retval = CellmapsImageEmbedder(outdir=image_coembed_tuple[1],
+                                       inputdir=self._image_dir,
+                                       embedding_generator=gen,
+                                       skip_logging=self._skip_logging,
+                                       input_data_dict=self._input_data_dict).run()
+        if retval != 0:
+            logger.error('image embedding ' + image_coembed_tuple[1] +
+                         'using fold' + str(image_coembed_tuple[0]) +
+                         ' had non zero exit code of: ' +
+                         str(retval))
+        return retval
+
     def _embed_ppi(self):
         """
         Embeds the protein-protein interaction data using the Node2Vec algorithm.
@@ -785,7 +1651,58 @@ class CellmapsPipeline(object):
         try:
             exit_status = self._runner.run()
         finally:
+            end_time = int(time.time())
             logutils.write_task_finish_json(outdir=self._outdir,
                                             start_time=self._start_time,
+                                            end_time=end_time,
                                             status=exit_status)
+            self._write_step_metrics(end_time=end_time, status=exit_status)
         return exit_status
+
+    def _get_task_finish_json_path(self):
+        """
+        Gets path to task finish json file written by
+        :py:func:`cellmaps_utils.logutils.write_task_finish_json`
+
+        :return: path to file
+        :rtype: str
+        """
+        return os.path.join(self._outdir, constants.TASK_FILE_PREFIX +
+                            str(self._start_time) +
+                            constants.TASK_FINISH_FILE_SUFFIX)
+
+    def _write_step_metrics(self, end_time=None, status=None):
+        """
+        Writes metrics of each step, obtained from the runner, to
+        :py:const:`~cellmaps_pipeline.metrics.StepMetricsRecorder.PIPELINE_METRICS_FILE`
+        and adds them, under ``step_metrics``, to the task finish json file.
+        Failures are logged since metrics should never fail the pipeline
+
+        :param end_time: time in seconds since epoch pipeline finished
+        :type end_time: int
+        :param status: exit status of pipeline
+        :type status: int
+        """
+        get_step_metrics = getattr(self._runner, 'get_step_metrics', None)
+        if get_step_metrics is None:
+            return
+        try:
+            step_metrics = get_step_metrics()
+            with open(os.path.join(self._outdir,
+                                   StepMetricsRecorder.PIPELINE_METRICS_FILE), 'w') as f:
+                json.dump({'start_time': self._start_time,
+                           'end_time': end_time,
+                           'elapsed_time': end_time - self._start_time,
+                           'status': status,
+                           'steps': step_metrics}, f, indent=2, default=str)
+
+            finish_json = self._get_task_finish_json_path()
+            if not os.path.isfile(finish_json):
+                return
+            with open(finish_json, 'r') as f:
+                task = json.load(f)
+            task['step_metrics'] = step_metrics
+            with open(finish_json, 'w') as f:
+                json.dump(task, f, indent=2, default=str)
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning('Unable to write step metrics: ' + str(e))
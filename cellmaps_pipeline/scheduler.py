@@ -0,0 +1,168 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
+
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+
+logger = logging.getLogger(__name__)
+
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS',
+                   'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS',
+                   'VECLIB_MAXIMUM_THREADS']
+"""
+Environment variables that cap the number of threads
+used by BLAS, OpenMP and numexpr
+"""
+
+
+def limit_worker_threads(num_threads=None):
+    """
+    Limits the number of threads the current process uses for
+    numerical libraries so several workers can share a node without
+    oversubscribing it. Environment variables in :py:const:`THREAD_ENV_VARS`
+    are set for any child processes, already loaded BLAS/OpenMP libraries are
+    limited via `threadpoolctl <https://github.com/joblib/threadpoolctl>`__
+    if it is installed and `torch <https://pytorch.org>`__ is limited if it
+    has been imported.
+
+    This is intended to be passed as the initializer of worker processes
+
+    :param num_threads: Maximum number of threads. If ``None`` or less than ``1``
+                        no limit is applied
+    :type num_threads: int
+    """
+    if num_threads is None or num_threads < 1:
+        return
+    for env_var in THREAD_ENV_VARS:
+        os.environ[env_var] = str(num_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=num_threads)
+    except ImportError:
+        logger.debug('threadpoolctl not installed, unable to limit '
+                     'threads of already loaded libraries')
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(num_threads)
+
+
+class StepScheduler(object):
+    """
+    Runs the steps of a pipeline in a pool of worker processes. A step
+    is submitted as soon as all the steps it depends on have finished
+    successfully so independent steps run concurrently.
+    """
+
+    def __init__(self, max_workers=None, mp_context=None,
+                 threads_per_worker=None):
+        """
+        Constructor
+
+        :param max_workers: Maximum number of steps to run at the same time.
+                            If ``None`` the number of processors on the machine
+                            is used
+        :type max_workers: int
+        :param mp_context: Multiprocessing context used to start the worker
+                           processes. If ``None`` the default context is used
+        :param threads_per_worker: If set, each worker process limits numerical
+                                   libraries to this many threads via
+                                   :py:func:`limit_worker_threads`
+        :type threads_per_worker: int
+        """
+        self._max_workers = max_workers
+        self._mp_context = mp_context
+        self._threads_per_worker = threads_per_worker
+
+    @staticmethod
+    def _validate_steps(steps):
+        """
+        Verifies every dependency refers to a known step and that
+        the dependencies do not contain a cycle
+
+        :param steps: list of tuples of (step name, list of step names it depends on)
+        :type steps: list
+        :raises CellmapsPipelineError: If a dependency is unknown or a cycle is found
+        """
+        dependencies = {}
+        for step_name, step_deps in steps:
+            if step_name in dependencies:
+                raise CellmapsPipelineError('Step ' + str(step_name) +
+                                            ' is defined more than once')
+            dependencies[step_name] = list(step_deps)
+
+        for step_name, step_deps in dependencies.items():
+            for dep in step_deps:
+                if dep not in dependencies:
+                    raise CellmapsPipelineError('Step ' + str(step_name) +
+                                                ' depends on unknown step ' +
+                                                str(dep))
+        visited = set()
+        remaining = dict(dependencies)
+        while remaining:
+            ready = [name for name, deps in remaining.items()
+                     if all(dep in visited for dep in deps)]
+            if len(ready) == 0:
+                raise CellmapsPipelineError('Cycle found in step dependencies: ' +
+                                            str(sorted(remaining.keys())))
+            for name in ready:
+                visited.add(name)
+                del remaining[name]
+
+    def run(self, steps, step_func):
+        """
+        Runs **step_func** on every step in **steps** honoring the dependencies.
+        Once a step returns a non zero exit code no new steps are started,
+        the steps already running are allowed to finish and the exit codes
+        gathered so far are returned.
+
+        :param steps: list of tuples of (step name, list of step names it depends on).
+                      Steps that are ready at the same time are submitted in the
+                      order they appear in this list
+        :type steps: list
+        :param step_func: Picklable callable invoked in a worker process with
+                          the step name as its only argument. Should return
+                          ``0`` upon success
+        :type step_func: callable
+        :raises CellmapsPipelineError: If the dependencies are invalid
+        :return: step name => exit code for each step that was run
+        :rtype: dict
+        """
+        self._validate_steps(steps)
+        pending = [(name, set(deps)) for name, deps in steps]
+        results = {}
+        running = {}
+        failed = False
+        with ProcessPoolExecutor(max_workers=self._max_workers,
+                                 mp_context=self._mp_context,
+                                 initializer=limit_worker_threads,
+                                 initargs=(self._threads_per_worker,)) as executor:
+            try:
+                while pending or running:
+                    if not failed:
+                        for entry in list(pending):
+                            name, deps = entry
+                            if not deps.issubset(results.keys()):
+                                continue
+                            logger.debug('Submitting step ' + str(name))
+                            running[executor.submit(step_func, name)] = name
+                            pending.remove(entry)
+                    if not running:
+                        break
+                    done, _ = wait(list(running.keys()),
+                                   return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        results[name] = future.result()
+                        logger.debug('Step ' + str(name) + ' finished with exit code: ' +
+                                     str(results[name]))
+                        if results[name] != 0:
+                            failed = True
+            except BaseException:
+                for future in running.keys():
+                    future.cancel()
+                raise
+        return results
@@ -0,0 +1,524 @@
+#! /usr/bin/env python
+
+import os
+import csv
+import shutil
+import logging
+
+from cellmaps_utils import constants
+from cellmaps_imagedownloader.runner import MultiProcessImageDownloader
+from cellmaps_imagedownloader.runner import CellmapsImageDownloader
+from cellmaps_imagedownloader.gene import ImageGeneNodeAttributeGenerator
+from cellmaps_imagedownloader.proteinatlas import ProteinAtlasReader
+from cellmaps_imagedownloader.proteinatlas import ProteinAtlasImageUrlReader
+from cellmaps_imagedownloader.proteinatlas import ImageDownloadTupleGenerator
+from cellmaps_imagedownloader.proteinatlas import LinkPrefixImageDownloadTupleGenerator
+from cellmaps_image_embedding.runner import EmbeddingGenerator
+from cellmaps_image_embedding.runner import CellmapsImageEmbedder
+
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+
+logger = logging.getLogger(__name__)
+
+ANTIBODY_COL = 'antibody'
+"""
+Column of samples and unique files samples are sharded by
+"""
+
+SHARD_PREFIX = 'shard'
+"""
+Prefix of output directory of each shard, followed by shard number
+"""
+
+INPUT_PREFIX = 'input'
+"""
+Prefix of input directory of each image embedding shard, followed by shard number
+"""
+
+
+def get_shard_dir(shards_dir, shard):
+    """
+    Gets output directory of **shard**
+
+    :param shards_dir: Directory holding all shards
+    :type shards_dir: str
+    :param shard: Shard number, starting at ``1`` as in SLURM array task ids,
+                  or ``$SLURM_ARRAY_TASK_ID``
+    :type shard: int or str
+    :return: path
+    :rtype: str
+    """
+    return os.path.join(shards_dir, SHARD_PREFIX + str(shard))
+
+
+def get_shard_input_dir(shards_dir, shard):
+    """
+    Gets input directory of image embedding **shard**
+
+    :param shards_dir: Directory holding all shards
+    :type shards_dir: str
+    :param shard: Shard number, starting at ``1``, or ``$SLURM_ARRAY_TASK_ID``
+    :type shard: int or str
+    :return: path
+    :rtype: str
+    """
+    return os.path.join(shards_dir, INPUT_PREFIX + str(shard))
+
+
+def get_samples_file(shards_dir, shard):
+    """
+    Gets samples file of image download **shard**
+
+    :param shards_dir: Directory holding all shards
+    :type shards_dir: str
+    :param shard: Shard number, starting at ``1``, or ``$SLURM_ARRAY_TASK_ID``
+    :type shard: int or str
+    :return: path
+    :rtype: str
+    """
+    return os.path.join(shards_dir, 'samples' + str(shard) + '.csv')
+
+
+def get_unique_file(shards_dir, shard):
+    """
+    Gets unique file of image download **shard**
+
+    :param shards_dir: Directory holding all shards
+    :type shards_dir: str
+    :param shard: Shard number, starting at ``1``, or ``$SLURM_ARRAY_TASK_ID``
+    :type shard: int or str
+    :return: path
+    :rtype: str
+    """
+    return os.path.join(shards_dir, 'unique' + str(shard) + '.csv')
+
+
+def _read_csv(csvfile):
+    """
+    Reads **csvfile** with header
+
+    :param csvfile: Path to CSV file
+    :type csvfile: str
+    :return: (column names, list of rows as dict)
+    :rtype: tuple
+    """
+    with open(csvfile, 'r', newline='') as f:
+        reader = csv.DictReader(f)
+        return reader.fieldnames, list(reader)
+
+
+def _write_csv(csvfile, fieldnames, rows):
+    """
+    Writes **rows** to **csvfile** with header **fieldnames**
+
+    :param csvfile: Path to CSV file
+    :type csvfile: str
+    :param fieldnames: Column names
+    :type fieldnames: list
+    :param rows: Rows as dict
+    :type rows: list
+    """
+    with open(csvfile, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def split_samples_by_antibody(samples, shards_dir, num_shards, unique=None):
+    """
+    Splits **samples**, and **unique** if set, into at most **num_shards**
+    shards so all samples of an antibody are in the same shard. Antibodies
+    with the most samples are placed first, each into the shard with the
+    fewest samples so far, so shards are about the same size.
+
+    Shards are written to :py:func:`get_samples_file` and
+    :py:func:`get_unique_file` under **shards_dir**, numbered from ``1``
+
+    :param samples: Path to samples CSV file
+    :type samples: str
+    :param shards_dir: Directory to write shards to, created if needed
+    :type shards_dir: str
+    :param num_shards: Maximum number of shards. Fewer are created if
+                       there are fewer antibodies
+    :type num_shards: int
+    :param unique: Path to unique CSV file
+    :type unique: str
+    :raises CellmapsPipelineError: If **num_shards** is less than ``1`` or
+                                   **samples** has no antibody column or samples
+    :return: number of shards written
+    :rtype: int
+    """
+    if num_shards is None or num_shards < 1:
+        raise CellmapsPipelineError('Number of shards must be at least 1: ' + str(num_shards))
+    fieldnames, rows = _read_csv(samples)
+    if fieldnames is None or ANTIBODY_COL not in fieldnames:
+        raise CellmapsPipelineError('No ' + ANTIBODY_COL + ' column in ' + str(samples))
+
+    counts = {}
+    for row in rows:
+        counts[row[ANTIBODY_COL]] = counts.get(row[ANTIBODY_COL], 0) + 1
+    if len(counts) == 0:
+        raise CellmapsPipelineError('No samples in ' + str(samples))
+    num_shards = min(num_shards, len(counts))
+
+    shard_sizes = [0] * num_shards
+    antibody_shard = {}
+    for antibody, count in sorted(counts.items(), key=lambda x: (-x[1], x[0])):
+        shard = shard_sizes.index(min(shard_sizes))
+        antibody_shard[antibody] = shard
+        shard_sizes[shard] += count
+
+    os.makedirs(shards_dir, mode=0o755, exist_ok=True)
+    for shard in range(num_shards):
+        _write_csv(get_samples_file(shards_dir, shard + 1), fieldnames,
+                   [row for row in rows if antibody_shard[row[ANTIBODY_COL]] == shard])
+
+    if unique is not None:
+        unique_fieldnames, unique_rows = _read_csv(unique)
+        if unique_fieldnames is None or ANTIBODY_COL not in unique_fieldnames:
+            raise CellmapsPipelineError('No ' + ANTIBODY_COL + ' column in ' + str(unique))
+        for shard in range(num_shards):
+            _write_csv(get_unique_file(shards_dir, shard + 1), unique_fieldnames,
+                       [row for row in unique_rows
+                        if antibody_shard.get(row[ANTIBODY_COL]) == shard])
+    logger.info('Split ' + str(len(rows)) + ' samples into ' + str(num_shards) +
+                ' shards of sizes ' + str(shard_sizes))
+    return num_shards
+
+
+def _link_or_copy(src, dest):
+    """
+    Hard links **src** to **dest** falling back
+    to copying if hard links are not possible
+
+    :param src: Source file
+    :type src: str
+    :param dest: Destination path
+    :type dest: str
+    """
+    try:
+        os.link(src, dest)
+    except OSError as e:
+        logger.debug('Unable to hard link ' + src + ', copying instead: ' + str(e))
+        shutil.copy2(src, dest)
+
+
+def _get_image_id(image_name):
+    """
+    Gets image id of **image_name**, which is everything up to and
+    including the last ``_``, the form used in the filename column of
+    image gene node attributes file, ie ``1_A1_1_`` for ``1_A1_1_red.jpg``
+
+    :param image_name: Name of image file
+    :type image_name: str
+    :return: image id
+    :rtype: str
+    """
+    return image_name[:image_name.rfind('_') + 1]
+
+
+class ShardImageLinker(object):
+    """
+    Places images already downloaded by image download shards into the
+    merged image download directory. Meant to be passed as ``override_dfunc``
+    to :py:class:`~cellmaps_imagedownloader.runner.MultiProcessImageDownloader`
+    so :py:class:`~cellmaps_imagedownloader.runner.CellmapsImageDownloader`
+    creates the merged directory, with its gene node attributes and RO-Crate,
+    as if it downloaded every image itself
+    """
+
+    def __init__(self, shard_dirs=None):
+        """
+        Constructor
+
+        :param shard_dirs: Output directories of image download shards
+        :type shard_dirs: list
+        :raises CellmapsPipelineError: If **shard_dirs** is ``None``
+        """
+        if shard_dirs is None:
+            raise CellmapsPipelineError('shard_dirs is None')
+        self._image_index = {}
+        for shard_dir in shard_dirs:
+            for color in constants.COLORS:
+                color_dir = os.path.join(shard_dir, color)
+                if not os.path.isdir(color_dir):
+                    continue
+                for entry in os.listdir(color_dir):
+                    self._image_index[(color, entry)] = os.path.join(color_dir, entry)
+
+    def get_num_images(self):
+        """
+        Gets number of images found in shards
+
+        :return: number of images
+        :rtype: int
+        """
+        return len(self._image_index)
+
+    def link_image(self, downloadtuple):
+        """
+        Places image with the name and color of the destination
+        in **downloadtuple** from the shards at that destination
+
+        :param downloadtuple: (download link, dest file path)
+        :type downloadtuple: tuple
+        :return: ``None`` upon success otherwise (404, error message, **downloadtuple**)
+                 as returned by :py:func:`~cellmaps_imagedownloader.runner.download_file`
+        :rtype: tuple
+        """
+        dest = downloadtuple[1]
+        key = (os.path.basename(os.path.dirname(dest)), os.path.basename(dest))
+        src = self._image_index.get(key)
+        if src is None:
+            return 404, 'Image not found in any shard', downloadtuple
+        if os.path.isfile(dest) and os.path.getsize(dest) > 0:
+            return None
+        try:
+            _link_or_copy(src, dest)
+        except OSError as e:
+            return 500, str(e), downloadtuple
+        return None
+
+
+def get_image_ids_for_shard(image_dir, fold, shard, num_shards):
+    """
+    Gets ids of the images, listed in the image gene node attributes file
+    of **fold**, that image embedding **shard** of **num_shards** embeds.
+    Only the first image of each gene is listed since that is the only one
+    image embedding keeps. Ids are sorted and dealt out to shards in turn
+
+    :param image_dir: Image download directory
+    :type image_dir: str
+    :param fold: Fold of image gene node attributes file
+    :type fold: int
+    :param shard: Shard number starting at ``1``
+    :type shard: int
+    :param num_shards: Number of shards
+    :type num_shards: int
+    :raises CellmapsPipelineError: If **shard** is not between ``1`` and **num_shards**
+    :return: image ids as in filename column of image gene node attributes file
+    :rtype: set
+    """
+    if shard < 1 or shard > num_shards:
+        raise CellmapsPipelineError('Shard ' + str(shard) + ' must be between 1 and ' +
+                                    str(num_shards))
+    attrs_file = os.path.join(image_dir, str(fold) + '_' + constants.IMAGE_GENE_NODE_ATTR_FILE)
+    image_ids = set()
+    with open(attrs_file, 'r', newline='') as f:
+        for row in csv.DictReader(f, delimiter='\t'):
+            image_ids.add(row[constants.IMAGE_GENE_NODE_FILENAME_COL].split(',')[0])
+    return set(sorted(image_ids)[shard - 1::num_shards])
+
+
+def create_image_embedding_shard_input(image_dir, input_dir, fold, shard, num_shards):
+    """
+    Creates **input_dir** for image embedding **shard**, holding links to
+    the images from :py:func:`get_image_ids_for_shard` along with the image
+    gene node attributes file of **fold** and RO-Crate metadata of
+    **image_dir**, so it can be passed as input directory to image
+    embedding. Any existing **input_dir** is replaced
+
+    :param image_dir: Image download directory
+    :type image_dir: str
+    :param input_dir: Input directory of shard to create
+    :type input_dir: str
+    :param fold: Fold of image gene node attributes file
+    :type fold: int
+    :param shard: Shard number starting at ``1``
+    :type shard: int
+    :param num_shards: Number of shards
+    :type num_shards: int
+    :return: number of images linked per color
+    :rtype: int
+    """
+    image_ids = get_image_ids_for_shard(image_dir, fold, shard, num_shards)
+    if os.path.isdir(input_dir):
+        shutil.rmtree(input_dir)
+    os.makedirs(input_dir, mode=0o755)
+    for filename in [str(fold) + '_' + constants.IMAGE_GENE_NODE_ATTR_FILE,
+                     constants.RO_CRATE_METADATA_FILE]:
+        src = os.path.join(image_dir, filename)
+        if os.path.isfile(src):
+            shutil.copy2(src, os.path.join(input_dir, filename))
+
+    num_linked = 0
+    for color in constants.COLORS:
+        color_dir = os.path.join(image_dir, color)
+        os.makedirs(os.path.join(input_dir, color), mode=0o755)
+        if not os.path.isdir(color_dir):
+            continue
+        for entry in os.listdir(color_dir):
+            if _get_image_id(entry) in image_ids:
+                _link_or_copy(os.path.join(color_dir, entry),
+                              os.path.join(input_dir, color, entry))
+                if color == constants.RED:
+                    num_linked += 1
+    logger.info('Linked ' + str(num_linked) + ' images into ' + input_dir)
+    return num_linked
+
+
+class ShardEmbeddingGenerator(EmbeddingGenerator):
+    """
+    Yields the rows of the image embedding and label probability files
+    written by each image embedding shard, in shard order, so
+    :py:class:`~cellmaps_image_embedding.runner.CellmapsImageEmbedder`
+    writes the merged image embedding directory, with its RO-Crate, as
+    if it computed every embedding itself
+    """
+
+    def __init__(self, shard_dirs=None, fold=EmbeddingGenerator.DEFAULT_FOLD):
+        """
+        Constructor
+
+        :param shard_dirs: Output directories of image embedding shards
+        :type shard_dirs: list
+        :param fold: Fold embedded by shards
+        :type fold: int
+        :raises CellmapsPipelineError: If **shard_dirs** is ``None`` or empty
+        """
+        if shard_dirs is None or len(shard_dirs) == 0:
+            raise CellmapsPipelineError('shard_dirs is None or empty')
+        with open(os.path.join(shard_dirs[0], constants.IMAGE_EMBEDDING_FILE), 'r', newline='') as f:
+            header = next(csv.reader(f, delimiter='\t'))
+        super().__init__(dimensions=len(header) - 1, fold=fold)
+        self._shard_dirs = shard_dirs
+
+    def get_next_embedding(self):
+        """
+        Generator of rows of embedding and label probability
+        files of each shard, skipping their headers
+
+        :raises CellmapsPipelineError: If files of a shard differ in number of rows
+        :return: (embedding row, label probability row)
+        :rtype: tuple
+        """
+        for shard_dir in self._shard_dirs:
+            with open(os.path.join(shard_dir, constants.IMAGE_EMBEDDING_FILE), 'r', newline='') as f:
+                with open(os.path.join(shard_dir, constants.IMAGE_LABELS_PROBABILITY_FILE),
+                          'r', newline='') as pf:
+                    reader = csv.reader(f, delimiter='\t')
+                    prob_reader = csv.reader(pf, delimiter='\t')
+                    next(reader, None)
+                    next(prob_reader, None)
+                    for row in reader:
+                        prob_row = next(prob_reader, None)
+                        if prob_row is None:
+                            raise CellmapsPipelineError('Fewer label probability rows than '
+                                                        'embedding rows in ' + shard_dir)
+                        yield row, prob_row
+
+
+def _get_proteinatlasxml(shard_dirs, proteinatlasxml=None):
+    """
+    Gets proteinatlas xml to read image URLs from. If **proteinatlasxml**
+    is ``None``, the copy downloaded by the first image download shard,
+    if any, is used so it is not downloaded again
+
+    :param shard_dirs: Output directories of image download shards
+    :type shard_dirs: list
+    :param proteinatlasxml: URL or path to proteinatlas xml
+    :type proteinatlasxml: str
+    :return: URL or path to proteinatlas xml, ``None`` for default URL
+    :rtype: str
+    """
+    if proteinatlasxml is not None:
+        return proteinatlasxml
+    local_file = os.path.join(shard_dirs[0],
+                              ProteinAtlasReader.DEFAULT_PROTEINATLAS_URL.split('/')[-1])
+    if os.path.isfile(local_file):
+        return local_file
+    return None
+
+
+def merge_image_download_shards(image_dir, shard_dirs, samples, unique=None,
+                                provenance=None, proteinatlasxml=None,
+                                skip_logging=True, input_data_dict=None):
+    """
+    Creates image download directory **image_dir** from the output
+    directories of image download shards. Image download is rerun on the
+    full **samples** and **unique** lists with images placed, instead of
+    downloaded, from the shards via :py:class:`ShardImageLinker` so the
+    gene node attributes of each fold, which pick images across all
+    samples of a gene, and the RO-Crate match those of an unsharded run
+
+    :param image_dir: Image download directory to create
+    :type image_dir: str
+    :param shard_dirs: Output directories of image download shards
+    :type shard_dirs: list
+    :param samples: Path to samples CSV file
+    :type samples: str
+    :param unique: Path to unique CSV file
+    :type unique: str
+    :param provenance: Provenance as passed to image download
+    :type provenance: dict
+    :param proteinatlasxml: URL or path to proteinatlas xml used to get image
+                            URLs. If ``None``, copy downloaded by a shard is used
+    :type proteinatlasxml: str
+    :param skip_logging: If ``True`` skip logging to image download directory
+    :type skip_logging: bool
+    :param input_data_dict: Parameters to record in RO-Crate
+    :type input_data_dict: dict
+    :raises CellmapsPipelineError: If **shard_dirs** is ``None`` or empty
+    :return: exit code of :py:meth:`~cellmaps_imagedownloader.runner.CellmapsImageDownloader.run`
+    :rtype: int
+    """
+    if shard_dirs is None or len(shard_dirs) == 0:
+        raise CellmapsPipelineError('shard_dirs is None or empty')
+    linker = ShardImageLinker(shard_dirs=shard_dirs)
+    logger.info('Found ' + str(linker.get_num_images()) + ' images in ' +
+                str(len(shard_dirs)) + ' shards')
+
+    samples_list = ImageGeneNodeAttributeGenerator.get_samples_from_csvfile(samples)
+    unique_list = None
+    if unique is not None:
+        unique_list = ImageGeneNodeAttributeGenerator.get_unique_list_from_csvfile(unique)
+    imagegen = ImageGeneNodeAttributeGenerator(unique_list=unique_list,
+                                               samples_list=samples_list)
+    if 'linkprefix' in imagegen.get_samples_list()[0]:
+        imageurlgen = LinkPrefixImageDownloadTupleGenerator(samples_list=imagegen.get_samples_list())
+    else:
+        proteinatlas_reader = ProteinAtlasReader(shard_dirs[0],
+                                                 proteinatlas=_get_proteinatlasxml(shard_dirs,
+                                                                                   proteinatlasxml))
+        imageurlgen = ImageDownloadTupleGenerator(reader=ProteinAtlasImageUrlReader(reader=proteinatlas_reader),
+                                                  samples_list=imagegen.get_samples_list())
+
+    dloader = MultiProcessImageDownloader(poolsize=1, override_dfunc=linker.link_image)
+    return CellmapsImageDownloader(outdir=image_dir,
+                                   imagedownloader=dloader,
+                                   imagegen=imagegen,
+                                   imageurlgen=imageurlgen,
+                                   provenance=provenance,
+                                   skip_logging=skip_logging,
+                                   input_data_dict=input_data_dict).run()
+
+
+def merge_image_embedding_shards(embed_dir, image_dir, shard_dirs, fold=1,
+                                 skip_logging=True, input_data_dict=None):
+    """
+    Creates image embedding directory **embed_dir** of **fold** from
+    the output directories of image embedding shards by running image
+    embedding on **image_dir** with :py:class:`ShardEmbeddingGenerator`
+    so the RO-Crate matches that of an unsharded run
+
+    :param embed_dir: Image embedding directory to create
+    :type embed_dir: str
+    :param image_dir: Image download directory shards embedded images of
+    :type image_dir: str
+    :param shard_dirs: Output directories of image embedding shards
+    :type shard_dirs: list
+    :param fold: Fold embedded by shards
+    :type fold: int
+    :param skip_logging: If ``True`` skip logging to image embedding directory
+    :type skip_logging: bool
+    :param input_data_dict: Parameters to record in RO-Crate
+    :type input_data_dict: dict
+    :return: exit code of :py:meth:`~cellmaps_image_embedding.runner.CellmapsImageEmbedder.run`
+    :rtype: int
+    """
+    gen = ShardEmbeddingGenerator(shard_dirs=shard_dirs, fold=fold)
+    return CellmapsImageEmbedder(outdir=embed_dir,
+                                 inputdir=image_dir,
+                                 embedding_generator=gen,
+                                 skip_logging=skip_logging,
+                                 input_data_dict=input_data_dict).run()
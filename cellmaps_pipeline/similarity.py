@@ -0,0 +1,605 @@
+#! /usr/bin/env python
+
+import logging
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy.linalg.blas import get_blas_funcs
+from scipy.spatial.distance import cdist
+from scipy.stats import rankdata
+from sklearn.preprocessing import normalize
+from sklearn.metrics.pairwise import euclidean_distances
+
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+from cellmaps_pipeline import topk
+from cellmaps_pipeline.topk import TopKEdgeSelector
+
+logger = logging.getLogger(__name__)
+
+KENDALL_CHUNK_ELEMENTS = 16777216
+"""
+Approximate number of elements of the sign matrix, of every pair
+of columns, built at a time by :py:func:`get_kendall_tau`
+"""
+
+
+class BlockedSimilarity(object):
+    """
+    Base class for computing similarity between rows of an embedding one
+    tile of rows at a time, so the full similarity matrix is never held
+    in memory.
+
+    Tiles hold unscaled scores where higher means more similar. Scores
+    are scaled into ``[0, 1]`` via :py:meth:`scale` with the global
+    minimum and maximum, including the diagonal, which gives the same
+    values as the scaled similarities in :py:mod:`cellmaps_utils.music_utils`
+    since that scaling is a linear map of these scores.
+    """
+
+    def __init__(self, embedding):
+        """
+        Constructor
+
+        :param embedding: Embedding with a row per gene. Values that are
+                          ``float32`` are kept as is, for faster tiles,
+                          otherwise they are converted to ``float64``
+        :type embedding: :py:class:`numpy.ndarray` or :py:class:`pandas.DataFrame`
+        """
+        self._values = np.asarray(embedding)
+        if self._values.dtype != np.float32:
+            self._values = self._values.astype(float, copy=False)
+
+    def get_num_rows(self):
+        """
+        Gets number of rows, or genes, in embedding
+
+        :return: number of rows
+        :rtype: int
+        """
+        return self._values.shape[0]
+
+    def get_num_valid_rows(self):
+        """
+        Gets number of rows whose similarity to other rows is defined.
+        Pairs involving any other row are ``NaN``
+
+        :return: number of rows
+        :rtype: int
+        """
+        return self.get_num_rows()
+
+    def get_tile(self, start, end):
+        """
+        Gets scores of rows **start** up to, but not including,
+        **end** against every row. Subclasses must implement this
+
+        :param start: First row of tile
+        :type start: int
+        :param end: Row after last row of tile
+        :type end: int
+        :raises NotImplementedError: Always
+        :return: tile of shape (**end** - **start**, number of rows)
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        raise NotImplementedError('subclasses need to implement')
+
+    @staticmethod
+    def scale(scores, min_score, max_score):
+        """
+        Scales **scores** into ``[0, 1]``
+
+        :param scores: Scores to scale
+        :type scores: :py:class:`numpy.ndarray`
+        :param min_score: Minimum score across all tiles
+        :type min_score: float
+        :param max_score: Maximum score across all tiles
+        :type max_score: float
+        :return: scaled scores
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        return (scores - min_score) / (max_score - min_score)
+
+
+class CosineBlockedSimilarity(BlockedSimilarity):
+    """
+    Cosine similarity, matches
+    :py:func:`cellmaps_utils.music_utils.cosine_similarity_scaled`
+    """
+
+    def __init__(self, embedding):
+        """
+        Constructor
+
+        :param embedding: Embedding with a row per gene
+        :type embedding: :py:class:`numpy.ndarray` or :py:class:`pandas.DataFrame`
+        """
+        super().__init__(embedding)
+        self._normalized = normalize(self._values, copy=True)
+
+    def get_tile(self, start, end):
+        """
+        Gets cosine similarity of rows **start** to **end** against every row
+
+        :param start: First row of tile
+        :type start: int
+        :param end: Row after last row of tile
+        :type end: int
+        :return: tile of shape (**end** - **start**, number of rows)
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        return self._normalized[start:end] @ self._normalized.T
+
+
+class EuclideanBlockedSimilarity(BlockedSimilarity):
+    """
+    Negated euclidean distance, matches
+    :py:func:`cellmaps_utils.music_utils.euclidean_similarity`
+    once scaled
+    """
+
+    def __init__(self, embedding):
+        """
+        Constructor
+
+        :param embedding: Embedding with a row per gene
+        :type embedding: :py:class:`numpy.ndarray` or :py:class:`pandas.DataFrame`
+        """
+        super().__init__(embedding)
+        self._norm_squared = np.einsum('ij,ij->i', self._values, self._values)
+
+    def get_tile(self, start, end):
+        """
+        Gets negated euclidean distance of rows **start** to **end**
+        against every row. Distance of a row to itself is set to ``0``
+
+        :param start: First row of tile
+        :type start: int
+        :param end: Row after last row of tile
+        :type end: int
+        :return: tile of shape (**end** - **start**, number of rows)
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        dist = euclidean_distances(self._values[start:end], self._values,
+                                   X_norm_squared=self._norm_squared[start:end].reshape(-1, 1),
+                                   Y_norm_squared=self._norm_squared.reshape(1, -1))
+        diag = np.arange(end - start)
+        dist[diag, diag + start] = 0.0
+        return np.negative(dist, out=dist)
+
+
+class DistanceBlockedSimilarity(BlockedSimilarity):
+    """
+    Base class for negated distances computed via
+    :py:func:`scipy.spatial.distance.cdist` with metric :py:attr:`METRIC`.
+    Each tile is split by rows across **workers** threads, which run at
+    the same time since ``cdist`` releases the GIL, and every pair
+    is computed in place so no (rows, rows, dimensions) array of
+    differences is ever built. Subclasses set :py:attr:`METRIC`
+    """
+
+    METRIC = None
+
+    def __init__(self, embedding, workers=None):
+        """
+        Constructor
+
+        :param embedding: Embedding with a row per gene. Values are
+                          converted to ``float64`` once, which ``cdist``
+                          would otherwise do for every tile
+        :type embedding: :py:class:`numpy.ndarray` or :py:class:`pandas.DataFrame`
+        :param workers: Number of threads per tile, if ``None``
+                        :py:func:`multiprocessing.cpu_count` is used
+        :type workers: int
+        """
+        super().__init__(embedding)
+        self._values = np.ascontiguousarray(self._values, dtype=float)
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self._workers = max(1, workers)
+
+    def get_tile(self, start, end):
+        """
+        Gets negated distance of rows **start** to **end** against every row
+
+        :param start: First row of tile
+        :type start: int
+        :param end: Row after last row of tile
+        :type end: int
+        :return: tile of shape (**end** - **start**, number of rows)
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        tile = np.empty((end - start, self.get_num_rows()), dtype=float)
+        part_rows = -(-(end - start) // self._workers)
+        parts = [(part_start, min(part_start + part_rows, end))
+                 for part_start in range(start, end, part_rows)]
+
+        def _compute_part(part):
+            cdist(self._values[part[0]:part[1]], self._values, metric=self.METRIC,
+                  out=tile[part[0] - start:part[1] - start])
+
+        if len(parts) == 1:
+            _compute_part(parts[0])
+        else:
+            with ThreadPoolExecutor(max_workers=len(parts)) as executor:
+                list(executor.map(_compute_part, parts))
+        return np.negative(tile, out=tile)
+
+
+class ManhattanBlockedSimilarity(DistanceBlockedSimilarity):
+    """
+    Negated manhattan distance, matches
+    :py:func:`cellmaps_utils.music_utils.manhattan_similarity`
+    once scaled
+    """
+
+    METRIC = 'cityblock'
+
+
+class CanberraBlockedSimilarity(DistanceBlockedSimilarity):
+    """
+    Negated canberra distance, matches
+    :py:func:`cellmaps_utils.music_utils.canberra_similarity`
+    once scaled
+    """
+
+    METRIC = 'canberra'
+
+
+class PearsonBlockedSimilarity(BlockedSimilarity):
+    """
+    Pearson correlation, matches
+    :py:func:`cellmaps_utils.music_utils.pearson_scaled`.
+    Rows with no variance have ``NaN`` correlation to every row
+    """
+
+    def __init__(self, embedding):
+        """
+        Constructor
+
+        :param embedding: Embedding with a row per gene
+        :type embedding: :py:class:`numpy.ndarray` or :py:class:`pandas.DataFrame`
+        """
+        super().__init__(embedding)
+        centered = self._values - self._values.mean(axis=1, keepdims=True)
+        norms = np.sqrt(np.einsum('ij,ij->i', centered, centered))
+        self._valid = norms > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self._normalized = centered / norms[:, np.newaxis]
+        self._normalized[~self._valid] = np.nan
+
+    def get_num_valid_rows(self):
+        """
+        Gets number of rows with variance
+
+        :return: number of rows
+        :rtype: int
+        """
+        return int(np.count_nonzero(self._valid))
+
+    def get_tile(self, start, end):
+        """
+        Gets pearson correlation of rows **start** to **end** against every row
+
+        :param start: First row of tile
+        :type start: int
+        :param end: Row after last row of tile
+        :type end: int
+        :return: tile of shape (**end** - **start**, number of rows)
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        return self._normalized[start:end] @ self._normalized.T
+
+
+class SpearmanBlockedSimilarity(PearsonBlockedSimilarity):
+    """
+    Spearman correlation, matches
+    :py:func:`cellmaps_utils.music_utils.spearman_scaled`. Computed as the
+    Pearson correlation of the ranks of the values of each row, with ties
+    given their average rank, so each tile is a single matrix product.
+    Rows with no variance have ``NaN`` correlation to every row
+    """
+
+    def __init__(self, embedding):
+        """
+        Constructor
+
+        :param embedding: Embedding with a row per gene
+        :type embedding: :py:class:`numpy.ndarray` or :py:class:`pandas.DataFrame`
+        """
+        values = np.asarray(embedding)
+        ranks = rankdata(values, axis=1)
+        if values.dtype == np.float32:
+            ranks = ranks.astype(np.float32)
+        super().__init__(ranks)
+
+
+class PrecomputedBlockedSimilarity(BlockedSimilarity):
+    """
+    Serves tiles of an already computed square similarity matrix, passed
+    as embedding, such as one from :py:mod:`cellmaps_utils.music_utils`, so similarities
+    without a blocked implementation can be used where a
+    :py:class:`BlockedSimilarity` is expected
+    """
+
+    def get_num_valid_rows(self):
+        """
+        Gets number of rows that are not all ``NaN``
+
+        :return: number of rows
+        :rtype: int
+        """
+        return int(np.count_nonzero(~np.isnan(self._values).all(axis=1)))
+
+    def get_tile(self, start, end):
+        """
+        Gets rows **start** to **end** of similarity matrix
+
+        :param start: First row of tile
+        :type start: int
+        :param end: Row after last row of tile
+        :type end: int
+        :return: tile of shape (**end** - **start**, number of rows)
+        :rtype: :py:class:`numpy.ndarray`
+        """
+        return self._values[start:end]
+
+
+def get_kendall_tau(embedding, chunk_elements=KENDALL_CHUNK_ELEMENTS):
+    """
+    Gets Kendall tau-b correlation between every pair of rows of **embedding**,
+    the same as :py:func:`scipy.stats.kendalltau`, without comparing each
+    pair of rows separately.
+
+    Each row is turned into the signs of the differences between every pair
+    of its values. The number of concordant minus discordant pairs of two rows
+    is the dot product of their sign vectors and the number of pairs not tied
+    within a row is the dot product of its sign vector with itself, so tau-b
+    is the cosine similarity of sign vectors. The products of all rows are
+    accumulated with a symmetric rank k update, ``syrk``, of
+    :py:mod:`scipy.linalg.blas`, which uses every core BLAS is allowed to,
+    a chunk of about **chunk_elements** signs at a time so the sign vectors,
+    which have an entry per pair of columns, are never held in memory at once.
+
+    Sums are ``float32``, which is exact, when there are fewer than
+    ``2 ** 24`` pairs of columns, otherwise ``float64``
+
+    :param embedding: Embedding with a row per gene
+    :type embedding: :py:class:`numpy.ndarray` or :py:class:`pandas.DataFrame`
+    :param chunk_elements: Approximate number of signs computed at a time
+    :type chunk_elements: int
+    :return: square matrix of tau-b, ``NaN`` for rows with no variance
+    :rtype: :py:class:`numpy.ndarray`
+    """
+    values = np.asarray(embedding, dtype=float)
+    num_rows, num_cols = values.shape
+    col_a, col_b = np.triu_indices(num_cols, k=1)
+    dtype = np.float32 if len(col_a) < 2 ** 24 else np.float64
+    columns = np.ascontiguousarray(values.T)
+    syrk = get_blas_funcs('syrk', dtype=dtype)
+    gram = np.zeros((num_rows, num_rows), dtype=dtype, order='F')
+    chunk = max(1, int(chunk_elements) // max(1, num_rows))
+    for start in range(0, len(col_a), chunk):
+        # pairs by genes so transpose is genes by pairs in fortran order,
+        # as syrk expects, without a copy
+        signs = np.sign(columns[col_a[start:start + chunk]] -
+                        columns[col_b[start:start + chunk]]).astype(dtype, copy=False)
+        gram = syrk(1.0, signs.T, beta=1.0, c=gram, overwrite_c=1)
+
+    # syrk only fills upper triangle
+    gram = np.triu(gram) + np.triu(gram, k=1).T
+    untied = np.sqrt(np.diagonal(gram).astype(float))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tau = gram / untied[:, np.newaxis] / untied[np.newaxis, :]
+    tau[untied == 0] = np.nan
+    tau[:, untied == 0] = np.nan
+    return tau
+
+
+class KendallBlockedSimilarity(PrecomputedBlockedSimilarity):
+    """
+    Kendall tau-b correlation, matches
+    :py:func:`cellmaps_utils.music_utils.kendall_scaled`. The full
+    correlation matrix is computed up front via :py:func:`get_kendall_tau`
+    and then served a tile at a time, so memory is proportional to the
+    square of the number of rows. Rows with no variance have ``NaN``
+    correlation to every row
+    """
+
+    def __init__(self, embedding):
+        """
+        Constructor
+
+        :param embedding: Embedding with a row per gene
+        :type embedding: :py:class:`numpy.ndarray` or :py:class:`pandas.DataFrame`
+        """
+        super().__init__(get_kendall_tau(embedding))
+
+
+BLOCKED_SIMILARITIES = {'cosine': CosineBlockedSimilarity,
+                        'euclidean': EuclideanBlockedSimilarity,
+                        'pearson': PearsonBlockedSimilarity,
+                        'manhattan': ManhattanBlockedSimilarity,
+                        'canberra': CanberraBlockedSimilarity,
+                        'spearman': SpearmanBlockedSimilarity,
+                        'kendall': KendallBlockedSimilarity}
+"""
+Similarity algorithm name => :py:class:`BlockedSimilarity` subclass
+"""
+
+
+def get_blocked_similarity(embedding, algorithm='cosine'):
+    """
+    Gets :py:class:`BlockedSimilarity` for **algorithm**
+
+    :param embedding: Embedding with a row per gene
+    :type embedding: :py:class:`numpy.ndarray` or :py:class:`pandas.DataFrame`
+    :param algorithm: Name of similarity algorithm, case insensitive
+    :type algorithm: str
+    :raises CellmapsPipelineError: If **algorithm** does not support blocked computation
+    :return: similarity
+    :rtype: :py:class:`BlockedSimilarity`
+    """
+    if algorithm is None or algorithm.lower() not in BLOCKED_SIMILARITIES:
+        raise CellmapsPipelineError('Blocked similarity not supported for: ' +
+                                    str(algorithm) + ' supported: ' +
+                                    str(sorted(BLOCKED_SIMILARITIES.keys())))
+    return BLOCKED_SIMILARITIES[algorithm.lower()](embedding)
+
+
+def get_top_edges_blocked_by_cutoff(similarity, cutoffs, block_rows=None):
+    """
+    Gets the top **cutoff** fraction, rounded up, of gene pairs ranked by
+    **similarity** for each of **cutoffs**, computing the similarity a tile
+    of rows at a time and keeping only the best pairs, for the largest
+    cutoff, seen so far in a :py:class:`~cellmaps_pipeline.topk.TopKEdgeSelector`.
+    Results for the other cutoffs are taken from those via
+    :py:func:`~cellmaps_pipeline.topk.split_by_cutoff_sizes`
+
+    :param similarity: Similarity to compute
+    :type similarity: :py:class:`BlockedSimilarity`
+    :param cutoffs: Fractions of pairs to keep, ``0.1`` means top ten percent
+    :type cutoffs: list
+    :param block_rows: Number of rows per tile. If ``None`` this is set so
+                       each tile has about
+                       :py:const:`~cellmaps_pipeline.topk.BLOCK_ELEMENTS` values
+    :type block_rows: int
+    :return: list of (row indices, column indices, scaled weights) as
+             :py:class:`numpy.ndarray` sorted by descending weight for
+             each of **cutoffs**
+    :rtype: list
+    """
+    num_rows = similarity.get_num_rows()
+    if block_rows is None:
+        block_rows = topk.get_block_rows(num_rows)
+    num_valid = similarity.get_num_valid_rows()
+    sizes = topk.get_cutoff_sizes(cutoffs, num_valid * (num_valid - 1) // 2)
+    selector = TopKEdgeSelector(max(sizes, default=0))
+    min_score = None
+    max_score = None
+    for start in range(0, num_rows, block_rows):
+        end = min(start + block_rows, num_rows)
+        tile = similarity.get_tile(start, end)
+        if num_valid < num_rows and np.isnan(tile).all():
+            continue
+        tile_min = np.nanmin(tile)
+        tile_max = np.nanmax(tile)
+        min_score = tile_min if min_score is None else min(min_score, tile_min)
+        max_score = tile_max if max_score is None else max(max_score, tile_max)
+        selector.add(*topk.get_upper_triangle_edges(tile, row_offset=start,
+                                                    min_weight=selector.get_threshold()))
+
+    rows, cols, scores = selector.get_edges()
+    if min_score is None or max_score == min_score:
+        # scaling would make every value NaN
+        empty = np.empty(0, dtype=np.int64)
+        return [(empty, empty, np.empty(0, dtype=float)) for _ in sizes]
+    return topk.split_by_cutoff_sizes(rows, cols,
+                                      BlockedSimilarity.scale(scores, min_score, max_score),
+                                      sizes)
+
+
+def get_top_edges_blocked(similarity, cutoff, block_rows=None):
+    """
+    Gets the top **cutoff** fraction, rounded up, of gene pairs ranked by
+    **similarity** via :py:func:`get_top_edges_blocked_by_cutoff`
+
+    :param similarity: Similarity to compute
+    :type similarity: :py:class:`BlockedSimilarity`
+    :param cutoff: Fraction of pairs to keep, ``0.1`` means top ten percent
+    :type cutoff: float
+    :param block_rows: Number of rows per tile. If ``None`` this is set so
+                       each tile has about
+                       :py:const:`~cellmaps_pipeline.topk.BLOCK_ELEMENTS` values
+    :type block_rows: int
+    :return: (row indices, column indices, scaled weights) as :py:class:`numpy.ndarray`
+             sorted by descending weight
+    :rtype: tuple
+    """
+    return get_top_edges_blocked_by_cutoff(similarity, [cutoff], block_rows=block_rows)[0]
+
+
+def get_similarity_matrix(similarity, block_rows=None):
+    """
+    Gets full scaled similarity matrix of **similarity**, filled a tile
+    of rows at a time, for callers that need every pair
+
+    :param similarity: Similarity to compute
+    :type similarity: :py:class:`BlockedSimilarity`
+    :param block_rows: Number of rows per tile. If ``None`` this is set so
+                       each tile has about
+                       :py:const:`~cellmaps_pipeline.topk.BLOCK_ELEMENTS` values
+    :type block_rows: int
+    :return: square matrix of similarities scaled into ``[0, 1]``
+    :rtype: :py:class:`numpy.ndarray`
+    """
+    num_rows = similarity.get_num_rows()
+    if block_rows is None:
+        block_rows = topk.get_block_rows(num_rows)
+    sim_mat = None
+    for start in range(0, num_rows, block_rows):
+        end = min(start + block_rows, num_rows)
+        tile = similarity.get_tile(start, end)
+        if sim_mat is None:
+            sim_mat = np.empty((num_rows, num_rows), dtype=tile.dtype)
+        sim_mat[start:end] = tile
+    if sim_mat is None:
+        return np.empty((0, 0), dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return BlockedSimilarity.scale(sim_mat, np.nanmin(sim_mat), np.nanmax(sim_mat))
+
+
+def get_knn_edges_blocked(similarity, k, block_rows=None):
+    """
+    Gets edges between each gene and its **k** most similar genes, by
+    **similarity**, computing the similarity a tile of rows at a time and
+    keeping only the top **k** entries of each row via
+    :py:func:`~cellmaps_pipeline.topk.get_row_top_edges`, so memory is
+    proportional to the number of genes times **k** plus one tile.
+
+    A pair of genes is connected if either is among the **k** nearest
+    neighbors of the other, so every gene with a defined similarity has
+    at least one edge. Search is exact and ties are cut in gene order
+
+    :param similarity: Similarity to compute
+    :type similarity: :py:class:`BlockedSimilarity`
+    :param k: Number of neighbors per gene
+    :type k: int
+    :param block_rows: Number of rows per tile. If ``None`` this is set so
+                       each tile has about
+                       :py:const:`~cellmaps_pipeline.topk.BLOCK_ELEMENTS` values
+    :type block_rows: int
+    :return: (row indices, column indices, scaled weights) as :py:class:`numpy.ndarray`
+             sorted by descending weight
+    :rtype: tuple
+    """
+    num_rows = similarity.get_num_rows()
+    if block_rows is None:
+        block_rows = topk.get_block_rows(num_rows)
+    num_valid = similarity.get_num_valid_rows()
+    min_score = None
+    max_score = None
+    rows = []
+    cols = []
+    scores = []
+    for start in range(0, num_rows, block_rows):
+        end = min(start + block_rows, num_rows)
+        tile = similarity.get_tile(start, end)
+        if num_valid < num_rows and np.isnan(tile).all():
+            continue
+        tile_min = np.nanmin(tile)
+        tile_max = np.nanmax(tile)
+        min_score = tile_min if min_score is None else min(min_score, tile_min)
+        max_score = tile_max if max_score is None else max(max_score, tile_max)
+        tile_rows, tile_cols, tile_scores = topk.get_row_top_edges(tile, k, row_offset=start)
+        rows.append(tile_rows)
+        cols.append(tile_cols)
+        scores.append(tile_scores)
+
+    if min_score is None or max_score == min_score:
+        # scaling would make every value NaN
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=float)
+    rows, cols, scores = topk.get_undirected_edges(np.concatenate(rows), np.concatenate(cols),
+                                                   np.concatenate(scores))
+    return rows, cols, BlockedSimilarity.scale(scores, min_score, max_score)
@@ -0,0 +1,240 @@
+#! /usr/bin/env python
+
+import re
+import json
+import logging
+
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+
+logger = logging.getLogger(__name__)
+
+
+class SLURMResourceProfiles(object):
+    """
+    Resources requested, via ``#SBATCH`` directives, by the SLURM job of
+    each pipeline step so small jobs, such as PPI download, can be packed
+    tightly while embedding jobs get the cores and memory they need.
+
+    Profiles are a dict of step name => dict of resource => value, where
+    resources are those in :py:const:`RESOURCES`. Resources of a step are
+    looked up in the profile of the step itself, such as
+    ``image_embedding_fold1``, then, for fold steps, in the profile of all
+    folds, such as ``image_embedding``, and finally in the ``default``
+    profile, which falls back to :py:const:`DEFAULT_RESOURCES`.
+
+    Example profiles as loaded via :py:meth:`from_file`:
+
+    .. code-block:: json
+
+        {
+          "default": {"cpus_per_task": 2, "mem": "8G", "time": "1:00:00"},
+          "image_download": {"time": "12:00:00"},
+          "image_embedding": {"cpus_per_task": 16, "mem": "64G",
+                              "time": "24:00:00", "partition": "cpu"}
+        }
+    """
+
+    DEFAULT_PROFILE = 'default'
+
+    IMAGE_DOWNLOAD_MERGE_STEP = 'image_download_merge'
+    """
+    Job merging image download shards, when image download is sharded
+    """
+
+    IMAGE_EMBEDDING_MERGE_STEP = 'image_embedding_merge'
+    """
+    Job merging image embedding shards of a fold, when image embedding is sharded
+    """
+
+    STEPS = ['image_download', 'ppi_download', 'ppi_embedding',
+             'image_embedding', 'coembedding', 'hierarchy', 'hierarchyeval',
+             IMAGE_DOWNLOAD_MERGE_STEP, IMAGE_EMBEDDING_MERGE_STEP]
+    """
+    Steps profiles can be set for. ``image_embedding``, ``coembedding`` and
+    ``image_embedding_merge`` apply to every fold, a single fold is set by
+    appending ``_fold#``. When sharded, ``image_download`` and ``image_embedding``
+    set the resources of each shard
+    """
+
+    FOLD_STEPS = ['image_embedding', 'coembedding', IMAGE_EMBEDDING_MERGE_STEP]
+
+    CPUS_PER_TASK = 'cpus_per_task'
+
+    MEM = 'mem'
+
+    TIME = 'time'
+
+    PARTITION = 'partition'
+
+    RESOURCES = [CPUS_PER_TASK, MEM, TIME, PARTITION]
+
+    DEFAULT_RESOURCES = {CPUS_PER_TASK: 4,
+                         MEM: '32G',
+                         TIME: '4:00:00',
+                         PARTITION: None}
+    """
+    Resources of the ``default`` profile unless set. A ``None``
+    partition means the partition given to the runner, if any, is used
+    """
+
+    MEM_PATTERN = re.compile(r'^\d+[KMGT]?$', re.IGNORECASE)
+
+    TIME_PATTERN = re.compile(r'^(\d+-)?\d+(:\d+){0,2}$')
+
+    FOLD_STEP_PATTERN = re.compile(r'^(' + '|'.join(FOLD_STEPS) + r')_fold\d+$')
+
+    def __init__(self, profiles=None):
+        """
+        Constructor
+
+        :param profiles: step name => dict of resource => value
+        :type profiles: dict
+        :raises CellmapsPipelineError: If a step, resource or value is invalid
+        """
+        self._profiles = {}
+        if profiles is not None:
+            if not isinstance(profiles, dict):
+                raise CellmapsPipelineError('SLURM resource profiles must be a dict '
+                                            'of step name to resources')
+            for step_name, resources in profiles.items():
+                if not isinstance(resources, dict):
+                    raise CellmapsPipelineError('SLURM resources of step ' + str(step_name) +
+                                                ' must be a dict of resource to value')
+                for resource, value in resources.items():
+                    self.set_resource(step_name, resource, value)
+
+    @staticmethod
+    def from_file(profiles_file):
+        """
+        Loads profiles from JSON file **profiles_file** in the format
+        described in :py:class:`SLURMResourceProfiles`
+
+        :param profiles_file: Path to JSON file
+        :type profiles_file: str
+        :raises CellmapsPipelineError: If file can not be read or is invalid
+        :return: profiles
+        :rtype: :py:class:`SLURMResourceProfiles`
+        """
+        try:
+            with open(profiles_file, 'r') as f:
+                profiles = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CellmapsPipelineError('Unable to load SLURM resource profiles from ' +
+                                        str(profiles_file) + ': ' + str(e))
+        return SLURMResourceProfiles(profiles)
+
+    @staticmethod
+    def _check_step_name(step_name):
+        """
+        Checks **step_name** is ``default``, one of :py:const:`STEPS`
+        or a fold of one of :py:const:`FOLD_STEPS`
+
+        :param step_name: Name of step
+        :type step_name: str
+        :raises CellmapsPipelineError: If **step_name** is not valid
+        """
+        if step_name == SLURMResourceProfiles.DEFAULT_PROFILE or step_name in SLURMResourceProfiles.STEPS:
+            return
+        if isinstance(step_name, str) and SLURMResourceProfiles.FOLD_STEP_PATTERN.match(step_name):
+            return
+        raise CellmapsPipelineError('Invalid step for SLURM resources: ' + str(step_name) +
+                                    ' valid steps: ' +
+                                    str([SLURMResourceProfiles.DEFAULT_PROFILE] + SLURMResourceProfiles.STEPS))
+
+    @staticmethod
+    def _get_valid_value(resource, value):
+        """
+        Validates **value** of **resource**, converting
+        it to the type written into ``#SBATCH`` directives
+
+        :param resource: One of :py:const:`RESOURCES`
+        :type resource: str
+        :param value: Value of resource
+        :raises CellmapsPipelineError: If **resource** or **value** is not valid
+        :return: value as int for ``cpus_per_task``, otherwise str
+        """
+        if resource not in SLURMResourceProfiles.RESOURCES:
+            raise CellmapsPipelineError('Invalid SLURM resource: ' + str(resource) +
+                                        ' valid resources: ' + str(SLURMResourceProfiles.RESOURCES))
+        if value is None:
+            return None
+        if resource == SLURMResourceProfiles.CPUS_PER_TASK:
+            try:
+                cpus = int(value)
+            except (TypeError, ValueError):
+                cpus = 0
+            if cpus < 1 or str(cpus) != str(value).strip():
+                raise CellmapsPipelineError('cpus_per_task must be a positive integer: ' + str(value))
+            return cpus
+        value = str(value).strip()
+        if resource == SLURMResourceProfiles.MEM and not SLURMResourceProfiles.MEM_PATTERN.match(value):
+            raise CellmapsPipelineError('mem must be a number with optional K, M, G '
+                                        'or T suffix: ' + value)
+        if resource == SLURMResourceProfiles.TIME and not SLURMResourceProfiles.TIME_PATTERN.match(value):
+            raise CellmapsPipelineError('time must be in a SLURM time format such as '
+                                        'minutes, HH:MM:SS or D-HH:MM:SS: ' + value)
+        if resource == SLURMResourceProfiles.PARTITION and len(value) == 0:
+            raise CellmapsPipelineError('partition must not be empty')
+        return value
+
+    def set_resource(self, step_name, resource, value):
+        """
+        Sets **resource** of profile of **step_name** to **value**
+
+        :param step_name: Name of step, ``default`` or as in :py:const:`STEPS`
+        :type step_name: str
+        :param resource: One of :py:const:`RESOURCES`
+        :type resource: str
+        :param value: Value of resource, ``None`` unsets it
+        :raises CellmapsPipelineError: If step, resource or value is not valid
+        """
+        SLURMResourceProfiles._check_step_name(step_name)
+        value = SLURMResourceProfiles._get_valid_value(resource, value)
+        profile = self._profiles.setdefault(step_name, {})
+        if value is None:
+            profile.pop(resource, None)
+        else:
+            profile[resource] = value
+
+    def apply_overrides(self, overrides):
+        """
+        Sets resources from **overrides**, as passed on the command line,
+        each in format ``<step>.<resource>=<value>`` such as
+        ``image_embedding.cpus_per_task=16``
+
+        :param overrides: Overrides to apply, if ``None`` nothing is done
+        :type overrides: list
+        :raises CellmapsPipelineError: If an override is not valid
+        """
+        if overrides is None:
+            return
+        for override in overrides:
+            key, sep, value = override.partition('=')
+            step_name, dot, resource = key.strip().rpartition('.')
+            if sep != '=' or dot != '.':
+                raise CellmapsPipelineError('SLURM resource override must be in format '
+                                            '<step>.<resource>=<value>: ' + str(override))
+            self.set_resource(step_name, resource, value)
+
+    def get_resources(self, step_name=None):
+        """
+        Gets every resource of **step_name** as described in
+        :py:class:`SLURMResourceProfiles`
+
+        :param step_name: Name of step, if ``None`` resources
+                          of the ``default`` profile are returned
+        :type step_name: str
+        :return: resource => value for each of :py:const:`RESOURCES`
+        :rtype: dict
+        """
+        lookup = [SLURMResourceProfiles.DEFAULT_PROFILE]
+        if step_name is not None:
+            fold_match = SLURMResourceProfiles.FOLD_STEP_PATTERN.match(step_name)
+            if fold_match is not None:
+                lookup.append(fold_match.group(1))
+            lookup.append(step_name)
+
+        resources = dict(SLURMResourceProfiles.DEFAULT_RESOURCES)
+        for profile_name in lookup:
+            resources.update(self._profiles.get(profile_name, {}))
+        return resources
@@ -0,0 +1,250 @@
+#! /usr/bin/env python
+
+import os
+import json
+import time
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StepCache(object):
+    """
+    Tracks completion of pipeline steps via manifest files. Each manifest
+    holds a key computed from a hash of the step's parameters, input files
+    and the manifests of the steps it depends on, along with a digest of
+    the files in the step's output directory. A step is only considered
+    complete if its manifest exists, the key matches and the output
+    directory still matches the digest.
+
+    Since a manifest is only written once a step finishes successfully,
+    a partially written output directory from a crashed run is never
+    treated as complete.
+    """
+
+    MANIFEST_DIR = 'step_manifests'
+    """
+    Default name of directory, under the pipeline output
+    directory, where manifests are written
+    """
+
+    MANIFEST_SUFFIX = '.json'
+
+    CHUNK_SIZE = 1048576
+
+    def __init__(self, manifest_dir=None):
+        """
+        Constructor
+
+        :param manifest_dir: Directory where manifest files are stored
+        :type manifest_dir: str
+        """
+        self._manifest_dir = manifest_dir
+
+    def get_manifest_path(self, step_name):
+        """
+        Gets path to manifest file for step
+
+        :param step_name: Name of step
+        :type step_name: str
+        :return: path to manifest file
+        :rtype: str
+        """
+        return os.path.join(self._manifest_dir,
+                            str(step_name) + StepCache.MANIFEST_SUFFIX)
+
+    def get_manifest(self, step_name):
+        """
+        Gets manifest for step
+
+        :param step_name: Name of step
+        :type step_name: str
+        :return: manifest or ``None`` if not found or unreadable
+        :rtype: dict
+        """
+        manifest_path = self.get_manifest_path(step_name)
+        if not os.path.isfile(manifest_path):
+            return None
+        try:
+            with open(manifest_path, 'r') as f:
+                return json.load(f)
+        except ValueError as e:
+            logger.warning('Unable to parse manifest ' + manifest_path +
+                           ' : ' + str(e))
+            return None
+
+    def remove_manifest(self, step_name):
+        """
+        Removes manifest for step if it exists
+
+        :param step_name: Name of step
+        :type step_name: str
+        """
+        manifest_path = self.get_manifest_path(step_name)
+        if os.path.isfile(manifest_path):
+            os.unlink(manifest_path)
+
+    @staticmethod
+    def get_file_digest(path):
+        """
+        Gets sha256 hex digest of the contents of file
+
+        :param path: Path to file
+        :type path: str
+        :return: hex digest
+        :rtype: str
+        """
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(StepCache.CHUNK_SIZE), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    @staticmethod
+    def get_file_or_value_digest(value):
+        """
+        If **value** is a path to a file, the digest of the file contents
+        is returned otherwise the value itself, such as a URL, is returned
+        as a string. ``None`` is returned as is
+
+        :param value: Path to file or other value
+        :type value: str
+        :return: digest of file or **value** as str
+        :rtype: str
+        """
+        if value is None:
+            return None
+        if os.path.isfile(value):
+            return StepCache.get_file_digest(value)
+        return str(value)
+
+    @staticmethod
+    def get_directory_digest(directory):
+        """
+        Gets sha256 hex digest of the relative paths and sizes
+        of all files under **directory**. File contents are not read
+        so this is fast even for directories holding many images
+
+        :param directory: Directory to examine
+        :type directory: str
+        :return: (hex digest, number of files) or (``None``, 0) if **directory**
+                 does not exist
+        :rtype: tuple
+        """
+        if not os.path.isdir(directory):
+            return None, 0
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(directory):
+            for filename in filenames:
+                full_path = os.path.join(dirpath, filename)
+                entries.append((os.path.relpath(full_path, directory),
+                                os.path.getsize(full_path)))
+        entries.sort()
+        sha = hashlib.sha256()
+        for relpath, size in entries:
+            sha.update((relpath + '\t' + str(size) + '\n').encode('utf-8'))
+        return sha.hexdigest(), len(entries)
+
+    def get_step_key(self, step_name, parameters=None, input_files=None,
+                     upstream_steps=None):
+        """
+        Computes the key of a step which is a sha256 hex digest
+        of the step name, **parameters**, contents of **input_files**
+        and the keys found in the manifests of **upstream_steps**.
+
+        Only the keys of upstream steps are used, not their output
+        digests, since outputs include timestamped log files. This keeps
+        the key of a step the same across runs and output directories
+        when nothing that feeds into it has changed. Callers rerunning a
+        step must therefore remove the manifests of steps downstream of it,
+        as its key, and thus theirs, stays the same.
+
+        :param step_name: Name of step
+        :type step_name: str
+        :param parameters: JSON serializable parameters of step
+        :type parameters: dict
+        :param input_files: name => path to file, URL or ``None``
+        :type input_files: dict
+        :param upstream_steps: Names of steps this step depends on
+        :type upstream_steps: list
+        :return: key
+        :rtype: str
+        """
+        key_data = {'step': step_name,
+                    'parameters': parameters if parameters is not None else {},
+                    'input_files': {},
+                    'upstream': {}}
+        if input_files is not None:
+            for name, path in input_files.items():
+                key_data['input_files'][name] = StepCache.get_file_or_value_digest(path)
+
+        if upstream_steps is not None:
+            for upstream_step in upstream_steps:
+                manifest = self.get_manifest(upstream_step)
+                if manifest is None:
+                    key_data['upstream'][upstream_step] = None
+                    continue
+                key_data['upstream'][upstream_step] = manifest.get('key')
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True,
+                                         default=str).encode('utf-8')).hexdigest()
+
+    def is_step_complete(self, step_name, key, step_dir):
+        """
+        Checks if step is complete. This is true if a manifest for
+        step exists with matching **key** and the digest of **step_dir**
+        matches the one in the manifest
+
+        :param step_name: Name of step
+        :type step_name: str
+        :param key: Key of step as returned by :py:meth:`get_step_key`
+        :type key: str
+        :param step_dir: Output directory of step
+        :type step_dir: str
+        :return: ``True`` if complete otherwise ``False``
+        :rtype: bool
+        """
+        manifest = self.get_manifest(step_name)
+        if manifest is None:
+            logger.debug('No manifest for step ' + str(step_name))
+            return False
+        if manifest.get('key') != key:
+            logger.info('Inputs of step ' + str(step_name) + ' have changed')
+            return False
+        outputs_digest, num_files = StepCache.get_directory_digest(step_dir)
+        if outputs_digest is None or manifest.get('outputs_digest') != outputs_digest:
+            logger.info('Output directory ' + str(step_dir) + ' of step ' +
+                        str(step_name) + ' does not match manifest')
+            return False
+        return True
+
+    def write_manifest(self, step_name, key, step_dir, parameters=None):
+        """
+        Writes manifest for step. This should only be called once the
+        step has completed successfully
+
+        :param step_name: Name of step
+        :type step_name: str
+        :param key: Key of step as returned by :py:meth:`get_step_key`
+        :type key: str
+        :param step_dir: Output directory of step
+        :type step_dir: str
+        :param parameters: JSON serializable parameters of step, stored for reference
+        :type parameters: dict
+        :return: manifest written
+        :rtype: dict
+        """
+        os.makedirs(self._manifest_dir, mode=0o755, exist_ok=True)
+        outputs_digest, num_files = StepCache.get_directory_digest(step_dir)
+        manifest = {'step': step_name,
+                    'key': key,
+                    'parameters': parameters if parameters is not None else {},
+                    'outputs_digest': outputs_digest,
+                    'num_files': num_files,
+                    'completed_time': int(time.time())}
+        manifest_path = self.get_manifest_path(step_name)
+        tmp_path = manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2, default=str)
+        os.replace(tmp_path, manifest_path)
+        return manifest
@@ -0,0 +1,350 @@
+#! /usr/bin/env python
+
+import math
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BLOCK_ELEMENTS = 4194304
+"""
+Approximate number of similarity matrix elements examined at a time
+"""
+
+
+def get_block_rows(num_cols, block_elements=BLOCK_ELEMENTS):
+    """
+    Gets number of rows of a matrix with **num_cols** columns to
+    process at a time so roughly **block_elements** are examined
+
+    :param num_cols: Number of columns in matrix
+    :type num_cols: int
+    :param block_elements: Number of elements to examine at a time
+    :type block_elements: int
+    :return: number of rows, at least ``1``
+    :rtype: int
+    """
+    return max(1, int(block_elements) // max(1, int(num_cols)))
+
+
+def get_upper_triangle_edges(block, row_offset=0, min_weight=None):
+    """
+    Gets the entries of **block**, a horizontal slice of a square
+    similarity matrix starting at row **row_offset**, that are above the
+    diagonal of the full matrix. ``NaN`` values are skipped
+
+    :param block: Rows of similarity matrix
+    :type block: :py:class:`numpy.ndarray`
+    :param row_offset: Row of full matrix that first row of **block** corresponds to
+    :type row_offset: int
+    :param min_weight: If set, entries below this value are skipped
+    :type min_weight: float
+    :return: (row indices, column indices, weights) as :py:class:`numpy.ndarray`
+    :rtype: tuple
+    """
+    row_idx = np.arange(row_offset, row_offset + block.shape[0])
+    mask = np.arange(block.shape[1])[np.newaxis, :] > row_idx[:, np.newaxis]
+    if min_weight is None:
+        mask &= ~np.isnan(block)
+    else:
+        # comparisons with NaN are False so this also skips NaN
+        mask &= block >= min_weight
+    rows, cols = np.nonzero(mask)
+    weights = block[rows, cols]
+    rows += row_offset
+    return rows, cols, weights
+
+
+def count_upper_triangle_values(sim_values, block_elements=BLOCK_ELEMENTS):
+    """
+    Counts entries above the diagonal of square **sim_values**
+    that are not ``NaN``
+
+    :param sim_values: Square similarity matrix
+    :type sim_values: :py:class:`numpy.ndarray`
+    :param block_elements: Number of elements to examine at a time
+    :type block_elements: int
+    :return: count
+    :rtype: int
+    """
+    num_rows = sim_values.shape[0]
+    total = num_rows * (num_rows - 1) // 2
+    block_rows = get_block_rows(num_rows, block_elements=block_elements)
+    for start in range(0, num_rows, block_rows):
+        block = sim_values[start:start + block_rows]
+        nan_mask = np.isnan(block)
+        if not nan_mask.any():
+            continue
+        row_idx = np.arange(start, start + block.shape[0])
+        nan_mask &= np.arange(num_rows)[np.newaxis, :] > row_idx[:, np.newaxis]
+        total -= int(np.count_nonzero(nan_mask))
+    return total
+
+
+class TopKEdgeSelector(object):
+    """
+    Keeps the **k** highest weighted edges out of all edges added via
+    :py:meth:`add`. Candidates are buffered and trimmed back to **k** with
+    :py:func:`numpy.argpartition` so memory stays proportional to **k**
+    plus the size of the batches added, and no full sort is done until
+    :py:meth:`get_edges` is called.
+
+    Which edges are kept when several share the lowest kept weight
+    is arbitrary.
+    """
+
+    def __init__(self, k):
+        """
+        Constructor
+
+        :param k: Number of edges to keep
+        :type k: int
+        """
+        self._k = max(0, int(k))
+        self._rows = np.empty(0, dtype=np.int64)
+        self._cols = np.empty(0, dtype=np.int64)
+        self._weights = np.empty(0, dtype=np.float64)
+        self._threshold = None
+
+    def get_threshold(self):
+        """
+        Gets the weight a new edge must at least have to be kept. Passing
+        this to :py:func:`get_upper_triangle_edges` avoids extracting edges
+        that would be discarded anyway
+
+        :return: minimum weight or ``None`` if fewer than **k** edges have been kept
+        :rtype: float
+        """
+        return self._threshold
+
+    def add(self, rows, cols, weights):
+        """
+        Adds candidate edges
+
+        :param rows: Row, or source, index of each edge
+        :type rows: :py:class:`numpy.ndarray`
+        :param cols: Column, or target, index of each edge
+        :type cols: :py:class:`numpy.ndarray`
+        :param weights: Weight of each edge
+        :type weights: :py:class:`numpy.ndarray`
+        """
+        if self._k == 0 or len(weights) == 0:
+            return
+        if self._threshold is not None:
+            keep = weights >= self._threshold
+            rows, cols, weights = rows[keep], cols[keep], weights[keep]
+            if len(weights) == 0:
+                return
+        self._rows = np.concatenate((self._rows, rows))
+        self._cols = np.concatenate((self._cols, cols))
+        self._weights = np.concatenate((self._weights, weights))
+        if len(self._weights) >= 2 * self._k:
+            self._trim()
+
+    def _trim(self):
+        """
+        Reduces buffered candidates to the **k** highest weighted
+        and updates the minimum weight a new candidate needs
+        """
+        if len(self._weights) > self._k:
+            top = np.argpartition(-self._weights, self._k - 1)[:self._k]
+            self._rows = self._rows[top]
+            self._cols = self._cols[top]
+            self._weights = self._weights[top]
+        if self._k > 0 and len(self._weights) == self._k:
+            self._threshold = self._weights.min()
+
+    def get_edges(self):
+        """
+        Gets the **k** highest weighted edges sorted by descending
+        weight with ties ordered by row and then column index
+
+        :return: (row indices, column indices, weights) as :py:class:`numpy.ndarray`
+        :rtype: tuple
+        """
+        self._trim()
+        order = np.lexsort((self._cols, self._rows, -self._weights))
+        return self._rows[order], self._cols[order], self._weights[order]
+
+
+def get_row_top_edges(block, k, row_offset=0):
+    """
+    Gets, for each row of **block**, a horizontal slice of a square
+    similarity matrix starting at row **row_offset**, the **k** highest
+    entries excluding the diagonal of the full matrix and ``NaN`` values.
+    Ties are kept in column order
+
+    :param block: Rows of similarity matrix
+    :type block: :py:class:`numpy.ndarray`
+    :param k: Number of entries to keep per row
+    :type k: int
+    :param row_offset: Row of full matrix that first row of **block** corresponds to
+    :type row_offset: int
+    :return: (row indices, column indices, weights) as :py:class:`numpy.ndarray`
+             ordered by row and then descending weight
+    :rtype: tuple
+    """
+    num_rows, num_cols = block.shape
+    k = min(max(0, int(k)), num_cols - 1)
+    if k == 0 or num_rows == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=block.dtype)
+    scores = np.array(block, dtype=block.dtype, copy=True)
+    scores[np.isnan(scores)] = -np.inf
+    row_idx = np.arange(num_rows)
+    scores[row_idx, row_idx + row_offset] = -np.inf
+
+    # kth highest score of each row, every entry at least that
+    # high is a candidate so ties can be cut in column order
+    threshold = -np.partition(-scores, k - 1, axis=1)[:, k - 1]
+    rows, cols = np.nonzero((scores >= threshold[:, np.newaxis]) & (scores > -np.inf))
+    weights = scores[rows, cols]
+    order = np.lexsort((cols, -weights, rows))
+    rows, cols, weights = rows[order], cols[order], weights[order]
+
+    # position of each candidate within its row
+    row_starts = np.searchsorted(rows, rows, side='left')
+    keep = np.arange(len(rows)) - row_starts < k
+    return rows[keep] + row_offset, cols[keep], weights[keep]
+
+
+def get_undirected_edges(rows, cols, weights):
+    """
+    Merges directed edges into undirected edges, with the lower index
+    as row, keeping one edge per pair of nodes. If both directions of a
+    pair are present, the weight of the first one is kept
+
+    :param rows: Row, or source, index of each edge
+    :type rows: :py:class:`numpy.ndarray`
+    :param cols: Column, or target, index of each edge
+    :type cols: :py:class:`numpy.ndarray`
+    :param weights: Weight of each edge
+    :type weights: :py:class:`numpy.ndarray`
+    :return: (row indices, column indices, weights) as :py:class:`numpy.ndarray`
+             sorted by descending weight with ties ordered by row and then column index
+    :rtype: tuple
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    low = np.minimum(rows, cols)
+    high = np.maximum(rows, cols)
+    num_nodes = int(high.max()) + 1 if len(high) > 0 else 0
+    _, first = np.unique(low * num_nodes + high, return_index=True)
+    low, high, weights = low[first], high[first], np.asarray(weights)[first]
+    order = np.lexsort((high, low, -weights))
+    return low[order], high[order], weights[order]
+
+
+def get_cutoff_sizes(cutoffs, num_values):
+    """
+    Gets number of edges kept for each of **cutoffs**
+
+    :param cutoffs: Fractions of edges to keep, ``0.1`` means top ten percent
+    :type cutoffs: list
+    :param num_values: Total number of edges
+    :type num_values: int
+    :return: top **cutoff** fraction, rounded up, of **num_values** for each cutoff
+    :rtype: list
+    """
+    return [math.ceil(cutoff * num_values) for cutoff in cutoffs]
+
+
+def split_by_cutoff_sizes(rows, cols, weights, sizes):
+    """
+    Gets the first **size** edges, for each of **sizes**, of edges sorted
+    by descending weight. Since ties are ordered by row and then column
+    index by :py:meth:`TopKEdgeSelector.get_edges` each of these is the
+    same as selecting that many edges separately. The arrays returned
+    are views so no edges are copied
+
+    :param rows: Row index of each edge
+    :type rows: :py:class:`numpy.ndarray`
+    :param cols: Column index of each edge
+    :type cols: :py:class:`numpy.ndarray`
+    :param weights: Weight of each edge
+    :type weights: :py:class:`numpy.ndarray`
+    :param sizes: Number of edges to get
+    :type sizes: list
+    :return: list of (row indices, column indices, weights) for each of **sizes**
+    :rtype: list
+    """
+    return [(rows[:size], cols[:size], weights[:size]) for size in sizes]
+
+
+def get_top_edges_by_cutoff(sim_values, cutoffs, block_elements=BLOCK_ELEMENTS):
+    """
+    Gets the top **cutoff** fraction, rounded up, of edges above the
+    diagonal of square similarity matrix **sim_values** for each of
+    **cutoffs**. Edges are selected once, for the largest cutoff, and
+    the results for the other cutoffs are taken from those via
+    :py:func:`split_by_cutoff_sizes`
+
+    :param sim_values: Square similarity matrix
+    :type sim_values: :py:class:`numpy.ndarray`
+    :param cutoffs: Fractions of edges to keep, ``0.1`` means top ten percent
+    :type cutoffs: list
+    :param block_elements: Number of elements to examine at a time
+    :type block_elements: int
+    :return: list of (row indices, column indices, weights) as :py:class:`numpy.ndarray`
+             sorted by descending weight for each of **cutoffs**
+    :rtype: list
+    """
+    num_values = count_upper_triangle_values(sim_values, block_elements=block_elements)
+    sizes = get_cutoff_sizes(cutoffs, num_values)
+    selector = TopKEdgeSelector(max(sizes, default=0))
+    block_rows = get_block_rows(sim_values.shape[0], block_elements=block_elements)
+    for start in range(0, sim_values.shape[0], block_rows):
+        selector.add(*get_upper_triangle_edges(sim_values[start:start + block_rows],
+                                               row_offset=start,
+                                               min_weight=selector.get_threshold()))
+    return split_by_cutoff_sizes(*selector.get_edges(), sizes)
+
+
+def get_top_edges(sim_values, cutoff, block_elements=BLOCK_ELEMENTS):
+    """
+    Gets the top **cutoff** fraction, rounded up, of edges above the
+    diagonal of square similarity matrix **sim_values** without building
+    the list of all pairs or sorting them
+
+    :param sim_values: Square similarity matrix
+    :type sim_values: :py:class:`numpy.ndarray`
+    :param cutoff: Fraction of edges to keep, ``0.1`` means top ten percent
+    :type cutoff: float
+    :param block_elements: Number of elements to examine at a time
+    :type block_elements: int
+    :return: (row indices, column indices, weights) as :py:class:`numpy.ndarray`
+             sorted by descending weight
+    :rtype: tuple
+    """
+    return get_top_edges_by_cutoff(sim_values, [cutoff],
+                                   block_elements=block_elements)[0]
+
+
+def get_descending_order(weights, k=None):
+    """
+    Gets indices of the **k** highest **weights** in descending order
+    with ties kept in their original order and ``NaN`` last, the same
+    as the first **k** entries of a stable descending sort, without
+    sorting every weight. :py:func:`numpy.argpartition` finds the
+    **k** th highest weight and only weights at least that high are sorted
+
+    :param weights: Weights to order
+    :type weights: :py:class:`numpy.ndarray`
+    :param k: Number of indices to get, if ``None`` or at least the
+              number of **weights** all are ordered
+    :type k: int
+    :return: indices into **weights**
+    :rtype: :py:class:`numpy.ndarray`
+    """
+    negated = -np.asarray(weights, dtype=float)
+    if k is None or k >= len(negated):
+        return np.argsort(negated, kind='stable')
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    threshold = np.partition(negated, k - 1)[k - 1]
+    if np.isnan(threshold):
+        return np.argsort(negated, kind='stable')[:k]
+    # keeps every weight tied with the kth so ties are cut in original order
+    candidates = np.flatnonzero(negated <= threshold)
+    return candidates[np.argsort(negated[candidates], kind='stable')[:k]]
@@ -0,0 +1,76 @@
+#! /usr/bin/env python
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+from cellmaps_utils import music_utils
+from cellmaps_pipeline import topk
+from cellmaps_pipeline import similarity
+
+if len(sys.argv) not in (3, 4):
+    msg = """
+    Usage <number of genes> <number of dimensions> [<max genes for music_utils>]
+
+    Times getting the top 10% of edges by spearman and kendall
+    similarity of a synthetic embedding of normally distributed values
+    via cellmaps_utils.music_utils, the current path, and via the blocked
+    similarities in cellmaps_pipeline.similarity, which also checks
+    the results agree.
+
+    Since music_utils compares each pair of genes separately for kendall,
+    which takes hours at 5000 genes, it is run on the first
+    <max genes for music_utils> genes (default 500) and its time scaled by
+    the square of the number of genes. Such times are marked as estimated.
+
+    Example, run with synthetic 5k x 1024 embedding:
+
+    benchmark_rank_similarity.py 5000 1024
+    """
+    sys.stderr.write(msg + '\n\n')
+    sys.stderr.flush()
+    sys.exit(1)
+
+num_genes = int(sys.argv[1])
+num_dims = int(sys.argv[2])
+max_music_genes = 500
+if len(sys.argv) == 4:
+    max_music_genes = int(sys.argv[3])
+
+cutoff = 0.1
+
+rng = np.random.default_rng(1)
+df = pd.DataFrame(rng.normal(size=(num_genes, num_dims)),
+                  index=['G' + str(i) for i in range(num_genes)])
+
+print('Embedding: ' + str(num_genes) + ' genes x ' + str(num_dims) + ' dimensions')
+
+for algorithm, sim_func in [('spearman', music_utils.spearman_scaled),
+                            ('kendall', music_utils.kendall_scaled)]:
+    music_genes = num_genes
+    if algorithm == 'kendall':
+        music_genes = min(num_genes, max_music_genes)
+    start = time.time()
+    expected = topk.get_top_edges(sim_func(df.iloc[:music_genes]).to_numpy(dtype=float),
+                                  cutoff)
+    music_duration = (time.time() - start) * (num_genes / music_genes) ** 2
+
+    start = time.time()
+    res = similarity.get_top_edges_blocked(similarity.get_blocked_similarity(df,
+                                                                             algorithm),
+                                           cutoff)
+    blocked_duration = time.time() - start
+
+    # check on the genes music_utils was run on
+    sub_res = similarity.get_top_edges_blocked(similarity.get_blocked_similarity(df.iloc[:music_genes],
+                                                                                 algorithm),
+                                               cutoff)
+    max_diff = np.max(np.abs(expected[2] - sub_res[2])) if len(expected[2]) > 0 else 0.0
+
+    estimated = ' (estimated from ' + str(music_genes) + ' genes)' if music_genes < num_genes else ''
+    print(algorithm + ':')
+    print('    music_utils: ' + '{:.2f}'.format(music_duration) + 's' + estimated)
+    print('    blocked:     ' + '{:.2f}'.format(blocked_duration) + 's, ' +
+          str(len(res[0])) + ' edges')
+    print('    speedup:     ' + '{:.1f}'.format(music_duration / blocked_duration) + 'x')
+    print('    max weight difference: ' + str(max_diff))
@@ -65,7 +65,8 @@ setup(
     packages=find_packages(include=['cellmaps_pipeline']),
     package_dir={'cellmaps_pipeline': 'cellmaps_pipeline'},
     scripts=[ 'cellmaps_pipeline/cellmaps_pipelinecmd.py',
-              'cellmaps_pipeline/cellmaps_cywebserviceapp.py'],
+              'cellmaps_pipeline/cellmaps_cywebserviceapp.py',
+              'cellmaps_pipeline/cellmaps_shardcmd.py'],
     setup_requires=setup_requirements,
     url=repo_url,
     version=version,
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `cellmaps_pipeline.artifactstore` module."""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from cellmaps_pipeline.artifactstore import ArtifactStore
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+
+
+class TestArtifactStore(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.store_dir = os.path.join(self.temp_dir, 'store')
+        self.step_dir = os.path.join(self.temp_dir, 'step')
+        os.makedirs(os.path.join(self.step_dir, 'sub'))
+        with open(os.path.join(self.step_dir, 'out.tsv'), 'w') as f:
+            f.write('hi\n')
+        with open(os.path.join(self.step_dir, 'sub', 'img.png'), 'w') as f:
+            f.write('x' * 100)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_constructor_invalid(self):
+        with self.assertRaises(CellmapsPipelineError):
+            ArtifactStore()
+        try:
+            ArtifactStore(store_dir=self.store_dir, link_mode='foo')
+            self.fail('Expected CellmapsPipelineError')
+        except CellmapsPipelineError as e:
+            self.assertEqual('Invalid link mode: foo', str(e))
+
+    def test_fetch_missing_entry(self):
+        store = ArtifactStore(store_dir=self.store_dir)
+        self.assertFalse(store.has_entry('abc'))
+        self.assertIsNone(store.fetch('abc', os.path.join(self.temp_dir, 'dest')))
+        self.assertEqual([], store.get_entries())
+
+    def test_put_and_fetch(self):
+        for link_mode in ArtifactStore.LINK_MODES:
+            store = ArtifactStore(store_dir=self.store_dir, link_mode=link_mode)
+            key = 'key_' + link_mode
+            self.assertTrue(store.put(key, self.step_dir, manifest={'key': key}))
+            self.assertTrue(store.has_entry(key))
+
+            dest_dir = os.path.join(self.temp_dir, 'dest_' + link_mode)
+            self.assertEqual({'key': key}, store.fetch(key, dest_dir))
+            with open(os.path.join(dest_dir, 'sub', 'img.png'), 'r') as f:
+                self.assertEqual('x' * 100, f.read())
+            dest_file = os.path.join(dest_dir, 'out.tsv')
+            self.assertEqual(link_mode == ArtifactStore.SYMLINK_MODE,
+                             os.path.islink(dest_file))
+            if link_mode == ArtifactStore.HARDLINK_MODE:
+                self.assertEqual(os.stat(os.path.join(self.step_dir, 'out.tsv')).st_ino,
+                                 os.stat(dest_file).st_ino)
+
+    def test_put_existing_entry(self):
+        store = ArtifactStore(store_dir=self.store_dir)
+        self.assertTrue(store.put('abc', self.step_dir, manifest={'key': 'abc'}))
+        self.assertTrue(store.put('abc', os.path.join(self.temp_dir, 'nonexistent')))
+        self.assertEqual(1, len(store.get_entries()))
+
+    def test_get_data_dir(self):
+        store = ArtifactStore(store_dir=self.store_dir)
+        self.assertIsNone(store.get_data_dir('a'))
+        store.put('a', self.step_dir)
+        data_dir = store.get_data_dir('a')
+        with open(os.path.join(data_dir, 'out.tsv'), 'r') as f:
+            self.assertEqual('hi\n', f.read())
+
+    def test_evict_least_recently_used(self):
+        store = ArtifactStore(store_dir=self.store_dir)
+        store.put('a', self.step_dir)
+        time.sleep(0.01)
+        store.put('b', self.step_dir)
+        time.sleep(0.01)
+        store.fetch('a', os.path.join(self.temp_dir, 'dest'))
+        self.assertEqual(['b', 'a'], [e[0] for e in store.get_entries()])
+        entry_size = store.get_entries()[0][1]
+
+        store = ArtifactStore(store_dir=self.store_dir, max_size=entry_size * 2)
+        time.sleep(0.01)
+        store.put('c', self.step_dir)
+        self.assertFalse(store.has_entry('b'))
+        self.assertEqual(['a', 'c'], [e[0] for e in store.get_entries()])
+        self.assertEqual([], store.evict())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+import io
 import json
 
 import pytest
@@ -5,9 +6,19 @@ import pandas as pd
 import numpy as np
 import tempfile
 import os
+import shutil
+from unittest.mock import patch
 
 from cellmaps_pipeline.cellmaps_cywebserviceapp import network_from_embedding_mode, community_detection_mode
+from cellmaps_pipeline.cellmaps_cywebserviceapp import main, create_hcx_mode
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+from cellmaps_pipeline import embeddingio
+from cellmaps_pipeline.cellmaps_cywebserviceapp import _get_edge_arrays, _write_cutoff_edgelists
+from cellmaps_pipeline.cellmaps_cywebserviceapp import _get_tempdir, _get_edgelists_size
+from cellmaps_pipeline.cellmaps_cywebserviceapp import _get_sim_mat_from_similarity
+from cellmaps_generate_hierarchy.hierarchy import CDAPSHiDeFHierarchyGenerator
 from ndex2.cx2 import CX2Network, RawCX2NetworkFactory
+from cellmaps_utils import music_utils
 
 
 def _write_dummy_embedding(file_path):
@@ -37,6 +48,210 @@ def test_network_from_embedding_mode_creates_network():
         assert len(net.get_nodes()) == 3
         assert len(net.get_edges()) > 0
 
+def test_network_from_embedding_mode_multiple_cutoffs():
+    with tempfile.TemporaryDirectory() as tempdir:
+        embedding_file = os.path.join(tempdir, 'embedding.tsv')
+        _write_dummy_embedding(embedding_file)
+
+        for blocked in [False, True]:
+            cx2list = network_from_embedding_mode(embedding=embedding_file,
+                                                  cutoff=[1.0, 0.3], blocked=blocked)
+            assert len(cx2list) == 2
+            factory = RawCX2NetworkFactory()
+            nets = [factory.get_cx2network(cx2) for cx2 in cx2list]
+            assert [len(net.get_edges()) for net in nets] == [3, 1]
+            assert nets[0].get_name() == 'Network from embedding.tsv top 100%'
+            assert nets[1].get_name() == 'Network from embedding.tsv top 30%'
+
+            single = network_from_embedding_mode(embedding=embedding_file,
+                                                 cutoff=0.3, blocked=blocked)
+            single_net = factory.get_cx2network(single[0])
+            assert single_net.get_name() == 'Network from embedding.tsv'
+            assert single_net.get_edges() == nets[1].get_edges()
+
+
+def test_network_from_embedding_mode_npy_and_float32():
+    with tempfile.TemporaryDirectory() as tempdir:
+        embedding_file = os.path.join(tempdir, 'embedding.tsv')
+        _write_dummy_embedding(embedding_file)
+        npy_file = os.path.join(tempdir, 'embedding.npy')
+        embeddingio.write_npy_embedding(embeddingio.read_embedding(embedding_file), npy_file)
+
+        factory = RawCX2NetworkFactory()
+        expected = factory.get_cx2network(network_from_embedding_mode(embedding=embedding_file,
+                                                                      cutoff=1.0)[0])
+        for blocked in [False, True]:
+            for dtype in [None, 'float32']:
+                net = factory.get_cx2network(network_from_embedding_mode(embedding=npy_file,
+                                                                         cutoff=1.0,
+                                                                         blocked=blocked,
+                                                                         dtype=dtype)[0])
+                assert len(net.get_edges()) == len(expected.get_edges())
+                for edge_id, edge in expected.get_edges().items():
+                    assert net.get_edge(edge_id)['s'] == edge['s']
+                    assert net.get_edge(edge_id)['t'] == edge['t']
+                    assert abs(net.get_edge(edge_id)['v']['weight'] - edge['v']['weight']) < 1e-5
+
+
+def test_network_from_embedding_mode_knn():
+    with tempfile.TemporaryDirectory() as tempdir:
+        embedding_file = os.path.join(tempdir, 'embedding.tsv')
+        pd.DataFrame({'x': [0.1, 0.9, 0.4], 'y': [0.5, 0.2, 0.8], 'z': [0.7, 0.3, 0.1]},
+                     index=['A', 'B', 'C']).to_csv(embedding_file, sep='\t')
+
+        factory = RawCX2NetworkFactory()
+        for algorithm in ['cosine', 'spearman']:
+            cx2list = network_from_embedding_mode(embedding=embedding_file, algorithm=algorithm,
+                                                  cutoff=[0.1, 0.2], knn=1)
+            assert len(cx2list) == 1
+            net = factory.get_cx2network(cx2list[0])
+            assert len(net.get_nodes()) == 3
+            assert 2 <= len(net.get_edges()) <= 3
+            assert 'nearest neighbors' in net.get_network_attributes()['description']
+
+        with pytest.raises(CellmapsPipelineError):
+            network_from_embedding_mode(embedding=embedding_file, knn=0)
+
+
+def test_network_from_embedding_mode_blocked_matches_default():
+    with tempfile.TemporaryDirectory() as tempdir:
+        embedding_file = os.path.join(tempdir, 'embedding.tsv')
+        rng = np.random.default_rng(3)
+        pd.DataFrame(rng.normal(size=(30, 4)),
+                     index=['G' + str(i) for i in range(30)]).to_csv(embedding_file, sep='\t')
+        factory = RawCX2NetworkFactory()
+        for algorithm in ['cosine', 'euclidean', 'pearson']:
+            expected = factory.get_cx2network(network_from_embedding_mode(embedding=embedding_file,
+                                                                          algorithm=algorithm,
+                                                                          cutoff=0.2)[0])
+            net = factory.get_cx2network(network_from_embedding_mode(embedding=embedding_file,
+                                                                     algorithm=algorithm,
+                                                                     cutoff=0.2, blocked=True,
+                                                                     block_rows=4)[0])
+            assert expected.get_nodes() == net.get_nodes()
+            assert len(expected.get_edges()) == len(net.get_edges())
+            for edge_id, edge in expected.get_edges().items():
+                blocked_edge = net.get_edge(edge_id)
+                assert edge['s'] == blocked_edge['s']
+                assert edge['t'] == blocked_edge['t']
+                assert abs(edge['v']['weight'] - blocked_edge['v']['weight']) < 1e-12
+
+
+def test_network_from_embedding_mode_blocked_rank_similarities():
+    with tempfile.TemporaryDirectory() as tempdir:
+        embedding_file = os.path.join(tempdir, 'embedding.tsv')
+        rng = np.random.default_rng(3)
+        pd.DataFrame(rng.normal(size=(30, 8)),
+                     index=['G' + str(i) for i in range(30)]).to_csv(embedding_file, sep='\t')
+        factory = RawCX2NetworkFactory()
+        for algorithm in ['spearman', 'kendall']:
+            expected = factory.get_cx2network(network_from_embedding_mode(embedding=embedding_file,
+                                                                          algorithm=algorithm,
+                                                                          cutoff=0.2)[0])
+            net = factory.get_cx2network(network_from_embedding_mode(embedding=embedding_file,
+                                                                     algorithm=algorithm,
+                                                                     cutoff=0.2, blocked=True,
+                                                                     block_rows=4)[0])
+            # ranks of 8 values tie often so which tied pairs make the
+            # cutoff, and the node order that follows, depends on rounding
+            expected_weights = [e['v']['weight'] for e in expected.get_edges().values()]
+            weights = [e['v']['weight'] for e in net.get_edges().values()]
+            assert np.allclose(expected_weights, weights, rtol=0, atol=1e-12)
+
+
+def test_network_from_embedding_mode_manhattan_and_canberra():
+    with tempfile.TemporaryDirectory() as tempdir:
+        embedding_file = os.path.join(tempdir, 'embedding.tsv')
+        rng = np.random.default_rng(3)
+        df = pd.DataFrame(rng.normal(size=(30, 4)),
+                          index=['G' + str(i) for i in range(30)])
+        df.to_csv(embedding_file, sep='\t')
+        factory = RawCX2NetworkFactory()
+        for algorithm, sim_func in [('manhattan', music_utils.manhattan_similarity),
+                                    ('canberra', music_utils.canberra_similarity)]:
+            sim_mat = sim_func(df).to_numpy()
+            for blocked in [False, True]:
+                net = factory.get_cx2network(network_from_embedding_mode(embedding=embedding_file,
+                                                                         algorithm=algorithm,
+                                                                         cutoff=0.2,
+                                                                         blocked=blocked)[0])
+                assert 87 == len(net.get_edges())
+                for edge in net.get_edges().values():
+                    source = int(net.get_node(edge['s'])['v']['name'][1:])
+                    target = int(net.get_node(edge['t'])['v']['name'][1:])
+                    assert abs(sim_mat[source, target] - edge['v']['weight']) < 1e-12
+
+
+def test_get_sim_mat_from_similarity_rank_similarities_match_music_utils():
+    rng = np.random.default_rng(5)
+    df = pd.DataFrame(rng.normal(size=(25, 6)),
+                      index=['G' + str(i) for i in range(25)])
+    for algorithm, sim_func in [('kendall', music_utils.kendall_scaled),
+                                ('spearman', music_utils.spearman_scaled)]:
+        sim_mat = _get_sim_mat_from_similarity(df, algorithm=algorithm)
+        expected = sim_func(df)
+        assert list(expected.index) == list(sim_mat.index)
+        assert list(expected.columns) == list(sim_mat.columns)
+        assert np.allclose(expected.to_numpy(dtype=float), sim_mat.to_numpy(dtype=float),
+                           atol=1e-12)
+
+
+def test_main_networkfromembedding_no_pretty(capsys):
+    with tempfile.TemporaryDirectory() as tempdir:
+        embedding_file = os.path.join(tempdir, 'embedding.tsv')
+        _write_dummy_embedding(embedding_file)
+        args = ['cellmaps_cywebserviceappcmd.py', 'input', '--mode', 'networkfromembedding',
+                '--embedding', embedding_file, '--embedding_cutoff', '0.5']
+        main(args)
+        pretty = capsys.readouterr().out
+        main(args + ['--no_pretty'])
+        compact = capsys.readouterr().out
+        assert '\n' in pretty
+        assert '\n' not in compact
+        assert json.loads(pretty) == json.loads(compact)
+        result = json.loads(compact)
+        assert result[0]['action'] == 'addNetworks'
+        expected = network_from_embedding_mode(embedding=embedding_file, cutoff=0.5)
+        assert result[0]['data'] == expected
+
+
+def test_main_networkfromembedding_manhattan(capsys):
+    with tempfile.TemporaryDirectory() as tempdir:
+        embedding_file = os.path.join(tempdir, 'embedding.tsv')
+        _write_dummy_embedding(embedding_file)
+        main(['cellmaps_cywebserviceappcmd.py', 'input', '--mode', 'networkfromembedding',
+              '--embedding', embedding_file, '--similarity', 'manhattan', '--no_pretty'])
+        result = json.loads(capsys.readouterr().out)
+        assert result[0]['data'] == network_from_embedding_mode(embedding=embedding_file,
+                                                                algorithm='manhattan')
+
+
+def test_write_cutoff_edgelists():
+    net = CX2Network()
+    nodes = [net.add_node(attributes={'name': chr(65 + i)}) for i in range(5)]
+    for source, target, weight in [(0, 1, 0.2), (1, 2, 0.9), (2, 3, None),
+                                   (3, 4, 0.5), (0, 4, 0.9)]:
+        attributes = {'x': 1} if weight is None else {'Weight': weight}
+        net.add_edge(source=nodes[source], target=nodes[target], attributes=attributes)
+    sources, targets, weights = _get_edge_arrays(net)
+    assert [0, 1, 2, 3, 0] == sources.tolist()
+    assert [1, 2, 3, 4, 4] == targets.tolist()
+    assert np.isnan(weights[2])
+    with tempfile.TemporaryDirectory() as tempdir:
+        files = _write_cutoff_edgelists(sources, targets, weights, [0.5, 0.1, 1.0], tempdir)
+        assert os.path.join(tempdir, 'ppi_0.5.id.edgelist.tsv') == files[0]
+        with open(files[0]) as f:
+            assert '1\t2\n0\t4\n3\t4\n' == f.read()
+        with open(files[1]) as f:
+            assert '1\t2\n' == f.read()
+        with open(files[2]) as f:
+            assert '1\t2\n0\t4\n3\t4\n0\t1\n2\t3\n' == f.read()
+
+        files = _write_cutoff_edgelists(sources, targets, None, [0.5], tempdir)
+        with open(files[0]) as f:
+            assert '0\t1\n1\t2\n2\t3\n' == f.read()
+
+
 def _create_dummy_cx2_network(path):
     net = CX2Network()
     nodes = [net.add_node(attributes={'name': chr(65+i)}) for i in range(10)]
@@ -64,3 +279,140 @@ def test_community_detection_mode_runs_and_returns_cx2():
         net = factory.get_cx2network(result[0])
         assert isinstance(net, CX2Network)
         assert len(net.get_nodes()) > 0
+
+
+def test_get_tempdir():
+    with tempfile.TemporaryDirectory() as tempdir:
+        scratch = os.path.join(tempdir, 'scratch')
+        assert _get_tempdir(tempdir=tempdir) == tempdir
+        assert _get_tempdir(tempdir=tempdir, scratch_dir=scratch) == tempdir
+        os.makedirs(scratch)
+        assert _get_tempdir(tempdir=tempdir, scratch_dir=scratch, required_size=10) == scratch
+        assert _get_tempdir(tempdir=tempdir, scratch_dir=scratch, scratch_max_size=10,
+                            required_size=10) == scratch
+        assert _get_tempdir(tempdir=tempdir, scratch_dir=scratch, scratch_max_size=10,
+                            required_size=11) == tempdir
+        assert _get_tempdir(tempdir=tempdir, scratch_dir=scratch,
+                            required_size=shutil.disk_usage(scratch).free + 1) == tempdir
+
+
+def test_get_edgelists_size():
+    sources = np.array([0, 1, 1000, 2])
+    targets = np.array([3, 4, 5, 6])
+    with tempfile.TemporaryDirectory() as tempdir:
+        files = _write_cutoff_edgelists(sources, targets, None, [0.1, 0.5, 1.0], tempdir)
+        actual = sum(os.path.getsize(f) for f in files)
+    assert actual <= _get_edgelists_size(sources, targets, [0.1, 0.5, 1.0])
+    assert 0 == _get_edgelists_size(np.array([]), np.array([]), [0.1])
+
+
+def test_community_detection_mode_removes_tempdir_on_failure():
+    with tempfile.TemporaryDirectory() as tempdir:
+        cx2_path = os.path.join(tempdir, 'dummy.cx2')
+        _create_dummy_cx2_network(cx2_path)
+        created = []
+
+        def fake_run_hidef(edgelist_files, outputprefix, algorithm, maxres, k):
+            created.append(os.path.dirname(outputprefix))
+            assert all(os.path.isfile(f) for f in edgelist_files)
+            raise Exception('hidef error')
+
+        with patch.object(CDAPSHiDeFHierarchyGenerator, '_run_hidef', side_effect=fake_run_hidef):
+            with pytest.raises(Exception, match='hidef error'):
+                community_detection_mode(interactome=cx2_path, ndex_uuid='test-uuid-123',
+                                         tempdir=tempdir)
+        assert os.path.dirname(created[0]) == tempdir
+        assert os.path.basename(created[0]).startswith('cdetect_')
+        assert not os.path.exists(created[0])
+        assert os.listdir(tempdir) == ['dummy.cx2']
+
+
+def test_main_server_mode(capsys):
+    with tempfile.TemporaryDirectory() as tempdir:
+        embedding_file = os.path.join(tempdir, 'embedding.tsv')
+        _write_dummy_embedding(embedding_file)
+        args = ['input', '--mode', 'networkfromembedding',
+                '--embedding', embedding_file, '--embedding_cutoff', '0.5']
+        requests = [json.dumps({'id': 1, 'args': args}),
+                    json.dumps({'id': 2, 'args': ['input', '--mode', 'server']})]
+        with patch('sys.stdin', io.StringIO('\n'.join(requests) + '\n')):
+            assert main(['cellmaps_cywebserviceappcmd.py', '--mode', 'server']) == 0
+        lines = capsys.readouterr().out.splitlines()
+        assert len(lines) == 2
+        responses = {json.loads(line)['id']: json.loads(line) for line in lines}
+        assert responses[1]['status'] == 0
+        assert responses[1]['result'][0]['data'] == network_from_embedding_mode(embedding=embedding_file,
+                                                                                cutoff=0.5)
+        assert responses[2]['status'] == 2
+        assert 'cannot be requested from server' in responses[2]['error']
+
+
+def test_create_hcx_mode():
+    parent = CX2Network()
+    parent.add_network_attribute('name', 'parent')
+    for node_id, name in enumerate(['A', 'B', 'C']):
+        parent.add_node(node_id, attributes={'name': name})
+    hierarchy = CX2Network()
+    hierarchy.add_node(0, attributes={'name': 'C0', 'CD_MemberList': 'A B C'})
+    hierarchy.add_node(1, attributes={'name': 'C1', 'CD_MemberList': 'B C'})
+    hierarchy.add_edge(edge_id=0, source=0, target=1)
+    with tempfile.TemporaryDirectory() as tempdir:
+        parent_file = os.path.join(tempdir, 'parent.cx2')
+        hierarchy_file = os.path.join(tempdir, 'hierarchy.cx2')
+        parent.write_as_raw_cx2(parent_file)
+        hierarchy.write_as_raw_cx2(hierarchy_file)
+
+        result = create_hcx_mode(hierarchy_file, parent_file, interactome_uuid='1234')
+        assert len(result) == 1
+        hcx = RawCX2NetworkFactory().get_cx2network(result[0])
+        assert hcx.get_network_attributes()['HCX::interactionNetworkUUID'] == '1234'
+        assert hcx.get_node(0)['v']['HCX::isRoot'] is True
+        assert hcx.get_node(1)['v']['HCX::isRoot'] is False
+        assert hcx.get_node(1)['v']['HCX::members'] == [1, 2]
+
+        with pytest.raises(CellmapsPipelineError):
+            create_hcx_mode(hierarchy_file, None)
+
+
+def test_main_result_cache(capsys):
+    with tempfile.TemporaryDirectory() as tempdir:
+        embedding_file = os.path.join(tempdir, 'embedding.tsv')
+        _write_dummy_embedding(embedding_file)
+        cache_dir = os.path.join(tempdir, 'cache')
+        args = ['cellmaps_cywebserviceappcmd.py', 'input', '--mode', 'networkfromembedding',
+                '--embedding', embedding_file, '--embedding_cutoff', '0.5',
+                '--result_cache', cache_dir]
+        assert main(args) is None
+        expected = capsys.readouterr().out
+        assert len(os.listdir(cache_dir)) == 1
+
+        with patch('cellmaps_pipeline.cellmaps_cywebserviceapp.network_from_embedding_mode',
+                   side_effect=Exception('should not be called')):
+            assert main(args) is None
+            assert capsys.readouterr().out == expected
+
+            # server responses are compact so are cached separately
+            request = json.dumps({'id': 1, 'args': args[1:-2]})
+            with patch('sys.stdin', io.StringIO(request + '\n')):
+                assert main(['cellmaps_cywebserviceappcmd.py', '--mode', 'server',
+                             '--result_cache', cache_dir]) == 0
+            response = json.loads(capsys.readouterr().out)
+            assert response['status'] == 2
+
+        assert main(args + ['--no_pretty']) is None
+        assert json.loads(capsys.readouterr().out) == json.loads(expected)
+        assert len(os.listdir(cache_dir)) == 2
+
+        with patch('cellmaps_pipeline.cellmaps_cywebserviceapp.network_from_embedding_mode',
+                   side_effect=Exception('should not be called')):
+            with patch('sys.stdin', io.StringIO(request + '\n')):
+                assert main(['cellmaps_cywebserviceappcmd.py', '--mode', 'server',
+                             '--result_cache', cache_dir]) == 0
+            response = json.loads(capsys.readouterr().out)
+            assert response['status'] == 0
+            assert response['result'] == json.loads(expected)
+
+        # argument changing result is not a hit
+        assert main(args + ['--embedding_cutoff', '0.9']) is None
+        assert json.loads(capsys.readouterr().out) != json.loads(expected)
+        assert len(os.listdir(cache_dir)) == 3
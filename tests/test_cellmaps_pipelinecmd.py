@@ -4,6 +4,7 @@
 """Tests for `cellmaps_pipeline` package."""
 
 import os
+import json
 import tempfile
 import shutil
 
@@ -45,3 +46,99 @@ class TestCellmaps_pipeline(unittest.TestCase):
             self.assertEqual(res, 1)
         finally:
             shutil.rmtree(temp_dir)
+
+    def test_main_slurm_resources(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            provenance = os.path.join(temp_dir, 'provenance.json')
+            with open(provenance, 'w') as f:
+                json.dump({}, f)
+            resources = os.path.join(temp_dir, 'resources.json')
+            with open(resources, 'w') as f:
+                json.dump({'default': {'cpus_per_task': 2},
+                           'image_embedding': {'cpus_per_task': 16}}, f)
+            outdir = os.path.join(temp_dir, 'out')
+            os.makedirs(outdir)
+            res = cellmaps_pipelinecmd.main(['myprog.py', outdir, '--slurm',
+                                             '--provenance', provenance,
+                                             '--samples', 'samples.csv',
+                                             '--edgelist', 'edgelist.tsv',
+                                             '--baitlist', 'baitlist.tsv',
+                                             '--fold', '1',
+                                             '--slurm_resources', resources,
+                                             '--slurm_resource', 'image_embedding.mem=64G',
+                                             'ppi_download.cpus_per_task=1'])
+            self.assertNotEqual(2, res)
+            with open(os.path.join(outdir, 'imageembedjob1.sh'), 'r') as f:
+                data = f.read().split('\n')
+            self.assertTrue('#SBATCH --cpus-per-task=16' in data)
+            self.assertTrue('#SBATCH --mem=64G' in data)
+            with open(os.path.join(outdir, 'ppidownloadjob.sh'), 'r') as f:
+                self.assertTrue('#SBATCH --cpus-per-task=1' in f.read().split('\n'))
+            with open(os.path.join(outdir, 'hierarchyjob.sh'), 'r') as f:
+                self.assertTrue('#SBATCH --cpus-per-task=2' in f.read().split('\n'))
+
+            res = cellmaps_pipelinecmd.main(['myprog.py', outdir, '--slurm',
+                                             '--provenance', provenance,
+                                             '--samples', 'samples.csv',
+                                             '--edgelist', 'edgelist.tsv',
+                                             '--baitlist', 'baitlist.tsv',
+                                             '--slurm_resource', 'foo.mem=64G'])
+            self.assertEqual(2, res)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_main_slurm_image_shards(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            provenance = os.path.join(temp_dir, 'provenance.json')
+            with open(provenance, 'w') as f:
+                json.dump({}, f)
+            samples = os.path.join(temp_dir, 'samples.csv')
+            with open(samples, 'w') as f:
+                f.write('filename,if_plate_id,position,sample,locations,antibody,'
+                        'ensembl_ids,gene_names\n'
+                        '1_A1_1_,1,A1,1,Golgi apparatus,HPA000001,ENSG1,GENE1\n'
+                        '2_A1_1_,2,A1,1,Golgi apparatus,HPA000002,ENSG2,GENE2\n')
+            outdir = os.path.join(temp_dir, 'out')
+            os.makedirs(outdir)
+            res = cellmaps_pipelinecmd.main(['myprog.py', outdir, '--slurm',
+                                             '--provenance', provenance,
+                                             '--samples', samples,
+                                             '--edgelist', 'edgelist.tsv',
+                                             '--baitlist', 'baitlist.tsv',
+                                             '--fold', '1',
+                                             '--slurm_image_shards', '2'])
+            self.assertNotEqual(2, res)
+            self.assertTrue(os.path.isfile(os.path.join(outdir, 'imagedownloadarrayjob.sh')))
+            self.assertTrue(os.path.isfile(os.path.join(outdir, 'imageembedmergejob1.sh')))
+
+            res = cellmaps_pipelinecmd.main(['myprog.py', outdir, '--slurm',
+                                             '--provenance', provenance,
+                                             '--samples', samples,
+                                             '--edgelist', 'edgelist.tsv',
+                                             '--baitlist', 'baitlist.tsv',
+                                             '--slurm_image_shards', '0'])
+            self.assertEqual(2, res)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_main_slurm_local_invalid_budget(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            provenance = os.path.join(temp_dir, 'provenance.json')
+            with open(provenance, 'w') as f:
+                json.dump({}, f)
+            outdir = os.path.join(temp_dir, 'out')
+            os.makedirs(outdir)
+            for budget in [['--slurm_local_cpus', '0'], ['--slurm_local_mem', 'lots']]:
+                res = cellmaps_pipelinecmd.main(['myprog.py', outdir, '--slurm',
+                                                 '--provenance', provenance,
+                                                 '--samples', 'samples.csv',
+                                                 '--edgelist', 'edgelist.tsv',
+                                                 '--baitlist', 'baitlist.tsv',
+                                                 '--slurm_local'] + budget)
+                self.assertEqual(2, res)
+                self.assertFalse(os.path.isfile(os.path.join(outdir, 'slurm_cellmaps_job.sh')))
+        finally:
+            shutil.rmtree(temp_dir)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `cellmaps_shardcmd` script."""
+
+import os
+import tempfile
+import shutil
+
+import unittest
+from cellmaps_utils import constants
+from cellmaps_pipeline import cellmaps_shardcmd
+
+
+class TestCellmapsShardCmd(unittest.TestCase):
+    """Tests for `cellmaps_shardcmd` script."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+
+    def test_parse_arguments(self):
+        """Tests parse arguments"""
+        res = cellmaps_shardcmd._parse_arguments('hi', ['mergeimageembedding', 'outdir'])
+
+        self.assertEqual('mergeimageembedding', res.mode)
+        self.assertEqual('outdir', res.outdir)
+        self.assertEqual(1, res.fold)
+        self.assertEqual(1, res.verbose)
+        self.assertIsNone(res.shard_dirs)
+
+        res = cellmaps_shardcmd._parse_arguments('hi', ['imageembeddinginput', 'outdir',
+                                                        '--fold', '2', '--shard', '3',
+                                                        '--num_shards', '4',
+                                                        '--shard_dirs', 'a', 'b'])
+        self.assertEqual(2, res.fold)
+        self.assertEqual(3, res.shard)
+        self.assertEqual(4, res.num_shards)
+        self.assertEqual(['a', 'b'], res.shard_dirs)
+
+    def test_main_missing_required(self):
+        for mode in cellmaps_shardcmd.MODES:
+            self.assertEqual(2, cellmaps_shardcmd.main(['myprog.py', mode, 'outdir']))
+
+    def test_main_imageembeddinginput(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            image_dir = os.path.join(temp_dir, 'images')
+            for color in constants.COLORS:
+                os.makedirs(os.path.join(image_dir, color))
+                for image_id in ['1_A1_1_', '2_A1_1_', '3_A1_1_']:
+                    open(os.path.join(image_dir, color, image_id + color + '.jpg'), 'w').close()
+            with open(os.path.join(image_dir, '1_' + constants.IMAGE_GENE_NODE_ATTR_FILE), 'w') as f:
+                f.write('name\trepresents\tambiguous\tantibody\tfilename\timageurl\n'
+                        'A\tENSG1\t\tHPA1\t1_A1_1_\turl\n'
+                        'B\tENSG2\t\tHPA2\t2_A1_1_,3_A1_1_\turl\n')
+            input_dir = os.path.join(temp_dir, 'input1')
+            self.assertEqual(0, cellmaps_shardcmd.main(['myprog.py', 'imageembeddinginput',
+                                                        input_dir, '--image_dir', image_dir,
+                                                        '--shard', '1', '--num_shards', '2']))
+            self.assertEqual(['1_A1_1_red.jpg'], os.listdir(os.path.join(input_dir, constants.RED)))
+            self.assertTrue(os.path.isfile(os.path.join(input_dir,
+                                                        '1_' + constants.IMAGE_GENE_NODE_ATTR_FILE)))
+        finally:
+            shutil.rmtree(temp_dir)
@@ -4,12 +4,14 @@
 """Tests for `cellmaps_pipeline` package."""
 
 import os
+import json
 import unittest
 from unittest.mock import MagicMock
 import shutil
 import tempfile
 from cellmaps_pipeline.runner import CellmapsPipeline
 from cellmaps_pipeline.exceptions import CellmapsPipelineError
+from cellmaps_pipeline.metrics import StepMetricsRecorder
 
 
 class TestCellmapspipelinerunner(unittest.TestCase):
@@ -48,3 +50,27 @@ class TestCellmapspipelinerunner(unittest.TestCase):
             self.assertTrue(os.path.isdir(outdir))
         finally:
             shutil.rmtree(temp_dir)
+
+    def test_run_writes_step_metrics(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            outdir = os.path.join(temp_dir, 'pipeline')
+            runner = MagicMock()
+            runner.run = MagicMock(return_value=0)
+            runner.get_step_metrics = MagicMock(return_value=[{'step': 'ppi_download',
+                                                               'wall_time': 1.5}])
+            myobj = CellmapsPipeline(outdir=outdir, runner=runner)
+            self.assertEqual(0, myobj.run())
+
+            with open(os.path.join(outdir,
+                                   StepMetricsRecorder.PIPELINE_METRICS_FILE), 'r') as f:
+                pipeline_metrics = json.load(f)
+            self.assertEqual(0, pipeline_metrics['status'])
+            self.assertEqual('ppi_download', pipeline_metrics['steps'][0]['step'])
+
+            with open(myobj._get_task_finish_json_path(), 'r') as f:
+                task = json.load(f)
+            self.assertEqual('0', task['status'])
+            self.assertEqual(1.5, task['step_metrics'][0]['wall_time'])
+        finally:
+            shutil.rmtree(temp_dir)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `cellmaps_pipeline.cx2builder` module."""
+
+import io
+import json
+import unittest
+
+import numpy as np
+import pandas as pd
+from ndex2.cx2 import CX2Network
+
+from cellmaps_pipeline.cx2builder import get_cx2_from_edgelist
+from cellmaps_pipeline.jsonstream import write_json
+
+
+def _get_cx2_via_cx2network(sources, targets, weights, node_names=None,
+                            network_attributes=None):
+    net = CX2Network()
+    if network_attributes is not None:
+        for key, value in network_attributes.items():
+            net.add_network_attribute(key, value)
+    node_to_id = {}
+    for node in pd.unique(np.column_stack((sources, targets)).ravel()):
+        name = node_names[node] if node_names is not None else node
+        node_to_id[node] = net.add_node(attributes={'name': name})
+    for src, tgt, weight in zip(sources, targets, weights):
+        net.add_edge(source=node_to_id[src], target=node_to_id[tgt],
+                     attributes={'weight': weight})
+    return net.to_cx2()
+
+
+class TestCX2Builder(unittest.TestCase):
+
+    def setUp(self):
+        self.net_attrs = {'name': 'foo', 'description': 'bar'}
+
+    def _assert_identical(self, sources, targets, weights, node_names=None):
+        expected = _get_cx2_via_cx2network(sources, targets, weights,
+                                           node_names=node_names,
+                                           network_attributes=self.net_attrs)
+        res = get_cx2_from_edgelist(np.array(sources), np.array(targets),
+                                    np.array(weights, dtype=float),
+                                    node_names=node_names,
+                                    network_attributes=self.net_attrs)
+        self.assertEqual(json.dumps(expected), json.dumps(res))
+
+    def test_no_edges(self):
+        self._assert_identical([], [], [])
+        self.assertEqual(json.dumps(CX2Network().to_cx2()),
+                         json.dumps(get_cx2_from_edgelist([], [], [])))
+
+    def test_node_names(self):
+        names = np.array(['A', 'B', 'C', 'D'], dtype=object)
+        self._assert_identical([2, 0, 1], [3, 2, 3], [0.9, 0.5, 0.25],
+                               node_names=names)
+
+    def test_names_as_nodes(self):
+        self._assert_identical(['X', 'Y', 'Z'], ['Y', 'Z', 'W'], [1.0, 0.5, 0.0])
+
+    def test_integer_names(self):
+        self._assert_identical([2, 0, 1], [3, 2, 3], [0.9, 0.5, 0.25],
+                               node_names=np.array([10, 11, 12, 13]))
+
+    def test_random_edges(self):
+        rng = np.random.default_rng(4)
+        names = np.array(['G' + str(i) for i in range(50)], dtype=object)
+        self._assert_identical(rng.integers(0, 50, 200).tolist(),
+                               rng.integers(0, 50, 200).tolist(),
+                               rng.random(200).tolist(), node_names=names)
+
+    def test_lazy(self):
+        names = np.array(['A', 'B', 'C', 'D'], dtype=object)
+        expected = get_cx2_from_edgelist([2, 0, 1], [3, 2, 3], [0.9, 0.5, 0.25],
+                                         node_names=names)
+        res = get_cx2_from_edgelist([2, 0, 1], [3, 2, 3], [0.9, 0.5, 0.25],
+                                    node_names=names, lazy=True)
+        out = io.StringIO()
+        write_json(res, out)
+        self.assertEqual(json.dumps(expected, indent=2), out.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
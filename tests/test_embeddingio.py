@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `cellmaps_pipeline.embeddingio` module."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+from cellmaps_pipeline import embeddingio
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+
+
+class TestEmbeddingIO(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        rng = np.random.default_rng(3)
+        self.df = pd.DataFrame(rng.normal(size=(5, 4)),
+                               index=['G' + str(i) for i in range(5)])
+        self.text_file = os.path.join(self.temp_dir, 'embedding.tsv')
+        self.df.to_csv(self.text_file, sep='\t')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_get_embedding_files(self):
+        self.assertEqual(['/a/e.tsv'], embeddingio.get_embedding_files('/a/e.tsv'))
+        self.assertEqual(['/a/e.npy', '/a/e.genes.txt'],
+                         embeddingio.get_embedding_files('/a/e.npy'))
+        self.assertEqual('/a/e.genes.txt', embeddingio.get_genes_file('/a/e.NPY'))
+
+    def test_read_text(self):
+        df = embeddingio.read_embedding(self.text_file)
+        self.assertEqual(np.float64, df.values.dtype)
+        self.assertEqual(self.df.index.tolist(), df.index.tolist())
+        self.assertTrue(np.allclose(self.df.values, df.values, rtol=0, atol=1e-15))
+
+        df = embeddingio.read_embedding(self.text_file, dtype='float32')
+        self.assertEqual(np.float32, df.values.dtype)
+        self.assertEqual(self.df.index.tolist(), df.index.tolist())
+        self.assertTrue(np.array_equal(self.df.values.astype(np.float32), df.values))
+
+    def test_read_npy(self):
+        npy_file = os.path.join(self.temp_dir, 'embedding.npy')
+        embeddingio.write_npy_embedding(self.df, npy_file)
+        self.assertTrue(os.path.isfile(os.path.join(self.temp_dir, 'embedding.genes.txt')))
+
+        df = embeddingio.read_embedding(npy_file)
+        # read only since memory mapped
+        self.assertFalse(df.values.flags.writeable)
+        self.assertEqual(self.df.index.tolist(), df.index.tolist())
+        self.assertTrue(np.array_equal(self.df.values, df.values))
+
+        df = embeddingio.read_embedding(npy_file, dtype='float32', mmap=False)
+        self.assertTrue(df.values.flags.writeable)
+        self.assertEqual(np.float32, df.values.dtype)
+        self.assertTrue(np.array_equal(self.df.values.astype(np.float32), df.values))
+
+    def test_read_npy_genes_mismatch(self):
+        npy_file = os.path.join(self.temp_dir, 'embedding.npy')
+        embeddingio.write_npy_embedding(self.df, npy_file)
+        with open(embeddingio.get_genes_file(npy_file), 'a') as f:
+            f.write('extra\n')
+        try:
+            embeddingio.read_embedding(npy_file)
+            self.fail('Expected CellmapsPipelineError')
+        except CellmapsPipelineError as e:
+            self.assertTrue('(6) does not match number of rows' in str(e))
+
+    def test_read_npy_not_2d(self):
+        npy_file = os.path.join(self.temp_dir, 'embedding.npy')
+        np.save(npy_file, np.zeros(3))
+        with self.assertRaises(CellmapsPipelineError):
+            embeddingio.read_embedding(npy_file)
+
+    def test_read_parquet(self):
+        parquet_file = os.path.join(self.temp_dir, 'embedding.parquet')
+        with patch('pandas.read_parquet', return_value=self.df.reset_index()) as mock_read:
+            df = embeddingio.read_embedding(parquet_file, dtype='float32')
+        mock_read.assert_called_once_with(parquet_file, memory_map=True)
+        self.assertEqual(self.df.index.tolist(), df.index.tolist())
+        self.assertEqual(np.float32, df.values.dtype)
+
+        with patch('pandas.read_parquet', return_value=self.df):
+            df = embeddingio.read_embedding(parquet_file)
+        self.assertEqual(self.df.index.tolist(), df.index.tolist())
+
+        with patch('pandas.read_parquet', side_effect=ImportError('no pyarrow')):
+            with self.assertRaises(CellmapsPipelineError):
+                embeddingio.read_embedding(parquet_file)
+
+    def test_invalid_dtype(self):
+        with self.assertRaises(CellmapsPipelineError):
+            embeddingio.read_embedding(self.text_file, dtype='int8')
+
+    def test_write_npy_embedding_invalid_suffix(self):
+        with self.assertRaises(CellmapsPipelineError):
+            embeddingio.write_npy_embedding(self.df, os.path.join(self.temp_dir, 'x.tsv'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `cellmaps_pipeline.hcx` module."""
+
+import unittest
+
+from ndex2.cx2 import CX2Network
+
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+from cellmaps_pipeline.hcx import CX2HCXFromCDAPSCXHierarchy
+
+
+def _get_parent_network():
+    parent = CX2Network()
+    parent.add_network_attribute('name', 'my interactome')
+    for node_id, name in enumerate(['A', 'B', 'C', 'D']):
+        parent.add_node(node_id * 10, attributes={'name': name})
+    parent.add_edge(edge_id=0, source=0, target=10)
+    return parent
+
+
+def _get_hierarchy():
+    hierarchy = CX2Network()
+    hierarchy.add_node(0, attributes={'name': 'C0', 'CD_MemberList': 'D C B A'})
+    hierarchy.add_node(1, attributes={'name': 'C1', 'CD_MemberList': 'C A X'})
+    hierarchy.add_node(2, attributes={'name': 'C2', 'CD_MemberList': 'B'})
+    hierarchy.add_node(3, attributes={'name': 'C3'})
+    hierarchy.add_edge(edge_id=0, source=0, target=1)
+    hierarchy.add_edge(edge_id=1, source=0, target=2)
+    hierarchy.add_edge(edge_id=2, source=2, target=3)
+    return hierarchy
+
+
+class TestCX2HCXFromCDAPSCXHierarchy(unittest.TestCase):
+
+    def test_get_root_nodes(self):
+        converter = CX2HCXFromCDAPSCXHierarchy()
+        self.assertEqual({0}, converter._get_root_nodes(_get_hierarchy()))
+
+    def test_get_mapping_of_node_names_to_ids(self):
+        converter = CX2HCXFromCDAPSCXHierarchy()
+        self.assertEqual({'A': 0, 'B': 10, 'C': 20, 'D': 30},
+                         converter._get_mapping_of_node_names_to_ids(_get_parent_network()))
+
+    def test_add_members_node_attribute_none_map(self):
+        converter = CX2HCXFromCDAPSCXHierarchy()
+        try:
+            converter._add_members_node_attribute(_get_hierarchy())
+            self.fail('Expected exception')
+        except CellmapsPipelineError as e:
+            self.assertEqual('interactome name map is None', str(e))
+
+    def test_get_converted_hierarchy(self):
+        converter = CX2HCXFromCDAPSCXHierarchy()
+        hierarchy, parent = converter.get_converted_hierarchy(hierarchy=_get_hierarchy(),
+                                                              parent_network=_get_parent_network())
+        net_attrs = hierarchy.get_network_attributes()
+        self.assertEqual('hierarchy_v0.1', net_attrs['ndexSchema'])
+        self.assertEqual(2, net_attrs['HCX::modelFileCount'])
+        self.assertEqual('my interactome', net_attrs['HCX::interactionNetworkName'])
+        self.assertFalse('HCX::interactionNetworkUUID' in net_attrs)
+
+        nodes = hierarchy.get_nodes()
+        self.assertEqual([True, False, False, False],
+                         [nodes[i]['v']['HCX::isRoot'] for i in range(4)])
+        self.assertEqual([0, 10, 20, 30], nodes[0]['v']['HCX::members'])
+        self.assertEqual([0, 20], nodes[1]['v']['HCX::members'])
+        self.assertEqual([10], nodes[2]['v']['HCX::members'])
+        self.assertFalse('HCX::members' in nodes[3]['v'])
+
+        declarations = hierarchy.get_attribute_declarations()['nodes']
+        self.assertEqual('list_of_long', declarations['HCX::members']['d'])
+        self.assertEqual('boolean', declarations['HCX::isRoot']['d'])
+
+        self.assertTrue(len(hierarchy.get_visual_properties()) > 0)
+        self.assertTrue(len(parent.get_visual_properties()) > 0)
+
+    def test_get_converted_hierarchy_with_uuid(self):
+        converter = CX2HCXFromCDAPSCXHierarchy()
+        hierarchy, _ = converter.get_converted_hierarchy(hierarchy=_get_hierarchy(),
+                                                         parent_network=_get_parent_network(),
+                                                         interactome_uuid='1234')
+        net_attrs = hierarchy.get_network_attributes()
+        self.assertEqual('1234', net_attrs['HCX::interactionNetworkUUID'])
+        self.assertFalse('HCX::interactionNetworkName' in net_attrs)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `cellmaps_pipeline.jsonlinesserver` module."""
+
+import io
+import json
+import threading
+import time
+import unittest
+
+from cellmaps_pipeline.jsonlinesserver import JSONLinesServer
+
+
+def _get_responses(out_stream):
+    return {json.dumps(r['id']): r for r in
+            [json.loads(line) for line in out_stream.getvalue().splitlines()]}
+
+
+class TestJSONLinesServer(unittest.TestCase):
+
+    def test_serve(self):
+        def handler(args):
+            if args[0] == 'fail':
+                raise ValueError('failed')
+            if args[0] == 'exit':
+                raise SystemExit(2)
+            return {'args': args, 'gen': (i for i in range(int(args[0])))}
+
+        requests = [json.dumps({'id': 1, 'args': ['2', 'x']}), '',
+                    json.dumps({'id': 'b', 'args': ['fail']}),
+                    json.dumps({'id': 3, 'args': ['exit']}),
+                    json.dumps({'id': 4, 'args': 'notalist'}),
+                    json.dumps([1]),
+                    'not json',
+                    json.dumps({'args': [0]})]
+        out_stream = io.StringIO()
+        server = JSONLinesServer(handler, max_concurrent=3)
+        self.assertEqual(7, server.serve(io.StringIO('\n'.join(requests) + '\n'), out_stream))
+        lines = out_stream.getvalue().splitlines()
+        self.assertEqual(7, len(lines))
+        responses = _get_responses(out_stream)
+        self.assertEqual({'id': 1, 'status': 0, 'result': {'args': ['2', 'x'], 'gen': [0, 1]}},
+                         responses['1'])
+        self.assertEqual({'id': 'b', 'status': 2, 'error': 'failed'}, responses['"b"'])
+        self.assertEqual({'id': 3, 'status': 2, 'error': 'Invalid arguments, exit code: 2'},
+                         responses['3'])
+        self.assertEqual(2, responses['4']['status'])
+        self.assertEqual([0, 2, 2], sorted(json.loads(line)['status'] for line in lines
+                                           if json.loads(line)['id'] is None))
+
+    def test_serve_limits_concurrency(self):
+        lock = threading.Lock()
+        running = [0]
+        max_running = [0]
+
+        def handler(args):
+            with lock:
+                running[0] += 1
+                max_running[0] = max(max_running[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return args[0]
+
+        requests = ''.join(json.dumps({'id': i, 'args': [i]}) + '\n' for i in range(8))
+        out_stream = io.StringIO()
+        JSONLinesServer(handler, max_concurrent=2).serve(io.StringIO(requests), out_stream)
+        self.assertEqual(2, max_running[0])
+        responses = _get_responses(out_stream)
+        self.assertEqual([str(i) for i in range(8)],
+                         [responses[str(i)]['result'] for i in range(8)])
+
+    def test_serve_unserializable_result(self):
+        out_stream = io.StringIO()
+        JSONLinesServer(lambda args: object()).serve(io.StringIO('{"id": 7, "args": []}\n'),
+                                                     out_stream)
+        response = json.loads(out_stream.getvalue())
+        self.assertEqual(7, response['id'])
+        self.assertEqual(2, response['status'])
+        self.assertTrue(response['error'].startswith('Unable to serialize result'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `cellmaps_pipeline.jsonstream` module."""
+
+import io
+import json
+import unittest
+from unittest.mock import patch
+
+from cellmaps_pipeline import jsonstream
+from cellmaps_pipeline.jsonstream import write_json
+from cellmaps_pipeline.jsonstream import COMPACT_SEPARATORS
+
+
+class TestJSONStream(unittest.TestCase):
+
+    def setUp(self):
+        nodes = [{'id': i, 'v': {'name': 'G' + str(i) + '\n"'}} for i in range(9)]
+        self.values = [[], {}, 'str', 1.5, None, [[]], [[1, 2], [3]],
+                       {'x': [1, {'y': [3, {'z': 'q'}]}], 1: True, None: [{}], 2.5: 's'},
+                       [{'action': 'addNetworks',
+                         'data': [[{'CXVersion': '2.0', 'hasFragments': False},
+                                   {'nodes': nodes + [[1], {'k': [2]}, 3]},
+                                   {'status': [{'error': '', 'success': True}]}]]}]]
+
+    def _get_json(self, value, indent):
+        out = io.StringIO()
+        write_json(value, out, indent=indent)
+        return out.getvalue()
+
+    def test_matches_json_dumps(self):
+        for batch_size in [1, 2, 1024]:
+            with patch.object(jsonstream, 'BATCH_SIZE', batch_size):
+                for value in self.values:
+                    for indent in [0, 2, 4]:
+                        self.assertEqual(json.dumps(value, indent=indent),
+                                         self._get_json(value, indent))
+                    self.assertEqual(json.dumps(value, separators=COMPACT_SEPARATORS),
+                                     self._get_json(value, None))
+
+    def test_generators_are_written_as_arrays(self):
+        value = {'nodes': ({'id': i} for i in range(3)), 'empty': iter([])}
+        self.assertEqual(json.dumps({'nodes': [{'id': 0}, {'id': 1}, {'id': 2}],
+                                     'empty': []}, indent=2),
+                         self._get_json(value, 2))
+        value = {'id': 1, 'result': {'x': {'gen': (i for i in range(2))}}}
+        self.assertEqual(json.dumps({'id': 1, 'result': {'x': {'gen': [0, 1]}}}),
+                         self._get_json(value, None).replace(',', ', ').replace(':', ': '))
+
+    def test_raw_json_written_as_is(self):
+        value = [1, {'result': jsonstream.RawJSON('{"a":[1,2]}')}, 2]
+        self.assertEqual('[1,{"result":{"a":[1,2]}},2]', self._get_json(value, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
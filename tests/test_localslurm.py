@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `cellmaps_pipeline.localslurm` module."""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from cellmaps_pipeline import localslurm
+from cellmaps_pipeline.localslurm import LocalSLURMExecutor
+from cellmaps_pipeline.runner import SLURMPipelineRunner
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+
+
+class TestLocalSLURM(unittest.TestCase):
+    """Tests for `cellmaps_pipeline.localslurm` module."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self._temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        shutil.rmtree(self._temp_dir)
+
+    def _write_job(self, name, commands, cpus=1, mem='1G', time_limit=None, array=None):
+        with open(os.path.join(self._temp_dir, name + '.sh'), 'w') as f:
+            f.write('#!/bin/bash\n\n')
+            f.write('#SBATCH --job-name=' + name + '\n')
+            f.write('#SBATCH --chdir=' + self._temp_dir + '\n')
+            if array is not None:
+                f.write('#SBATCH --array=' + array + '\n')
+                f.write('#SBATCH --output=%x.%A_%a.out\n')
+            else:
+                f.write('#SBATCH --output=%x.%j.out\n')
+            f.write('#SBATCH --cpus-per-task=' + str(cpus) + '\n')
+            f.write('#SBATCH --mem=' + mem + '\n')
+            if time_limit is not None:
+                f.write('#SBATCH --time=' + time_limit + '\n')
+            f.write('\n' + commands + '\n')
+        return name + '.sh'
+
+    def _write_submit_script(self, lines):
+        submit_script = os.path.join(self._temp_dir, 'slurm_cellmaps_job.sh')
+        with open(submit_script, 'w') as f:
+            f.write('#! /bin/bash\n\n')
+            for line in lines:
+                f.write(line + '\n\n')
+            f.write('echo "job submitted; here is ID of final job: $c_job"\n')
+        return submit_script
+
+    def test_get_mem_bytes(self):
+        self.assertEqual(32 * 1024 ** 3, localslurm.get_mem_bytes('32G'))
+        self.assertEqual(512 * 1024 ** 2, localslurm.get_mem_bytes('512'))
+        self.assertEqual(2 * 1024, localslurm.get_mem_bytes('2k'))
+        with self.assertRaises(CellmapsPipelineError):
+            localslurm.get_mem_bytes('lots')
+
+    def test_get_time_seconds(self):
+        self.assertEqual(300, localslurm.get_time_seconds('5'))
+        self.assertEqual(330, localslurm.get_time_seconds('5:30'))
+        self.assertEqual(4 * 3600, localslurm.get_time_seconds('4:00:00'))
+        self.assertEqual(26 * 3600, localslurm.get_time_seconds('1-02'))
+        self.assertEqual(26 * 3600 + 60, localslurm.get_time_seconds('1-02:01'))
+        self.assertEqual(86400 + 1, localslurm.get_time_seconds('1-00:00:01'))
+        for bad in ['1:2:3:4', 'x', '']:
+            with self.assertRaises(CellmapsPipelineError):
+                localslurm.get_time_seconds(bad)
+
+    def test_get_submitted_jobs(self):
+        submit_script = self._write_submit_script([
+            "a_job=$(sbatch a.sh | awk '{print $4}')",
+            "if [ -n \"$SUBMIT_B\" ]; then b_job=$(sbatch --array=1-2 /tmp/b.sh | awk '{print $4}'); fi",
+            "c_job=$(sbatch --dependency=afterok:$a_job${b_job:+:$b_job} c.sh arg | awk '{print $4}')"])
+        jobs = localslurm.get_submitted_jobs(submit_script, env={'SUBMIT_B': '1'})
+        self.assertEqual([1, 2, 3], [job['submit_id'] for job in jobs])
+        self.assertEqual(os.path.join(self._temp_dir, 'a.sh'), jobs[0]['script'])
+        self.assertEqual('/tmp/b.sh', jobs[1]['script'])
+        self.assertEqual({'array': '1-2'}, jobs[1]['options'])
+        self.assertEqual([1, 2], jobs[2]['dependencies'])
+        self.assertEqual(os.path.join(self._temp_dir, 'c.sh'), jobs[2]['script'])
+
+        # only jobs actually submitted are returned
+        jobs = localslurm.get_submitted_jobs(submit_script)
+        self.assertEqual(['a.sh', 'c.sh'], [os.path.basename(job['script']) for job in jobs])
+        self.assertEqual([1], jobs[1]['dependencies'])
+
+        submit_script = self._write_submit_script([
+            "a_job=$(sbatch a.sh | awk '{print $4}')",
+            "c_job=$(sbatch --dependency=afterany:$a_job c.sh | awk '{print $4}')"])
+        with self.assertRaises(CellmapsPipelineError):
+            localslurm.get_submitted_jobs(submit_script)
+
+        submit_script = self._write_submit_script([
+            "c_job=$(sbatch --dependency=afterok:$a_job c.sh | awk '{print $4}')"])
+        with self.assertRaises(CellmapsPipelineError) as ce:
+            localslurm.get_submitted_jobs(submit_script)
+        self.assertTrue('unknown job' in str(ce.exception))
+
+        submit_script = self._write_submit_script(['exit 5'])
+        with self.assertRaises(CellmapsPipelineError) as ce:
+            localslurm.get_submitted_jobs(submit_script)
+        self.assertTrue('exited with 5' in str(ce.exception))
+
+    def test_parse_sbatch_directives(self):
+        script = os.path.join(self._temp_dir, self._write_job('a', 'echo hi\n#SBATCH --mem=9G',
+                                                              cpus=3, array='1-4'))
+        options = localslurm.parse_sbatch_directives(script)
+        self.assertEqual('3', options['cpus-per-task'])
+        self.assertEqual('1G', options['mem'])
+        self.assertEqual('1-4', options['array'])
+        self.assertEqual('a', options['job-name'])
+
+    def test_constructor_invalid(self):
+        with self.assertRaises(CellmapsPipelineError):
+            LocalSLURMExecutor(max_cpus=0)
+        with self.assertRaises(CellmapsPipelineError):
+            LocalSLURMExecutor(max_mem='lots')
+
+    def test_run_dependencies_and_arrays(self):
+        self._write_job('a', 'echo a >> order.txt')
+        self._write_job('b', 'echo b$SLURM_ARRAY_TASK_ID.$SLURM_ARRAY_JOB_ID >> order.txt',
+                        array='1-3')
+        self._write_job('c', 'echo c$SLURM_JOB_ID >> order.txt\necho $SLURM_CPUS_PER_TASK',
+                        cpus=2)
+        submit_script = self._write_submit_script([
+            "a_job=$(sbatch a.sh | awk '{print $4}')",
+            "b_job=$(sbatch --dependency=afterok:$a_job b.sh | awk '{print $4}')",
+            "c_job=$(sbatch --dependency=afterok:$a_job:$b_job c.sh | awk '{print $4}')"])
+        executor = LocalSLURMExecutor(max_cpus=2, poll_interval=0.01)
+        self.assertEqual(0, executor.run(submit_script))
+
+        with open(os.path.join(self._temp_dir, 'order.txt'), 'r') as f:
+            lines = f.read().split()
+        self.assertEqual('a', lines[0])
+        self.assertEqual(['b1.2', 'b2.2', 'b3.2'], sorted(lines[1:4]))
+        self.assertEqual('c6', lines[4])
+        self.assertTrue(os.path.isfile(os.path.join(self._temp_dir, 'b.2_3.out')))
+        with open(os.path.join(self._temp_dir, 'c.6.out'), 'r') as f:
+            self.assertEqual('2\n', f.read())
+
+        metrics = executor.get_job_metrics()
+        self.assertEqual(['a', 'b', 'c'], [x['step'] for x in metrics])
+        self.assertEqual(['COMPLETED'] * 3, [x['state'] for x in metrics])
+        self.assertEqual([1, 2, 6], [x['job_id'] for x in metrics])
+        self.assertEqual(3, len(metrics[1]['tasks']))
+        self.assertFalse('tasks' in metrics[0])
+        self.assertTrue(metrics[2]['start_time'] >= metrics[1]['end_time'])
+        for x in metrics:
+            self.assertEqual(0, x['exit_code'])
+            self.assertTrue(x['wall_time'] >= 0)
+            self.assertTrue(x['wait_time'] >= 0)
+            self.assertIsNotNone(x['cpu_time'])
+            self.assertTrue(x['peak_rss'] > 0)
+
+        with open(os.path.join(self._temp_dir, LocalSLURMExecutor.REPORT_FILE), 'r') as f:
+            report = json.load(f)
+        self.assertEqual(2, report['max_cpus'])
+        self.assertEqual(3, len(report['jobs']))
+        self.assertTrue(report['elapsed_time'] > 0)
+
+    def test_run_failed_dependency_cancels(self):
+        self._write_job('a', 'exit 3')
+        self._write_job('b', 'touch b.txt')
+        self._write_job('c', 'touch c.txt')
+        submit_script = self._write_submit_script([
+            "a_job=$(sbatch a.sh | awk '{print $4}')",
+            "b_job=$(sbatch --dependency=afterok:$a_job b.sh | awk '{print $4}')",
+            "c_job=$(sbatch c.sh | awk '{print $4}')"])
+        executor = LocalSLURMExecutor(poll_interval=0.01)
+        self.assertEqual(1, executor.run(submit_script))
+        metrics = executor.get_job_metrics()
+        self.assertEqual(['FAILED', 'CANCELLED', 'COMPLETED'], [x['state'] for x in metrics])
+        self.assertEqual(3, metrics[0]['exit_code'])
+        self.assertIsNone(metrics[1]['start_time'])
+        self.assertFalse(os.path.isfile(os.path.join(self._temp_dir, 'b.txt')))
+        self.assertTrue(os.path.isfile(os.path.join(self._temp_dir, 'c.txt')))
+
+    def test_run_cpu_and_mem_budget(self):
+        # each job writes start and end time so overlap can be checked
+        cmd = 'date +%s.%N > $SLURM_JOB_NAME.start\nsleep 0.3\ndate +%s.%N > $SLURM_JOB_NAME.end'
+        self._write_job('a', cmd, cpus=2, mem='2G')
+        self._write_job('b', cmd, cpus=2, mem='2G')
+        # requests more than budget, so gets the whole budget
+        self._write_job('c', cmd, cpus=8, mem='2G')
+        submit_script = self._write_submit_script([
+            "a_job=$(sbatch a.sh | awk '{print $4}')",
+            "b_job=$(sbatch b.sh | awk '{print $4}')",
+            "c_job=$(sbatch c.sh | awk '{print $4}')"])
+
+        def get_times(name):
+            times = []
+            for suffix in ['.start', '.end']:
+                with open(os.path.join(self._temp_dir, name + suffix), 'r') as f:
+                    times.append(float(f.read()))
+            return times
+
+        self.assertEqual(0, LocalSLURMExecutor(max_cpus=4, poll_interval=0.01).run(submit_script))
+        a, b, c = get_times('a'), get_times('b'), get_times('c')
+        # a and b fit together, c runs alone
+        self.assertTrue(b[0] < a[1])
+        self.assertTrue(c[0] >= max(a[1], b[1]))
+
+        # memory budget only fits one job at a time
+        self.assertEqual(0, LocalSLURMExecutor(max_cpus=4, max_mem='3G',
+                                               poll_interval=0.01).run(submit_script))
+        a, b = get_times('a'), get_times('b')
+        self.assertTrue(b[0] >= a[1])
+
+    def test_run_time_limit(self):
+        self._write_job('a', 'sleep 30', time_limit='0:01')
+        submit_script = self._write_submit_script(["a_job=$(sbatch a.sh | awk '{print $4}')"])
+        executor = LocalSLURMExecutor(poll_interval=0.01)
+        self.assertEqual(1, executor.run(submit_script))
+        metrics = executor.get_job_metrics()
+        self.assertEqual('TIMEOUT', metrics[0]['state'])
+        self.assertEqual(-9, metrics[0]['exit_code'])
+        self.assertTrue(metrics[0]['wall_time'] < 10)
+
+    def _write_tool_stubs(self):
+        bin_dir = os.path.join(self._temp_dir, 'bin')
+        os.makedirs(bin_dir)
+        # stand-ins for the tools invoked by job scripts that create their
+        # output directory, log their name and fail if named in FAIL_CMD
+        for cmd in ['cellmaps_imagedownloadercmd.py', 'cellmaps_ppidownloadercmd.py',
+                    'cellmaps_image_embeddingcmd.py', 'cellmaps_ppi_embeddingcmd.py',
+                    'cellmaps_coembeddingcmd.py', 'cellmaps_generate_hierarchycmd.py',
+                    'cellmaps_hierarchyevalcmd.py']:
+            cmd_path = os.path.join(bin_dir, cmd)
+            with open(cmd_path, 'w') as f:
+                f.write('#!/bin/bash\nmkdir -p "$1"\necho ' + cmd + ' >> ' +
+                        os.path.join(self._temp_dir, 'cmds.txt') + '\n' +
+                        '[ "$FAIL_CMD" != "' + cmd + '" ]\n')
+            os.chmod(cmd_path, 0o755)
+        return bin_dir
+
+    def _get_cmds(self):
+        cmds_file = os.path.join(self._temp_dir, 'cmds.txt')
+        if not os.path.isfile(cmds_file):
+            return []
+        with open(cmds_file, 'r') as f:
+            cmds = f.read().split()
+        os.remove(cmds_file)
+        return cmds
+
+    def test_run_slurm_pipeline_runner(self):
+        bin_dir = self._write_tool_stubs()
+        outdir = os.path.join(self._temp_dir, 'out')
+        os.makedirs(outdir)
+        executor = LocalSLURMExecutor(max_cpus=8, poll_interval=0.01,
+                                      env={'PATH': bin_dir + os.pathsep + os.environ['PATH']})
+        runner = SLURMPipelineRunner(outdir, samples='samples.csv', edgelist='edgelist',
+                                     baitlist='baitlist', provenance='provenance.json',
+                                     fold=[1, 2], local_executor=executor)
+        self.assertEqual(0, runner.run())
+        metrics = runner.get_step_metrics()
+        self.assertEqual(['imagedownload', 'ppidownload', 'ppiembed', 'imageembed1',
+                          'imageembed2', 'coembedding1', 'coembedding2', 'hierarchy',
+                          'hierarchyeval'], [x['step'] for x in metrics])
+        self.assertTrue(all(x['state'] == 'COMPLETED' for x in metrics))
+        # co-embedding waits on image and PPI embedding
+        self.assertEqual([4, 3], metrics[5]['dependencies'])
+        self.assertTrue(metrics[5]['start_time'] >= metrics[2]['end_time'])
+        cmds = self._get_cmds()
+        self.assertEqual(9, len(cmds))
+        self.assertEqual('cellmaps_hierarchyevalcmd.py', cmds[-1])
+        self.assertTrue(os.path.isdir(os.path.join(outdir, '5.hierarchyeval')))
+        self.assertTrue(os.path.isfile(os.path.join(outdir, LocalSLURMExecutor.REPORT_FILE)))
+
+        self.assertEqual([], SLURMPipelineRunner(outdir).get_step_metrics())
+
+    def test_run_slurm_pipeline_runner_resume(self):
+        bin_dir = self._write_tool_stubs()
+        outdir = os.path.join(self._temp_dir, 'out')
+        os.makedirs(outdir)
+        path = bin_dir + os.pathsep + os.environ['PATH']
+
+        def run_pipeline(env):
+            runner = SLURMPipelineRunner(outdir, samples='samples.csv', edgelist='edgelist',
+                                         baitlist='baitlist', provenance='provenance.json',
+                                         fold=[1, 2],
+                                         local_executor=LocalSLURMExecutor(max_cpus=8,
+                                                                           poll_interval=0.01,
+                                                                           env=env))
+            return runner.run(), runner.get_step_metrics()
+
+        # co-embedding fails leaving partial output directories
+        res, metrics = run_pipeline({'PATH': path, 'FAIL_CMD': 'cellmaps_coembeddingcmd.py'})
+        self.assertEqual(1, res)
+        self.assertEqual({'imagedownload': 'COMPLETED', 'ppidownload': 'COMPLETED',
+                          'ppiembed': 'COMPLETED', 'imageembed1': 'COMPLETED',
+                          'coembedding1': 'FAILED', 'imageembed2': 'COMPLETED',
+                          'coembedding2': 'FAILED', 'hierarchy': 'CANCELLED',
+                          'hierarchyeval': 'CANCELLED'},
+                         {x['step']: x['state'] for x in metrics})
+        self.assertEqual(7, len(self._get_cmds()))
+        coembed_dir = os.path.join(outdir, '3.coembedding_fold1')
+        self.assertFalse(os.path.isfile(os.path.join(coembed_dir,
+                                                     SLURMPipelineRunner.COMPLETION_MARKER)))
+        open(os.path.join(coembed_dir, 'partial'), 'w').close()
+
+        # only failed and cancelled steps are resubmitted, depending
+        # only on each other, and partial output is removed
+        res, metrics = run_pipeline({'PATH': path})
+        self.assertEqual(0, res)
+        self.assertEqual(['coembedding1', 'coembedding2', 'hierarchy', 'hierarchyeval'],
+                         [x['step'] for x in metrics])
+        self.assertEqual([[], [], [1, 2], [3]], [x['dependencies'] for x in metrics])
+        self.assertEqual(4, len(self._get_cmds()))
+        self.assertFalse(os.path.isfile(os.path.join(coembed_dir, 'partial')))
+        self.assertTrue(os.path.isfile(os.path.join(coembed_dir,
+                                                    SLURMPipelineRunner.COMPLETION_MARKER)))
+
+        # nothing left to run
+        res, metrics = run_pipeline({'PATH': path})
+        self.assertEqual(0, res)
+        self.assertEqual([], metrics)
+        self.assertEqual([], self._get_cmds())
+
+        # steps downstream of a rerun step are rerun too
+        os.remove(os.path.join(outdir, '2.ppi_embedding', SLURMPipelineRunner.COMPLETION_MARKER))
+        res, metrics = run_pipeline({'PATH': path})
+        self.assertEqual(0, res)
+        self.assertEqual(['ppiembed', 'coembedding1', 'coembedding2', 'hierarchy', 'hierarchyeval'],
+                         [x['step'] for x in metrics])
+
+    def test_run_slurm_pipeline_runner_resume_shards(self):
+        bin_dir = self._write_tool_stubs()
+        # logs mode of shard command and fails if it is named in FAIL_CMD
+        cmd_path = os.path.join(bin_dir, 'cellmaps_shardcmd.py')
+        with open(cmd_path, 'w') as f:
+            f.write('#!/bin/bash\nmkdir -p "$2"\necho $1 >> ' +
+                    os.path.join(self._temp_dir, 'cmds.txt') + '\n' +
+                    '[ "$FAIL_CMD" != "$1" ]\n')
+        os.chmod(cmd_path, 0o755)
+        outdir = os.path.join(self._temp_dir, 'out')
+        os.makedirs(outdir)
+        path = bin_dir + os.pathsep + os.environ['PATH']
+
+        def run_pipeline(env):
+            runner = SLURMPipelineRunner(outdir, cm4ai_image='image', edgelist='edgelist',
+                                         baitlist='baitlist', provenance='provenance.json',
+                                         image_shards=2,
+                                         local_executor=LocalSLURMExecutor(max_cpus=8,
+                                                                           poll_interval=0.01,
+                                                                           env=env))
+            return runner.run(), runner.get_step_metrics()
+
+        # merge of image embedding shards fails
+        res, metrics = run_pipeline({'PATH': path, 'FAIL_CMD': 'mergeimageembedding'})
+        self.assertEqual(1, res)
+        self.assertEqual('FAILED', metrics[4]['state'])
+        self.assertEqual(2, self._get_cmds().count('cellmaps_image_embeddingcmd.py'))
+        shards_dir = os.path.join(outdir, '2.image_embedding_fold1_shards')
+        for shard in ['shard1', 'shard2']:
+            self.assertTrue(os.path.isfile(os.path.join(shards_dir, shard,
+                                                        SLURMPipelineRunner.COMPLETION_MARKER)))
+
+        # finished shards are not embedded again, only merged
+        res, metrics = run_pipeline({'PATH': path})
+        self.assertEqual(0, res)
+        self.assertEqual(['imageembedshard1', 'imageembedmerge1', 'coembedding1', 'hierarchy',
+                          'hierarchyeval'], [x['step'] for x in metrics])
+        cmds = self._get_cmds()
+        self.assertEqual(0, cmds.count('cellmaps_image_embeddingcmd.py'))
+        self.assertEqual(1, cmds.count('mergeimageembedding'))
+
+        # shards are embedded again if image download is rerun
+        os.remove(os.path.join(outdir, '1.image_download', SLURMPipelineRunner.COMPLETION_MARKER))
+        res, metrics = run_pipeline({'PATH': path})
+        self.assertEqual(0, res)
+        self.assertEqual(2, self._get_cmds().count('cellmaps_image_embeddingcmd.py'))
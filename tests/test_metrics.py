@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `cellmaps_pipeline.metrics` module."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cellmaps_pipeline.metrics import StepMetricsRecorder
+from cellmaps_pipeline.metrics import count_file_rows
+from cellmaps_pipeline.metrics import count_files
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.recorder = StepMetricsRecorder(metrics_dir=os.path.join(self.temp_dir,
+                                                                     StepMetricsRecorder.METRICS_DIR))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_count_file_rows(self):
+        tsv_file = os.path.join(self.temp_dir, 'x.tsv')
+        self.assertIsNone(count_file_rows(tsv_file))
+        with open(tsv_file, 'w') as f:
+            f.write('a\tb\n1\t2\n3\t4')
+        self.assertEqual(2, count_file_rows(tsv_file))
+        self.assertEqual(3, count_file_rows(tsv_file, header=False))
+        with open(tsv_file, 'w') as f:
+            f.write('')
+        self.assertEqual(0, count_file_rows(tsv_file))
+
+    def test_count_files(self):
+        self.assertIsNone(count_files(os.path.join(self.temp_dir, 'nonexistent')))
+        os.makedirs(os.path.join(self.temp_dir, 'red'))
+        for name in ['red/a.JPG', 'red/b.png', 'c.tsv']:
+            with open(os.path.join(self.temp_dir, name), 'w') as f:
+                f.write('x')
+        self.assertEqual(3, count_files(self.temp_dir))
+        self.assertEqual(2, count_files(self.temp_dir, suffixes=('.jpg', '.png')))
+
+    def test_measure(self):
+        def step_func(step_name):
+            with open(os.path.join(self.temp_dir, step_name + '.txt'), 'w') as f:
+                f.write('x' * 1000)
+            return 0
+
+        self.assertEqual(0, self.recorder.measure('a', step_func,
+                                                  item_counter=lambda x: {'genes': 5}))
+        self.assertEqual(2, self.recorder.measure('b', lambda x: 2,
+                                                  item_counter=lambda x: {'genes': 5}))
+        step_metrics = self.recorder.get_step_metrics()
+        self.assertEqual(['a', 'b'], [m['step'] for m in step_metrics])
+        self.assertEqual({'genes': 5}, step_metrics[0]['items'])
+        self.assertEqual({}, step_metrics[1]['items'])
+        self.assertEqual(2, step_metrics[1]['exit_code'])
+        for key in ['wall_time', 'cpu_time', 'cpu_user_time', 'cpu_system_time']:
+            self.assertTrue(step_metrics[0][key] >= 0)
+        self.assertTrue(step_metrics[0]['peak_rss'] > 0)
+        if step_metrics[0]['bytes_written'] is not None:
+            self.assertTrue(step_metrics[0]['bytes_written'] >= 1000)
+
+        self.recorder.clear()
+        self.assertEqual([], self.recorder.get_step_metrics())
+
+    def test_measure_step_raises_exception(self):
+        def step_func(step_name):
+            raise ValueError('bad')
+
+        with self.assertRaises(ValueError):
+            self.recorder.measure('a', step_func)
+        step_metrics = self.recorder.get_step_metrics()
+        self.assertEqual(1, len(step_metrics))
+        self.assertIsNone(step_metrics[0]['exit_code'])
+
+    def test_measure_item_counter_raises_exception(self):
+        def item_counter(step_name):
+            raise ValueError('bad')
+
+        self.assertEqual(0, self.recorder.measure('a', lambda x: 0,
+                                                  item_counter=item_counter))
+        self.assertEqual({}, self.recorder.get_step_metrics()[0]['items'])
+
+
+if __name__ == '__main__':
+    unittest.main()
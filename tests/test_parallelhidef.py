@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `cellmaps_pipeline.parallelhidef` module."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+from cellmaps_pipeline.parallelhidef import ParallelHiDeFRunner
+from cellmaps_pipeline.parallelhidef import get_hidef_numthreads
+from cellmaps_pipeline.parallelhidef import merge_hidef_outputs
+from cellmaps_pipeline.parallelhidef import read_hidef_clusters
+
+
+def _write_nodes(path, rows):
+    with open(path, 'w') as f:
+        for row in rows:
+            f.write('\t'.join([row[0], str(len(row[1].split())), row[1], str(row[2])]) + '\n')
+
+
+def _read_rows(path):
+    with open(path, 'r') as f:
+        return [line.rstrip('\n').split('\t') for line in f]
+
+
+class TestParallelHiDeF(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def test_get_hidef_numthreads(self):
+        self.assertEqual(4, get_hidef_numthreads(2, cpu_count=8))
+        self.assertEqual(2, get_hidef_numthreads(3, cpu_count=8))
+        self.assertEqual(1, get_hidef_numthreads(16, cpu_count=8))
+        self.assertEqual(8, get_hidef_numthreads(0, cpu_count=8))
+
+    def test_read_hidef_clusters(self):
+        nodes_file = os.path.join(self._temp_dir, 'x.nodes')
+        self.assertEqual([], read_hidef_clusters(nodes_file))
+        _write_nodes(nodes_file, [('Cluster0-0', 'A B C D E', 0),
+                                  ('Cluster1-0', 'A B C', 8)])
+        self.assertEqual([('Cluster0-0', ['A', 'B', 'C', 'D', 'E'], 0),
+                          ('Cluster1-0', ['A', 'B', 'C'], 8)], read_hidef_clusters(nodes_file))
+
+    def test_merge_hidef_outputs(self):
+        one = os.path.join(self._temp_dir, 'h.0')
+        two = os.path.join(self._temp_dir, 'h.1')
+        _write_nodes(one + '.nodes', [('Cluster0-0', '1 2 3 4 5 6', 0),
+                                      ('Cluster1-0', '1 2 3', 5),
+                                      ('Cluster2-0', '1 2', 2)])
+        _write_nodes(two + '.nodes', [('Cluster0-0', '1 2 3 4 5 6 7', 0),
+                                      ('Cluster1-0', '1 2 3', 3),
+                                      ('Cluster1-1', '4 5 6', 4)])
+        outprefix = os.path.join(self._temp_dir, 'h')
+        self.assertEqual(4, merge_hidef_outputs([one, two], outprefix))
+
+        nodes = {row[2]: row for row in _read_rows(outprefix + '.nodes')}
+        self.assertEqual(['1 2', '1 2 3', '1 2 3 4 5 6 7', '4 5 6'], sorted(nodes.keys()))
+        self.assertEqual('0', nodes['1 2 3 4 5 6 7'][3])
+        # identical clusters are merged and persistence summed
+        self.assertEqual('8', nodes['1 2 3'][3])
+        self.assertEqual('4', nodes['4 5 6'][3])
+
+        edges = set((nodes_row, child) for nodes_row, child, _ in _read_rows(outprefix + '.edges'))
+        name = {row[2]: row[0] for row in nodes.values()}
+        self.assertEqual({(name['1 2 3 4 5 6 7'], name['1 2 3']),
+                          (name['1 2 3 4 5 6 7'], name['4 5 6']),
+                          (name['1 2 3'], name['1 2'])}, edges)
+
+    def test_merge_hidef_outputs_no_clusters(self):
+        outprefix = os.path.join(self._temp_dir, 'h')
+        open(outprefix + '.0.nodes', 'w').close()
+        self.assertEqual(0, merge_hidef_outputs([outprefix + '.0'], outprefix))
+        self.assertEqual([['Cluster0-0', '0', '', '0']], _read_rows(outprefix + '.nodes'))
+        self.assertEqual(0, os.path.getsize(outprefix + '.edges'))
+
+    def test_merge_hidef_outputs_missing_nodes_file(self):
+        one = os.path.join(self._temp_dir, 'h.0')
+        _write_nodes(one + '.nodes', [('Cluster0-0', '1 2 3', 0),
+                                      ('Cluster1-0', '1 2', 5)])
+        outprefix = os.path.join(self._temp_dir, 'h')
+        with self.assertRaises(CellmapsPipelineError) as ce:
+            merge_hidef_outputs([one, outprefix + '.1'], outprefix)
+        self.assertEqual('HiDeF output ' + outprefix + '.1.nodes not found', str(ce.exception))
+        self.assertFalse(os.path.isfile(outprefix + '.nodes'))
+
+    def _get_hier_generator(self, fail_edgelists, no_cluster_edgelists=None,
+                            no_output_edgelists=None):
+        hier_generator = MagicMock()
+        hier_generator._python = 'python'
+        hier_generator._hidef_cmd = 'hidef_finder.py'
+
+        def fake_run_cmd(cmd):
+            edgelist = cmd[cmd.index('--g') + 1]
+            if edgelist in fail_edgelists:
+                return 1, 'out', 'ValueError: bad input'
+            if no_cluster_edgelists is not None and edgelist in no_cluster_edgelists:
+                # traceback HiDeF writes when no clusters are found
+                return 1, b'', (b'    cluG_collapsed.insert(0, np.ones(len(cluG_collapsed[0]), ))\n'
+                                b'IndexError: list index out of range\n')
+            if no_output_edgelists is not None and edgelist in no_output_edgelists:
+                return 0, '', ''
+            _write_nodes(cmd[cmd.index('--o') + 1] + '.nodes',
+                         [('Cluster0-0', '1 2 3 4 5 6 7 8', 0),
+                          ('Cluster1-0', edgelist, 3)])
+            return 0, '', ''
+        hier_generator._run_cmd.side_effect = fake_run_cmd
+        return hier_generator
+
+    def test_run(self):
+        hier_generator = self._get_hier_generator([])
+        runner = ParallelHiDeFRunner(workers=2, hier_generator=hier_generator)
+        outprefix = os.path.join(self._temp_dir, 'h')
+        self.assertEqual(2, runner.run(['1 2 3', '2 3 4'], outprefix, 'leiden', 80, 10))
+
+        self.assertEqual(2, hier_generator._run_cmd.call_count)
+        cmd = hier_generator._run_cmd.call_args_list[0][0][0]
+        self.assertEqual(['python', 'hidef_finder.py', '--g', '1 2 3',
+                          '--o', outprefix + '.0', '--alg', 'leiden',
+                          '--maxres', '80', '--k', '10', '--numthreads'], cmd[:13])
+        self.assertEqual('--skipgml', cmd[-1])
+        self.assertEqual(['1 2 3', '2 3 4'], sorted(row[2] for row in _read_rows(outprefix + '.nodes')
+                                                    if row[0] != 'Cluster0-0'))
+
+    def test_run_one_edgelist_fails(self):
+        for workers in [1, 2]:
+            hier_generator = self._get_hier_generator(['b'])
+            runner = ParallelHiDeFRunner(workers=workers, hier_generator=hier_generator)
+            outprefix = os.path.join(self._temp_dir, 'h' + str(workers))
+            with self.assertRaises(CellmapsPipelineError) as ce:
+                runner.run(['a', 'b', 'c'], outprefix, 'leiden', 80, 10)
+            self.assertTrue('HiDeF failed on b' in str(ce.exception))
+            self.assertTrue('ValueError' in str(ce.exception))
+            self.assertFalse(os.path.isfile(outprefix + '.nodes'))
+
+    def test_run_one_edgelist_without_output(self):
+        hier_generator = self._get_hier_generator([], no_output_edgelists=['b'])
+        runner = ParallelHiDeFRunner(workers=2, hier_generator=hier_generator)
+        outprefix = os.path.join(self._temp_dir, 'h')
+        with self.assertRaises(CellmapsPipelineError) as ce:
+            runner.run(['a', 'b'], outprefix, 'leiden', 80, 10)
+        self.assertEqual('HiDeF output ' + outprefix + '.1.nodes not found', str(ce.exception))
+        self.assertFalse(os.path.isfile(outprefix + '.nodes'))
+
+    def test_run_one_edgelist_without_clusters(self):
+        hier_generator = self._get_hier_generator([], no_cluster_edgelists=['1 2'])
+        runner = ParallelHiDeFRunner(workers=2, hier_generator=hier_generator)
+        outprefix = os.path.join(self._temp_dir, 'h')
+        self.assertEqual(1, runner.run(['1 2', '2 3 4'], outprefix, 'leiden', 80, 10))
+        self.assertEqual(0, os.path.getsize(outprefix + '.0.nodes'))
+        self.assertEqual(['2 3 4'], [row[2] for row in _read_rows(outprefix + '.nodes')
+                                     if row[0] != 'Cluster0-0'])
+
+
+if __name__ == '__main__':
+    unittest.main()
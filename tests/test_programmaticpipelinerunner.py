@@ -7,6 +7,10 @@ import unittest
 from cellmaps_imagedownloader.exceptions import CellMapsImageDownloaderError
 
 from cellmaps_pipeline.runner import ProgrammaticPipelineRunner
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+from cellmaps_pipeline.artifactstore import ArtifactStore
+from cellmaps_pipeline.metrics import StepMetricsRecorder
+from cellmaps_utils import constants
 import os
 import shutil
 from unittest.mock import patch, MagicMock
@@ -30,6 +34,170 @@ class TestProgrammaticPipelineRunner(unittest.TestCase):
         with self.assertRaises(CellMapsImageDownloaderError):
             self.runner._download_images()
 
+    def test_get_step_dependencies_two_folds(self):
+        runner = ProgrammaticPipelineRunner(outdir=self.outdir, fold=[1, 2])
+        steps = dict(runner._get_step_dependencies())
+        self.assertEqual([], steps['image_download'])
+        self.assertEqual([], steps['ppi_download'])
+        self.assertEqual(['ppi_download'], steps['ppi_embedding'])
+        self.assertEqual(['image_download'], steps['image_embedding_fold1'])
+        self.assertEqual(['image_download'], steps['image_embedding_fold2'])
+        self.assertEqual(['image_embedding_fold1', 'ppi_embedding'],
+                         steps['coembedding_fold1'])
+        self.assertEqual(['image_embedding_fold2', 'ppi_embedding'],
+                         steps['coembedding_fold2'])
+        self.assertEqual(['image_download', 'ppi_download',
+                          'coembedding_fold1', 'coembedding_fold2'],
+                         steps['hierarchy'])
+        self.assertEqual(['hierarchy'], steps['hierarchyeval'])
+
+    def test_run_step_dispatches_fold(self):
+        runner = ProgrammaticPipelineRunner(outdir=self.outdir, fold=[1, 2])
+        runner._embed_image_fold = MagicMock(return_value=0)
+        self.assertEqual(0, runner._run_step('image_embedding_fold2'))
+        self.assertEqual(2, runner._embed_image_fold.call_args[0][0][0])
+
+    def test_run_step_unknown_step(self):
+        with self.assertRaises(CellmapsPipelineError):
+            self.runner._run_step('foo')
+
+    def test_run_steps_concurrently_failure(self):
+        runner = ProgrammaticPipelineRunner(outdir=self.outdir, max_workers=2)
+        with patch('cellmaps_pipeline.runner.StepScheduler') as mock_scheduler:
+            mock_scheduler.return_value.run.return_value = {'image_download': 0,
+                                                            'ppi_download': 3}
+            try:
+                runner.run()
+                self.fail('Expected CellmapsPipelineError')
+            except CellmapsPipelineError as e:
+                self.assertEqual('PPI download failed', str(e))
+
+    def test_run_fold_steps_concurrently(self):
+        runner = ProgrammaticPipelineRunner(outdir=self.outdir, fold=[1, 2],
+                                            fold_workers=2, threads_per_worker=3)
+        with patch('cellmaps_pipeline.runner.StepScheduler') as mock_scheduler:
+            mock_scheduler.return_value.run.return_value = {}
+            runner._run_fold_steps_concurrently()
+            mock_scheduler.assert_called_once_with(max_workers=2, threads_per_worker=3)
+            steps = mock_scheduler.return_value.run.call_args[0][0]
+            self.assertEqual([('image_embedding_fold1', []),
+                              ('image_embedding_fold2', []),
+                              ('coembedding_fold1', ['image_embedding_fold1']),
+                              ('coembedding_fold2', ['image_embedding_fold2'])], steps)
+
+    def test_run_step_with_step_cache(self):
+        runner = ProgrammaticPipelineRunner(outdir=self.outdir, ppi_cutoffs=[0.1],
+                                            use_step_cache=True)
+
+        def fake_invoke_step(step_name):
+            step_dir = runner._get_step_dir(step_name)
+            os.makedirs(step_dir, exist_ok=True)
+            with open(os.path.join(step_dir, 'out.txt'), 'w') as f:
+                f.write('done')
+            return 0
+
+        runner._invoke_step = MagicMock(side_effect=fake_invoke_step)
+        self.assertEqual(0, runner.run())
+        num_steps = len(runner._get_step_dependencies())
+        self.assertEqual(num_steps, runner._invoke_step.call_count)
+
+        # nothing changed so every step should be skipped
+        self.assertEqual(0, runner.run())
+        self.assertEqual(num_steps, runner._invoke_step.call_count)
+
+        # changing a parameter reruns hierarchy and hierarchyeval
+        runner._ppi_cutoffs = [0.2]
+        self.assertEqual(0, runner.run())
+        self.assertEqual(num_steps + 2, runner._invoke_step.call_count)
+        self.assertEqual('hierarchyeval', runner._invoke_step.call_args[0][0])
+
+    def test_run_step_with_step_cache_reruns_downstream_steps(self):
+        runner = ProgrammaticPipelineRunner(outdir=self.outdir, ppi_cutoffs=[0.1],
+                                            use_step_cache=True)
+        runner._invoke_step = MagicMock(side_effect=_get_fake_invoke_step(runner))
+        self.assertEqual(0, runner.run())
+        num_steps = len(runner._get_step_dependencies())
+
+        # deleted upstream output reruns it along with every step downstream
+        shutil.rmtree(runner._ppi_embed_dir)
+        self.assertEqual(0, runner.run())
+        invoked = [c[0][0] for c in runner._invoke_step.call_args_list[num_steps:]]
+        self.assertEqual(['ppi_embedding', 'coembedding_fold1', 'hierarchy',
+                          'hierarchyeval'], invoked)
+
+    def test_get_downstream_steps(self):
+        runner = ProgrammaticPipelineRunner(outdir=self.outdir, fold=[1, 2])
+        self.assertEqual(['ppi_embedding', 'coembedding_fold1', 'coembedding_fold2',
+                          'hierarchy', 'hierarchyeval'],
+                         runner._get_downstream_steps('ppi_download'))
+        self.assertEqual(['coembedding_fold2', 'hierarchy', 'hierarchyeval'],
+                         runner._get_downstream_steps('image_embedding_fold2'))
+        self.assertEqual([], runner._get_downstream_steps('hierarchyeval'))
+
+    def test_run_step_with_step_cache_removes_partial_dir(self):
+        runner = ProgrammaticPipelineRunner(outdir=self.outdir, use_step_cache=True)
+        os.makedirs(os.path.join(runner._ppi_dir, 'partial'))
+        runner._invoke_step = MagicMock(return_value=1)
+        self.assertEqual(1, runner._run_step('ppi_download'))
+        self.assertFalse(os.path.isdir(runner._ppi_dir))
+        self.assertIsNone(runner._step_cache.get_manifest('ppi_download'))
+
+    def test_run_with_artifact_store_reuses_outputs(self):
+        store_dir = os.path.join(self.outdir, 'store')
+        runner = ProgrammaticPipelineRunner(outdir=os.path.join(self.outdir, 'run1'),
+                                            ppi_cutoffs=[0.1],
+                                            artifact_store=ArtifactStore(store_dir=store_dir))
+        runner._invoke_step = MagicMock(side_effect=_get_fake_invoke_step(runner))
+        self.assertEqual(0, runner.run())
+        self.assertEqual(len(runner._get_step_dependencies()),
+                         runner._invoke_step.call_count)
+
+        # new output directory, only steps not kept in store should run
+        runner2 = ProgrammaticPipelineRunner(outdir=os.path.join(self.outdir, 'run2'),
+                                             ppi_cutoffs=[0.1],
+                                             artifact_store=ArtifactStore(store_dir=store_dir))
+        runner2._invoke_step = MagicMock(side_effect=_get_fake_invoke_step(runner2))
+        self.assertEqual(0, runner2.run())
+        invoked = [c[0][0] for c in runner2._invoke_step.call_args_list]
+        self.assertEqual(['ppi_download', 'hierarchy', 'hierarchyeval'], invoked)
+        with open(os.path.join(runner2._image_coembed_tuples[0][1],
+                               'out.txt'), 'r') as f:
+            self.assertEqual('image_embedding_fold1', f.read())
+
+    def test_run_records_step_metrics(self):
+        runner = ProgrammaticPipelineRunner(outdir=self.outdir, ppi_cutoffs=[0.1])
+
+        def fake_invoke_step(step_name):
+            step_dir = runner._get_step_dir(step_name)
+            os.makedirs(step_dir, exist_ok=True)
+            with open(os.path.join(step_dir, constants.PPI_EDGELIST_FILE), 'w') as f:
+                f.write('geneA\tgeneB\nA\tB\nB\tC\n')
+            return 0
+
+        # left over from a prior run
+        os.makedirs(os.path.join(self.outdir, StepMetricsRecorder.METRICS_DIR))
+        with open(os.path.join(self.outdir, StepMetricsRecorder.METRICS_DIR, 'foo.json'), 'w') as f:
+            f.write('{}')
+
+        runner._invoke_step = MagicMock(side_effect=fake_invoke_step)
+        self.assertEqual(0, runner.run())
+        step_metrics = runner.get_step_metrics()
+        self.assertEqual([s[0] for s in runner._get_step_dependencies()],
+                         [m['step'] for m in step_metrics])
+        ppi_metrics = step_metrics[1]
+        self.assertEqual(2, ppi_metrics['items']['edges'])
+        self.assertIsNone(ppi_metrics['items']['genes'])
+        self.assertEqual(0, ppi_metrics['exit_code'])
+
+
+def _get_fake_invoke_step(runner):
+    def fake_invoke_step(step_name):
+        step_dir = runner._get_step_dir(step_name)
+        os.makedirs(step_dir, exist_ok=True)
+        with open(os.path.join(step_dir, 'out.txt'), 'w') as f:
+            f.write(step_name)
+        return 0
+    return fake_invoke_step
 
 if __name__ == '__main__':
     unittest.main()
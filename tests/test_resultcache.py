@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `cellmaps_pipeline.resultcache` module."""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+from cellmaps_pipeline.resultcache import ResultCache
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.temp_dir, 'cache')
+        self.input_file = os.path.join(self.temp_dir, 'input.tsv')
+        with open(self.input_file, 'w') as f:
+            f.write('a\tb\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_constructor_invalid(self):
+        with self.assertRaises(CellmapsPipelineError):
+            ResultCache()
+
+    def test_get_key(self):
+        key = ResultCache.get_key('foo', parameters={'k': 1},
+                                  input_files={'input': self.input_file})
+        self.assertEqual(key, ResultCache.get_key('foo', parameters={'k': 1},
+                                                  input_files={'input': self.input_file}))
+        self.assertNotEqual(key, ResultCache.get_key('foo', parameters={'k': 2},
+                                                     input_files={'input': self.input_file}))
+        self.assertNotEqual(key, ResultCache.get_key('bar', parameters={'k': 1},
+                                                     input_files={'input': self.input_file}))
+
+        # only contents of input file matter, not its path
+        other_file = os.path.join(self.temp_dir, 'other.tsv')
+        shutil.copy(self.input_file, other_file)
+        self.assertEqual(key, ResultCache.get_key('foo', parameters={'k': 1},
+                                                  input_files={'input': other_file}))
+        with open(other_file, 'a') as f:
+            f.write('c\td\n')
+        self.assertNotEqual(key, ResultCache.get_key('foo', parameters={'k': 1},
+                                                     input_files={'input': other_file}))
+
+    def test_put_and_open_result(self):
+        cache = ResultCache(cache_dir=self.cache_dir)
+        self.assertIsNone(cache.open_result('a'))
+        result = [{'action': 'addNetworks', 'data': (i for i in range(3))}]
+        with cache.put('a', result) as f:
+            self.assertEqual('[{"action":"addNetworks","data":[0,1,2]}]', f.read())
+        with cache.open_result('a') as f:
+            self.assertEqual([{'action': 'addNetworks', 'data': [0, 1, 2]}], json.load(f))
+        self.assertEqual(['a'], os.listdir(self.cache_dir))
+
+    def test_put_indent(self):
+        cache = ResultCache(cache_dir=self.cache_dir)
+        with cache.put('a', {'x': [1]}, indent=2) as f:
+            self.assertEqual(json.dumps({'x': [1]}, indent=2), f.read())
+
+    def test_put_result_larger_than_max_size(self):
+        cache = ResultCache(cache_dir=self.cache_dir, max_size=1)
+        with cache.put('a', {'x': 'y' * 100}) as f:
+            self.assertEqual({'x': 'y' * 100}, json.load(f))
+        self.assertIsNone(cache.open_result('a'))
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `cellmaps_pipeline.scheduler` module."""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from cellmaps_pipeline.scheduler import StepScheduler
+from cellmaps_pipeline.scheduler import limit_worker_threads
+from cellmaps_pipeline.scheduler import THREAD_ENV_VARS
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+
+
+class RecordingStep(object):
+    """
+    Picklable step function that records start and end
+    times of each step into files under **outdir**
+    """
+    def __init__(self, outdir, fail_step=None, sleep=0.0):
+        self._outdir = outdir
+        self._fail_step = fail_step
+        self._sleep = sleep
+
+    def __call__(self, step_name):
+        with open(os.path.join(self._outdir, step_name + '.start'), 'w') as f:
+            f.write(str(time.time()))
+        time.sleep(self._sleep)
+        with open(os.path.join(self._outdir, step_name + '.end'), 'w') as f:
+            f.write(str(time.time()))
+        if step_name == self._fail_step:
+            return 1
+        return 0
+
+
+def _get_time(outdir, step_name, suffix):
+    with open(os.path.join(outdir, step_name + suffix), 'r') as f:
+        return float(f.read())
+
+
+class TestStepScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_unknown_dependency(self):
+        try:
+            StepScheduler(max_workers=2).run([('a', ['b'])], RecordingStep(self.temp_dir))
+            self.fail('Expected CellmapsPipelineError')
+        except CellmapsPipelineError as e:
+            self.assertEqual('Step a depends on unknown step b', str(e))
+
+    def test_cycle(self):
+        try:
+            StepScheduler(max_workers=2).run([('a', ['b']), ('b', ['a'])],
+                                             RecordingStep(self.temp_dir))
+            self.fail('Expected CellmapsPipelineError')
+        except CellmapsPipelineError as e:
+            self.assertTrue('Cycle found' in str(e))
+
+    def test_dependencies_honored(self):
+        steps = [('a', []), ('b', []), ('c', ['a']), ('d', ['b', 'c'])]
+        res = StepScheduler(max_workers=2).run(steps,
+                                               RecordingStep(self.temp_dir, sleep=0.2))
+        self.assertEqual({'a': 0, 'b': 0, 'c': 0, 'd': 0}, res)
+        self.assertTrue(_get_time(self.temp_dir, 'c', '.start') >=
+                        _get_time(self.temp_dir, 'a', '.end'))
+        self.assertTrue(_get_time(self.temp_dir, 'd', '.start') >=
+                        _get_time(self.temp_dir, 'c', '.end'))
+        self.assertTrue(_get_time(self.temp_dir, 'd', '.start') >=
+                        _get_time(self.temp_dir, 'b', '.end'))
+
+        # a and b have no dependencies so they should overlap
+        self.assertTrue(_get_time(self.temp_dir, 'b', '.start') <
+                        _get_time(self.temp_dir, 'a', '.end'))
+
+    def test_failure_stops_dependent_steps(self):
+        steps = [('a', []), ('b', ['a']), ('c', ['b'])]
+        res = StepScheduler(max_workers=2).run(steps,
+                                               RecordingStep(self.temp_dir,
+                                                             fail_step='a'))
+        self.assertEqual({'a': 1}, res)
+        self.assertFalse(os.path.isfile(os.path.join(self.temp_dir, 'b.start')))
+
+    def test_threads_per_worker(self):
+        steps = [('a', [])]
+        res = StepScheduler(max_workers=1,
+                            threads_per_worker=2).run(steps, _get_omp_num_threads)
+        self.assertEqual({'a': '2'}, res)
+
+    def test_limit_worker_threads_none(self):
+        orig = dict(os.environ)
+        try:
+            limit_worker_threads(None)
+            for env_var in THREAD_ENV_VARS:
+                self.assertEqual(orig.get(env_var), os.environ.get(env_var))
+        finally:
+            os.environ.clear()
+            os.environ.update(orig)
+
+
+def _get_omp_num_threads(step_name):
+    return os.environ.get('OMP_NUM_THREADS')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `cellmaps_pipeline.sharding` module."""
+
+import os
+import csv
+import shutil
+import filecmp
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from cellmaps_utils import constants
+from cellmaps_imagedownloader.gene import GeneQuery
+from cellmaps_imagedownloader.gene import ImageGeneNodeAttributeGenerator
+from cellmaps_imagedownloader.runner import CellmapsImageDownloader
+from cellmaps_imagedownloader.runner import MultiProcessImageDownloader
+from cellmaps_imagedownloader.proteinatlas import LinkPrefixImageDownloadTupleGenerator
+from cellmaps_image_embedding.runner import CellmapsImageEmbedder
+from cellmaps_image_embedding.runner import FakeEmbeddingGenerator
+
+from cellmaps_pipeline import sharding
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+
+
+def _fake_querymany(self, queries, species=None, scopes=None, fields=None):
+    return [{'query': q, '_id': q, 'ensembl': {'gene': q}, 'symbol': 'SYM' + q}
+            for q in queries]
+
+
+def _write_image(downloadtuple):
+    with open(downloadtuple[1], 'w') as f:
+        f.write(downloadtuple[0])
+    return None
+
+
+class TestSharding(unittest.TestCase):
+    """Tests for `cellmaps_pipeline.sharding` module."""
+
+    PROVENANCE = CellmapsImageDownloader.get_example_provenance(with_ids=True)
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self._temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        shutil.rmtree(self._temp_dir)
+
+    def _write_samples(self, num_samples=12, num_antibodies=5):
+        samples = os.path.join(self._temp_dir, 'samples.csv')
+        unique = os.path.join(self._temp_dir, 'unique.csv')
+        with open(samples, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['filename', 'if_plate_id', 'position', 'sample',
+                             'locations', 'antibody', 'ensembl_ids',
+                             'gene_names', 'linkprefix'])
+            for i in range(num_samples):
+                writer.writerow([str(i) + '_A' + str(i) + '_1_', str(i), 'A' + str(i), '1',
+                                 'Golgi apparatus', 'HPA00000' + str(i % num_antibodies),
+                                 'ENSG' + str(i % num_antibodies), 'GENE' + str(i % num_antibodies),
+                                 'http://foo/' + str(i) + '/' + str(i) + '_A' + str(i) + '_1_'])
+        with open(unique, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['antibody', 'ensembl_ids', 'gene_names', 'atlas_name',
+                             'locations', 'n_location'])
+            for i in range(num_antibodies):
+                writer.writerow(['HPA00000' + str(i), 'ENSG' + str(i), 'GENE' + str(i),
+                                 'U-2 OS', 'Golgi apparatus', '1'])
+        return samples, unique
+
+    def _download_images(self, outdir, samples, imagedownloader):
+        imagegen = ImageGeneNodeAttributeGenerator(
+            samples_list=ImageGeneNodeAttributeGenerator.get_samples_from_csvfile(samples))
+        imageurlgen = LinkPrefixImageDownloadTupleGenerator(samples_list=imagegen.get_samples_list())
+        return CellmapsImageDownloader(outdir=outdir, imagedownloader=imagedownloader,
+                                       imagegen=imagegen, imageurlgen=imageurlgen,
+                                       provenance=TestSharding.PROVENANCE).run()
+
+    def _read_antibodies(self, csvfile):
+        with open(csvfile, 'r', newline='') as f:
+            return [row['antibody'] for row in csv.DictReader(f)]
+
+    def test_split_samples_by_antibody(self):
+        samples, unique = self._write_samples()
+        shards_dir = os.path.join(self._temp_dir, 'shards')
+        self.assertEqual(3, sharding.split_samples_by_antibody(samples, shards_dir, 3,
+                                                               unique=unique))
+        all_samples = []
+        sizes = []
+        for shard in range(1, 4):
+            antibodies = self._read_antibodies(sharding.get_samples_file(shards_dir, shard))
+            unique_antibodies = self._read_antibodies(sharding.get_unique_file(shards_dir, shard))
+            self.assertEqual(set(antibodies), set(unique_antibodies))
+            all_samples.extend(antibodies)
+            sizes.append(len(antibodies))
+        # antibodies with 3, 3, 2, 2, 2 samples placed largest first
+        # into shard with fewest samples
+        self.assertEqual([5, 3, 4], sizes)
+        self.assertEqual(sorted(self._read_antibodies(samples)), sorted(all_samples))
+
+    def test_split_samples_by_antibody_more_shards_than_antibodies(self):
+        samples, unique = self._write_samples(num_samples=4, num_antibodies=2)
+        shards_dir = os.path.join(self._temp_dir, 'shards')
+        self.assertEqual(2, sharding.split_samples_by_antibody(samples, shards_dir, 10))
+        self.assertTrue(os.path.isfile(sharding.get_samples_file(shards_dir, 2)))
+        self.assertFalse(os.path.isfile(sharding.get_samples_file(shards_dir, 3)))
+        self.assertFalse(os.path.isfile(sharding.get_unique_file(shards_dir, 1)))
+
+    def test_split_samples_by_antibody_invalid(self):
+        samples, unique = self._write_samples()
+        for num_shards in [None, 0]:
+            with self.assertRaises(CellmapsPipelineError):
+                sharding.split_samples_by_antibody(samples, self._temp_dir, num_shards)
+        no_antibody = os.path.join(self._temp_dir, 'noantibody.csv')
+        with open(no_antibody, 'w') as f:
+            f.write('filename\n1_A1_1_\n')
+        with self.assertRaises(CellmapsPipelineError) as ce:
+            sharding.split_samples_by_antibody(no_antibody, self._temp_dir, 2)
+        self.assertTrue('No antibody column' in str(ce.exception))
+        with self.assertRaises(CellmapsPipelineError) as ce:
+            sharding.split_samples_by_antibody(samples, self._temp_dir, 2,
+                                               unique=no_antibody)
+        self.assertTrue('No antibody column' in str(ce.exception))
+
+        empty = os.path.join(self._temp_dir, 'empty.csv')
+        with open(empty, 'w') as f:
+            f.write('antibody,filename\n')
+        with self.assertRaises(CellmapsPipelineError) as ce:
+            sharding.split_samples_by_antibody(empty, self._temp_dir, 2)
+        self.assertTrue('No samples' in str(ce.exception))
+
+    def test_shard_image_linker(self):
+        shard_dir = os.path.join(self._temp_dir, 'shard1')
+        os.makedirs(os.path.join(shard_dir, constants.RED))
+        with open(os.path.join(shard_dir, constants.RED, '1_A1_1_red.jpg'), 'w') as f:
+            f.write('hi')
+        dest_dir = os.path.join(self._temp_dir, 'dest', constants.RED)
+        os.makedirs(dest_dir)
+        linker = sharding.ShardImageLinker(shard_dirs=[shard_dir,
+                                                       os.path.join(self._temp_dir, 'nope')])
+        self.assertEqual(1, linker.get_num_images())
+        dest = os.path.join(dest_dir, '1_A1_1_red.jpg')
+        self.assertIsNone(linker.link_image(('http://foo', dest)))
+        with open(dest, 'r') as f:
+            self.assertEqual('hi', f.read())
+
+        missing = ('http://foo', os.path.join(dest_dir, '2_A1_1_red.jpg'))
+        self.assertEqual(404, linker.link_image(missing)[0])
+        self.assertEqual(missing, linker.link_image(missing)[2])
+
+        with self.assertRaises(CellmapsPipelineError):
+            sharding.ShardImageLinker()
+
+    @patch.object(GeneQuery, 'querymany', _fake_querymany)
+    def test_merge_image_download_shards_matches_unsharded(self):
+        samples, unique = self._write_samples(num_samples=6, num_antibodies=3)
+        dloader = MultiProcessImageDownloader(poolsize=1, override_dfunc=_write_image)
+        full_dir = os.path.join(self._temp_dir, 'full')
+        self.assertEqual(0, self._download_images(full_dir, samples, dloader))
+
+        shards_dir = os.path.join(self._temp_dir, 'shards')
+        num_shards = sharding.split_samples_by_antibody(samples, shards_dir, 2)
+        shard_dirs = [sharding.get_shard_dir(shards_dir, shard)
+                      for shard in range(1, num_shards + 1)]
+        for shard in range(num_shards):
+            self.assertEqual(0, self._download_images(shard_dirs[shard],
+                                                      sharding.get_samples_file(shards_dir,
+                                                                                shard + 1),
+                                                      dloader))
+        image_dir = os.path.join(self._temp_dir, 'merged')
+        self.assertEqual(0, sharding.merge_image_download_shards(image_dir, shard_dirs, samples,
+                                                                 provenance=TestSharding.PROVENANCE))
+        for fold in [1, 2]:
+            attrs_file = str(fold) + '_' + constants.IMAGE_GENE_NODE_ATTR_FILE
+            self.assertTrue(filecmp.cmp(os.path.join(full_dir, attrs_file),
+                                        os.path.join(image_dir, attrs_file), shallow=False))
+        for color in constants.COLORS:
+            self.assertEqual(sorted(os.listdir(os.path.join(full_dir, color))),
+                             sorted(os.listdir(os.path.join(image_dir, color))))
+        self.assertTrue(os.path.isfile(os.path.join(image_dir, constants.RO_CRATE_METADATA_FILE)))
+
+        with self.assertRaises(CellmapsPipelineError):
+            sharding.merge_image_download_shards(image_dir, [], samples)
+
+    @patch.object(GeneQuery, 'querymany', _fake_querymany)
+    def test_image_embedding_shards(self):
+        samples, unique = self._write_samples(num_samples=6, num_antibodies=3)
+        image_dir = os.path.join(self._temp_dir, 'images')
+        self.assertEqual(0, self._download_images(image_dir, samples,
+                                                  MultiProcessImageDownloader(poolsize=1,
+                                                                              override_dfunc=_write_image)))
+        all_ids = set()
+        shard_dirs = []
+        for shard in [1, 2]:
+            image_ids = sharding.get_image_ids_for_shard(image_dir, 1, shard, 2)
+            self.assertEqual(set(), all_ids.intersection(image_ids))
+            all_ids.update(image_ids)
+
+            input_dir = sharding.get_shard_input_dir(os.path.join(self._temp_dir, 'eshards'), shard)
+            self.assertEqual(len(image_ids),
+                             sharding.create_image_embedding_shard_input(image_dir, input_dir,
+                                                                         1, shard, 2))
+            # rerun replaces input directory
+            self.assertEqual(len(image_ids),
+                             sharding.create_image_embedding_shard_input(image_dir, input_dir,
+                                                                         1, shard, 2))
+            for color in constants.COLORS:
+                self.assertEqual(len(image_ids), len(os.listdir(os.path.join(input_dir, color))))
+            shard_dir = sharding.get_shard_dir(os.path.join(self._temp_dir, 'eshards'), shard)
+            gen = FakeEmbeddingGenerator(input_dir, dimensions=4, fold=1)
+            self.assertEqual(0, CellmapsImageEmbedder(outdir=shard_dir, inputdir=input_dir,
+                                                      embedding_generator=gen).run())
+            shard_dirs.append(shard_dir)
+        self.assertEqual(3, len(all_ids))
+
+        with self.assertRaises(CellmapsPipelineError):
+            sharding.get_image_ids_for_shard(image_dir, 1, 3, 2)
+
+        gen = sharding.ShardEmbeddingGenerator(shard_dirs=shard_dirs)
+        self.assertEqual(4, gen.get_dimensions())
+        self.assertEqual(1, gen.get_fold())
+
+        embed_dir = os.path.join(self._temp_dir, 'embed')
+        self.assertEqual(0, sharding.merge_image_embedding_shards(embed_dir, image_dir,
+                                                                  shard_dirs, fold=1))
+        expected_rows = []
+        for shard_dir in shard_dirs:
+            with open(os.path.join(shard_dir, constants.IMAGE_EMBEDDING_FILE), 'r') as f:
+                expected_rows.extend(f.readlines()[1:])
+        with open(os.path.join(embed_dir, constants.IMAGE_EMBEDDING_FILE), 'r') as f:
+            lines = f.readlines()
+        self.assertEqual('id\t0\t1\t2\t3\n', lines[0])
+        self.assertEqual(expected_rows, lines[1:])
+        self.assertEqual(['SYMENSG' + str(i) for i in range(3)],
+                         sorted([row.split('\t')[0] for row in expected_rows]))
+        with open(os.path.join(embed_dir, constants.IMAGE_LABELS_PROBABILITY_FILE), 'r') as f:
+            self.assertEqual(4, len(f.readlines()))
+
+        with self.assertRaises(CellmapsPipelineError):
+            sharding.ShardEmbeddingGenerator(shard_dirs=[])
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `cellmaps_pipeline.similarity` module."""
+
+import unittest
+
+import numpy as np
+import pandas as pd
+from cellmaps_utils import music_utils
+
+from cellmaps_pipeline import topk
+from cellmaps_pipeline import similarity
+from cellmaps_pipeline.similarity import BlockedSimilarity
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+
+
+class TestSimilarity(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(2)
+        self.df = pd.DataFrame(rng.normal(size=(41, 6)),
+                               index=['G' + str(i) for i in range(41)])
+
+    def _assert_matches_music_utils(self, algorithm, sim_func, cutoff=0.1):
+        expected = topk.get_top_edges(sim_func(self.df).to_numpy(dtype=float), cutoff)
+        for block_rows in [1, 5, None, 100]:
+            res = similarity.get_top_edges_blocked(similarity.get_blocked_similarity(self.df,
+                                                                                     algorithm),
+                                                   cutoff, block_rows=block_rows)
+            self.assertEqual(expected[0].tolist(), res[0].tolist())
+            self.assertEqual(expected[1].tolist(), res[1].tolist())
+            self.assertTrue(np.allclose(expected[2], res[2], rtol=0, atol=1e-12))
+
+    def _assert_matches_music_utils_with_ties(self, algorithm, sim_func, cutoff=0.1):
+        # rank based similarities of 6 values tie often, so which of the
+        # tied pairs make the cutoff depends on rounding, compare weights instead
+        full = sim_func(self.df).to_numpy(dtype=float)
+        expected = topk.get_top_edges(full, cutoff)
+        for block_rows in [1, 5, None, 100]:
+            res = similarity.get_top_edges_blocked(similarity.get_blocked_similarity(self.df,
+                                                                                     algorithm),
+                                                   cutoff, block_rows=block_rows)
+            self.assertTrue(np.allclose(expected[2], res[2], rtol=0, atol=1e-12))
+            self.assertTrue(np.allclose(full[res[0], res[1]], res[2], rtol=0, atol=1e-12))
+            self.assertTrue(np.all(res[0] < res[1]))
+
+    def test_get_blocked_similarity_unsupported(self):
+        with self.assertRaises(CellmapsPipelineError):
+            similarity.get_blocked_similarity(self.df, None)
+        try:
+            similarity.get_blocked_similarity(self.df, 'foo')
+            self.fail('Expected CellmapsPipelineError')
+        except CellmapsPipelineError as e:
+            self.assertTrue('Blocked similarity not supported for: foo' in str(e))
+
+    def test_base_get_tile(self):
+        with self.assertRaises(NotImplementedError):
+            BlockedSimilarity(self.df).get_tile(0, 1)
+
+    def test_cosine(self):
+        self._assert_matches_music_utils('cosine', music_utils.cosine_similarity_scaled)
+        self._assert_matches_music_utils('COSINE', music_utils.cosine_similarity_scaled,
+                                         cutoff=1.0)
+
+    def test_euclidean(self):
+        self._assert_matches_music_utils('euclidean', music_utils.euclidean_similarity)
+
+    def test_pearson(self):
+        self._assert_matches_music_utils('pearson', music_utils.pearson_scaled)
+
+    def test_pearson_constant_rows(self):
+        self.df.iloc[3] = 2.0
+        self.df.iloc[17] = 0.0
+        self.assertEqual(39, similarity.get_blocked_similarity(self.df,
+                                                               'pearson').get_num_valid_rows())
+        self._assert_matches_music_utils('pearson', music_utils.pearson_scaled,
+                                         cutoff=0.5)
+
+    def test_manhattan(self):
+        self._assert_matches_music_utils('manhattan', music_utils.manhattan_similarity)
+
+    def test_canberra(self):
+        self.df.iloc[3] = 0.0
+        self._assert_matches_music_utils('canberra', music_utils.canberra_similarity,
+                                         cutoff=0.3)
+
+    def test_distance_workers(self):
+        for algorithm in ['manhattan', 'canberra']:
+            expected = similarity.get_blocked_similarity(self.df, algorithm).get_tile(3, 17)
+            sim_class = similarity.BLOCKED_SIMILARITIES[algorithm]
+            for workers in [1, 4, 100]:
+                sim = sim_class(self.df.astype(np.float32), workers=workers)
+                self.assertEqual((14, 41), sim.get_tile(3, 17).shape)
+                self.assertTrue(np.allclose(sim_class(self.df, workers=workers).get_tile(3, 17),
+                                            expected, rtol=0, atol=1e-12))
+                self.assertEqual(0.0, sim.get_tile(5, 6)[0, 5])
+
+    def test_get_similarity_matrix(self):
+        for algorithm, sim_func in [('manhattan', music_utils.manhattan_similarity),
+                                    ('canberra', music_utils.canberra_similarity),
+                                    ('cosine', music_utils.cosine_similarity_scaled)]:
+            expected = sim_func(self.df).to_numpy(dtype=float)
+            for block_rows in [1, 7, None]:
+                sim_mat = similarity.get_similarity_matrix(similarity.get_blocked_similarity(self.df,
+                                                                                             algorithm),
+                                                           block_rows=block_rows)
+                self.assertTrue(np.allclose(expected, sim_mat, rtol=0, atol=1e-12))
+        self.assertEqual((0, 0), similarity.get_similarity_matrix(
+            similarity.get_blocked_similarity(self.df.iloc[:0], 'manhattan')).shape)
+
+    def test_spearman(self):
+        self._assert_matches_music_utils_with_ties('spearman', music_utils.spearman_scaled)
+        self.df.iloc[3] = 2.0
+        self.df.iloc[5] = self.df.iloc[5].round(0)
+        self.assertEqual(40, similarity.get_blocked_similarity(self.df,
+                                                               'spearman').get_num_valid_rows())
+        self._assert_matches_music_utils_with_ties('spearman', music_utils.spearman_scaled,
+                                                   cutoff=0.5)
+
+    def test_spearman_float32_kept(self):
+        sim = similarity.get_blocked_similarity(self.df.astype(np.float32), 'spearman')
+        self.assertEqual(np.float32, sim.get_tile(0, 2).dtype)
+
+    def test_kendall(self):
+        self._assert_matches_music_utils_with_ties('kendall', music_utils.kendall_scaled)
+        self.df.iloc[3] = 2.0
+        self.df.iloc[5] = self.df.iloc[5].round(0)
+        self.assertEqual(40, similarity.get_blocked_similarity(self.df,
+                                                               'kendall').get_num_valid_rows())
+        self._assert_matches_music_utils_with_ties('kendall', music_utils.kendall_scaled,
+                                                   cutoff=0.5)
+
+    def test_get_kendall_tau(self):
+        self.df.iloc[3] = 2.0
+        self.df.iloc[5] = self.df.iloc[5].round(0)
+        expected = self.df.T.corr(method='kendall').to_numpy()
+        np.fill_diagonal(expected, 1.0)
+        expected[3, :] = np.nan
+        expected[:, 3] = np.nan
+        # chunks of 1 pair, several pairs and all pairs of columns
+        for chunk_elements in [1, 41 * 4, None]:
+            if chunk_elements is None:
+                tau = similarity.get_kendall_tau(self.df)
+            else:
+                tau = similarity.get_kendall_tau(self.df, chunk_elements=chunk_elements)
+            self.assertEqual(np.isnan(expected).tolist(), np.isnan(tau).tolist())
+            self.assertTrue(np.allclose(expected, tau, rtol=0, atol=1e-12, equal_nan=True))
+
+    def test_get_top_edges_blocked_by_cutoff(self):
+        cutoffs = [0.05, 0.5, 0.2]
+        res = similarity.get_top_edges_blocked_by_cutoff(similarity.get_blocked_similarity(self.df,
+                                                                                           'cosine'),
+                                                         cutoffs, block_rows=7)
+        self.assertEqual(len(cutoffs), len(res))
+        for cutoff, cutoff_res in zip(cutoffs, res):
+            expected = similarity.get_top_edges_blocked(similarity.get_blocked_similarity(self.df,
+                                                                                          'cosine'),
+                                                        cutoff, block_rows=7)
+            for i in range(3):
+                self.assertEqual(expected[i].tolist(), cutoff_res[i].tolist())
+
+    def test_float32_kept(self):
+        sim = similarity.get_blocked_similarity(self.df.astype(np.float32), 'cosine')
+        self.assertEqual(np.float32, sim.get_tile(0, 2).dtype)
+        self.assertEqual(np.float64,
+                         similarity.get_blocked_similarity(self.df.values.astype(int),
+                                                           'cosine').get_tile(0, 2).dtype)
+
+    def test_get_knn_edges_blocked(self):
+        for algorithm, sim_func in [('cosine', music_utils.cosine_similarity_scaled),
+                                    ('euclidean', music_utils.euclidean_similarity),
+                                    ('pearson', music_utils.pearson_scaled)]:
+            full = sim_func(self.df).to_numpy(dtype=float)
+            expected = set()
+            for row in range(full.shape[0]):
+                values = full[row].copy()
+                values[row] = -np.inf
+                for col in np.argsort(-values, kind='stable')[:3]:
+                    expected.add((min(row, col), max(row, col)))
+            for sim in [similarity.get_blocked_similarity(self.df, algorithm),
+                        similarity.PrecomputedBlockedSimilarity(full)]:
+                for block_rows in [1, 6, None]:
+                    rows, cols, weights = similarity.get_knn_edges_blocked(sim, 3,
+                                                                           block_rows=block_rows)
+                    self.assertEqual(expected, set(zip(rows.tolist(), cols.tolist())))
+                    self.assertTrue(np.allclose(full[rows, cols], weights, rtol=0, atol=1e-12))
+                    self.assertTrue(np.all(np.diff(weights) <= 0))
+
+    def test_get_knn_edges_blocked_constant_rows(self):
+        self.df.iloc[3] = 2.0
+        rows, cols, weights = similarity.get_knn_edges_blocked(similarity.get_blocked_similarity(self.df,
+                                                                                                 'pearson'),
+                                                               2, block_rows=4)
+        self.assertFalse(3 in rows.tolist() or 3 in cols.tolist())
+        self.assertEqual(set(range(41)) - {3}, set(rows.tolist()) | set(cols.tolist()))
+
+    def test_identical_rows(self):
+        df = pd.DataFrame(np.ones((4, 3)), index=['A', 'B', 'C', 'D'])
+        res = similarity.get_top_edges_blocked(similarity.get_blocked_similarity(df, 'euclidean'),
+                                               1.0)
+        self.assertEqual(0, len(res[0]))
+        res = similarity.get_top_edges_blocked_by_cutoff(similarity.get_blocked_similarity(df, 'euclidean'),
+                                                         [1.0, 0.5])
+        self.assertEqual([0, 0], [len(r[0]) for r in res])
+
+
+if __name__ == '__main__':
+    unittest.main()
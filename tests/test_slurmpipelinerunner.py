@@ -9,6 +9,7 @@ import tempfile
 import shutil
 import os
 from cellmaps_pipeline.runner import SLURMPipelineRunner
+from cellmaps_pipeline.slurmresources import SLURMResourceProfiles
 from cellmaps_pipeline.exceptions import CellmapsPipelineError
 
 
@@ -39,6 +40,44 @@ class TestSLURMPipelineRunner(unittest.TestCase):
         finally:
             shutil.rmtree(temp_dir)
 
+    def test_write_slurm_directives_resource_profiles(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            profiles = SLURMResourceProfiles({'default': {'cpus_per_task': 1, 'mem': '2G'},
+                                              'image_embedding': {'cpus_per_task': 16,
+                                                                  'mem': '64G',
+                                                                  'time': '1-00:00:00',
+                                                                  'partition': 'cpu'}})
+            myobj = SLURMPipelineRunner(temp_dir, slurm_partition='shared',
+                                        resource_profiles=profiles)
+            myobj._generate_embed_image_command(fold=1)
+            with open(os.path.join(temp_dir, 'imageembedjob1.sh'), 'r') as f:
+                data = f.read().split('\n')
+            self.assertTrue('#SBATCH --cpus-per-task=16' in data)
+            self.assertTrue('#SBATCH --mem=64G' in data)
+            self.assertTrue('#SBATCH --time=1-00:00:00' in data)
+            self.assertTrue('#SBATCH --partition=cpu' in data)
+
+            myobj._generate_embed_ppi_command()
+            with open(os.path.join(temp_dir, 'ppiembedjob.sh'), 'r') as f:
+                data = f.read().split('\n')
+            self.assertTrue('#SBATCH --cpus-per-task=1' in data)
+            self.assertTrue('#SBATCH --mem=2G' in data)
+            self.assertTrue('#SBATCH --time=4:00:00' in data)
+            self.assertTrue('#SBATCH --partition=shared' in data)
+
+            # explicit values win over profile
+            filename = os.path.join(temp_dir, 'foo.txt')
+            with open(filename, 'w') as f:
+                myobj._write_slurm_directives(out=f, mem='1G',
+                                              step_name='image_embedding_fold1')
+            with open(filename, 'r') as f:
+                data = f.read().split('\n')
+            self.assertTrue('#SBATCH --mem=1G' in data)
+            self.assertTrue('#SBATCH --cpus-per-task=16' in data)
+        finally:
+            shutil.rmtree(temp_dir)
+
     def test_generate_download_images_command(self):
         temp_dir = tempfile.mkdtemp()
         cm4ai_image = 'test_image'
@@ -104,6 +143,66 @@ class TestSLURMPipelineRunner(unittest.TestCase):
         finally:
             shutil.rmtree(temp_dir)
 
+    def test_slurm_run_dependencies(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            myobj = SLURMPipelineRunner(temp_dir, samples='test_samples', edgelist='edgelist',
+                                        baitlist='baitlist', provenance='test_provenance',
+                                        fold=[1, 2])
+            myobj.run()
+            with open(os.path.join(temp_dir, 'slurm_cellmaps_job.sh'), 'r') as f:
+                data = f.read()
+            # each job depends on jobs of the steps whose output it reads
+            for job, dependencies in [('ppi_embed_job', '$ppi_download_job'),
+                                      ('image_embed_job1', '$image_download_job'),
+                                      ('f1_coembed_job', '$image_embed_job1 $ppi_embed_job'),
+                                      ('f2_coembed_job', '$image_embed_job2 $ppi_embed_job'),
+                                      ('hierarchy_job', '$image_download_job $ppi_download_job '
+                                                        '$f1_coembed_job $f2_coembed_job'),
+                                      ('hierarchyeval_job', '$hierarchy_job')]:
+                self.assertTrue('    ' + job + '=$(sbatch $(get_dependency ' + dependencies + ') ' in data,
+                                job)
+            self.assertTrue('    image_download_job=$(sbatch imagedownloadjob.sh ' in data)
+            self.assertTrue('    ppi_download_job=$(sbatch ppidownloadjob.sh ' in data)
+            # jobs are submitted after the jobs they depend on
+            self.assertTrue(data.index('ppi_embed_job=$(sbatch') < data.index('f1_coembed_job=$(sbatch'))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_get_step_jobs_unknown_step(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            myobj = SLURMPipelineRunner(temp_dir)
+            with self.assertRaises(CellmapsPipelineError):
+                myobj._get_step_jobs('foo')
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_completion_marker(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            myobj = SLURMPipelineRunner(temp_dir, samples='test_samples', edgelist='edgelist',
+                                        baitlist='baitlist', provenance='test_provenance')
+            myobj._generate_embed_ppi_command()
+            ppi_embed_dir = os.path.join(temp_dir, '2.ppi_embedding')
+            marker = os.path.join(ppi_embed_dir, SLURMPipelineRunner.COMPLETION_MARKER)
+            with open(os.path.join(temp_dir, 'ppiembedjob.sh'), 'r') as f:
+                data = f.read()
+            self.assertTrue('if [ -f "' + marker + '" ]; then\n' in data)
+            self.assertTrue('    rm -rf "' + ppi_embed_dir + '"\n' in data)
+            self.assertTrue('    touch "' + marker + '" || exit $?\n' in data)
+            self.assertTrue(data.endswith('exit $exit_code\n'))
+
+            myobj.run()
+            with open(os.path.join(temp_dir, 'slurm_cellmaps_job.sh'), 'r') as f:
+                data = f.read()
+            self.assertTrue('if [ ! -f "' + marker + '" ] || [ -n "$ppi_download_job" ]; then\n'
+                            '    rm -f "' + marker + '"\n'
+                            '    ppi_embed_job=$(sbatch $(get_dependency $ppi_download_job) '
+                            'ppiembedjob.sh' in data)
+        finally:
+            shutil.rmtree(temp_dir)
+
     def test_slurm_run(self):
         temp_dir = tempfile.mkdtemp()
         samples = 'test_samples'
@@ -119,3 +218,132 @@ class TestSLURMPipelineRunner(unittest.TestCase):
             self.assertTrue(os.path.isfile(filename))
         finally:
             shutil.rmtree(temp_dir)
+
+    def _write_samples(self, temp_dir):
+        samples = os.path.join(temp_dir, 'samples.csv')
+        with open(samples, 'w') as f:
+            f.write('filename,if_plate_id,position,sample,locations,antibody,ensembl_ids,gene_names\n')
+            for i in range(5):
+                f.write(str(i) + '_A1_1_,' + str(i) + ',A1,1,Golgi apparatus,HPA00000' +
+                        str(i % 3) + ',ENSG' + str(i % 3) + ',GENE' + str(i % 3) + '\n')
+        unique = os.path.join(temp_dir, 'unique.csv')
+        with open(unique, 'w') as f:
+            f.write('antibody,ensembl_ids,gene_names,atlas_name,locations,n_location\n')
+            for i in range(3):
+                f.write('HPA00000' + str(i) + ',ENSG' + str(i) + ',GENE' + str(i) +
+                        ',U-2 OS,Golgi apparatus,1\n')
+        return samples, unique
+
+    def test_constructor_invalid_image_shards(self):
+        with self.assertRaises(CellmapsPipelineError):
+            SLURMPipelineRunner('foo', image_shards=0)
+
+    def test_slurm_run_image_shards(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            samples, unique = self._write_samples(temp_dir)
+            profiles = SLURMResourceProfiles({'image_download_merge': {'mem': '4G'},
+                                              'image_embedding_merge': {'mem': '8G'}})
+            myobj = SLURMPipelineRunner(temp_dir, samples=samples, unique=unique,
+                                        edgelist='edgelist', baitlist='baitlist',
+                                        provenance=os.path.join(temp_dir, 'provenance.json'),
+                                        fold=[1, 2], resource_profiles=profiles, image_shards=4)
+            myobj.run()
+            shards_dir = os.path.join(temp_dir, 'image_download_shards')
+            # only 3 antibodies so only 3 image download shards
+            self.assertEqual(['samples1.csv', 'samples2.csv', 'samples3.csv',
+                              'unique1.csv', 'unique2.csv', 'unique3.csv'],
+                             sorted(os.listdir(shards_dir)))
+
+            with open(os.path.join(temp_dir, 'imagedownloadarrayjob.sh'), 'r') as f:
+                data = f.read()
+            self.assertTrue('#SBATCH --array=1-3\n' in data)
+            self.assertTrue('#SBATCH --output=%x.%A_%a.out\n' in data)
+            self.assertTrue('cellmaps_imagedownloadercmd.py ' +
+                            os.path.join(shards_dir, 'shard${SLURM_ARRAY_TASK_ID}') +
+                            ' --provenance ' + os.path.join(temp_dir, 'provenance.json') +
+                            ' --samples ' +
+                            os.path.join(shards_dir, 'samples${SLURM_ARRAY_TASK_ID}.csv') +
+                            ' --unique ' + os.path.join(shards_dir, 'unique${SLURM_ARRAY_TASK_ID}.csv') +
+                            '\n' in data)
+            # each task skips, or marks complete, its own shard
+            shard_marker = os.path.join(shards_dir, 'shard${SLURM_ARRAY_TASK_ID}',
+                                        SLURMPipelineRunner.COMPLETION_MARKER)
+            self.assertTrue('if [ -f "' + shard_marker + '" ]; then\n' in data)
+            self.assertTrue('    rm -rf "' + os.path.join(shards_dir, 'shard${SLURM_ARRAY_TASK_ID}') +
+                            '"\n' in data)
+            self.assertTrue('    touch "' + shard_marker + '" || exit $?\n' in data)
+            self.assertFalse(os.path.join(temp_dir, '1.image_download') in data)
+
+            with open(os.path.join(temp_dir, 'imagedownloadmergejob.sh'), 'r') as f:
+                data = f.read()
+            self.assertFalse('--array' in data)
+            self.assertTrue('#SBATCH --mem=4G\n' in data)
+            self.assertTrue('cellmaps_shardcmd.py mergeimagedownload ' +
+                            os.path.join(temp_dir, '1.image_download') in data)
+            self.assertTrue('--shard_dirs ' + ' '.join([os.path.join(shards_dir, 'shard' + str(i))
+                                                        for i in range(1, 4)]) + ' -vvvv' in data)
+
+            with open(os.path.join(temp_dir, 'imageembedarrayjob2.sh'), 'r') as f:
+                data = f.read()
+            embed_shards_dir = os.path.join(temp_dir, '2.image_embedding_fold2_shards')
+            self.assertTrue('#SBATCH --array=1-4\n' in data)
+            self.assertTrue('cellmaps_shardcmd.py imageembeddinginput ' +
+                            os.path.join(embed_shards_dir, 'input${SLURM_ARRAY_TASK_ID}') +
+                            ' --image_dir ' + os.path.join(temp_dir, '1.image_download') +
+                            ' --fold 2 --shard ${SLURM_ARRAY_TASK_ID} --num_shards 4' in data)
+            self.assertTrue('cellmaps_image_embeddingcmd.py ' +
+                            os.path.join(embed_shards_dir, 'shard${SLURM_ARRAY_TASK_ID}') +
+                            ' --fold 2 --inputdir ' +
+                            os.path.join(embed_shards_dir, 'input${SLURM_ARRAY_TASK_ID}') in data)
+            shard_marker = os.path.join(embed_shards_dir, 'shard${SLURM_ARRAY_TASK_ID}',
+                                        SLURMPipelineRunner.COMPLETION_MARKER)
+            self.assertTrue('if [ -f "' + shard_marker + '" ]; then\n' in data)
+            self.assertTrue('    touch "' + shard_marker + '" || exit $?\n' in data)
+
+            with open(os.path.join(temp_dir, 'imageembedmergejob2.sh'), 'r') as f:
+                data = f.read()
+            self.assertTrue('#SBATCH --mem=8G\n' in data)
+            self.assertTrue('cellmaps_shardcmd.py mergeimageembedding ' +
+                            os.path.join(temp_dir, '2.image_embedding_fold2') +
+                            ' --image_dir ' + os.path.join(temp_dir, '1.image_download') +
+                            ' --fold 2 --shard_dirs ' +
+                            ' '.join([os.path.join(embed_shards_dir, 'shard' + str(i))
+                                      for i in range(1, 5)]) + ' -vvvv' in data)
+
+            with open(os.path.join(temp_dir, 'slurm_cellmaps_job.sh'), 'r') as f:
+                data = f.read()
+            self.assertFalse(os.path.isfile(os.path.join(temp_dir, 'imagedownloadjob.sh')))
+            self.assertTrue('image_download_array_job=$(sbatch imagedownloadarrayjob.sh ' in data)
+            self.assertTrue('image_download_job=$(sbatch $(get_dependency $image_download_array_job) '
+                            'imagedownloadmergejob.sh ' in data)
+            self.assertTrue('image_embed_array_job1=$(sbatch $(get_dependency $image_download_job) '
+                            'imageembedarrayjob1.sh ' in data)
+            self.assertTrue('image_embed_job1=$(sbatch $(get_dependency $image_download_job '
+                            '$image_embed_array_job1) imageembedmergejob1.sh ' in data)
+            self.assertTrue('f2_coembed_job=$(sbatch $(get_dependency $image_embed_job2 '
+                            '$ppi_embed_job) ' in data)
+            # shards are redone if image download is rerun
+            self.assertTrue('    if [ -n "$image_download_job" ]; then\n'
+                            '        rm -f "' + embed_shards_dir + '"/shard*/' +
+                            SLURMPipelineRunner.COMPLETION_MARKER + '\n' in data)
+            self.assertFalse('rm -f "' + shards_dir + '"/shard*' in data)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_slurm_run_image_shards_cm4ai_image(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            myobj = SLURMPipelineRunner(temp_dir, cm4ai_image='test_image',
+                                        edgelist='edgelist', baitlist='baitlist',
+                                        provenance='test_provenance', image_shards=2)
+            myobj.run()
+            # image download is not sharded, but image embedding is
+            with open(os.path.join(temp_dir, 'slurm_cellmaps_job.sh'), 'r') as f:
+                data = f.read()
+            self.assertTrue('image_download_job=$(sbatch imagedownloadjob.sh ' in data)
+            self.assertFalse('image_download_array_job' in data)
+            self.assertTrue('image_embed_array_job1=$(sbatch $(get_dependency $image_download_job) '
+                            'imageembedarrayjob1.sh ' in data)
+        finally:
+            shutil.rmtree(temp_dir)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `cellmaps_pipeline.slurmresources` module."""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from cellmaps_pipeline.exceptions import CellmapsPipelineError
+from cellmaps_pipeline.slurmresources import SLURMResourceProfiles
+
+
+class TestSLURMResourceProfiles(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def test_default_resources(self):
+        profiles = SLURMResourceProfiles()
+        self.assertEqual({'cpus_per_task': 4, 'mem': '32G',
+                          'time': '4:00:00', 'partition': None},
+                         profiles.get_resources())
+        self.assertEqual(profiles.get_resources(),
+                         profiles.get_resources('image_embedding_fold1'))
+
+    def test_get_resources_lookup_order(self):
+        profiles = SLURMResourceProfiles({'default': {'cpus_per_task': 1, 'mem': '2G'},
+                                          'image_embedding': {'cpus_per_task': 16,
+                                                              'partition': 'cpu'},
+                                          'image_embedding_fold2': {'mem': '64G'}})
+        self.assertEqual({'cpus_per_task': 1, 'mem': '2G',
+                          'time': '4:00:00', 'partition': None},
+                         profiles.get_resources('ppi_download'))
+        self.assertEqual({'cpus_per_task': 16, 'mem': '2G',
+                          'time': '4:00:00', 'partition': 'cpu'},
+                         profiles.get_resources('image_embedding_fold1'))
+        self.assertEqual({'cpus_per_task': 16, 'mem': '64G',
+                          'time': '4:00:00', 'partition': 'cpu'},
+                         profiles.get_resources('image_embedding_fold2'))
+        self.assertEqual(1, profiles.get_resources('coembedding_fold1')['cpus_per_task'])
+
+    def test_invalid_profiles(self):
+        for profiles, message in [(['x'], 'must be a dict'),
+                                  ({'foo': {'mem': '1G'}}, 'Invalid step for SLURM resources: foo'),
+                                  ({'hierarchy_fold1': {'mem': '1G'}}, 'Invalid step'),
+                                  ({'hierarchy': 4}, 'must be a dict'),
+                                  ({'hierarchy': {'gpus': 1}}, 'Invalid SLURM resource: gpus'),
+                                  ({'hierarchy': {'cpus_per_task': 0}}, 'positive integer'),
+                                  ({'hierarchy': {'cpus_per_task': '2.5'}}, 'positive integer'),
+                                  ({'hierarchy': {'mem': '4GB'}}, 'mem must be'),
+                                  ({'hierarchy': {'time': '4 hours'}}, 'time must be'),
+                                  ({'hierarchy': {'partition': ''}}, 'partition must not')]:
+            try:
+                SLURMResourceProfiles(profiles)
+                self.fail('Expected CellmapsPipelineError for ' + str(profiles))
+            except CellmapsPipelineError as e:
+                self.assertTrue(message in str(e), str(e))
+
+    def test_valid_values(self):
+        profiles = SLURMResourceProfiles({'hierarchy': {'cpus_per_task': '8', 'mem': 4096,
+                                                        'time': '1-12:00:00'},
+                                          'hierarchyeval': {'mem': '500m', 'time': 30}})
+        self.assertEqual({'cpus_per_task': 8, 'mem': '4096',
+                          'time': '1-12:00:00', 'partition': None},
+                         profiles.get_resources('hierarchy'))
+        self.assertEqual('500m', profiles.get_resources('hierarchyeval')['mem'])
+        self.assertEqual('30', profiles.get_resources('hierarchyeval')['time'])
+
+    def test_apply_overrides(self):
+        profiles = SLURMResourceProfiles({'image_embedding': {'cpus_per_task': 16}})
+        profiles.apply_overrides(None)
+        profiles.apply_overrides(['image_embedding.cpus_per_task=32',
+                                  'default.partition=small',
+                                  'coembedding_fold2.mem=100G'])
+        self.assertEqual(32, profiles.get_resources('image_embedding_fold1')['cpus_per_task'])
+        self.assertEqual('small', profiles.get_resources('hierarchy')['partition'])
+        self.assertEqual('100G', profiles.get_resources('coembedding_fold2')['mem'])
+        self.assertEqual('32G', profiles.get_resources('coembedding_fold1')['mem'])
+
+        for override in ['image_embedding.cpus_per_task', 'cpus_per_task=4']:
+            try:
+                profiles.apply_overrides([override])
+                self.fail('Expected CellmapsPipelineError')
+            except CellmapsPipelineError as e:
+                self.assertTrue('<step>.<resource>=<value>' in str(e))
+
+    def test_from_file(self):
+        profiles_file = os.path.join(self._temp_dir, 'resources.json')
+        with open(profiles_file, 'w') as f:
+            json.dump({'ppi_download': {'cpus_per_task': 1, 'time': '0:30:00'}}, f)
+        profiles = SLURMResourceProfiles.from_file(profiles_file)
+        self.assertEqual('0:30:00', profiles.get_resources('ppi_download')['time'])
+
+        with open(profiles_file, 'w') as f:
+            f.write('{not json')
+        with self.assertRaises(CellmapsPipelineError):
+            SLURMResourceProfiles.from_file(profiles_file)
+        with self.assertRaises(CellmapsPipelineError):
+            SLURMResourceProfiles.from_file(os.path.join(self._temp_dir, 'doesnotexist.json'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `cellmaps_pipeline.stepcache` module."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from cellmaps_pipeline.stepcache import StepCache
+
+
+class TestStepCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = StepCache(manifest_dir=os.path.join(self.temp_dir,
+                                                         StepCache.MANIFEST_DIR))
+        self.step_dir = os.path.join(self.temp_dir, 'step')
+        os.makedirs(self.step_dir)
+        with open(os.path.join(self.step_dir, 'out.tsv'), 'w') as f:
+            f.write('hi\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_get_file_or_value_digest(self):
+        self.assertIsNone(StepCache.get_file_or_value_digest(None))
+        self.assertEqual('http://foo', StepCache.get_file_or_value_digest('http://foo'))
+        self.assertEqual(StepCache.get_file_digest(os.path.join(self.step_dir, 'out.tsv')),
+                         StepCache.get_file_or_value_digest(os.path.join(self.step_dir, 'out.tsv')))
+
+    def test_get_directory_digest(self):
+        self.assertEqual((None, 0), StepCache.get_directory_digest(os.path.join(self.temp_dir,
+                                                                                'nonexistent')))
+        digest, num_files = StepCache.get_directory_digest(self.step_dir)
+        self.assertEqual(1, num_files)
+        with open(os.path.join(self.step_dir, 'out.tsv'), 'a') as f:
+            f.write('more\n')
+        self.assertNotEqual(digest, StepCache.get_directory_digest(self.step_dir)[0])
+
+    def test_step_key_changes_with_parameters_and_input_files(self):
+        input_file = os.path.join(self.temp_dir, 'input.tsv')
+        with open(input_file, 'w') as f:
+            f.write('a\tb\n')
+        key = self.cache.get_step_key('step', parameters={'cutoff': 0.1},
+                                      input_files={'edgelist': input_file})
+        self.assertEqual(key, self.cache.get_step_key('step', parameters={'cutoff': 0.1},
+                                                      input_files={'edgelist': input_file}))
+        self.assertNotEqual(key, self.cache.get_step_key('step', parameters={'cutoff': 0.2},
+                                                         input_files={'edgelist': input_file}))
+        with open(input_file, 'w') as f:
+            f.write('a\tc\n')
+        self.assertNotEqual(key, self.cache.get_step_key('step', parameters={'cutoff': 0.1},
+                                                         input_files={'edgelist': input_file}))
+
+    def test_step_key_changes_with_upstream_manifest(self):
+        key = self.cache.get_step_key('down', upstream_steps=['step'])
+        self.cache.write_manifest('step', 'abc', self.step_dir)
+        upkey = self.cache.get_step_key('down', upstream_steps=['step'])
+        self.assertNotEqual(key, upkey)
+        self.cache.write_manifest('step', 'xyz', self.step_dir)
+        self.assertNotEqual(upkey, self.cache.get_step_key('down', upstream_steps=['step']))
+
+    def test_is_step_complete(self):
+        self.assertFalse(self.cache.is_step_complete('step', 'abc', self.step_dir))
+        manifest = self.cache.write_manifest('step', 'abc', self.step_dir,
+                                             parameters={'fake': True})
+        self.assertEqual('abc', manifest['key'])
+        self.assertEqual(1, manifest['num_files'])
+        self.assertEqual({'fake': True}, self.cache.get_manifest('step')['parameters'])
+        self.assertTrue(self.cache.is_step_complete('step', 'abc', self.step_dir))
+        self.assertFalse(self.cache.is_step_complete('step', 'def', self.step_dir))
+
+        # output changed after manifest was written
+        with open(os.path.join(self.step_dir, 'extra.tsv'), 'w') as f:
+            f.write('partial')
+        self.assertFalse(self.cache.is_step_complete('step', 'abc', self.step_dir))
+
+    def test_remove_manifest(self):
+        self.cache.remove_manifest('step')
+        self.cache.write_manifest('step', 'abc', self.step_dir)
+        self.assertTrue(os.path.isfile(self.cache.get_manifest_path('step')))
+        self.cache.remove_manifest('step')
+        self.assertIsNone(self.cache.get_manifest('step'))
+
+    def test_get_manifest_invalid_json(self):
+        os.makedirs(os.path.join(self.temp_dir, StepCache.MANIFEST_DIR))
+        with open(self.cache.get_manifest_path('step'), 'w') as f:
+            f.write('{')
+        self.assertIsNone(self.cache.get_manifest('step'))
+
+
+if __name__ == '__main__':
+    unittest.main()
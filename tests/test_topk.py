@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `cellmaps_pipeline.topk` module."""
+
+import math
+import unittest
+
+import numpy as np
+
+from cellmaps_pipeline import topk
+from cellmaps_pipeline.topk import TopKEdgeSelector
+
+
+def _get_top_edges_by_sorting(sim_values, cutoff):
+    rows, cols = np.triu_indices(sim_values.shape[0], k=1)
+    weights = sim_values[rows, cols]
+    keep = ~np.isnan(weights)
+    rows, cols, weights = rows[keep], cols[keep], weights[keep]
+    order = np.argsort(-weights, kind='stable')[:math.ceil(cutoff * len(weights))]
+    return rows[order], cols[order], weights[order]
+
+
+class TestTopK(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        sim = rng.random((37, 37))
+        self.sim = (sim + sim.T) / 2
+
+    def test_get_block_rows(self):
+        self.assertEqual(1, topk.get_block_rows(100, block_elements=10))
+        self.assertEqual(4, topk.get_block_rows(25, block_elements=100))
+        self.assertEqual(100, topk.get_block_rows(0, block_elements=100))
+
+    def test_get_upper_triangle_edges(self):
+        sim = np.arange(16, dtype=float).reshape(4, 4)
+        sim[1, 3] = np.nan
+        rows, cols, weights = topk.get_upper_triangle_edges(sim[1:3], row_offset=1)
+        self.assertEqual([1, 2], rows.tolist())
+        self.assertEqual([2, 3], cols.tolist())
+        self.assertEqual([6.0, 11.0], weights.tolist())
+
+    def test_count_upper_triangle_values(self):
+        self.assertEqual(37 * 36 // 2, topk.count_upper_triangle_values(self.sim))
+        self.sim[0, 5] = np.nan
+        self.sim[5, 0] = np.nan
+        self.sim[3, 3] = np.nan
+        self.assertEqual(37 * 36 // 2 - 1,
+                         topk.count_upper_triangle_values(self.sim, block_elements=50))
+
+    def test_get_top_edges_matches_full_sort(self):
+        self.sim[2, 9] = np.nan
+        for cutoff in [0.0, 0.01, 0.1, 0.37, 1.0]:
+            for block_elements in [1, 50, 1000000]:
+                expected = _get_top_edges_by_sorting(self.sim, cutoff)
+                res = topk.get_top_edges(self.sim, cutoff,
+                                         block_elements=block_elements)
+                for i in range(3):
+                    self.assertEqual(expected[i].tolist(), res[i].tolist())
+
+    def test_get_top_edges_by_cutoff(self):
+        self.sim[2, 9] = np.nan
+        cutoffs = [0.1, 0.0, 1.0, 0.37]
+        res = topk.get_top_edges_by_cutoff(self.sim, cutoffs, block_elements=50)
+        self.assertEqual(len(cutoffs), len(res))
+        for cutoff, cutoff_res in zip(cutoffs, res):
+            expected = _get_top_edges_by_sorting(self.sim, cutoff)
+            for i in range(3):
+                self.assertEqual(expected[i].tolist(), cutoff_res[i].tolist())
+        self.assertEqual([], topk.get_top_edges_by_cutoff(self.sim, []))
+
+    def test_split_by_cutoff_sizes_ties(self):
+        sim = np.ones((4, 4))
+        res = topk.get_top_edges_by_cutoff(sim, [0.5, 1.0])
+        self.assertEqual([0, 0, 0], res[0][0].tolist())
+        self.assertEqual([1, 2, 3], res[0][1].tolist())
+        self.assertEqual(res[0][0].tolist(), res[1][0][:3].tolist())
+        self.assertEqual(res[0][1].tolist(), res[1][1][:3].tolist())
+
+    def test_get_row_top_edges(self):
+        self.sim[3, 7] = np.nan
+        rows, cols, weights = topk.get_row_top_edges(self.sim[2:9], 4, row_offset=2)
+        for row in range(2, 9):
+            values = self.sim[row].copy()
+            values[row] = -np.inf
+            values[np.isnan(values)] = -np.inf
+            expected = np.argsort(-values, kind='stable')[:4]
+            self.assertEqual(expected.tolist(), cols[rows == row].tolist())
+            self.assertEqual(values[expected].tolist(), weights[rows == row].tolist())
+
+    def test_get_row_top_edges_ties_and_small_rows(self):
+        sim = np.ones((4, 4))
+        sim[0, 1:] = np.nan
+        rows, cols, weights = topk.get_row_top_edges(sim, 2)
+        self.assertEqual([1, 1, 2, 2, 3, 3], rows.tolist())
+        self.assertEqual([0, 2, 0, 1, 0, 1], cols.tolist())
+        rows, cols, weights = topk.get_row_top_edges(sim, 10)
+        self.assertEqual(9, len(rows))
+        self.assertEqual(0, len(topk.get_row_top_edges(sim, 0)[0]))
+
+    def test_get_undirected_edges(self):
+        rows, cols, weights = topk.get_undirected_edges(np.array([0, 1, 2, 1, 3]),
+                                                        np.array([1, 0, 1, 2, 0]),
+                                                        np.array([0.5, 0.5, 0.7, 0.7, 0.5]))
+        self.assertEqual([1, 0, 0], rows.tolist())
+        self.assertEqual([2, 1, 3], cols.tolist())
+        self.assertEqual([0.7, 0.5, 0.5], weights.tolist())
+        self.assertEqual(0, len(topk.get_undirected_edges(np.array([]), np.array([]),
+                                                          np.array([]))[0]))
+
+    def test_selector_orders_ties_by_index(self):
+        selector = TopKEdgeSelector(3)
+        selector.add(np.array([4, 1, 2, 0]), np.array([5, 3, 3, 9]),
+                     np.array([0.5, 0.5, 0.9, 0.1]))
+        rows, cols, weights = selector.get_edges()
+        self.assertEqual([2, 1, 4], rows.tolist())
+        self.assertEqual([0.9, 0.5, 0.5], weights.tolist())
+
+    def test_selector_k_zero(self):
+        selector = TopKEdgeSelector(0)
+        selector.add(np.array([0]), np.array([1]), np.array([0.5]))
+        self.assertEqual(0, len(selector.get_edges()[0]))
+
+    def test_get_descending_order_matches_stable_sort(self):
+        rng = np.random.default_rng(5)
+        weights = rng.integers(0, 6, size=200).astype(float)
+        weights[[3, 50, 77]] = np.nan
+        expected = np.argsort(-weights, kind='stable')
+        for k in [None, 0, 1, 7, 40, 196, 197, 198, 200, 500]:
+            res = topk.get_descending_order(weights, k=k)
+            self.assertEqual(expected[:k].tolist(), res.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()